@@ -0,0 +1,424 @@
+import sys
+import copy
+import time
+import argparse
+import tracemalloc
+from array import array
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional, Tuple, Callable
+
+from cow_core import Army, ArmySnapshot, BattleMode, BattleOutcome, run_simulation
+from cow_rng import CounterRNG, fresh_seed
+
+# ============================================================================
+# 1. 配置
+# ============================================================================
+
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+
+# ============================================================================
+# 2. 状态快照 (避免每次试验都从 JSON 重建 Army)
+# ============================================================================
+
+def snapshot_army(army: Army) -> ArmySnapshot:
+    return army.snapshot()
+
+def restore_army(army: Army, snap: ArmySnapshot):
+    """恢复快照并清零本回合战损。"""
+    army.restore(snap)
+    army.reset_round_stats()
+
+# ============================================================================
+# 3. 结果结构
+# ============================================================================
+
+def percentile(sorted_vals, q: float) -> float:
+    """线性插值百分位 (q 取 0~100)，输入需已排序。"""
+    n = len(sorted_vals)
+    if n == 0: return 0.0
+    pos = (n - 1) * q / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, n - 1)
+    frac = pos - lo
+    return sorted_vals[lo] * (1.0 - frac) + sorted_vals[hi] * frac
+
+def _mean(samples) -> float:
+    return sum(samples) / len(samples) if len(samples) else 0.0
+
+def _percentiles(samples, qs) -> Dict[float, float]:
+    ordered = sorted(samples)
+    return {q: percentile(ordered, q) for q in qs}
+
+@dataclass
+class CasualtyStats:
+    label: str
+    initial_count: int
+    initial_hp: float
+    dead: Dict[float, float]     # 百分位 -> 阵亡数量
+    hp_lost: Dict[float, float]  # 百分位 -> 损失 HP
+    mean_dead: float = 0.0
+    mean_hp_lost: float = 0.0
+
+@dataclass
+class BuildingStats:
+    label: str
+    initial_hp: float
+    hp: Dict[float, float]       # 百分位 -> 战后建筑 HP
+
+@dataclass
+class ArmyStats:
+    name: str
+    groups: List[CasualtyStats] = field(default_factory=list)
+    stacks: List[CasualtyStats] = field(default_factory=list)
+    buildings: List[BuildingStats] = field(default_factory=list)
+
+@dataclass
+class MonteCarloResult:
+    trials: int
+    wins: int      # A 胜 (B 全灭且 A 存活)
+    draws: int     # 同归于尽或回合耗尽
+    losses: int    # A 全灭且 B 存活
+    rounds_histogram: Dict[int, int]
+    side_a: ArmyStats
+    side_b: ArmyStats
+
+    @property
+    def win_prob(self) -> float:
+        return self.wins / self.trials if self.trials else 0.0
+
+    @property
+    def draw_prob(self) -> float:
+        return self.draws / self.trials if self.trials else 0.0
+
+    @property
+    def loss_prob(self) -> float:
+        return self.losses / self.trials if self.trials else 0.0
+
+    @property
+    def mean_rounds(self) -> float:
+        if not self.trials: return 0.0
+        return sum(r * c for r, c in self.rounds_histogram.items()) / self.trials
+
+# ============================================================================
+# 4. 样本收集
+# ============================================================================
+
+class _ArmySampler:
+    """按列收集每次试验结束时的 Group/Building 状态。"""
+
+    def __init__(self, army: Army):
+        self.army = army
+        self.groups = [(s, g) for s in army.stacks for g in s.groups]
+        self.counts = [array('d') for _ in self.groups]
+        self.hps = [array('d') for _ in self.groups]
+        self.b_hps = [array('d') if s.building else None for s in army.stacks]
+
+    def record(self):
+        for i, (_, g) in enumerate(self.groups):
+            self.counts[i].append(g.count)
+            self.hps[i].append(g.current_hp)
+        for s, col in zip(self.army.stacks, self.b_hps):
+            if col is not None:
+                col.append(s.building.current_hp)
+
+    def extend(self, counts, hps, b_hps):
+        """一次性追加一批试验结果：counts/hps 为 (G, T)，b_hps 为 (S, T)。"""
+        for i in range(len(self.groups)):
+            self.counts[i].extend(counts[i].tolist())
+            self.hps[i].extend(hps[i].tolist())
+        for si, col in enumerate(self.b_hps):
+            if col is not None:
+                col.extend(b_hps[si].tolist())
+
+    def summarize(self, qs) -> ArmyStats:
+        stats = ArmyStats(self.army.name)
+        n = len(self.counts[0]) if self.counts else 0
+        stack_dead = {id(s): array('d', bytes(8 * n)) for s in self.army.stacks}
+        stack_lost = {id(s): array('d', bytes(8 * n)) for s in self.army.stacks}
+
+        for i, (s, g) in enumerate(self.groups):
+            dead = [g.initial_count - c for c in self.counts[i]]
+            lost = [g.initial_hp - h for h in self.hps[i]]
+            col_d, col_l = stack_dead[id(s)], stack_lost[id(s)]
+            for t in range(n):
+                col_d[t] += dead[t]
+                col_l[t] += lost[t]
+            stats.groups.append(CasualtyStats(f"[{s.name}] {g.name}", g.initial_count, g.initial_hp,
+                                              _percentiles(dead, qs), _percentiles(lost, qs),
+                                              _mean(dead), _mean(lost)))
+
+        for s in self.army.stacks:
+            init_c = sum(g.initial_count for g in s.groups)
+            init_h = sum(g.initial_hp for g in s.groups)
+            stats.stacks.append(CasualtyStats(s.name, init_c, init_h,
+                                              _percentiles(stack_dead[id(s)], qs),
+                                              _percentiles(stack_lost[id(s)], qs),
+                                              _mean(stack_dead[id(s)]), _mean(stack_lost[id(s)])))
+
+        for s, col in zip(self.army.stacks, self.b_hps):
+            if col is not None:
+                stats.buildings.append(BuildingStats(f"{s.name}:{s.building.name}", s.building.initial_hp,
+                                                     _percentiles(col, qs)))
+        return stats
+
+# ============================================================================
+# 5. Monte Carlo 主循环
+# ============================================================================
+
+# 试验次数达到该值且 numpy 可用时，engine="auto" 选择向量化引擎
+VECTOR_MIN_TRIALS = 64
+# 试验次数低于该值且 numba 可用时，engine="auto" 选择 jit 引擎。jit 的耗时与试验数成正比，
+# 向量引擎的逐回合固定开销随试验数摊薄；分界点由 `cow_bench.py engines` 测得
+# (内置配置 jit / vector：100 场 0.02s / 0.09s，512 场 0.08s / 0.11s，1000 场 0.17s / 0.13s，
+# 1 万场 1.9s / 1.2s，10 万场 20s / 11s)
+JIT_MAX_TRIALS = 768
+
+def _vector_engine():
+    try:
+        import cow_vector
+    except ImportError:
+        return None
+    return cow_vector
+
+def _jit_engine():
+    try:
+        import cow_jit
+    except ImportError:
+        return None
+    return cow_jit
+
+def _pick_vector(engine: str, trials: int, army_a: Army, army_b: Army, mode: BattleMode):
+    """返回应使用的批量引擎模块 (cow_jit / cow_vector，接口相同)，None 表示使用标量引擎。"""
+    if engine == "jit":
+        jit = _jit_engine()
+        if jit is None:
+            raise RuntimeError("jit engine requires numba")
+        return jit
+    vec = _vector_engine() if engine in ("auto", "vector") else None
+    if engine == "vector":
+        if vec is None:
+            raise RuntimeError("vector engine requires numpy")
+        return vec
+    # auto：目标选择类配置 (Split / 空军 / 手动目标) 只有标量引擎支持
+    if vec is None or not vec.supports(army_a, army_b, mode):
+        return None
+    # 试验数较少时向量引擎的逐回合固定开销占主导，编译内核逐试验运行更快
+    if trials < JIT_MAX_TRIALS:
+        jit = _jit_engine()
+        if jit is not None:
+            return jit
+    return vec if trials >= VECTOR_MIN_TRIALS else None
+
+def run_monte_carlo(army_a: Army, army_b: Army, mode: BattleMode, trials: int,
+                    max_rounds: int = 50, seed: Optional[int] = None,
+                    percentiles=DEFAULT_PERCENTILES, engine: str = "auto",
+                    first_trial: int = 0, siege_damage: bool = True) -> MonteCarloResult:
+    """
+    对同一对 Army 重复进行 trials 次随机战斗。
+    engine: "scalar" 逐试验运行标量引擎 (Army 只构建一次，通过快照恢复初始状态)；
+            "vector" 使用 cow_vector 一次性推进全部试验；
+            "jit" 使用 cow_jit 在编译内核中逐试验运行 (需要 numba)；
+            "auto" 配置受支持时，试验数低于 JIT_MAX_TRIALS 选 jit (需要 numba)，
+            否则试验数不少于 VECTOR_MIN_TRIALS 时选 vector。
+    第 t 个试验使用随机流 (seed, first_trial + t)，各引擎相同；把 N 个试验拆成若干段
+    (各段给出各自的 first_trial) 分别运行，合并后与一次运行全部试验逐试验一致。
+    siege_damage=False 时不计算攻城伤害；向量 / jit 引擎总是计算攻城伤害，此时只用标量引擎。
+    """
+    seed = fresh_seed() if seed is None else seed
+    vec = _pick_vector(engine, trials, army_a, army_b, mode) if siege_damage else None
+    if vec is not None:
+        return _run_monte_carlo_vector(vec, army_a, army_b, mode, trials, max_rounds, seed, percentiles, first_trial)
+
+    snap_a = snapshot_army(army_a)
+    snap_b = snapshot_army(army_b)
+    sampler_a = _ArmySampler(army_a)
+    sampler_b = _ArmySampler(army_b)
+    rounds_hist = Counter()
+    wins = draws = losses = 0
+
+    for t in range(first_trial, first_trial + trials):
+        restore_army(army_a, snap_a)
+        restore_army(army_b, snap_b)
+        res = run_simulation(army_a, army_b, mode, max_rounds, True, False, verbose=False, rng=CounterRNG(seed, t),
+                             siege_damage=siege_damage)
+        rounds_hist[res.rounds] += 1
+
+        if res.outcome == BattleOutcome.A_WIN: wins += 1
+        elif res.outcome == BattleOutcome.B_WIN: losses += 1
+        else: draws += 1
+
+        sampler_a.record()
+        sampler_b.record()
+
+    result = MonteCarloResult(trials, wins, draws, losses, dict(sorted(rounds_hist.items())),
+                              sampler_a.summarize(percentiles), sampler_b.summarize(percentiles))
+    # 还原为初始状态，调用方可继续使用这两个 Army
+    restore_army(army_a, snap_a)
+    restore_army(army_b, snap_b)
+    return result
+
+def _run_monte_carlo_vector(vec, army_a: Army, army_b: Army, mode: BattleMode, trials: int,
+                            max_rounds: int, seed: int, percentiles, first_trial: int = 0) -> MonteCarloResult:
+    res = vec.run_vector_battle(army_a, army_b, mode, trials, max_rounds, True, seed=seed, first_trial=first_trial)
+    a_alive, b_alive = res.a_alive, res.b_alive
+    wins = int((a_alive & ~b_alive).sum())
+    losses = int((b_alive & ~a_alive).sum())
+    rounds_hist = Counter(res.rounds.tolist())
+
+    sampler_a = _ArmySampler(army_a)
+    sampler_b = _ArmySampler(army_b)
+    sampler_a.extend(res.army_a.count, res.army_a.hp, res.army_a.bld_hp)
+    sampler_b.extend(res.army_b.count, res.army_b.hp, res.army_b.bld_hp)
+    return MonteCarloResult(trials, wins, trials - wins - losses, losses, dict(sorted(rounds_hist.items())),
+                            sampler_a.summarize(percentiles), sampler_b.summarize(percentiles))
+
+def count_outcomes(army_a: Army, army_b: Army, mode: BattleMode, trials: int, max_rounds: int = 50,
+                   seed: Optional[int] = None, engine: str = "auto", first_trial: int = 0,
+                   siege_damage: bool = True) -> Tuple[int, int, int]:
+    """只统计 (A 胜, 平, A 负) 次数，不收集伤亡分布，供搜索类工具反复调用。随机流与 siege_damage 同 run_monte_carlo。"""
+    seed = fresh_seed() if seed is None else seed
+    vec = _pick_vector(engine, trials, army_a, army_b, mode) if siege_damage else None
+    if vec is not None:
+        res = vec.run_vector_battle(army_a, army_b, mode, trials, max_rounds, True, seed=seed, first_trial=first_trial)
+        a_alive, b_alive = res.a_alive, res.b_alive
+        wins = int((a_alive & ~b_alive).sum())
+        losses = int((b_alive & ~a_alive).sum())
+        return wins, trials - wins - losses, losses
+
+    snap_a = snapshot_army(army_a)
+    snap_b = snapshot_army(army_b)
+    counts = Counter()
+    for t in range(first_trial, first_trial + trials):
+        restore_army(army_a, snap_a)
+        restore_army(army_b, snap_b)
+        counts[run_simulation(army_a, army_b, mode, max_rounds, True, False, verbose=False,
+                              rng=CounterRNG(seed, t), siege_damage=siege_damage).outcome] += 1
+    restore_army(army_a, snap_a)
+    restore_army(army_b, snap_b)
+    return counts[BattleOutcome.A_WIN], counts[BattleOutcome.DRAW], counts[BattleOutcome.B_WIN]
+
+def print_monte_carlo_summary(result: MonteCarloResult):
+    print(f"=== Monte Carlo: {result.side_a.name} vs {result.side_b.name} ({result.trials} trials) ===")
+    print(f"  胜 {result.win_prob*100:.2f}% | 平 {result.draw_prob*100:.2f}% | 负 {result.loss_prob*100:.2f}%"
+          f" | 平均回合 {result.mean_rounds:.2f}")
+
+    for side in (result.side_a, result.side_b):
+        print(f"\n[{side.name}] 战损分布 (阵亡数量 / 损失HP):")
+        qs = list(side.groups[0].dead.keys()) if side.groups else []
+        header = " | ".join(f"P{q:g}".rjust(17) for q in qs)
+        print(f"  {'UNIT (STACK)':<30} | {header}")
+        for row in side.groups + side.stacks:
+            cells = " | ".join(f"{row.dead[q]:>6.1f} / {row.hp_lost[q]:>8.1f}" for q in qs)
+            print(f"  {row.label:<30} | {cells}")
+        for b in side.buildings:
+            cells = " | ".join(f"{b.hp[q]:>17.2f}" for q in qs)
+            print(f"  {('BLD ' + b.label):<30} | {cells}")
+
+    print("\n回合数分布:")
+    for r, c in result.rounds_histogram.items():
+        print(f"  {r:>5}: {c:>8} ({c / result.trials * 100:.2f}%)")
+
+# ============================================================================
+# 6. 状态重置基准
+# ============================================================================
+# 比较每次试验把双方 Army 恢复到初始状态的几种方式：从 JSON 重建、deepcopy、逐字段写回、扁平数组快照。
+
+def _legacy_snapshot(army: Army) -> Tuple[list, list]:
+    """逐字段快照 (扁平数组之前的做法)，仅作基准对照。"""
+    groups = [(g.count, g.current_hp) for s in army.stacks for g in s.groups]
+    buildings = [s.building.current_hp if s.building else None for s in army.stacks]
+    return groups, buildings
+
+def _legacy_restore(army: Army, snap: Tuple[list, list]):
+    groups, buildings = snap
+    i = 0
+    for s in army.stacks:
+        for g in s.groups:
+            g.count, g.current_hp = groups[i]
+            g.reset_round_stats()
+            i += 1
+    for s, b_hp in zip(army.stacks, buildings):
+        if s.building:
+            s.building.current_hp = b_hp
+
+def _traced_bytes(fn: Callable[[], object]) -> Tuple[object, int]:
+    """fn 返回对象在调用结束后仍占用的内存 (tracemalloc)。"""
+    own = not tracemalloc.is_tracing()
+    if own:
+        tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        obj = fn()
+        return obj, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        if own:
+            tracemalloc.stop()
+
+@dataclass
+class ResetBenchmark:
+    groups: int                         # 双方 Group 总数
+    battle_bytes: int                   # 一场战斗 (双方 Army) 的常驻内存
+    snapshot_bytes: Dict[str, int]      # 各方式为恢复所保存的数据大小 (重建为 0)
+    resets_per_s: Dict[str, float]      # 每秒可恢复双方 Army 的次数
+
+    def summary(self) -> str:
+        lines = [f"=== Reset benchmark: {self.groups} groups, {self.battle_bytes / 1024:.1f} KiB / battle ===",
+                 f"  {'METHOD':<10} | {'SNAPSHOT':>10} | {'RESETS/s':>12} | {'SPEEDUP':>8}"]
+        base = self.resets_per_s.get("rebuild") or 1.0
+        for name, rate in self.resets_per_s.items():
+            lines.append(f"  {name:<10} | {self.snapshot_bytes[name] / 1024:>7.1f} KiB | {rate:>12.0f} | "
+                         f"{rate / base:>7.1f}x")
+        return "\n".join(lines)
+
+def bench_resets(build: Callable[[], Tuple[Army, Army]], iterations: int = 2000) -> ResetBenchmark:
+    """
+    build() 每次返回一对新构建的 Army (通常是 run_battle.build_army)。
+    每种方式都在新构建的 Army 上取快照、打一场战斗，再计时恢复 iterations 次。
+    恢复函数返回下一场使用的 (a, b)：rebuild / deepcopy 换成新对象，fields / flat 原地恢复。
+    """
+    (army_a, army_b), battle_bytes = _traced_bytes(build)
+
+    def in_place(restore):
+        def reset(a, b, snap):
+            restore(a, snap[0])
+            restore(b, snap[1])
+            return a, b
+        return reset
+
+    methods = {
+        "rebuild": (lambda a, b: None, lambda a, b, snap: build()),
+        "deepcopy": (lambda a, b: copy.deepcopy((a, b)), lambda a, b, snap: copy.deepcopy(snap)),
+        "fields": (lambda a, b: (_legacy_snapshot(a), _legacy_snapshot(b)), in_place(_legacy_restore)),
+        "flat": (lambda a, b: (snapshot_army(a), snapshot_army(b)), in_place(restore_army)),
+    }
+    snapshot_bytes: Dict[str, int] = {}
+    resets_per_s: Dict[str, float] = {}
+    for name, (take, reset) in methods.items():
+        a, b = build()
+        snap, snapshot_bytes[name] = _traced_bytes(lambda: take(a, b))
+        run_simulation(a, b, BattleMode.LAND_MEET, 5, False, False, verbose=False)
+        t0 = time.perf_counter()
+        for _ in range(iterations):
+            a, b = reset(a, b, snap)
+        resets_per_s[name] = iterations / max(time.perf_counter() - t0, 1e-9)
+    groups = len(army_a._groups) + len(army_b._groups)
+    return ResetBenchmark(groups, battle_bytes, snapshot_bytes, resets_per_s)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Army 状态重置基准 (内存 / 每秒恢复次数)")
+    parser.add_argument("--config", default="battle_config.json")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    from cow_db import load_databases
+    from run_battle import load_json, build_army
+    conf = load_json(args.config)
+    units_db, buildings_db = load_databases("units.json", "buildings.json")
+    build = lambda: (build_army(conf["team_a"], units_db, buildings_db),
+                     build_army(conf["team_b"], units_db, buildings_db))
+    print(bench_resets(build, args.iterations).summary())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
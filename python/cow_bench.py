@@ -0,0 +1,466 @@
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import datetime
+import subprocess
+import tracemalloc
+from array import array
+from dataclasses import dataclass, asdict
+from typing import List, Dict, Optional, Callable, Tuple
+
+import cow_core
+from cow_core import Army, BattleMode, run_simulation
+from cow_batch import run_monte_carlo, percentile, _pick_vector
+from cow_db import load_databases
+from run_battle import load_json, build_army
+
+# ============================================================================
+# 1. 参考场景
+# ============================================================================
+# 场景均由固定种子生成，保证不同机器、不同版本跑的是同一组战斗。
+
+GROUND_UNITS = ("Infantry_Lvl1", "Medium_Tank_Lvl1", "Allies_Armored_Car_Lvl1")
+
+def _stack(name: str, rng: random.Random, units=GROUND_UNITS, groups: int = 3, lo: int = 10, hi: int = 40,
+           **extra) -> dict:
+    return {"name": name, "units": [{"id": rng.choice(units), "count": rng.randint(lo, hi),
+                                     "hp_ratio": round(rng.uniform(0.6, 1.0), 2)} for _ in range(groups)], **extra}
+
+def scenario_shipped() -> dict:
+    return load_json("battle_config.json")
+
+def scenario_brawl() -> dict:
+    """20 对 20 Stack 的 LAND_MEET 混战。"""
+    rng = random.Random(20)
+    return {"battle_mode": "LAND_MEET", "max_rounds": 100,
+            "team_a": {"name": "A", "stacks": [_stack(f"A{i}", rng, core=i % 4 == 0) for i in range(20)]},
+            "team_b": {"name": "B", "stacks": [_stack(f"B{i}", rng) for i in range(20)]}}
+
+def scenario_air_strike() -> dict:
+    """轰炸机空袭重防空阵地 (对空防御值最高的步兵 / 装甲车大量堆叠，部分带碉堡)。"""
+    rng = random.Random(30)
+    bombers = [_stack(f"Air{i}", rng, ("Allies_Tactical_Bomber_Lvl1",), 1, 20, 30, is_airplane=True)
+               for i in range(4)]
+    aa = [_stack(f"AA{i}", rng, ("Infantry_Lvl1", "Allies_Armored_Car_Lvl1"), 2, 30, 60,
+                 **({"building": {"id": "Bunker", "level": 3}} if i % 2 == 0 else {})) for i in range(6)]
+    return {"battle_mode": "AIR_STRIKE", "max_rounds": 100,
+            "team_a": {"name": "A", "stacks": bombers}, "team_b": {"name": "B", "stacks": aa}}
+
+def scenario_siege() -> dict:
+    """攻打满级碉堡与基础设施。"""
+    rng = random.Random(40)
+    attackers = [_stack(f"S{i}", rng, ("Medium_Tank_Lvl1", "Infantry_Lvl1"), 2, 20, 50) for i in range(5)]
+    defenders = [_stack(f"D{i}", rng, ("Infantry_Lvl1",), 2, 20, 40, core=True,
+                        building={"id": "Bunker", "level": 5}) for i in range(3)]
+    defenders.append(_stack("Town", rng, ("Infantry_Lvl1",), 1, 10, 20, building={"id": "Infrastructure", "level": 2}))
+    return {"battle_mode": "LAND_ATTACK", "max_rounds": 200,
+            "team_a": {"name": "A", "stacks": attackers}, "team_b": {"name": "B", "stacks": defenders}}
+
+def scenario_front(stacks: int, mode: str = "LAND_MEET", seed: int = 50) -> dict:
+    """stacks 对 stacks 的大规模战线 (每个 Stack 3 个 Group，兵力足以支撑多个回合)，供规模测试使用。"""
+    rng = random.Random(seed)
+    return {"battle_mode": mode, "max_rounds": 50,
+            "team_a": {"name": "A", "stacks": [_stack(f"A{i}", rng, lo=50, hi=200, core=i % 4 == 0)
+                                               for i in range(stacks)]},
+            "team_b": {"name": "B", "stacks": [_stack(f"B{i}", rng, lo=50, hi=200) for i in range(stacks)]}}
+
+SCENARIOS: Dict[str, Callable[[], dict]] = {
+    "shipped": scenario_shipped,
+    "brawl_20v20": scenario_brawl,
+    "air_strike_aa": scenario_air_strike,
+    "siege_bunker": scenario_siege,
+}
+
+# ============================================================================
+# 2. 引擎模式
+# ============================================================================
+# deterministic / random：标量引擎单场 (关闭 / 开启随机)；mc_scalar / mc_vector / mc_jit：Monte Carlo 批量。
+# 向量引擎需要 numpy、jit 引擎需要 numba，且两者只支持部分配置，不满足时该模式记为跳过。
+
+MODES = ("deterministic", "random", "mc_scalar", "mc_vector", "mc_jit")
+MC_TRIALS = 16
+PERCENTILES = (50, 90, 99)
+
+@dataclass
+class BenchResult:
+    battles: int
+    seconds: float
+    battles_per_s: float
+    rounds_per_s: float
+    rounds_per_battle: float
+    clash_us: Optional[Dict[str, float]]     # 单次交战耗时百分位 (微秒)，Monte Carlo 模式为 None
+    peak_kib: float                          # 单次运行的 tracemalloc 峰值
+
+class _ClashTimer:
+    """临时替换 cow_core.resolve_atomic_clash，记录每次交战的耗时。"""
+
+    def __init__(self):
+        self.samples = array('d')
+
+    def __enter__(self):
+        self._orig = orig = cow_core.resolve_atomic_clash
+        samples, clock = self.samples, time.perf_counter
+
+        def timed(*args, **kwargs):
+            t0 = clock()
+            try:
+                return orig(*args, **kwargs)
+            finally:
+                samples.append(clock() - t0)
+        cow_core.resolve_atomic_clash = timed
+        return self
+
+    def __exit__(self, *exc):
+        cow_core.resolve_atomic_clash = self._orig
+        return False
+
+def _runner(mode: str, army_a: Army, army_b: Army, conf: dict) -> Optional[Callable[[int], Tuple[int, int]]]:
+    """返回 run(seed) -> (场数, 回合数)；该模式不适用时返回 None。"""
+    b_mode = BattleMode(conf.get("battle_mode", "LAND_ATTACK"))
+    max_rounds = conf.get("max_rounds", 50)
+    siege = conf.get("siege_damage", True)
+
+    if mode in ("deterministic", "random"):
+        use_random = mode == "random"
+        snap_a, snap_b = army_a.snapshot(), army_b.snapshot()
+
+        def run(seed: int) -> Tuple[int, int]:
+            army_a.restore(snap_a)
+            army_b.restore(snap_b)
+            res = run_simulation(army_a, army_b, b_mode, max_rounds, use_random, False, verbose=False,
+                                 rng=random.Random(seed), siege_damage=siege)
+            return 1, res.rounds
+        return run
+
+    engine = mode[len("mc_"):]
+    if engine != "scalar":
+        try:
+            import cow_vector
+            if engine == "jit":
+                import cow_jit
+        except ImportError:
+            return None
+        if not cow_vector.supports(army_a, army_b, b_mode):
+            return None
+
+    def run(seed: int) -> Tuple[int, int]:
+        mc = run_monte_carlo(army_a, army_b, b_mode, MC_TRIALS, max_rounds, seed, engine=engine, siege_damage=siege)
+        return mc.trials, sum(r * c for r, c in mc.rounds_histogram.items())
+    return run
+
+def bench_one(conf: dict, mode: str, units_db, buildings_db, min_time: float = 0.5,
+              min_runs: int = 3) -> Optional[BenchResult]:
+    """至少运行 min_runs 次且累计 min_time 秒 (Monte Carlo 模式每次已含 MC_TRIALS 场，至少 1 次)。"""
+    army_a = build_army(conf["team_a"], units_db, buildings_db)
+    army_b = build_army(conf["team_b"], units_db, buildings_db)
+    run = _runner(mode, army_a, army_b, conf)
+    if run is None:
+        return None
+
+    if mode == "mc_scalar":
+        min_runs = 1
+    else:
+        run(0)  # 预热 (伤害表缓存、向量引擎的 numpy 初始化、jit 内核的编译 / 缓存加载)
+    battles = rounds = runs = 0
+    t0 = time.perf_counter()
+    while runs < min_runs or time.perf_counter() - t0 < min_time:
+        b, r = run(runs)
+        battles += b
+        rounds += r
+        runs += 1
+    seconds = time.perf_counter() - t0
+
+    # 交战延迟与内存峰值单独测量，不计入吞吐
+    clash_us = None
+    if mode in ("deterministic", "random"):
+        with _ClashTimer() as timer:
+            for i in range(min_runs):
+                run(i)
+        ordered = sorted(timer.samples)
+        clash_us = {f"p{q}": percentile(ordered, q) * 1e6 for q in PERCENTILES}
+    tracemalloc.start()
+    try:
+        run(0)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return BenchResult(battles, seconds, battles / seconds, rounds / seconds, rounds / max(battles, 1),
+                       clash_us, peak / 1024)
+
+# ============================================================================
+# 3. 基线文件
+# ============================================================================
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+def run_suite(scenarios: List[str], modes: List[str], min_time: float = 0.5, log=None) -> dict:
+    """运行 场景 x 模式 并返回可写入基线文件的字典 (键为 "场景/模式")。"""
+    units_db, buildings_db = load_databases("units.json", "buildings.json")
+    results: Dict[str, Optional[dict]] = {}
+    for name in scenarios:
+        conf = SCENARIOS[name]()
+        for mode in modes:
+            res = bench_one(conf, mode, units_db, buildings_db, min_time)
+            results[f"{name}/{mode}"] = asdict(res) if res is not None else None
+            if log is not None:
+                log(format_row(f"{name}/{mode}", res))
+    return {"meta": {"created": datetime.datetime.now().isoformat(timespec="seconds"), "commit": _git_commit(),
+                     "python": platform.python_version(), "machine": platform.machine(),
+                     "platform": platform.platform(), "min_time": min_time, "mc_trials": MC_TRIALS},
+            "results": results}
+
+def format_row(key: str, res: Optional[BenchResult]) -> str:
+    if res is None:
+        return f"  {key:<30} | skipped"
+    clash = " / ".join(f"{res.clash_us[f'p{q}']:.1f}" for q in PERCENTILES) if res.clash_us else "-"
+    return (f"  {key:<30} | {res.battles_per_s:>10.2f} | {res.rounds_per_s:>10.0f} | "
+            f"{clash:>22} | {res.peak_kib:>9.1f}")
+
+HEADER = (f"  {'SCENARIO/MODE':<30} | {'BATTLES/s':>10} | {'ROUNDS/s':>10} | "
+          f"{'CLASH us p50/p90/p99':>22} | {'PEAK KiB':>9}")
+
+# ============================================================================
+# 4. 回归比较
+# ============================================================================
+# 吞吐 (越高越好) 下降、或交战延迟 / 内存峰值 (越低越好) 上升超过阈值即判为回归。
+
+HIGHER_BETTER = ("battles_per_s", "rounds_per_s")
+LOWER_BETTER = ("clash_us.p50", "clash_us.p99", "peak_kib")
+
+def _metric(rec: dict, name: str) -> Optional[float]:
+    for part in name.split("."):
+        if rec is None:
+            return None
+        rec = rec.get(part)
+    return rec
+
+@dataclass
+class Change:
+    key: str
+    metric: str
+    base: float
+    new: float
+    ratio: float        # new / base
+    regression: bool
+
+def compare(base: dict, new: dict, threshold: float = 0.10) -> Tuple[List[Change], List[str]]:
+    """返回 (各指标变化, 基线中有但新结果缺失或跳过的条目)。"""
+    changes, missing = [], []
+    for key, b in base["results"].items():
+        n = new["results"].get(key)
+        if b is None:
+            continue
+        if n is None:
+            missing.append(key)
+            continue
+        for metric in HIGHER_BETTER + LOWER_BETTER:
+            bv, nv = _metric(b, metric), _metric(n, metric)
+            if bv is None or nv is None or bv <= 0:
+                continue
+            ratio = nv / bv
+            worse = ratio < 1.0 - threshold if metric in HIGHER_BETTER else ratio > 1.0 + threshold
+            changes.append(Change(key, metric, bv, nv, ratio, worse))
+    return changes, missing
+
+# ============================================================================
+# 5. 规模测试
+# ============================================================================
+# 固定回合数内测量每回合 / 每次交战的耗时随 Stack 数的变化 (scenario_front)。
+# 交战次数按各回合的出手队列统计。
+#
+# 每次交战的成本并不与规模无关：结果要求逐位精确，每次命中都要按兵力占比分摊到受击池
+# (前排 / 后排 / 空军) 内的每个 Group，这部分与受击池的 Group 数成正比。选目标、池内兵力、
+# 在场护甲、合并输出等其余部分已是常数或对数成本，因此 Stack 数翻倍时 GROWTH 仍接近 2x
+# (10 -> 200 个 Stack 每次交战约增加 5-7 倍)。ns/GROUP 为每次交战耗时除以受击池的 Group 数
+# (scenario_front 中全部为前排，即敌方 Group 数)；小规模时以每次交战的固定开销为主，
+# 规模增大后该列趋于稳定，说明剩余的增长就是这一分摊。
+
+SCALE_STACKS = (10, 25, 50, 100, 200)
+SCALE_ROUNDS = 3
+
+@dataclass
+class ScalePoint:
+    mode: str
+    stacks: int
+    groups: int             # 单方 Group 数
+    rounds: int
+    clashes: int
+    round_ms: float
+    clash_us: float
+
+def bench_scale(stacks: int, mode: str, units_db, buildings_db, rounds: int = SCALE_ROUNDS,
+                seed: int = 0) -> ScalePoint:
+    """
+    在 stacks 对 stacks 的战线上推进 rounds 个随机回合 (不做僵局检测)，返回平均耗时。
+    每次交战耗时随受击池的 Group 数线性增长 (见本节说明)。
+    """
+    conf = scenario_front(stacks, mode)
+    army_a = build_army(conf["team_a"], units_db, buildings_db)
+    army_b = build_army(conf["team_b"], units_db, buildings_db)
+    b_mode = BattleMode(mode)
+    rng = random.Random(seed)
+    clashes = played = 0
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        if not (army_a.is_alive and army_b.is_alive):
+            break
+        clashes += len(cow_core.get_interleaved_turn_order(army_a, army_b, b_mode))
+        army_a.reset_round_stats()
+        army_b.reset_round_stats()
+        f_atk = max(cow_core.RANDOM_MIN, min(cow_core.RANDOM_MAX, rng.gauss(cow_core.RANDOM_MU, cow_core.RANDOM_SIGMA)))
+        f_def = max(cow_core.RANDOM_MIN, min(cow_core.RANDOM_MAX, rng.gauss(cow_core.RANDOM_MU, cow_core.RANDOM_SIGMA)))
+        cow_core.play_round(army_a, army_b, b_mode, f_atk, f_def)
+        played += 1
+    seconds = time.perf_counter() - t0
+    groups = sum(len(s.groups) for s in army_a.stacks)
+    return ScalePoint(mode, stacks, groups, played, clashes, seconds / max(played, 1) * 1e3,
+                      seconds / max(clashes, 1) * 1e6)
+
+def run_scale(stack_counts, modes, rounds: int = SCALE_ROUNDS, log=None) -> List[ScalePoint]:
+    units_db, buildings_db = load_databases("units.json", "buildings.json")
+    points = []
+    for mode in modes:
+        prev = None
+        for n in stack_counts:
+            pt = bench_scale(n, mode, units_db, buildings_db, rounds)
+            points.append(pt)
+            if log is not None:
+                # 相对上一档的每次交战耗时之比；受击池随 Stack 数线性增长，翻倍时预期接近 2x
+                growth = f"{pt.clash_us / prev.clash_us:>6.2f}x" if prev else f"{'-':>7}"
+                log(f"  {mode:<12} | {n:>6} | {pt.groups:>6} | {pt.clashes / max(pt.rounds, 1):>8.0f} | "
+                    f"{pt.round_ms:>10.2f} | {pt.clash_us:>9.1f} | {growth} | "
+                    f"{pt.clash_us * 1e3 / max(pt.groups, 1):>8.1f}")
+            prev = pt
+    return points
+
+SCALE_HEADER = (f"  {'MODE':<12} | {'STACKS':>6} | {'GROUPS':>6} | {'CLASH/R':>8} | {'ms/ROUND':>10} | "
+                f"{'us/CLASH':>9} | {'GROWTH':>7} | {'ns/GROUP':>8}")
+
+# ============================================================================
+# 6. 批量引擎对比
+# ============================================================================
+# 同一配置下 vector / jit 引擎完成 N 场 Monte Carlo 的耗时 (各引擎先预热，jit 含编译缓存加载)，
+# 以及 engine="auto" 在该试验数下的选择；cow_batch.JIT_MAX_TRIALS 依据这里的分界点设定。
+# 两种引擎逐试验结果相同，耗时差异只来自执行方式。
+
+ENGINE_TRIALS = (1000, 10000, 100000)
+
+@dataclass
+class EnginePoint:
+    trials: int
+    seconds: Dict[str, Optional[float]]     # 引擎 -> 耗时 (秒)，不可用时为 None
+    auto: str                               # engine="auto" 的选择
+
+def run_engines(conf: dict, trial_counts=ENGINE_TRIALS, engines=("vector", "jit"), seed: int = 0,
+                log=None) -> List[EnginePoint]:
+    units_db, buildings_db = load_databases("units.json", "buildings.json")
+    army_a = build_army(conf["team_a"], units_db, buildings_db)
+    army_b = build_army(conf["team_b"], units_db, buildings_db)
+    b_mode = BattleMode(conf.get("battle_mode", "LAND_ATTACK"))
+    max_rounds = conf.get("max_rounds", 50)
+
+    available = []
+    for name in engines:
+        try:
+            run_monte_carlo(army_a, army_b, b_mode, 4, max_rounds, seed, engine=name)  # 预热
+            available.append(name)
+        except (ImportError, RuntimeError):
+            pass
+
+    points = []
+    for n in trial_counts:
+        seconds = {}
+        for name in engines:
+            if name not in available:
+                seconds[name] = None
+                continue
+            t0 = time.perf_counter()
+            run_monte_carlo(army_a, army_b, b_mode, n, max_rounds, seed, engine=name)
+            seconds[name] = time.perf_counter() - t0
+        vec = _pick_vector("auto", n, army_a, army_b, b_mode)
+        auto = "scalar" if vec is None else vec.__name__[len("cow_"):]
+        pt = EnginePoint(n, seconds, auto)
+        points.append(pt)
+        if log is not None:
+            cols = " | ".join(f"{'-':>9}" if seconds[e] is None else f"{seconds[e]:>8.3f}s" for e in engines)
+            log(f"  {n:>8} | {cols} | {auto:<6}")
+    return points
+
+# ============================================================================
+# 7. 命令行
+# ============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="引擎性能基准与回归比较")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_run = sub.add_parser("run", help="运行基准并 (可选) 写出基线 JSON")
+    p_run.add_argument("--out", default=None, help="结果 JSON 路径")
+    p_run.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="只运行指定场景 (可多次)")
+    p_run.add_argument("--mode", action="append", choices=list(MODES), help="只运行指定模式 (可多次)")
+    p_run.add_argument("--min-time", type=float, default=0.5, help="每个 场景/模式 至少计时的秒数")
+    p_cmp = sub.add_parser("compare", help="比较两份结果，回归时返回非零")
+    p_cmp.add_argument("base")
+    p_cmp.add_argument("new")
+    p_cmp.add_argument("--threshold", type=float, default=0.10, help="判定回归的相对变化 (默认 10%%)")
+    p_cmp.add_argument("--strict", action="store_true", help="基线中有而新结果缺失 / 跳过的条目也算回归")
+    p_scale = sub.add_parser("scale", help="每回合 / 每次交战耗时随 Stack 数的变化")
+    p_scale.add_argument("--stacks", type=int, nargs="+", default=list(SCALE_STACKS), help="单方 Stack 数")
+    p_scale.add_argument("--mode", action="append", choices=["LAND_MEET", "LAND_ATTACK"], help="战斗模式 (可多次)")
+    p_scale.add_argument("--rounds", type=int, default=SCALE_ROUNDS, help="每档推进的回合数")
+    p_scale.add_argument("--out", default=None, help="结果 JSON 路径")
+    p_eng = sub.add_parser("engines", help="各试验数下 vector / jit 批量引擎的耗时与 auto 的选择")
+    p_eng.add_argument("--scenario", default="shipped", choices=list(SCENARIOS), help="参考场景")
+    p_eng.add_argument("--trials", type=int, nargs="+", default=list(ENGINE_TRIALS), help="试验次数")
+    p_eng.add_argument("--engine", action="append", choices=["scalar", "vector", "jit"],
+                       help="参与比较的引擎 (可多次，默认 vector 与 jit)")
+    p_eng.add_argument("--out", default=None, help="结果 JSON 路径")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "engines":
+        engines = args.engine or ["vector", "jit"]
+        print(f"  {'TRIALS':>8} | " + " | ".join(f"{e:>9}" for e in engines) + f" | {'AUTO':<6}")
+        points = run_engines(SCENARIOS[args.scenario](), args.trials, engines, log=print)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump([asdict(p) for p in points], f, ensure_ascii=False, indent=2)
+        return 0
+
+    if args.cmd == "scale":
+        print(SCALE_HEADER)
+        points = run_scale(args.stacks, args.mode or ["LAND_MEET", "LAND_ATTACK"], args.rounds, print)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump([asdict(p) for p in points], f, ensure_ascii=False, indent=2)
+        return 0
+
+    if args.cmd == "run":
+        print(HEADER)
+        report = run_suite(args.scenario or list(SCENARIOS), args.mode or list(MODES), args.min_time, print)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        return 0
+
+    base, new = load_json(args.base), load_json(args.new)
+    changes, missing = compare(base, new, args.threshold)
+    print(f"  {'SCENARIO/MODE':<30} | {'METRIC':<14} | {'BASE':>12} | {'NEW':>12} | {'CHANGE':>8}")
+    for c in changes:
+        flag = "  REGRESSION" if c.regression else ""
+        print(f"  {c.key:<30} | {c.metric:<14} | {c.base:>12.2f} | {c.new:>12.2f} | {(c.ratio - 1) * 100:>+7.1f}%{flag}")
+    for key in missing:
+        print(f"  {key:<30} | missing in {args.new}" + ("  REGRESSION" if args.strict else ""))
+    n_reg = sum(c.regression for c in changes) + (len(missing) if args.strict else 0)
+    print(f"{n_reg} regression(s) beyond {args.threshold * 100:.0f}%")
+    return 1 if n_reg else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+import time
+import pickle
+import sqlite3
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Optional
+
+from cow_core import Army, ArmyState, BattleMode, BattleResult, run_simulation
+
+# ============================================================================
+# 1. 配置
+# ============================================================================
+
+# 引擎规则或 BattleResult 结构变化时递增，旧缓存条目自然失配
+CACHE_VERSION = 2
+DEFAULT_MAX_ENTRIES = 4096
+DEFAULT_MAX_BYTES = 64 << 20
+
+# ============================================================================
+# 2. 规范化键
+# ============================================================================
+# 键只包含影响战斗结果的内容：Stack / Group 的顺序、单位数值、数量与 HP、地形、核心、
+# Split / 空军 / 目标 / 巡逻 / 远程标记、建筑等级配置与 HP，以及模式和回合上限。浮点数用 float.hex 精确表示。
+
+def _f(x: float) -> str:
+    return float(x).hex()
+
+def _canonical_army(army: Army) -> list:
+    stacks = []
+    for s in army.stacks:
+        groups = [(g.name, _f(g.stats.hp), g.stats.armor_type.value,
+                   tuple(_f(v) for v in g.stats.attack_table), tuple(_f(v) for v in g.stats.defense_table),
+                   g.count, _f(g.current_hp), g.initial_count, _f(g.initial_hp),
+                   _f(g.terrain_bonus), g.is_core, g.is_ranged, g.is_ultra_ranged)
+                  for g in s.groups]
+        b = s.building
+        bld = None if b is None else (b.name, tuple((c.level, _f(c.hp_add), _f(c.mitigation_add))
+                                                    for c in b.levels_config),
+                                      _f(b.current_hp), _f(b.initial_hp))
+        stacks.append((s.name, s.is_core, s.is_split, s.is_air, s.manual_target, s.is_patrol, bld, groups))
+    return [army.name, stacks]
+
+def battle_key(army_a: Army, army_b: Army, mode: BattleMode, max_rounds: int, **options) -> str:
+    """确定性战斗的内容寻址键 (sha256)。options 为影响结果的 run_simulation 参数。"""
+    canon = (CACHE_VERSION, mode.value, max_rounds, sorted(options.items()),
+             _canonical_army(army_a), _canonical_army(army_b))
+    return hashlib.sha256(repr(canon).encode()).hexdigest()
+
+def apply_army_state(army: Army, state: ArmyState):
+    """把 BattleResult 中的最终状态写回 Army，使缓存命中与实际运行的副作用一致。"""
+    groups = iter(state.groups)
+    for s in army.stacks:
+        for g in s.groups:
+            gs = next(groups)
+            g.count, g.current_hp = gs.count, gs.current_hp
+            g.last_round_loss, g.last_round_dead = gs.round_loss, gs.round_dead
+    buildings = iter(state.buildings)
+    for s in army.stacks:
+        if s.building:
+            s.building.current_hp = next(buildings).current_hp
+
+# ============================================================================
+# 3. 统计
+# ============================================================================
+
+@dataclass
+class CacheStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    bypassed: int = 0       # 开启随机的请求不进缓存
+    evictions: int = 0
+    hit_seconds: float = 0.0
+    miss_seconds: float = 0.0
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @property
+    def mean_hit_ms(self) -> float:
+        return self.hit_seconds / self.hits * 1000 if self.hits else 0.0
+
+    @property
+    def mean_miss_ms(self) -> float:
+        return self.miss_seconds / self.misses * 1000 if self.misses else 0.0
+
+    def summary(self) -> str:
+        return (f"hit {self.hit_rate*100:.1f}% (mem {self.memory_hits}, disk {self.disk_hits}) | "
+                f"miss {self.misses} | bypass {self.bypassed} | evict {self.evictions} | "
+                f"hit {self.mean_hit_ms:.3f} ms, miss {self.mean_miss_ms:.3f} ms")
+
+# ============================================================================
+# 4. 存储
+# ============================================================================
+
+class _DiskStore:
+    """sqlite 持久层：按总字节数淘汰最久未访问的条目。多个进程可共享同一文件。"""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS battles "
+                        "(key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, atime REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS battles_atime ON battles (atime)")
+        self._sync()
+
+    def _sync(self):
+        """重新统计总字节数。data_version 只在其他连接提交后变化，本进程的写入由 put 增量维护。"""
+        self.version = self.db.execute("PRAGMA data_version").fetchone()[0]
+        self.total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM battles").fetchone()[0]
+
+    def get(self, key: str) -> Optional[bytes]:
+        row = self.db.execute("SELECT value FROM battles WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.db.execute("UPDATE battles SET atime = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key: str, blob: bytes) -> int:
+        """写入并按容量淘汰，返回淘汰条数。"""
+        if self.db.execute("PRAGMA data_version").fetchone()[0] != self.version:
+            self._sync()    # 其他进程共享同一文件并写入过
+        old = self.db.execute("SELECT size FROM battles WHERE key = ?", (key,)).fetchone()
+        self.db.execute("INSERT OR REPLACE INTO battles VALUES (?, ?, ?, ?)", (key, blob, len(blob), time.time()))
+        self.total += len(blob) - (old[0] if old else 0)
+        evicted = 0
+        if self.total > self.max_bytes:
+            for k, size in self.db.execute("SELECT key, size FROM battles ORDER BY atime").fetchall():
+                if self.total <= self.max_bytes or k == key:
+                    break
+                self.db.execute("DELETE FROM battles WHERE key = ?", (k,))
+                self.total -= size
+                evicted += 1
+        return evicted
+
+    def close(self):
+        self.db.close()
+
+class BattleCache:
+    """
+    关闭随机时 run_simulation 的结果缓存。内存层为 LRU (按条数与字节数限制)，
+    可选 sqlite 持久层 (disk_path)。命中时同样把最终状态写回传入的 Army。
+    缓存的结果不含逐回合快照，也不会触发 reporter。
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_BYTES,
+                 disk_path: Optional[str] = None, disk_max_bytes: int = 16 * DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.mem: "OrderedDict[str, bytes]" = OrderedDict()
+        self.mem_bytes = 0
+        self.disk = _DiskStore(disk_path, disk_max_bytes) if disk_path else None
+        self.stats = CacheStats()
+
+    def _remember(self, key: str, blob: bytes):
+        old = self.mem.pop(key, None)
+        if old is not None:
+            self.mem_bytes -= len(old)
+        self.mem[key] = blob
+        self.mem_bytes += len(blob)
+        while self.mem and (len(self.mem) > self.max_entries or self.mem_bytes > self.max_bytes):
+            _, dropped = self.mem.popitem(last=False)
+            self.mem_bytes -= len(dropped)
+            self.stats.evictions += 1
+
+    def lookup(self, key: str) -> Optional[BattleResult]:
+        blob = self.mem.get(key)
+        if blob is not None:
+            self.mem.move_to_end(key)
+            self.stats.memory_hits += 1
+            return pickle.loads(blob)
+        if self.disk is not None:
+            blob = self.disk.get(key)
+            if blob is not None:
+                self._remember(key, blob)
+                self.stats.disk_hits += 1
+                return pickle.loads(blob)
+        return None
+
+    def store(self, key: str, result: BattleResult):
+        blob = pickle.dumps(replace(result, snapshots=[]), protocol=pickle.HIGHEST_PROTOCOL)
+        self._remember(key, blob)
+        if self.disk is not None:
+            self.stats.evictions += self.disk.put(key, blob)
+
+    def run(self, army_a: Army, army_b: Army, mode: BattleMode, max_rounds: int = 50,
+            use_random: bool = False, rng=None, detect_stalemate: bool = True,
+            extrapolate: bool = False, siege_damage: bool = True) -> BattleResult:
+        """与 run_simulation 同参 (静默运行)；use_random=True 时直接透传，不读写缓存。"""
+        if use_random:
+            self.stats.bypassed += 1
+            return run_simulation(army_a, army_b, mode, max_rounds, True, False, verbose=False, rng=rng,
+                                  detect_stalemate=detect_stalemate, siege_damage=siege_damage)
+
+        t0 = time.perf_counter()
+        key = battle_key(army_a, army_b, mode, max_rounds, detect_stalemate=detect_stalemate,
+                         extrapolate=extrapolate, siege_damage=siege_damage)
+        result = self.lookup(key)
+        if result is not None:
+            apply_army_state(army_a, result.army_a)
+            apply_army_state(army_b, result.army_b)
+            self.stats.hit_seconds += time.perf_counter() - t0
+            return result
+
+        result = run_simulation(army_a, army_b, mode, max_rounds, False, False, verbose=False,
+                                detect_stalemate=detect_stalemate, extrapolate=extrapolate,
+                                siege_damage=siege_damage)
+        self.store(key, result)
+        self.stats.misses += 1
+        self.stats.miss_seconds += time.perf_counter() - t0
+        return result
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
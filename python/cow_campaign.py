@@ -0,0 +1,424 @@
+import sys
+import copy
+import time
+import argparse
+from array import array
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional, Tuple
+
+from cow_core import (Army, ArmySnapshot, ArmyState, BattleMode, BattleResult, run_simulation, capture_army_state,
+                      print_state_summary)
+from cow_batch import restore_army, percentile, _vector_engine, VECTOR_MIN_TRIALS, DEFAULT_PERCENTILES
+from cow_db import load_lazy_databases
+from cow_rng import CounterRNG, fresh_seed
+from run_battle import load_json, build_army
+
+# ============================================================================
+# 1. 战役配置
+# ============================================================================
+# 战役由一支常驻军队 ("army") 与依次进行的若干场战斗 ("battles") 组成：
+#   {"army": {team 配置}, "enable_randomness": true, "siege_damage": true,
+#    "battles": [{"name": "Wave 1", "battle_mode": "LAND_ATTACK", "side": "team_b", "max_rounds": 50,
+#                 "enemy": {team 配置},
+#                 "reinforcements": [{"stack": "Stack 1", "id": "Infantry_Lvl1", "count": 20, "hp_ratio": 1}],
+#                 "repair": {"Stack 1": 0.25}}, ...]}
+# 每场战斗的 enemy 按配置重新构建；常驻军队的幸存者 (数量 / HP / 建筑 HP) 直接带入下一场。
+# side 为常驻军队在本场中的位置 (team_a 为进攻方，team_b 为防守方)。
+# reinforcements / repair 在本场开战前生效：增援按满血比例 hp_ratio 加入指定 Stack 的同名 Group
+# (Stack / Group 不存在时在构建时预先补上数量为 0 的空位)；repair 为 Stack 名 (或 "*") 到
+# 修复量占建筑满血 HP 比例的映射，修复后不超过满血。
+
+DEFAULT_PARTICLES = 2000
+SIDES = ("team_a", "team_b")
+
+@dataclass
+class Reinforcement:
+    stack: str
+    unit: str
+    count: int
+    hp_ratio: float = 1.0
+
+@dataclass
+class Stage:
+    name: str
+    mode: BattleMode
+    max_rounds: int
+    side: str
+    enemy: dict
+    reinforcements: List[Reinforcement] = field(default_factory=list)
+    repair: Dict[str, float] = field(default_factory=dict)
+
+@dataclass
+class Campaign:
+    name: str
+    army: dict              # 常驻军队的 team 配置 (已补全增援用的空位)
+    stages: List[Stage]
+    use_random: bool = True
+    siege_damage: bool = True
+    detailed_output: bool = False
+
+def _stacks_form(team: dict) -> dict:
+    """旧格式 (team 层级直接给出 units) 转为 stacks 格式，与 build_army 的兼容规则一致。"""
+    if "units" not in team:
+        return copy.deepcopy(team)
+    return {"name": team.get("name", "Unknown Army"),
+            "stacks": [{"name": "Main Stack", "units": copy.deepcopy(team["units"]),
+                        "building": copy.deepcopy(team.get("building")), "core": team.get("core", False)}]}
+
+def parse_campaign(conf: dict) -> Campaign:
+    stages = []
+    for k, b in enumerate(conf["battles"], 1):
+        side = b.get("side", "team_a")
+        if side not in SIDES:
+            raise ValueError(f"battle {k}: side must be one of {SIDES}, got {side!r}")
+        reinf = [Reinforcement(r.get("stack", "Main Stack"), r["id"], int(r["count"]), float(r.get("hp_ratio", 1.0)))
+                 for r in b.get("reinforcements", [])]
+        stages.append(Stage(b.get("name", f"Battle {k}"), BattleMode(b.get("battle_mode", conf.get("battle_mode", "LAND_ATTACK"))),
+                            int(b.get("max_rounds", conf.get("max_rounds", 50))), side, b["enemy"], reinf,
+                            {s: float(r) for s, r in b.get("repair", {}).items()}))
+
+    # 军队结构在构建后不可增删：增援涉及的 Stack / Group 先以数量 0 占位 (零数量 Group 不产生输出、不承受伤害)
+    army = _stacks_form(conf["army"])
+    stacks = army.setdefault("stacks", [])
+    for st in stages:
+        for r in st.reinforcements:
+            s_entry = next((s for s in stacks if s.get("name", "Stack") == r.stack), None)
+            if s_entry is None:
+                s_entry = {"name": r.stack, "units": []}
+                stacks.append(s_entry)
+            units = s_entry.setdefault("units", [])
+            if not any(u["id"] == r.unit for u in units):
+                units.append({"id": r.unit, "count": 0})
+    return Campaign(conf.get("name", army.get("name", "Campaign")), army, stages, conf.get("enable_randomness", True),
+                    conf.get("siege_damage", True), conf.get("detailed_output", False))
+
+# ============================================================================
+# 2. 战间状态变换
+# ============================================================================
+
+class _Transition:
+    """
+    一场战斗开战前的增援与修复，预先解析为对 ArmySnapshot 扁平数组的下标操作，
+    单条链与 Monte Carlo 的每个粒子都直接改写快照，不经过 JSON。
+    """
+
+    def __init__(self, army: Army, stage: Stage):
+        groups = [(s.name, g) for s in army.stacks for g in s.groups]
+        n = len(groups)
+        self.labels: List[str] = []
+        self.reinforce: List[Tuple[int, int, float]] = []     # (Group 下标, 数量, 增加的 HP)
+        for r in stage.reinforcements:
+            k = next((k for k, (sn, g) in enumerate(groups) if sn == r.stack and g.name == r.unit), None)
+            if k is None:
+                raise ValueError(f"{stage.name}: unknown unit '{r.unit}' for reinforcement of '{r.stack}'")
+            self.reinforce.append((k, r.count, r.count * groups[k][1].max_hp_per_unit * r.hp_ratio))
+            self.labels.append(f"增援 [{r.stack}] {r.unit} +{r.count}")
+
+        # 建筑 HP 位于快照 f 的尾部，按带建筑的 Stack 顺序排列 (见 Army.__init__)
+        self.repair: List[Tuple[int, float, float]] = []      # (f 下标, 修复量, 满血 HP)
+        pos = 2 * n
+        for s in army.stacks:
+            if s.building is None:
+                continue
+            ratio = stage.repair.get(s.name, stage.repair.get("*", 0.0))
+            if ratio > 0:
+                cap = s.building.max_hp
+                self.repair.append((pos, ratio * cap, cap))
+                self.labels.append(f"修复 [{s.name}] {s.building.name} +{ratio*100:g}%")
+            pos += 1
+        unknown = set(stage.repair) - {s.name for s in army.stacks} - {"*"}
+        if unknown:
+            raise ValueError(f"{stage.name}: repair refers to unknown stacks {sorted(unknown)}")
+
+    def __bool__(self):
+        return bool(self.reinforce or self.repair)
+
+    def apply(self, snap: ArmySnapshot):
+        f, i = snap.f, snap.i
+        for k, count, hp in self.reinforce:
+            i[k] += count
+            f[k] += hp
+        for k, add, cap in self.repair:
+            f[k] = min(cap, f[k] + add)
+
+def _rebase(army: Army):
+    """以当前状态作为本场的初始值，战报中的伤亡只统计本场。"""
+    for s in army.stacks:
+        for g in s.groups:
+            g.initial_count = g.count
+            g.initial_hp = g.current_hp
+        if s.building:
+            s.building.initial_hp = s.building.current_hp
+
+def _fight(army: Army, enemy: Army, stage: Stage, **kwargs) -> BattleResult:
+    """按 side 排好攻守方运行一场。"""
+    a, b = (army, enemy) if stage.side == "team_a" else (enemy, army)
+    return run_simulation(a, b, stage.mode, stage.max_rounds, **kwargs)
+
+# ============================================================================
+# 3. 单条战役链
+# ============================================================================
+
+@dataclass
+class CampaignBattle:
+    stage: str
+    side: str
+    result: BattleResult
+    army: ArmyState         # 常驻军队战后状态，即下一场 (增援 / 修复前) 的输入
+
+@dataclass
+class CampaignResult:
+    stages: int
+    battles: List[CampaignBattle]
+    army: ArmyState
+    survived: bool
+
+    @property
+    def completed(self) -> bool:
+        return self.survived and len(self.battles) == self.stages
+
+class CampaignRunner:
+    """常驻军队只构建一次；每场的敌方按配置构建一次，Monte Carlo 中通过快照复位。"""
+
+    def __init__(self, campaign: Campaign, units_db, buildings_db):
+        self.campaign = campaign
+        self.army = build_army(campaign.army, units_db, buildings_db)
+        self.enemies = [build_army(st.enemy, units_db, buildings_db) for st in campaign.stages]
+        self.enemy_snaps = [e.snapshot() for e in self.enemies]
+        self.transitions = [_Transition(self.army, st) for st in campaign.stages]
+        self.initial = self.army.snapshot()
+
+    def run(self, seed: Optional[int] = None, verbose: bool = True) -> CampaignResult:
+        """逐场运行一条战役链，常驻军队被全歼时停止。第 k 场使用随机流 (seed, k)。"""
+        c, army = self.campaign, self.army
+        restore_army(army, self.initial)
+        battles = []
+        for k, (st, enemy, tr) in enumerate(zip(c.stages, self.enemies, self.transitions)):
+            restore_army(enemy, self.enemy_snaps[k])
+            if tr:
+                snap = army.snapshot()
+                tr.apply(snap)
+                restore_army(army, snap)
+            _rebase(army)
+            if verbose:
+                print(f"\n##### 第 {k+1}/{len(c.stages)} 场: {st.name} ({st.mode.value}, 常驻军队为 {st.side}) #####")
+                for label in tr.labels:
+                    print(f"  {label}")
+            res = _fight(army, enemy, st, use_random=c.use_random, detailed_output=c.detailed_output,
+                         verbose=verbose, rng=CounterRNG(seed, k), siege_damage=c.siege_damage)
+            battles.append(CampaignBattle(st.name, st.side, res, capture_army_state(army)))
+            if not army.is_alive:
+                break
+        return CampaignResult(len(c.stages), battles, capture_army_state(army), army.is_alive)
+
+    # ========================================================================
+    # 4. Monte Carlo：粒子传播 + 重采样
+    # ========================================================================
+    # 常驻军队的分布用 N 个粒子 (ArmySnapshot) 表示。每场战斗把全部粒子各打一次 (向量引擎一次推进全部粒子)，
+    # 全歼的粒子在此结束战役；存活粒子按等权系统重采样回 N 个，进入下一场。
+    # 后续各场因此始终以 N 个粒子估计 "到达本场" 条件下的分布，到达概率按各场存活率连乘，
+    # 10 场战役的开销约为 10 次 N 试验的单场 Monte Carlo，与存活率无关。
+
+    def run_monte_carlo(self, particles: int = DEFAULT_PARTICLES, seed: Optional[int] = None,
+                        engine: str = "auto", percentiles=DEFAULT_PERCENTILES) -> "CampaignMonteCarloResult":
+        """第 k 场第 j 个粒子使用随机流 (seed, k * particles + j)，标量与向量引擎逐粒子一致。"""
+        c, army = self.campaign, self.army
+        seed = fresh_seed() if seed is None else seed
+        start = time.perf_counter()
+        pool = [ArmySnapshot(array('d', self.initial.f), array('q', self.initial.i)) for _ in range(particles)]
+        reach = 1.0
+        stats = []
+        for k, (st, enemy, tr) in enumerate(zip(c.stages, self.enemies, self.transitions)):
+            t0 = time.perf_counter()
+            restore_army(enemy, self.enemy_snaps[k])
+            for snap in pool:
+                tr.apply(snap)
+            vec = self._pick_vector(engine, particles, enemy, st)
+            if vec is not None:
+                pool, rounds, alive, won = self._stage_vector(vec, pool, enemy, st, seed, k * particles)
+            else:
+                pool, rounds, alive, won = self._stage_scalar(pool, enemy, st, seed, k * particles)
+            survivors = [j for j in range(particles) if alive[j]]
+            s = self._stage_stats(st, reach, pool, survivors, rounds, won, percentiles)
+            s.engine = "vector" if vec is not None else "scalar"
+            s.seconds = time.perf_counter() - t0
+            stats.append(s)
+            reach *= len(survivors) / particles
+            if not survivors:
+                break
+            # 等权系统重采样：各幸存粒子被复制 floor / ceil(N / 幸存数) 次
+            m = len(survivors)
+            pool = [pool[survivors[(j * m) // particles]] for j in range(particles)]
+            pool = [ArmySnapshot(array('d', p.f), array('q', p.i)) for p in pool]
+        restore_army(army, self.initial)
+        return CampaignMonteCarloResult(particles, len(c.stages), stats, reach if len(stats) == len(c.stages) else 0.0,
+                                        time.perf_counter() - start)
+
+    def _pick_vector(self, engine: str, particles: int, enemy: Army, st: Stage):
+        """同 cow_batch._pick_vector；向量引擎总是计算攻城伤害，siege_damage=False 时只能用标量引擎。"""
+        if engine == "scalar":
+            return None
+        vec = _vector_engine()
+        a, b = (self.army, enemy) if st.side == "team_a" else (enemy, self.army)
+        if engine == "vector":
+            if vec is None:
+                raise RuntimeError("vector engine requires numpy")
+            if not self.campaign.siege_damage or not vec.supports(a, b, st.mode):
+                raise ValueError(f"{st.name}: vector engine does not support this battle; use --engine scalar")
+            return vec
+        if (vec is None or not self.campaign.siege_damage or particles < VECTOR_MIN_TRIALS
+                or not vec.supports(a, b, st.mode)):
+            return None
+        return vec
+
+    def _stage_scalar(self, pool: List[ArmySnapshot], enemy: Army, st: Stage, seed: int, first: int):
+        army = self.army
+        enemy_snap = enemy.snapshot()
+        out, rounds, alive, won = [], [], [], []
+        for j, snap in enumerate(pool):
+            restore_army(army, snap)
+            restore_army(enemy, enemy_snap)
+            res = _fight(army, enemy, st, use_random=True, verbose=False, rng=CounterRNG(seed, first + j),
+                         siege_damage=self.campaign.siege_damage)
+            out.append(army.snapshot())
+            rounds.append(res.rounds)
+            alive.append(army.is_alive)
+            won.append(army.is_alive and not enemy.is_alive)
+        restore_army(enemy, enemy_snap)
+        return out, rounds, alive, won
+
+    def _stage_vector(self, vec, pool: List[ArmySnapshot], enemy: Army, st: Stage, seed: int, first: int):
+        import numpy as np
+        army = self.army
+        N = len(pool)
+        G = sum(len(s.groups) for s in army.stacks)
+        bld = [si for si, s in enumerate(army.stacks) if s.building is not None]
+        F = np.array([p.f for p in pool], dtype=float).reshape(N, -1)
+        I = np.array([p.i for p in pool], dtype=np.int64).reshape(N, -1)
+        b_hp = np.zeros((len(army.stacks), N))
+        for pos, si in enumerate(bld):
+            b_hp[si] = F[:, 2 * G + pos]
+
+        mine = vec.VectorArmy(army, 1)
+        mine.load_state(np.ascontiguousarray(I[:, :G].T), np.ascontiguousarray(F[:, :G].T), b_hp)
+        theirs = vec.VectorArmy(enemy, N)
+        va, vb = (mine, theirs) if st.side == "team_a" else (theirs, mine)
+        rounds = vec.advance(va, vb, st.mode, st.max_rounds, vec.StreamGauss(seed, range(first, first + N)))
+
+        # 回写为快照：本回合战损列清零 (下一场开战前 reset_round_stats 同样会清零)
+        F[:, G:] = 0.0
+        F[:, :G] = mine.hp.T
+        for pos, si in enumerate(bld):
+            F[:, 2 * G + pos] = mine.bld_hp[si]
+        I[:, G:] = 0
+        I[:, :G] = mine.count.T
+        out = [ArmySnapshot(array('d', F[j].tobytes()), array('q', I[j].tobytes())) for j in range(N)]
+        alive = mine.alive()
+        return out, rounds.tolist(), alive.tolist(), (alive & ~theirs.alive()).tolist()
+
+    def _stage_stats(self, st: Stage, reach: float, pool: List[ArmySnapshot], survivors: List[int],
+                     rounds: List[int], won: List[bool], percentiles) -> "StageStats":
+        army = self.army
+        N = len(pool)
+        wins = sum(won)
+        losses = N - len(survivors)
+        labels = [f"[{s.name}] {g.name}" for s in army.stacks for g in s.groups]
+        G = len(labels)
+        m = max(1, len(survivors))
+        groups = [(labels[k], sum(pool[j].i[k] for j in survivors) / m, sum(pool[j].f[k] for j in survivors) / m)
+                  for k in range(G)]
+        buildings = []
+        pos = 2 * G
+        for s in army.stacks:
+            if s.building is not None:
+                buildings.append((f"[{s.name}] {s.building.name}", sum(pool[j].f[pos] for j in survivors) / m,
+                                  s.building.max_hp))
+                pos += 1
+        totals = sorted(sum(pool[j].i[:G]) for j in survivors)
+        pcts = {q: percentile(totals, q) for q in percentiles} if totals else {}
+        return StageStats(st.name, st.side, st.mode, reach, N, wins, N - wins - losses, losses,
+                          sum(rounds) / N if N else 0.0, groups, buildings, pcts)
+
+# ============================================================================
+# 5. Monte Carlo 结果
+# ============================================================================
+
+@dataclass
+class StageStats:
+    """一场战斗在 "到达本场" 条件下的统计；groups / buildings 为常驻军队幸存粒子的战后均值。"""
+    name: str
+    side: str
+    mode: BattleMode
+    reach_prob: float
+    particles: int
+    wins: int               # 敌方全灭且常驻军队存活
+    draws: int              # 双方都存活 (回合上限 / 僵局)，常驻军队带着残部进入下一场
+    losses: int             # 常驻军队全灭 (含同归于尽)，战役在此结束
+    mean_rounds: float
+    groups: List[Tuple[str, float, float]]          # (Group, 平均数量, 平均 HP)
+    buildings: List[Tuple[str, float, float]]       # (建筑, 平均 HP, 满血 HP)
+    count_percentiles: Dict[float, float]           # 幸存总数量的分位数
+    engine: str = ""
+    seconds: float = 0.0
+
+    @property
+    def survive_prob(self) -> float:
+        return (self.wins + self.draws) / self.particles if self.particles else 0.0
+
+@dataclass
+class CampaignMonteCarloResult:
+    particles: int
+    stages: int
+    stage_stats: List[StageStats]
+    survival: float         # 打完全部战斗后常驻军队仍存活的概率
+    seconds: float
+
+def print_campaign_summary(res: CampaignMonteCarloResult):
+    print(f"\n=== Campaign Monte Carlo: {res.particles} particles, {len(res.stage_stats)}/{res.stages} battles, "
+          f"{res.seconds:.2f} s ===")
+    print(f"  {'#':>2} {'battle':<18} {'side':<7} {'reach':>8} {'win':>8} {'draw':>8} {'loss':>8} "
+          f"{'rounds':>7} {'engine':>7} {'time':>7}")
+    for k, s in enumerate(res.stage_stats, 1):
+        n = s.particles
+        print(f"  {k:>2} {s.name[:18]:<18} {s.side:<7} {s.reach_prob*100:7.2f}% {s.wins/n*100:7.2f}% "
+              f"{s.draws/n*100:7.2f}% {s.losses/n*100:7.2f}% {s.mean_rounds:7.1f} {s.engine:>7} {s.seconds:6.2f}s")
+    for k, s in enumerate(res.stage_stats, 1):
+        pct = " ".join(f"p{q:g}={v:.0f}" for q, v in s.count_percentiles.items())
+        print(f"\n  [{k}] {s.name} 后幸存部队 (条件于存活){': ' + pct if pct else ''}")
+        for label, count, hp in s.groups:
+            if count > 0:
+                print(f"      {label:<32} 数量 {count:9.2f}  HP {hp:11.2f}")
+        for label, hp, cap in s.buildings:
+            print(f"      {label:<32} HP {hp:11.2f} / {cap:.0f}")
+    print(f"\n  完成全部战斗且常驻军队存活的概率: {res.survival*100:.2f}%")
+
+# ============================================================================
+# 6. CLI
+# ============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="战役模拟：常驻军队的幸存者依次迎战多波敌军")
+    parser.add_argument("--config", default="campaign_config.json", help="战役配置文件")
+    parser.add_argument("--particles", type=int, default=0,
+                        help="Monte Carlo 粒子数 (>0 时传播整条战役的结果分布，忽略 enable_randomness)")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子")
+    parser.add_argument("--engine", choices=["auto", "scalar", "vector"], default="auto",
+                        help="Monte Carlo 引擎 (vector 需要 numpy)")
+    args = parser.parse_args(argv)
+
+    campaign = parse_campaign(load_json(args.config))
+    u_db, b_db = load_lazy_databases("units.json", "buildings.json")
+    runner = CampaignRunner(campaign, u_db, b_db)
+
+    if args.particles > 0:
+        print_campaign_summary(runner.run_monte_carlo(args.particles, args.seed, args.engine))
+        return 0
+
+    res = runner.run(args.seed)
+    print(f"\n##### 战役 {campaign.name}: {len(res.battles)}/{res.stages} 场, "
+          f"{'完成' if res.completed else '常驻军队被全歼'} #####")
+    print_state_summary(res.army)
+    return 0 if res.completed else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,15 @@
 import json
-import random
 import math
+from array import array
+from bisect import bisect_right
+from heapq import heapify, heappush, heappop
+from operator import itemgetter
 from enum import Enum
+from contextlib import contextmanager
 from dataclasses import dataclass, field
-from typing import List, Dict, Optional, Tuple, Any, Set
+from typing import List, Dict, Optional, Tuple, Any, Set, Sequence, NamedTuple
+
+from cow_rng import CounterRNG
 
 # ============================================================================
 # 1. 全局配置
@@ -16,6 +22,7 @@ RANDOM_MIN = 0.8
 RANDOM_MAX = 1.2
 CORE_DMG_MULTI = 1.15       # 核心领土伤害倍率
 CORE_MITIGATION_ADD = 0.15  # 核心领土减伤数值
+BLOB_HEAP_MIN_GROUPS = 32   # Group 数不少于该值的 Army 用惰性堆计算合并输出 (见 _OutputHeap)
 
 # ============================================================================
 # 2. 枚举与基础类
@@ -30,6 +37,10 @@ class ArmorType(str, Enum):
     SUBMARINE = "Submarine"
     BUILDING = "Building"
 
+ARMOR_ORDER: List[ArmorType] = list(ArmorType)
+ARMOR_ORDINAL: Dict[ArmorType, int] = {a: i for i, a in enumerate(ARMOR_ORDER)}
+_ZERO_ROW = (0.0,) * len(ARMOR_ORDER)
+
 class DamageType(str, Enum):
     ATTACK = "Attack"
     DEFENSE = "Defense"
@@ -45,39 +56,62 @@ class BuildingLevelConfig:
     hp_add: float
     mitigation_add: float
 
+class MitigationCurve:
+    """
+    由等级配置预先编译的分段减伤曲线：各级的起止累计 HP 与累计减伤，
+    查询时二分定位当前 HP 所在等级，复杂度 O(log 等级数)。
+    """
+    __slots__ = ("levels", "hps", "mits", "starts", "ends", "cum_mit", "lv1_hp", "total_hp")
+
+    def __init__(self, levels_config: List[BuildingLevelConfig]):
+        self.levels = [cfg.level for cfg in levels_config]
+        self.hps = [cfg.hp_add for cfg in levels_config]
+        self.mits = [cfg.mitigation_add for cfg in levels_config]
+        self.starts, self.ends, self.cum_mit = [], [], [0.0]
+        pos = 0.0
+        for hp, mit in zip(self.hps, self.mits):
+            self.starts.append(pos)
+            pos += hp
+            self.ends.append(pos)
+            self.cum_mit.append(self.cum_mit[-1] + mit)
+        self.lv1_hp = self.hps[0] if self.hps else 0.0
+        self.total_hp = pos
+
+    def mitigation(self, hp: float) -> float:
+        if not self.hps or hp < self.lv1_hp - 1e-9: return 0.0
+        # k: HP 已填满的等级数；第 k 级 (若存在) 为部分填充，1 级以上按比例折算
+        k = bisect_right(self.ends, hp)
+        total = self.cum_mit[k]
+        if k < len(self.hps) and self.levels[k] > 1:
+            ratio = (hp - self.starts[k]) / self.hps[k]
+            total += (0.2 + 0.8 * ratio) * self.mits[k]
+        return total
+
 @dataclass
 class Building:
     name: str
     levels_config: List[BuildingLevelConfig]
     current_hp: float
     initial_hp: float = 0.0 
+    curve: Optional[MitigationCurve] = field(default=None, repr=False, compare=False)
 
     def __post_init__(self):
         self.initial_hp = self.current_hp
+        if self.curve is None:
+            self.curve = MitigationCurve(self.levels_config)
+        # 减伤只随建筑 HP 变化，按 HP 缓存上一次的查询结果
+        self._mit_hp = None
+        self._mit_val = 0.0
 
     @property
     def max_hp(self) -> float:
-        return sum(cfg.hp_add for cfg in self.levels_config)
+        return self.curve.total_hp
 
     def get_current_mitigation(self) -> float:
-        if not self.levels_config: return 0.0
-        lv1_hp = self.levels_config[0].hp_add
-        if self.current_hp < lv1_hp - 1e-9: return 0.0
-        
-        total = 0.0
-        temp_hp = self.current_hp
-        for cfg in self.levels_config:
-            l_max = cfg.hp_add
-            if temp_hp >= l_max:
-                total += cfg.mitigation_add
-                temp_hp -= l_max
-            else:
-                if cfg.level > 1:
-                    ratio = temp_hp / l_max
-                    total += (0.2 + 0.8 * ratio) * cfg.mitigation_add
-                temp_hp = 0
-                break
-        return total
+        if self.current_hp != self._mit_hp:
+            self._mit_val = self.curve.mitigation(self.current_hp)
+            self._mit_hp = self.current_hp
+        return self._mit_val
 
     def take_damage(self, damage: float):
         self.current_hp = max(0.0, self.current_hp - damage)
@@ -93,111 +127,326 @@ class UnitStats:
     armor_type: ArmorType
     attack_values: Dict[ArmorType, float]
     defense_values: Dict[ArmorType, float]
+    # 按 ARMOR_ORDER 序号排列的稠密表，供向量化/编译路径直接索引
+    attack_table: Tuple[float, ...] = field(default=(), repr=False, compare=False)
+    defense_table: Tuple[float, ...] = field(default=(), repr=False, compare=False)
+
+    def __post_init__(self):
+        if not self.attack_table:
+            self.attack_table = tuple(self.attack_values.get(a, 0.0) for a in ARMOR_ORDER)
+        if not self.defense_table:
+            self.defense_table = tuple(self.defense_values.get(a, 0.0) for a in ARMOR_ORDER)
 
 class UnitGroup:
+    """
+    count / current_hp / terrain_bonus / is_core 为属性，赋值时自动使本 Group 的伤害表
+    以及所属 Stack、Army 的聚合缓存失效，因此外部代码可以像普通字段一样直接修改。
+
+    数量 / HP / 本回合战损不存放在对象上，而是存放在所属 Army 的两个扁平数组里 (见 Army.snapshot)：
+    构造时先用 Group 自己的小数组，加入 Army 后改绑到全军共享的数组。
+    """
+
+    __slots__ = ("name", "stats", "max_hp_per_unit", "is_ranged", "is_ultra_ranged", "initial_count", "initial_hp",
+                 "_terrain_bonus", "_is_core", "_stack", "_atk_row", "_def_row", "_f", "_i", "_o", "_r")
+
     def __init__(self, name: str, unit_stats: UnitStats, count: int, 
-                 current_hp: float = None, terrain_bonus: float = 0.0, is_core: bool = False):
+                 current_hp: float = None, terrain_bonus: float = 0.0, is_core: bool = False,
+                 is_ranged: bool = False, is_ultra_ranged: bool = False):
+        self._stack: Optional["Stack"] = None   # 由 Stack 构造时回填
+        self._atk_row: Optional[Tuple[float, ...]] = None
+        self._def_row: Optional[Tuple[float, ...]] = None
         self.name = name
         self.stats = unit_stats
-        self.count = count
         self.max_hp_per_unit = unit_stats.hp
-        self.terrain_bonus = terrain_bonus
-        self.is_core = is_core  # 新增: 核心状态
+        self._terrain_bonus = terrain_bonus
+        self._is_core = is_core  # 新增: 核心状态
+        # 远程 / 超远程 (超远程必然也是远程)，只在 Split Stack 与索敌中生效
+        self.is_ultra_ranged = is_ultra_ranged
+        self.is_ranged = is_ranged or is_ultra_ranged
         
         if current_hp is None:
-            self.current_hp = count * self.max_hp_per_unit
-        else:
-            self.current_hp = current_hp
+            current_hp = count * self.max_hp_per_unit
+
+        # _f[_o] = HP, _f[_r] = 本回合损失 HP；_i[_o] = 数量, _i[_r] = 本回合阵亡
+        self._bind(array('d', (current_hp, 0.0)), array('q', (count, 0)), 0, 1)
 
         self.initial_count = count
-        self.initial_hp = self.current_hp
+        self.initial_hp = current_hp
+
+    def _bind(self, f: array, i: array, o: int, r: int):
+        self._f, self._i, self._o, self._r = f, i, o, r
+
+    # ------------------------------------------------------------------
+    # 可变状态 (赋值即失效缓存)
+    # ------------------------------------------------------------------
 
-        self.last_round_dead = 0.0
-        self.last_round_loss = 0.000
+    def _changed(self):
+        self._atk_row = self._def_row = None
+        if self._stack is not None:
+            self._stack._changed()
+
+    @property
+    def count(self) -> int:
+        return self._i[self._o]
+
+    @count.setter
+    def count(self, value: int):
+        self._i[self._o] = value
+        self._changed()
+
+    @property
+    def current_hp(self) -> float:
+        return self._f[self._o]
+
+    @current_hp.setter
+    def current_hp(self, value: float):
+        self._f[self._o] = value
+        self._changed()
+
+    @property
+    def last_round_loss(self) -> float:
+        return self._f[self._r]
+
+    @last_round_loss.setter
+    def last_round_loss(self, value: float):
+        self._f[self._r] = value
+
+    @property
+    def last_round_dead(self) -> int:
+        return self._i[self._r]
+
+    @last_round_dead.setter
+    def last_round_dead(self, value: int):
+        self._i[self._r] = value
+
+    @property
+    def terrain_bonus(self) -> float:
+        return self._terrain_bonus
+
+    @terrain_bonus.setter
+    def terrain_bonus(self, value: float):
+        self._terrain_bonus = value
+        self._changed()
+
+    @property
+    def is_core(self) -> bool:
+        return self._is_core
+
+    @is_core.setter
+    def is_core(self, value: bool):
+        self._is_core = value
+        self._changed()
 
     @property
     def total_max_hp(self):
-        return self.count * self.max_hp_per_unit
+        return self._i[self._o] * self.max_hp_per_unit
 
     @property
     def hp_ratio(self):
-        if self.count <= 0: return 0.0
-        c_max = self.count * self.max_hp_per_unit
+        count = self._i[self._o]
+        if count <= 0: return 0.0
+        c_max = count * self.max_hp_per_unit
         if c_max <= 0: return 0.0
-        return self.current_hp / c_max
+        return self._f[self._o] / c_max
 
-    def get_unit_damage(self, dmg_type: DamageType, target_armor: ArmorType) -> float:
-        if self.count <= 0: return 0.0
-        table = self.stats.attack_values if dmg_type == DamageType.ATTACK else self.stats.defense_values
-        base = table.get(target_armor, 0.0)
-        eff = 0.2 + 0.8 * self.hp_ratio
-        
+    # ------------------------------------------------------------------
+    # 伤害
+    # ------------------------------------------------------------------
+
+    def _damage_row(self, table: Tuple[float, ...]) -> Tuple[float, ...]:
+        o = self._o
+        count = self._i[o]
+        if count <= 0: return _ZERO_ROW
+        # 同 hp_ratio，内联省去一次属性调用
+        c_max = count * self.max_hp_per_unit
+        eff = 0.2 + 0.8 * (self._f[o] / c_max if c_max > 0 else 0.0)
         # === 核心逻辑修改 ===
         # Terrain Bonus (加法基数): (1.0 + terrain)
         # Core Bonus (独立乘区): * 1.15
-        terrain_mult = 1.0 + self.terrain_bonus
-        core_mult = CORE_DMG_MULTI if self.is_core else 1.0
-        
-        return base * eff * terrain_mult * core_mult
+        terrain_mult = 1.0 + self._terrain_bonus
+        core_mult = CORE_DMG_MULTI if self._is_core else 1.0
+        if terrain_mult == 1.0 and core_mult == 1.0:
+            # 乘 1.0 是精确的，省去两次乘法结果不变
+            return tuple([base * eff for base in table])
+        return tuple([base * eff * terrain_mult * core_mult for base in table])
+
+    def damage_row(self, dmg_type: DamageType) -> Tuple[float, ...]:
+        """当前状态下单个单位对各护甲的伤害 (按 ARMOR_ORDER 排列)，状态变化前重复调用直接返回缓存。"""
+        if dmg_type == DamageType.ATTACK:
+            row = self._atk_row
+            if row is None:
+                row = self._atk_row = self._damage_row(self.stats.attack_table)
+        else:
+            row = self._def_row
+            if row is None:
+                row = self._def_row = self._damage_row(self.stats.defense_table)
+        return row
+
+    def get_unit_damage(self, dmg_type: DamageType, target_armor: ArmorType) -> float:
+        return self.damage_row(dmg_type)[ARMOR_ORDINAL[target_armor]]
 
     def apply_damage(self, amount: float):
-        if amount <= 0 or self.count <= 0: 
-            self.last_round_loss += 0.0
+        i, o = self._i, self._o
+        count = i[o]
+        if amount <= 0 or count <= 0: 
             return
 
+        f, r = self._f, self._r
+        hp = f[o]
+        c_max = count * self.max_hp_per_unit
         dead = 0
-        if self.hp_ratio < CASUALTY_THRESHOLD:
-            avg_hp = self.current_hp / self.count
+        if (hp / c_max if c_max > 0 else 0.0) < CASUALTY_THRESHOLD:
+            avg_hp = hp / count
             if avg_hp > 0:
-                dead = min(int(amount // avg_hp), self.count)
+                # 与网页版一致取 floor(a / b)：商被舍入为整数时可能比 a // b 大 1
+                dead = min(math.floor(amount / avg_hp), count)
         
-        real_dmg = min(self.current_hp, amount)
-        self.current_hp -= real_dmg
-        self.last_round_loss += real_dmg
+        real_dmg = hp if hp <= amount else amount
+        hp -= real_dmg
+        f[r] += real_dmg
 
         if dead > 0:
-            self.count -= dead
-            self.last_round_dead += dead
+            count -= dead
+            i[r] += dead
         
-        if self.current_hp <= 1e-5:
-            self.current_hp = 0.0
-            self.count = 0
-        elif self.count == 0:
-            self.current_hp = 0.0
+        if hp <= 1e-5:
+            hp = 0.0
+            count = 0
+        elif count == 0:
+            hp = 0.0
+        # 直接写状态数组，缓存只失效一次
+        f[o] = hp
+        i[o] = count
+        self._changed()
 
     def reset_round_stats(self):
-        self.last_round_dead = 0
-        self.last_round_loss = 0.000
+        self._i[self._r] = 0
+        self._f[self._r] = 0.0
 
 # ============================================================================
 # 4. Stack
 # ============================================================================
 
+def _output_rows(groups: List[UnitGroup], dmg_type: DamageType, only_ranged: bool) -> list:
+    """有兵力的 Group 的 (伤害表, 数量)，保持 Group 顺序。"""
+    rows = []
+    for g in groups:
+        count = g._i[g._o]
+        if count > 0 and (g.is_ranged or not only_ranged):
+            rows.append((g.damage_row(dmg_type), count))
+    return rows
+
+def _top_output(rows: list, target_armor: ArmorType, limit: int) -> float:
+    """按单位伤害从高到低取前 limit 个单位的总输出。"""
+    idx = ARMOR_ORDINAL[target_armor]
+    candidates = [(row[idx], cnt) for row, cnt in rows if row[idx] > 0]
+    if len(candidates) > 1:
+        candidates.sort(key=itemgetter(0), reverse=True)
+    total = 0.0
+    left = limit
+    for u_dmg, cnt in candidates:
+        if left <= 0: break
+        take = min(left, cnt)
+        total += take * u_dmg
+        left -= take
+    return total
+
 class Stack:
-    def __init__(self, name: str, groups: List[UnitGroup], building: Optional[Building] = None, is_core: bool = False):
+    """
+    total_hp / total_count / is_alive / 在场护甲以及 calculate_output 的结果按需计算并缓存，
+    任一 Group 的数量或 HP 变化时失效 (见 UnitGroup)。groups 列表在构造后不应再增删。
+    """
+
+    __slots__ = ("name", "groups", "building", "is_core", "_is_split", "_is_air", "manual_target", "is_patrol",
+                 "_army", "_agg", "_out")
+
+    def __init__(self, name: str, groups: List[UnitGroup], building: Optional[Building] = None, is_core: bool = False,
+                 is_split: bool = False, is_air: bool = False, manual_target: Optional[str] = None,
+                 is_patrol: bool = False):
         self.name = name
         self.groups = groups
         self.building = building  # Building 现在归 Stack 管
         self.is_core = is_core    # Core 现在归 Stack 管
+        self._is_split = is_split  # 后排 (炮兵/防空等)
+        self._is_air = is_air
+        # 手动目标 (敌方 Stack 名)。None 表示配置中未给出；"" 表示显式给出空目标，见 is_stack_grounded_plane
+        self.manual_target = manual_target
+        self.is_patrol = is_patrol
+        self._army: Optional["Army"] = None   # 由 Army 构造时回填
+        self._agg = None    # (total_hp, total_count, is_alive, 在场护甲)
+        self._out: Dict[tuple, Any] = {}    # 各护甲的输出，以及按伤害类型缓存的 (伤害表, 数量) 行
+        for g in groups:
+            g._stack = self
+
+    def _changed(self):
+        self._agg = None
+        if self._out:
+            self._out = {}
+        if self._army is not None:
+            self._army._changed()
+
+    def _aggregate(self) -> tuple:
+        agg = self._agg
+        if agg is None:
+            hp = 0
+            count = 0
+            any_count = False
+            armors = set()
+            for g in self.groups:
+                o = g._o
+                g_hp = g._f[o]
+                g_count = g._i[o]
+                hp += g_hp
+                count += g_count
+                if g_count > 0:
+                    any_count = True
+                    if g_hp > 0:
+                        armors.add(g.stats.armor_type)
+            agg = self._agg = (hp, count, hp > 0 and any_count, frozenset(armors))
+        return agg
 
     @property
     def total_hp(self):
-        return sum(g.current_hp for g in self.groups)
+        return self._aggregate()[0]
     
     @property
     def total_count(self):
-        return sum(g.count for g in self.groups)
+        return self._aggregate()[1]
 
     @property
     def is_alive(self):
-        return self.total_hp > 0 and any(g.count > 0 for g in self.groups)
+        return self._aggregate()[2]
+
+    # 阵位决定所属 Army 的分池 (见 Army._roster)，修改时一并失效
+    @property
+    def is_split(self) -> bool:
+        return self._is_split
+
+    @is_split.setter
+    def is_split(self, value: bool):
+        self._is_split = value
+        self._changed()
+
+    @property
+    def is_air(self) -> bool:
+        return self._is_air
+
+    @is_air.setter
+    def is_air(self, value: bool):
+        self._is_air = value
+        self._changed()
+
+    @property
+    def has_ranged(self):
+        return any(g.is_ranged and g.count > 0 for g in self.groups)
+
+    @property
+    def has_ultra(self):
+        return any(g.is_ultra_ranged and g.count > 0 for g in self.groups)
 
     def get_present_armor_types(self) -> Set[ArmorType]:
-        types = set()
-        for g in self.groups:
-            if g.count > 0 and g.current_hp > 0:
-                types.add(g.stats.armor_type)
-        return types
+        """当前存活 Group 的护甲类型 (只读集合)。"""
+        return self._aggregate()[3]
     
     # 新增: 获取当前 Stack 的总减伤
     def get_total_mitigation(self) -> float:
@@ -211,21 +460,16 @@ class Stack:
         
         return min(mit, 1.0) # 上限 100%
 
-    def calculate_output(self, dmg_type: DamageType, target_armor: ArmorType, limit: int = 10) -> float:
-        candidates = []
-        for g in self.groups:
-            dmg = g.get_unit_damage(dmg_type, target_armor)
-            if dmg > 0 and g.count > 0:
-                candidates.append((dmg, g.count))
-        candidates.sort(key=lambda x: x[0], reverse=True)
-        total = 0.0
-        left = limit
-        for u_dmg, cnt in candidates:
-            if left <= 0: break
-            take = min(left, cnt)
-            total += take * u_dmg
-            left -= take
-        return total
+    def calculate_output(self, dmg_type: DamageType, target_armor: ArmorType, limit: int = 10,
+                         only_ranged: bool = False) -> float:
+        key = (dmg_type, target_armor, limit, only_ranged)
+        out = self._out.get(key)
+        if out is None:
+            rows = self._out.get((dmg_type, only_ranged))
+            if rows is None:
+                rows = self._out[(dmg_type, only_ranged)] = _output_rows(self.groups, dmg_type, only_ranged)
+            out = self._out[key] = _top_output(rows, target_armor, limit)
+        return out
 
     def receive_damage_distribution(self, potential_damages: Dict[ArmorType, float], total_army_count: int):
         """
@@ -233,95 +477,400 @@ class Stack:
         注意: 这里不再传入 mitigation 参数，因为 mitigation 是 Stack 自身的属性。
         """
         if total_army_count <= 0: return
-        
+        lost, died, bumped = _distribute((self,), potential_damages, total_army_count)
+        if self._army is not None and (lost or died or bumped):
+            self._army._damaged(_pool_index(self), lost, died, bumped)
+
+
+def _distribute(stacks, potential_damages: Dict[ArmorType, float], total_army_count: int):
+    """
+    同一伤害池内的 Stack 按兵力占比分摊伤害 (逐 Group 与 UnitGroup.apply_damage 相同)。
+    分摊必须遍历池内每个 Group，耗时与池的 Group 数成正比 (每次交战中唯一随规模增长的部分)。
+    直接改写 Army 的状态数组，Stack 缓存只在该 Stack 受伤时失效一次；
+    返回 (兵力减少, 是否有 Group 全灭, 单位伤害可能回升的 Group 下标)，由调用方增量通知 Army (见 Army._damaged)。
+    """
+    lost = 0
+    died = False
+    bumped = None
+    get = potential_damages.get
+    for s in stacks:
         # 获取当前 Stack 的减伤
-        my_mitigation = self.get_total_mitigation()
-        
-        for g in self.groups:
-            if g.current_hp > 0 and g.count > 0:
-                my_armor = g.stats.armor_type
-                pot_dmg = potential_damages.get(my_armor, 0.0)
-                weight = g.count / total_army_count
-                raw = pot_dmg * weight
-                
-                # 应用减伤
-                final = raw * (1.0 - my_mitigation)
-                g.apply_damage(final)
+        keep = 1.0 - s.get_total_mitigation()
+        touched = False
+        for g in s.groups:
+            i, o = g._i, g._o
+            count = i[o]
+            if count <= 0:
+                continue
+            f = g._f
+            hp = f[o]
+            if hp <= 0:
+                continue
+            # 按兵力占比分摊，再应用减伤
+            amount = get(g.stats.armor_type, 0.0) * (count / total_army_count) * keep
+            if amount <= 0:
+                continue
+            m = g.max_hp_per_unit
+            c_max = count * m
+            ratio = hp / c_max if c_max > 0 else 0.0
+            dead = 0
+            if ratio < CASUALTY_THRESHOLD:
+                avg_hp = hp / count
+                if avg_hp > 0:
+                    dead = min(math.floor(amount / avg_hp), count)
+            real_dmg = hp if hp <= amount else amount
+            hp -= real_dmg
+            r = g._r
+            f[r] += real_dmg
+            left = count
+            if dead > 0:
+                left -= dead
+                i[r] += dead
+            if hp <= 1e-5:
+                hp = 0.0
+                left = 0
+            elif left == 0:
+                hp = 0.0
+            f[o] = hp
+            i[o] = left
+            g._atk_row = g._def_row = None
+            touched = True
+            if left == 0:
+                died = True
+            elif dead > 0 and m > 0 and hp / (left * m) > ratio:
+                # 阵亡取整可能让平均 HP 略微回升，单位伤害随之上升 (见 _OutputHeap.bump)
+                if bumped is None: bumped = []
+                bumped.append(o)
+            lost += count - left
+        if touched:
+            s._agg = None
+            if s._out:
+                s._out = {}
+    return lost, died, bumped
 
 # ============================================================================
 # 5. Army
 # ============================================================================
 
+_ZEROS: Dict[Tuple[str, int], array] = {}
+
+def _zeros(typecode: str, n: int) -> array:
+    """长度为 n 的全零数组，按 (类型, 长度) 在所有 Army 间共享，只读。"""
+    z = _ZEROS.get((typecode, n))
+    if z is None:
+        z = _ZEROS[(typecode, n)] = array(typecode, bytes(8 * n))
+    return z
+
+class _Roster:
+    """
+    存活 Stack 按阵位分池 (前排 / 后排 Split / 空军，保持 Stack 顺序)，以及各池总兵力与全军在场护甲。
+    索敌与分摊伤害由此直接取得，不再每次交战扫描全部 Stack；只在有 Group 全灭或外部修改后重建，
+    其余受伤只按增量更新池兵力 (见 Army._damaged)。
+    """
+
+    __slots__ = ("pools", "counts", "armors")
+
+    def __init__(self, stacks: List["Stack"]):
+        pools = ([], [], [])
+        armors = set()
+        for s in stacks:
+            _, _, alive, s_armors = s._aggregate()
+            if alive:
+                pools[_pool_index(s)].append(s)
+            armors.update(s_armors)
+        self.pools = pools
+        self.counts = [sum(s.total_count for s in p) for p in pools]
+        self.armors = frozenset(armors)
+
+def _pool_index(stack: "Stack") -> int:
+    return 2 if stack._is_air else 1 if stack._is_split else 0
+
+class _OutputHeap:
+    """
+    大型 Army 的合并输出 (compute_army_blob_output) 在某一 (伤害类型, 护甲) 下的惰性最大堆。
+    每个 Group 一个有效条目 (-键, Group 序号, 版本)，键是单位伤害的上界：受伤只会降低 HP 比例，
+    单位伤害随之下降，因此受伤时不必更新；查询时弹出的过期条目以当前值重新入堆，凑够 limit 个单位即停止，
+    每次查询只触及排在最前的少数 Group。阵亡取整可能让 HP 比例回升，此时由 bump() 以新值入堆。
+    同值按 Group 顺序出堆，与 _top_output 的稳定排序一致，求和顺序因此逐位相同。
+    """
+
+    __slots__ = ("groups", "dmg_type", "idx", "heap", "keys", "vers")
+
+    def __init__(self, groups: List[UnitGroup], dmg_type: DamageType, target_armor: ArmorType):
+        self.groups = groups
+        self.dmg_type = dmg_type
+        self.idx = idx = ARMOR_ORDINAL[target_armor]
+        self.keys = [g.damage_row(dmg_type)[idx] for g in groups]
+        self.vers = [0] * len(groups)
+        self.heap = [(-v, k, 0) for k, v in enumerate(self.keys) if v > 0]
+        heapify(self.heap)
+
+    def bump(self, k: int):
+        v = self.groups[k].damage_row(self.dmg_type)[self.idx]
+        if v > self.keys[k]:
+            self.keys[k] = v
+            self.vers[k] += 1
+            heappush(self.heap, (-v, k, self.vers[k]))
+
+    def top(self, limit: int) -> float:
+        """同 _top_output：按单位伤害从高到低取前 limit 个单位的总输出。"""
+        heap, keys, vers, groups = self.heap, self.keys, self.vers, self.groups
+        dmg_type, idx = self.dmg_type, self.idx
+        total = 0.0
+        left = limit
+        taken = []
+        while left > 0 and heap:
+            entry = heappop(heap)
+            k = entry[1]
+            if entry[2] != vers[k]:
+                continue    # 已被更新的条目
+            g = groups[k]
+            v = g.damage_row(dmg_type)[idx]
+            if v != -entry[0]:
+                keys[k] = v
+                vers[k] += 1
+                if v > 0:
+                    heappush(heap, (-v, k, vers[k]))
+                continue
+            taken.append(entry)
+            cnt = g._i[g._o]
+            take = min(left, cnt)
+            total += take * v
+            left -= take
+        for entry in taken:
+            heappush(heap, entry)
+        return total
+
+class ArmySnapshot(NamedTuple):
+    """Army 可变状态的拷贝：f = [各 Group HP..., 各 Group 本回合损失..., 各建筑 HP...]，i = [各 Group 数量..., 本回合阵亡...]。"""
+    f: array
+    i: array
+
 class Army:
+    """
+    聚合量与全军合并输出 (compute_army_blob_output) 同样缓存，任一 Group 变化时失效。stacks 列表在构造后不应再增删。
+
+    全军所有 Group 的数量 / HP / 本回合战损集中存放在两个扁平数组 (float64 / int64) 中，
+    snapshot() / restore() 只做整块拷贝，Monte Carlo 与搜索的每次试验无需从 JSON 重建 Army。
+    一个 Group 只能属于一个 Army：用同一批 Stack 再构造 Army 会把 Group 改绑到新数组。
+    """
+
+    __slots__ = ("name", "stacks", "_groups", "_agg", "_blob", "_f", "_i", "_buildings", "_ros", "_heaps", "_by_name")
+
     def __init__(self, name: str, stacks: List[Stack]):
         self.name = name
         self.stacks = stacks
         # Building 移除
+        self._groups = [g for s in stacks for g in s.groups]
+        self._agg = None    # (total_hp, total_count, is_alive, 在场护甲)
+        self._blob: Dict[Any, Any] = {}    # 同 Stack._out
+        self._ros: Optional[_Roster] = None
+        self._heaps: Optional[Dict[Tuple[DamageType, ArmorType], _OutputHeap]] = None
+        self._by_name: Dict[str, List[Stack]] = {}   # 手动目标按名字查找
+        for s in stacks:
+            s._army = self
+            self._by_name.setdefault(s.name, []).append(s)
+
+        groups = self._groups
+        n = len(groups)
+        f = array('d', [g.current_hp for g in groups])
+        f.extend([g.last_round_loss for g in groups])
+        i = array('q', [g.count for g in groups])
+        i.extend([g.last_round_dead for g in groups])
+        for k, g in enumerate(groups):
+            g._bind(f, i, k, n + k)
+        # 建筑 HP 仍是 Building 的普通字段，只在 snapshot / restore 时与数组尾部同步
+        buildings = []
+        for s in stacks:
+            if s.building is not None:
+                buildings.append((len(f), s.building))
+                f.append(s.building.current_hp)
+        self._buildings = tuple(buildings)
+        self._f, self._i = f, i
+
+    def _changed(self):
+        self._agg = None
+        self._ros = None
+        self._heaps = None
+        if self._blob:
+            self._blob = {}
+
+    def _damaged(self, pool: int, lost: int, died: bool, bumped: Optional[List[int]]):
+        """
+        伤害分摊 (_distribute) 之后的增量更新：第 pool 个池兵力减少 lost，
+        有 Group 全灭 (died) 时分池与在场护甲可能变化，重建 _Roster；合并输出的堆只补入 bumped 中的 Group。
+        """
+        self._agg = None
+        if self._blob:
+            self._blob = {}
+        ros = self._ros
+        if ros is not None:
+            if died:
+                self._ros = None
+            else:
+                ros.counts[pool] -= lost
+        if bumped and self._heaps:
+            for heap in self._heaps.values():
+                for k in bumped:
+                    heap.bump(k)
+
+    def _roster(self) -> _Roster:
+        ros = self._ros
+        if ros is None:
+            ros = self._ros = _Roster(self.stacks)
+        return ros
+
+    # ------------------------------------------------------------------
+    # 状态快照
+    # ------------------------------------------------------------------
+
+    def snapshot(self, out: Optional[ArmySnapshot] = None) -> ArmySnapshot:
+        """拷贝当前状态。传入 out (之前的快照) 时原地覆盖，不分配新对象。"""
+        f = self._f
+        for k, b in self._buildings:
+            f[k] = b.current_hp
+        if out is None:
+            return ArmySnapshot(array('d', f), array('q', self._i))
+        self._check(out)
+        out.f[:] = f
+        out.i[:] = self._i
+        return out
+
+    def restore(self, snap: ArmySnapshot):
+        """整块拷回 snapshot() 时的状态 (含本回合战损与建筑 HP)，并清空所有缓存。"""
+        self._check(snap)
+        f = self._f
+        f[:] = snap.f
+        self._i[:] = snap.i
+        for k, b in self._buildings:
+            b.current_hp = f[k]
+        for g in self._groups:
+            g._atk_row = g._def_row = None
+        for s in self.stacks:
+            s._agg = None
+            s._out.clear()
+        self._agg = None
+        self._ros = None
+        self._heaps = None
+        self._blob.clear()
+
+    def _check(self, snap: ArmySnapshot):
+        # 长度不同时切片赋值会改变数组长度，必须提前拒绝
+        if len(snap.f) != len(self._f) or len(snap.i) != len(self._i):
+            raise ValueError(f"snapshot does not match the layout of army {self.name!r}")
+
+    def _aggregate(self) -> tuple:
+        agg = self._agg
+        if agg is None:
+            hp = 0
+            count = 0
+            alive = False
+            armors = set()
+            for s in self.stacks:
+                s_hp, s_count, s_alive, s_armors = s._aggregate()
+                hp += s_hp
+                count += s_count
+                alive = alive or s_alive
+                armors.update(s_armors)
+            agg = self._agg = (hp, count, alive, frozenset(armors))
+        return agg
 
     @property
     def total_hp(self):
-        return sum(s.total_hp for s in self.stacks)
+        return self._aggregate()[0]
     
     @property
     def total_count(self):
-        return sum(s.total_count for s in self.stacks)
+        return self._aggregate()[1]
     
     @property
     def is_alive(self):
-        return any(s.is_alive for s in self.stacks)
+        pools = self._roster().pools
+        return bool(pools[0] or pools[1] or pools[2])
 
     def reset_round_stats(self):
-        for s in self.stacks:
-            for g in s.groups:
-                g.reset_round_stats()
+        n = len(self._groups)
+        self._f[n:2 * n] = _zeros('d', n)
+        self._i[n:] = _zeros('q', n)
 
     def get_all_armor_types(self) -> Set[ArmorType]:
-        types = set()
-        for s in self.stacks:
-            types.update(s.get_present_armor_types())
-        return types
+        """全军存活 Group 的护甲类型 (只读集合)。"""
+        return self._roster().armors
 
-    def compute_army_output(self, enemy: 'Army', dmg_type: DamageType, use_random: bool) -> Tuple[Dict[ArmorType, float], float]:
+    def compute_army_blob_output(self, dmg_type: DamageType, target_armor: ArmorType, limit: int = 10) -> float:
+        """
+        合并全部 Group 后的输出 (防守反击 / 防空按全军计算)。
+        由于 Group 对象本身携带 is_core 属性，合并后依然按每个 Group 自己的 Core 状态加成；
+        阵亡 Group 输出为 0，不影响结果。
+        """
+        key = (dmg_type, target_armor, limit)
+        out = self._blob.get(key)
+        if out is None:
+            if len(self._groups) >= BLOB_HEAP_MIN_GROUPS:
+                # 大型 Army：每次受伤后只需刷新排在最前的少数 Group，不必重建并排序全部输出行
+                heaps = self._heaps
+                if heaps is None:
+                    heaps = self._heaps = {}
+                heap = heaps.get((dmg_type, target_armor))
+                if heap is None:
+                    heap = heaps[(dmg_type, target_armor)] = _OutputHeap(self._groups, dmg_type, target_armor)
+                out = self._blob[key] = heap.top(limit)
+                return out
+            rows = self._blob.get(dmg_type)
+            if rows is None:
+                rows = self._blob[dmg_type] = _output_rows(self._groups, dmg_type, False)
+            out = self._blob[key] = _top_output(rows, target_armor, limit)
+        return out
+
+    def compute_army_output(self, enemy: 'Army', dmg_type: DamageType, use_random: bool, rng=None) -> Tuple[Dict[ArmorType, float], float]:
         if not self.is_alive: return {}, 0.0
-        all_groups = []
-        for s in self.stacks:
-            all_groups.extend(s.groups)
-        # 这里合并了所有 Group。
-        # 由于 Group 对象本身携带 is_core 属性 (在 get_unit_damage 中使用)，
-        # 所以即使合并，伤害计算依然会根据每个 Group 自己的 Core 状态进行加成。逻辑正确。
-        temp_stack = Stack("Temp_Merged", all_groups)
-        
+        if use_random and rng is None:
+            rng = CounterRNG()
         target_armors = enemy.get_all_armor_types()
         pot_dmg = {}
         factor = 1.0
         if use_random:
-            val = random.gauss(RANDOM_MU, RANDOM_SIGMA)
+            val = rng.gauss(RANDOM_MU, RANDOM_SIGMA)
             factor = max(RANDOM_MIN, min(RANDOM_MAX, val))
         for armor in target_armors:
-            base = temp_stack.calculate_output(dmg_type, armor, limit=10)
-            pot_dmg[armor] = base * factor
-            
-        b_dmg = 0.0
-        # 只要 Enemy 有任意一个 Stack 有建筑，我们就算对建筑伤害（简化）
-        # 或者更精确地：如果 enemy.has_any_building?
-        # 实际上这个 b_dmg 是攻击方输出的"攻城值"。
-        base_b = temp_stack.calculate_output(dmg_type, ArmorType.BUILDING, limit=10)
-        b_dmg = base_b * factor
+            pot_dmg[armor] = self.compute_army_blob_output(dmg_type, armor) * factor
+        # b_dmg 是攻击方输出的"攻城值"
+        b_dmg = self.compute_army_blob_output(dmg_type, ArmorType.BUILDING) * factor
         return pot_dmg, b_dmg
 
-    def receive_damage(self, potential_damages: Dict[ArmorType, float], building_damage: float):
-        total_cnt = self.total_count
-        if total_cnt <= 0: return
-        
-        # 分发给每个 Stack
-        for s in self.stacks:
+    def receive_damage(self, potential_damages: Dict[ArmorType, float], building_damage: float,
+                       primary_target: Optional[Stack] = None):
+        """
+        按阵位分池承受伤害：空军、前排 (非 Split)、后排 (Split) 三个池子各自按池内总兵力分摊。
+        地面伤害由前排承担，前排全灭后才轮到后排；primary_target 为 Split 时直接打后排，为空军时不打地面。
+        空军池独立承受伤害。建筑伤害只作用于承担地面伤害的 Stack。
+        """
+        ros = self._roster()
+        pool_front, pool_back, pool_air = ros.pools
+
+        if primary_target is not None and primary_target.is_air:
+            ground = []
+        elif primary_target is not None and primary_target.is_split:
+            ground = pool_back
+        else:
+            ground = pool_front or pool_back
+
+        if ground:
+            # 池内总兵力取分发前的值 (各池兵力由 _Roster 增量维护)
+            pool = 0 if ground is pool_front else 1
+            total_cnt = ros.counts[pool]
             # 1. 兵力承受伤害 (Stack 内部自己计算减伤)
-            s.receive_damage_distribution(potential_damages, total_cnt)
-            
-            # 2. 建筑承受伤害 (如果有)
-            if s.building:
-                # 建筑受到的伤害是否受减伤影响？通常 CoW 中攻城值是直接扣建筑血量的。
-                s.building.take_damage(building_damage)
+            if total_cnt > 0:
+                self._damaged(pool, *_distribute(ground, potential_damages, total_cnt))
+            # 2. 建筑承受伤害 (如果有)。攻城值直接扣建筑血量，不受减伤影响
+            for s in ground:
+                if s.building:
+                    s.building.take_damage(building_damage)
+
+        if pool_air:
+            total_cnt = ros.counts[2]
+            if total_cnt > 0:
+                self._damaged(2, *_distribute(pool_air, potential_damages, total_cnt))
 
 # ============================================================================
 # 6. JSON Helpers & Utility
@@ -338,11 +887,17 @@ def load_building_from_json(json_data: dict, current_hp: float = None) -> Buildi
     b.initial_hp = hp
     return b
 
-def create_unit_group_from_json(name: str, unit_data: dict, count: int, 
-                                terrain_bonus: float = 0.0, is_core: bool = False) -> UnitGroup:
+def compile_unit_stats(name: str, unit_data: dict) -> UnitStats:
     atk_map = {ArmorType(k): float(v) for k, v in unit_data.get("attack", {}).items() if k in ArmorType._value2member_map_}
     def_map = {ArmorType(k): float(v) for k, v in unit_data.get("defense", {}).items() if k in ArmorType._value2member_map_}
-    stats = UnitStats(name, unit_data["hp"], ArmorType(unit_data["armor_type"]), atk_map, def_map)
+    return UnitStats(name, unit_data["hp"], ArmorType(unit_data["armor_type"]), atk_map, def_map)
+
+def create_unit_group_from_json(name: str, unit_data: dict, count: int, 
+                                terrain_bonus: float = 0.0, is_core: bool = False,
+                                stats: Optional[UnitStats] = None) -> UnitGroup:
+    # stats 可传入预编译 (可共享) 的 UnitStats，省去每个 Group 重新解析 JSON
+    if stats is None:
+        stats = compile_unit_stats(name, unit_data)
     return UnitGroup(name, stats, count, terrain_bonus=terrain_bonus, is_core=is_core)
 
 def merge_damage_dicts(d1, d2):
@@ -355,82 +910,254 @@ def merge_damage_dicts(d1, d2):
 # 7. 核心逻辑
 # ============================================================================
 
-def resolve_atomic_clash(active_stack: Stack, 
-                         target_army: Army, 
-                         active_army_ref: Army, 
-                         atk_factor: float, 
-                         def_factor: float):
-    if not active_stack.is_alive or not target_army.is_alive:
-        return
+# 目标选择与交战规则与网页版引擎 (docs/js/engine.js) 保持一致，两者的逐回合结果可用 cow_parity 对拍。
+
+def is_stack_grounded_plane(stack: Stack, is_passive_defender: bool) -> bool:
+    """被动防守方中显式给出空目标 ("" / null) 的空军 Stack 视为停在地面：可被地面部队攻击。"""
+    return stack.is_air and is_passive_defender and stack.manual_target == ""
+
+def select_target(attacker: Stack, enemy_army: Army, is_enemy_passive: bool) -> Optional[Stack]:
+    """
+    手动目标存活且可攻击时优先；否则按优先级自动索敌:
+    前排 > 后排 (Split) > 停在地面的空军 > 空中的空军 (仅空军可攻击)。
+    远程 (非超远程) 攻击方打后排时跳过带超远程单位的 Stack；没有可打的后排时继续向下找。
+    """
+    can_attack_flying = attacker.is_air
+
+    if attacker.manual_target:
+        for s in enemy_army._by_name.get(attacker.manual_target, ()):
+            if s.is_alive:
+                flying = s.is_air and not is_stack_grounded_plane(s, is_enemy_passive)
+                if not (flying and not can_attack_flying):
+                    return s
+                break
 
-    # === Step 1: Attack ===
+    # 各阵位的存活 Stack 由 Army 缓存 (见 _Roster)，通常直接命中前排第一个
+    front, back, air = enemy_army._roster().pools
+    if front: return front[0]
+    if back:
+        if not (attacker.has_ranged and not attacker.has_ultra):
+            return back[0]
+        for s in back:
+            if not s.has_ultra:
+                return s
+    flying = None
+    for s in air:
+        if is_stack_grounded_plane(s, is_enemy_passive): return s
+        if can_attack_flying and flying is None: flying = s
+    return flying
+
+def _defense_map(active_stack: Stack, target_army: Army, factor: float) -> Dict[ArmorType, float]:
+    # 防守方 Blob 计算：合并全部 Group
+    return {armor: target_army.compute_army_blob_output(DamageType.DEFENSE, armor, 10) * factor
+            for armor in active_stack.get_present_armor_types()}
+
+def _attack_map(active_stack: Stack, target_army: Army, factor: float, only_ranged: bool,
+                siege: bool) -> Tuple[Dict[ArmorType, float], float]:
     atk_map = {}
-    target_armors = target_army.get_all_armor_types()
-    for armor in target_armors:
-        base = active_stack.calculate_output(DamageType.ATTACK, armor, limit=10)
-        atk_map[armor] = base * atk_factor
-        
+    for armor in target_army.get_all_armor_types():
+        atk_map[armor] = active_stack.calculate_output(DamageType.ATTACK, armor, 10, only_ranged) * factor
     atk_b_dmg = 0.0
     # 检查 Target 任意 Stack 是否有建筑，有则计算攻城伤害
-    if any(s.building for s in target_army.stacks):
-        base_b = active_stack.calculate_output(DamageType.ATTACK, ArmorType.BUILDING, limit=10)
-        atk_b_dmg = base_b * atk_factor
+    if siege and target_army._buildings:
+        atk_b_dmg = active_stack.calculate_output(DamageType.ATTACK, ArmorType.BUILDING, 10, only_ranged) * factor
+    return atk_map, atk_b_dmg
 
-    # === Step 2: Defense ===
-    def_map = {}
-    active_armors = active_stack.get_present_armor_types()
-    
-    # 防守方 Blob 计算
-    all_def_groups = []
-    for s in target_army.stacks:
-        all_def_groups.extend(s.groups)
-    temp_def_stack = Stack("Def_Temp", all_def_groups)
-    
-    for armor in active_armors:
-        base = temp_def_stack.calculate_output(DamageType.DEFENSE, armor, limit=10)
-        def_map[armor] = base * def_factor
+def resolve_atomic_clash(active_stack: Stack,
+                         target_stack: Stack,
+                         target_army: Army,
+                         active_army_ref: Army,
+                         atk_factor: float,
+                         def_factor: float,
+                         is_target_passive: bool = False,
+                         siege: bool = True):
+    """
+    active_stack 对 target_stack 所在的 target_army 发起一次交战。
+    - 地面部队无法攻击空中的空军；
+    - 巡逻的空军交战两次，每次伤害减半；
+    - 带远程单位的 Split Stack 只用远程单位输出，且不受反击；
+    - 空军攻击停在地面的空军时 (非巡逻) 不受反击；
+    - 空对地/海：防守方先开火，空军存活才按受损后的状态投弹；其余情况双方同步结算。
+    siege=False 时不计算攻城伤害 (网页版引擎没有攻城伤害)。
+    """
+    if not active_stack.is_alive or not target_stack.is_alive:
+        return
 
-    # === Step 3: Application ===
-    target_army.receive_damage(atk_map, atk_b_dmg)
-    
-    # Active Stack 承受反击 (Stack 独立承受)
-    # Active Stack 自己的 get_total_mitigation 会处理 Core 和 Building
-    active_stack.receive_damage_distribution(def_map, active_stack.total_count)
+    target_grounded = is_stack_grounded_plane(target_stack, is_target_passive)
+    target_flying = target_stack.is_air and not target_grounded
+    if target_flying and not active_stack.is_air:
+        return
+
+    patrol = active_stack.is_patrol and active_stack.is_air
+    iterations = 2 if patrol else 1
+    modifier = 0.5 if patrol else 1.0
+    free_hit = active_stack.is_split and (active_stack.has_ranged or active_stack.has_ultra)
+    air_to_surface = active_stack.is_air and not target_flying
+    atk_f, def_f = atk_factor * modifier, def_factor * modifier
+
+    for _ in range(iterations):
+        if not active_stack.is_alive or not target_stack.is_alive:
+            break
+        has_defense = not free_hit and not (target_grounded and active_stack.is_air and not patrol)
+
+        if air_to_surface and has_defense:
+            # 防空先开火，飞机承受反击后再投弹
+            def_map = _defense_map(active_stack, target_army, def_f)
+            active_stack.receive_damage_distribution(def_map, active_stack.total_count)
+            if not active_stack.is_alive:
+                break
+            atk_map, atk_b_dmg = _attack_map(active_stack, target_army, atk_f, free_hit, siege)
+            target_army.receive_damage(atk_map, atk_b_dmg)
+        else:
+            # === Step 1: Attack / Defense 基于交战前状态同时计算 ===
+            atk_map, atk_b_dmg = _attack_map(active_stack, target_army, atk_f, free_hit, siege)
+            def_map = _defense_map(active_stack, target_army, def_f) if has_defense else None
+            # === Step 2: Application ===
+            target_army.receive_damage(atk_map, atk_b_dmg)
+            # Active Stack 承受反击 (Stack 独立承受)，自己的 get_total_mitigation 会处理 Core 和 Building
+            if def_map is not None:
+                active_stack.receive_damage_distribution(def_map, active_stack.total_count)
 
 
-def get_interleaved_turn_order(army_a: Army, army_b: Army) -> List[Tuple[Stack, Army, Army]]:
+def get_interleaved_turn_order(army_a: Army, army_b: Army, mode: BattleMode) -> List[Tuple[Stack, Army, Army]]:
+    """
+    回合开始时存活的 Stack 按 A、B 交替排队。LAND_MEET 中 B 方全部参与；
+    其余模式 B 方只有 Split / 空军 / 指定了目标的 Stack 主动出击。
+    """
+    stacks_a = [s for s in army_a.stacks if s.is_alive]
+    if mode == BattleMode.LAND_MEET:
+        stacks_b = [s for s in army_b.stacks if s.is_alive]
+    else:
+        stacks_b = [s for s in army_b.stacks if s.is_alive and (s.is_split or s.is_air or s.manual_target)]
     queue = []
-    stacks_a = army_a.stacks
-    stacks_b = army_b.stacks
-    max_len = max(len(stacks_a), len(stacks_b))
-    for i in range(max_len):
+    for i in range(max(len(stacks_a), len(stacks_b))):
         if i < len(stacks_a):
             queue.append((stacks_a[i], army_b, army_a))
         if i < len(stacks_b):
             queue.append((stacks_b[i], army_a, army_b))
     return queue
 
+# ============================================================================
+# 8. 结构化结果
+# ============================================================================
+
+class BattleOutcome(str, Enum):
+    A_WIN = "A_WIN"
+    B_WIN = "B_WIN"
+    DRAW = "DRAW"    # 同归于尽或回合耗尽
+
+class EndReason(str, Enum):
+    ANNIHILATION = "ANNIHILATION"   # 至少一方全灭
+    MAX_ROUNDS = "MAX_ROUNDS"       # 回合耗尽
+    NO_DAMAGE = "NO_DAMAGE"         # 开战前判定双方都无法对对方造成任何伤害
+    FIXED_POINT = "FIXED_POINT"     # 某回合双方状态均未改变，之后每回合都相同
+    EXTRAPOLATED = "EXTRAPOLATED"   # 确定性稳态下按闭式外推到回合上限
+
+@dataclass
+class GroupState:
+    stack: str
+    name: str
+    count: int
+    current_hp: float
+    max_hp: float          # 当前数量下的满血 HP
+    initial_count: int
+    initial_hp: float
+    round_loss: float
+    round_dead: int
+
+@dataclass
+class BuildingState:
+    stack: str
+    name: str
+    current_hp: float
+    initial_hp: float
+    mitigation: float
+
+@dataclass
+class ArmyState:
+    name: str
+    total_hp: float
+    total_count: int
+    groups: List[GroupState]
+    buildings: List[BuildingState]
+
+    @property
+    def total_dead(self) -> int:
+        return sum(g.initial_count - g.count for g in self.groups)
+
+    @property
+    def total_hp_lost(self) -> float:
+        return sum(g.initial_hp - g.current_hp for g in self.groups)
+
+def capture_army_state(army: Army) -> ArmyState:
+    groups = [GroupState(s.name, g.name, g.count, g.current_hp, g.total_max_hp, g.initial_count, g.initial_hp,
+                         g.last_round_loss, g.last_round_dead)
+              for s in army.stacks for g in s.groups]
+    buildings = [BuildingState(s.name, s.building.name, s.building.current_hp, s.building.initial_hp,
+                               s.building.get_current_mitigation())
+                 for s in army.stacks if s.building]
+    return ArmyState(army.name, army.total_hp, army.total_count, groups, buildings)
+
+@dataclass
+class RoundSnapshot:
+    round: int
+    factor_atk: float
+    factor_def: float
+    army_a: ArmyState
+    army_b: ArmyState
+
+@dataclass
+class BattleResult:
+    mode: BattleMode
+    rounds: int
+    outcome: BattleOutcome
+    army_a: ArmyState
+    army_b: ArmyState
+    snapshots: List[RoundSnapshot] = field(default_factory=list)  # 仅在 record_rounds=True 时填充
+    end_reason: EndReason = EndReason.MAX_ROUNDS
+    rounds_simulated: int = 0   # 实际逐回合模拟的回合数 (僵局/外推跳过的回合不计入)
+
+# ============================================================================
+# 9. Reporter (观察者)
+# ============================================================================
+
+class BattleReporter:
+    """战斗观察者接口，所有回调默认为空操作，按需覆写。"""
+
+    def on_battle_start(self, army_a: Army, army_b: Army, mode: BattleMode, use_random: bool): pass
+    def on_round_start(self, r: int, factor_atk: float, factor_def: float): pass
+    def on_round_end(self, r: int, army_a: Army, army_b: Army): pass
+    def on_battle_end(self, army_a: Army, army_b: Army, result: BattleResult): pass
+
 def print_round_details(army: Army, detailed: bool):
-    print(f"  > {army.name} 详情:")
+    print_state_details(capture_army_state(army), detailed)
+
+def print_state_details(state: ArmyState, detailed: bool):
+    """print_round_details 的数据版本 (回放等不持有 Army 的场合使用)。"""
+    print(f"  > {state.name} 详情:")
     has_output = False
-    for s in army.stacks:
-        for g in s.groups:
-            loss = g.last_round_loss
-            dead = g.last_round_dead
-            if detailed or (loss > 0.001 or dead > 0):
-                has_output = True
-                prev_hp = g.current_hp + loss
-                loss_pct = 0.0
-                if prev_hp > 0: loss_pct = (loss / prev_hp) * 100
-                eff_pct = g.hp_ratio * 100
-                dead_str = f" ☠️ {dead}" if dead > 0 else ""
-                full_name = f"[{s.name}] {g.name}"
-                status_str = f"HP {g.current_hp:.2f}/{g.total_max_hp:.1f} ({eff_pct:.2f}%)"
-                loss_str = f"Lost {loss:.2f} ({loss_pct:.2f}%)"
-                print(f"    * {full_name:<28} | {status_str:<22} | {loss_str:<18}{dead_str}")
+    for g in state.groups:
+        loss = g.round_loss
+        dead = g.round_dead
+        if detailed or (loss > 0.001 or dead > 0):
+            has_output = True
+            prev_hp = g.current_hp + loss
+            loss_pct = 0.0
+            if prev_hp > 0: loss_pct = (loss / prev_hp) * 100
+            eff_pct = (g.current_hp / g.max_hp if g.count > 0 and g.max_hp > 0 else 0.0) * 100
+            dead_str = f" ☠️ {dead}" if dead > 0 else ""
+            full_name = f"[{g.stack}] {g.name}"
+            status_str = f"HP {g.current_hp:.2f}/{g.max_hp:.1f} ({eff_pct:.2f}%)"
+            loss_str = f"Lost {loss:.2f} ({loss_pct:.2f}%)"
+            print(f"    * {full_name:<28} | {status_str:<22} | {loss_str:<18}{dead_str}")
     if not has_output and not detailed:
         print("    (无战损)")
 
+def print_state_summary(state: ArmyState):
+    b_info = [f"{b.stack}:{b.name}({b.mitigation*100:.2f}%)" for b in state.buildings]
+    b_str = " | Bld: " + ", ".join(b_info) if b_info else ""
+    print(f"  Summary {state.name}: HP {state.total_hp:.2f} (Cnt: {state.total_count}){b_str}")
+
 def print_final_detailed_stats(army: Army):
     print(f"[{army.name}] 最终结算详细报告:")
     print(f"  {'UNIT (STACK)':<30} | {'START (HP/CNT)':<20} | {'END (HP/CNT)':<20} | {'LOSS (HP/CNT)':<20}")
@@ -465,72 +1192,252 @@ def print_final_detailed_stats(army: Army):
             print(f"  [Stack {s.name}] BUILDING: {b.name} | Start: {b.initial_hp:.2f} -> End: {b.current_hp:.2f} | Lost: {loss:.2f}")
 
 
-def run_simulation(army_a: Army, army_b: Army, mode: BattleMode, max_rounds=50, use_random=True, detailed_output=False):
-    print(f"=== 战斗开始: {army_a.name} vs {army_b.name} ===")
-    print(f"模式: {mode.value} | 随机: {use_random} | 详细日志: {detailed_output}")
+# 进程级 reporter：挂载到之后的每一场 run_simulation (供性能分析等工具使用)，默认为空
+_global_reporters: List[BattleReporter] = []
+
+def add_global_reporter(rep: BattleReporter):
+    _global_reporters.append(rep)
+
+def remove_global_reporter(rep: BattleReporter):
+    if rep in _global_reporters:
+        _global_reporters.remove(rep)
+
+class ConsoleReporter(BattleReporter):
+    """原有的控制台输出。"""
+
+    def __init__(self, detailed: bool = False):
+        self.detailed = detailed
+
+    def on_battle_start(self, army_a, army_b, mode, use_random):
+        print(f"=== 战斗开始: {army_a.name} vs {army_b.name} ===")
+        print(f"模式: {mode.value} | 随机: {use_random} | 详细日志: {self.detailed}")
+
+    def on_round_start(self, r, factor_atk, factor_def):
+        print(f"\nRound {r}:")
+
+    def on_round_end(self, r, army_a, army_b):
+        states = (capture_army_state(army_a), capture_army_state(army_b))
+        for state in states:
+            print_state_details(state, self.detailed)
+        for state in states:
+            print_state_summary(state)
+
+    def on_battle_end(self, army_a, army_b, result):
+        if result.end_reason not in (EndReason.ANNIHILATION, EndReason.MAX_ROUNDS):
+            print(f"\n提前结束: {result.end_reason.value} (实际模拟 {result.rounds_simulated} 回合，"
+                  f"按 {result.rounds} 回合结算)")
+        print("\n" + "="*60)
+        print("最终结果统计")
+        print("="*60)
+        print_final_detailed_stats(army_a)
+        print("-" * 60)
+        print_final_detailed_stats(army_b)
+        print("="*60)
+
+class RoundRecorder(BattleReporter):
+    """逐回合记录双方状态快照。"""
+
+    def __init__(self):
+        self.snapshots: List[RoundSnapshot] = []
+        self._factors = (1.0, 1.0)
+
+    def on_round_start(self, r, factor_atk, factor_def):
+        self._factors = (factor_atk, factor_def)
+
+    def on_round_end(self, r, army_a, army_b):
+        self.snapshots.append(RoundSnapshot(r, self._factors[0], self._factors[1],
+                                            capture_army_state(army_a), capture_army_state(army_b)))
+
+# ============================================================================
+# 10. 僵局检测
+# ============================================================================
+# 不改变战斗结果，只跳过已知结局的回合：
+#   - 开战前双方都无法对对方造成伤害 (攻防表对敌方护甲全为 0)，结果等同于打满回合；
+#   - 某回合没有任何 Group 受到伤害、建筑 HP 也未变化，则之后的回合全部相同 (不动点)。
+#     随机系数恒为正，伤害为 0 与系数无关，因此随机模式下同样成立。
+# 可选的稳态外推仅用于关闭随机的战斗，见 steady_state_jump。
+
+def _can_damage(src: Army, dst: Army, dmg_types: Sequence[DamageType], buildings: bool) -> bool:
+    armors = set(dst.get_all_armor_types())
+    if buildings and any(s.building and s.building.current_hp > 0 for s in dst.stacks):
+        armors.add(ArmorType.BUILDING)
+    for s in src.stacks:
+        for g in s.groups:
+            if g.count <= 0 or g.current_hp <= 0: continue
+            for dmg_type in dmg_types:
+                if any(g.get_unit_damage(dmg_type, a) > 0 for a in armors):
+                    return True
+    return False
+
+def is_zero_output_matchup(army_a: Army, army_b: Army, mode: BattleMode) -> bool:
+    """双方在该模式下都无法对对方 (含建筑) 造成任何伤害。"""
+    # B 方有主动出击的 Stack 时双方都会进攻，按 LAND_MEET 判定
+    b_active = any(s.is_split or s.is_air or s.manual_target for s in army_b.stacks)
+    if mode == BattleMode.LAND_MEET or b_active:
+        both = (DamageType.ATTACK, DamageType.DEFENSE)
+        return not _can_damage(army_a, army_b, both, True) and not _can_damage(army_b, army_a, both, True)
+    # LAND_ATTACK / AIR_STRIKE：A 进攻 (含攻城)，B 只有防御/防空反击
+    return (not _can_damage(army_a, army_b, (DamageType.ATTACK,), True)
+            and not _can_damage(army_b, army_a, (DamageType.DEFENSE,), False))
+
+def _building_hps(army: Army) -> List[Optional[float]]:
+    return [s.building.current_hp if s.building else None for s in army.stacks]
+
+def _side_untouched(army: Army, b_hps_before: List[Optional[float]]) -> bool:
+    return (all(g.last_round_loss == 0 for s in army.stacks for g in s.groups)
+            and _building_hps(army) == b_hps_before)
+
+def steady_state_jump(frozen: Army, target: Army, remaining: int) -> int:
+    """
+    确定性稳态外推。要求本回合 frozen 一方完全未受损 (其输出因此不变)，target 一方无阵亡、建筑未变
+    (数量分布与减伤因此不变)，则后续每回合 target 各 Group 受到的伤害与本回合相同，
+    直到某个 Group 跌破阵亡阈值。按闭式 hp -= n * d 一次跳过 n 回合并返回 n。
+    闭式结果与逐回合累减只在浮点末位上可能不同。
+    """
+    n = remaining
+    losses = []
+    for s in target.stacks:
+        for g in s.groups:
+            if g.last_round_dead > 0: return 0
+            d = g.last_round_loss
+            if d <= 0: continue
+            thr = CASUALTY_THRESHOLD * g.count * g.max_hp_per_unit
+            if g.current_hp < thr: return 0
+            # 少跳一回合，给闭式结果的舍入误差留出余量
+            n = min(n, int((g.current_hp - thr) // d) - 1)
+            losses.append((g, d))
+    if n <= 0 or not losses: return 0
+    for g, d in losses:
+        g.current_hp -= n * d
+    return n
+
+# ============================================================================
+# 11. 主循环
+# ============================================================================
+
+@contextmanager
+def air_strike_flags(army_a: Army, mode: BattleMode):
+    """
+    AIR_STRIKE 中 A 方所有 Stack 按空军处理。空军标记属于单场战斗的状态：
+    只在 with 块内设置，退出时还原调用方原有的 Stack.is_air。其余模式不做任何修改。
+    """
+    if mode != BattleMode.AIR_STRIKE:
+        yield
+        return
+    saved = [(s, s.is_air) for s in army_a.stacks if not s.is_air]
+    for s, _ in saved:
+        s.is_air = True
+    try:
+        yield
+    finally:
+        for s, flag in saved:
+            s.is_air = flag
+
+def play_round(army_a: Army, army_b: Army, mode: BattleMode, factor_atk: float, factor_def: float,
+               siege_damage: bool = True):
+    """
+    按给定的随机系数推进一回合的全部交战 (不清零回合统计、不触发 reporter)。
+    AIR_STRIKE 需由调用方在 air_strike_flags 块内调用。
+    """
+    for active_stack, target_army, active_ref in get_interleaved_turn_order(army_a, army_b, mode):
+        if active_stack.is_alive and target_army.is_alive:
+            # LAND_ATTACK 中 B 方是被动防守方
+            passive = mode == BattleMode.LAND_ATTACK and target_army is army_b
+            target_stack = select_target(active_stack, target_army, passive)
+            if target_stack is not None:
+                resolve_atomic_clash(active_stack, target_stack, target_army, active_ref,
+                                     factor_atk, factor_def, passive, siege_damage)
+
+def run_simulation(army_a: Army, army_b: Army, mode: BattleMode, max_rounds=50, use_random=True, detailed_output=False,
+                   verbose=True, rng=None, reporters: Sequence[BattleReporter] = (),
+                   record_rounds=False, detect_stalemate=True, extrapolate=False, siege_damage=True) -> BattleResult:
+    """
+    运行一场战斗并返回 BattleResult。
+    verbose=True 时挂载 ConsoleReporter (原控制台输出)；verbose=False 且无 reporter 时不做任何格式化。
+    record_rounds=True 时在结果中附带逐回合快照。rng 需提供 gauss(mu, sigma)，
+    为 None 时使用随机种子的 cow_rng.CounterRNG (需要复现时传入 CounterRNG(seed, trial))。
+    detect_stalemate 跳过结局已定的回合 (零输出对阵、不动点)，最终状态与回合数不变；
+    extrapolate 在关闭随机时对单方面消耗的稳态做闭式外推 (见 steady_state_jump)。
+    跳过的回合不会触发 reporter 的回合回调。
+    siege_damage=False 时不计算攻城伤害 (与网页版引擎一致)。
+    AIR_STRIKE 模式下 A 方所有 Stack 在战斗期间按空军处理，返回前还原 (见 air_strike_flags)。
+    """
+    with air_strike_flags(army_a, mode):
+        return _simulate(army_a, army_b, mode, max_rounds, use_random, detailed_output, verbose, rng,
+                         reporters, record_rounds, detect_stalemate, extrapolate, siege_damage)
+
+def _simulate(army_a: Army, army_b: Army, mode: BattleMode, max_rounds, use_random, detailed_output,
+              verbose, rng, reporters, record_rounds, detect_stalemate, extrapolate, siege_damage) -> BattleResult:
+    if use_random and rng is None:
+        rng = CounterRNG()
+    reporters = _global_reporters + list(reporters)
+    if verbose:
+        reporters.insert(0, ConsoleReporter(detailed_output))
+    recorder = None
+    if record_rounds:
+        recorder = RoundRecorder()
+        reporters.append(recorder)
+
+    for rep in reporters:
+        rep.on_battle_start(army_a, army_b, mode, use_random)
     
-    for r in range(1, max_rounds + 1):
+    rounds = 0
+    simulated = 0
+    end_reason = None
+    if (detect_stalemate and max_rounds > 0 and army_a.is_alive and army_b.is_alive
+            and is_zero_output_matchup(army_a, army_b, mode)):
+        rounds, end_reason = max_rounds, EndReason.NO_DAMAGE
+
+    r = 0
+    while end_reason is None and r < max_rounds:
+        r += 1
         if not army_a.is_alive or not army_b.is_alive: break
+        rounds = r
+        simulated += 1
         
         army_a.reset_round_stats()
         army_b.reset_round_stats()
+        if detect_stalemate:
+            b_hps_a, b_hps_b = _building_hps(army_a), _building_hps(army_b)
         
         factor_atk = 1.0
         factor_def = 1.0
         if use_random:
-            factor_atk = max(RANDOM_MIN, min(RANDOM_MAX, random.gauss(RANDOM_MU, RANDOM_SIGMA)))
-            factor_def = max(RANDOM_MIN, min(RANDOM_MAX, random.gauss(RANDOM_MU, RANDOM_SIGMA)))
+            factor_atk = max(RANDOM_MIN, min(RANDOM_MAX, rng.gauss(RANDOM_MU, RANDOM_SIGMA)))
+            factor_def = max(RANDOM_MIN, min(RANDOM_MAX, rng.gauss(RANDOM_MU, RANDOM_SIGMA)))
         
-        print(f"\nRound {r}:")
+        for rep in reporters:
+            rep.on_round_start(r, factor_atk, factor_def)
 
-        if mode == BattleMode.LAND_ATTACK:
-            for stack_a in army_a.stacks:
-                if stack_a.is_alive and army_b.is_alive:
-                    resolve_atomic_clash(stack_a, army_b, army_a, factor_atk, factor_def)
-        
-        elif mode == BattleMode.LAND_MEET:
-            turn_order = get_interleaved_turn_order(army_a, army_b)
-            for active_stack, target_army, active_ref in turn_order:
-                if active_stack.is_alive and target_army.is_alive:
-                    resolve_atomic_clash(active_stack, target_army, active_ref, factor_atk, factor_def)
-
-        elif mode == BattleMode.AIR_STRIKE:
-            for stack_a in army_a.stacks:
-                if not stack_a.is_alive or not army_b.is_alive: continue
-                
-                # 1. B 防空
-                b_def_map, b_def_b = army_b.compute_army_output(army_a, DamageType.DEFENSE, use_random)
-                # 飞机承受防空，Stack 自带 mitigation (通常为 0，除非配置了Core/Building? 通常飞机没有)
-                stack_a.receive_damage_distribution(b_def_map, stack_a.total_count)
-                
-                # 2. 轰炸
-                if stack_a.is_alive:
-                    a_atk_map = {}
-                    target_armors = army_b.get_all_armor_types()
-                    for armor in target_armors:
-                        a_atk_map[armor] = stack_a.calculate_output(DamageType.ATTACK, armor, limit=10) * factor_atk
-                    
-                    b_dmg = stack_a.calculate_output(DamageType.ATTACK, ArmorType.BUILDING, limit=10) * factor_atk
-                    
-                    army_b.receive_damage(a_atk_map, b_dmg)
-
-
-        print_round_details(army_a, detailed_output)
-        print_round_details(army_b, detailed_output)
-        
-        for army in [army_a, army_b]:
-             b_info = []
-             for s in army.stacks:
-                 if s.building:
-                    mit = s.building.get_current_mitigation()
-                    b_info.append(f"{s.name}:{s.building.name}({mit*100:.2f}%)")
-             b_str = " | Bld: " + ", ".join(b_info) if b_info else ""
-             print(f"  Summary {army.name}: HP {army.total_hp:.2f} (Cnt: {army.total_count}){b_str}")
-
-    print("\n" + "="*60)
-    print("最终结果统计")
-    print("="*60)
-    print_final_detailed_stats(army_a)
-    print("-" * 60)
-    print_final_detailed_stats(army_b)
-    print("="*60)
\ No newline at end of file
+        play_round(army_a, army_b, mode, factor_atk, factor_def, siege_damage)
+
+        for rep in reporters:
+            rep.on_round_end(r, army_a, army_b)
+
+        if detect_stalemate and r < max_rounds and army_a.is_alive and army_b.is_alive:
+            steady = extrapolate and not use_random
+            a_still = _side_untouched(army_a, b_hps_a)
+            b_still = (a_still or steady) and _side_untouched(army_b, b_hps_b)
+            if a_still and b_still:
+                rounds, end_reason = max_rounds, EndReason.FIXED_POINT
+            elif steady and (a_still or b_still):
+                if a_still and _building_hps(army_b) == b_hps_b:
+                    r += steady_state_jump(army_a, army_b, max_rounds - r)
+                elif b_still and _building_hps(army_a) == b_hps_a:
+                    r += steady_state_jump(army_b, army_a, max_rounds - r)
+                rounds = r
+                if r >= max_rounds:
+                    end_reason = EndReason.EXTRAPOLATED
+
+    a_alive, b_alive = army_a.is_alive, army_b.is_alive
+    if a_alive and not b_alive: outcome = BattleOutcome.A_WIN
+    elif b_alive and not a_alive: outcome = BattleOutcome.B_WIN
+    else: outcome = BattleOutcome.DRAW
+    if end_reason is None:
+        end_reason = EndReason.ANNIHILATION if not (a_alive and b_alive) else EndReason.MAX_ROUNDS
+
+    result = BattleResult(mode, rounds, outcome, capture_army_state(army_a), capture_army_state(army_b),
+                          recorder.snapshots if recorder else [], end_reason, simulated)
+    for rep in reporters:
+        rep.on_battle_end(army_a, army_b, result)
+    return result
@@ -0,0 +1,591 @@
+import os
+import sys
+import json
+import time
+import pickle
+import hashlib
+import argparse
+import threading
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import List, Dict, Optional, Tuple, Iterable, Callable
+
+from cow_core import (
+    ArmorType, Building, BuildingLevelConfig, MitigationCurve, UnitStats,
+    compile_unit_stats,
+)
+
+# ============================================================================
+# 1. 配置
+# ============================================================================
+
+CACHE_DIR = ".cow_cache"
+# 编译结构 (UnitStats / MitigationCurve 等) 变化时递增，使旧缓存失效
+CACHE_VERSION = 2
+# 索引格式或校验规则变化时递增
+INDEX_VERSION = 1
+WATCH_INTERVAL = 1.0        # DatabaseWatcher 两次检查源文件的最小间隔 (秒)
+
+# ============================================================================
+# 2. 编译后的数据库
+# ============================================================================
+# 两个数据库都实现 Mapping 接口，按 id 取到的仍是原始 JSON 条目，
+# 因此可以直接替换 load_json 的结果传给 build_army 等现有代码。
+
+class UnitDatabase(Mapping):
+    """
+    units.json 的编译形式：每个单位预先解析好的 UnitStats (所有同类 Group 共享同一实例)。
+    """
+
+    def __init__(self, raw: Dict[str, dict]):
+        self.raw = raw
+        self.ids: List[str] = list(raw)
+        self.index: Dict[str, int] = {u: i for i, u in enumerate(self.ids)}
+        self._stats: Dict[str, UnitStats] = {u_id: compile_unit_stats(u_id, raw[u_id]) for u_id in self.ids}
+
+    def __getitem__(self, u_id: str) -> dict:
+        return self.raw[u_id]
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, u_id) -> bool:
+        return u_id in self.index
+
+    def stats(self, u_id: str) -> UnitStats:
+        return self._stats[u_id]
+
+class BuildingDatabase(Mapping):
+    """
+    buildings.json 的编译形式：每种建筑按等级排序的配置，
+    以及每个可用等级对应的 (等级配置前缀, MitigationCurve)，同一 (建筑, 等级) 的所有实例共享。
+    """
+
+    def __init__(self, raw: Dict[str, dict]):
+        self.raw = raw
+        self.levels: Dict[str, List[BuildingLevelConfig]] = {}
+        self._curves: Dict[Tuple[str, int], Tuple[List[BuildingLevelConfig], MitigationCurve]] = {}
+        for b_id, data in raw.items():
+            levels = sorted((BuildingLevelConfig(l["level"], l["hp"], l["mitigation"]) for l in data["levels"]),
+                            key=lambda x: x.level)
+            self.levels[b_id] = levels
+            for lv in {cfg.level for cfg in levels}:
+                valid = [cfg for cfg in levels if cfg.level <= lv]
+                self._curves[(b_id, lv)] = (valid, MitigationCurve(valid))
+
+    def __getitem__(self, b_id: str) -> dict:
+        return self.raw[b_id]
+
+    def __iter__(self):
+        return iter(self.raw)
+
+    def __len__(self) -> int:
+        return len(self.raw)
+
+    def curve(self, b_id: str, level: int) -> Optional[Tuple[List[BuildingLevelConfig], MitigationCurve]]:
+        """不高于 level 的全部等级配置及其减伤曲线；没有可用等级时返回 None。"""
+        hit = self._curves.get((b_id, level))
+        if hit is None:
+            # 配置中的等级可能不在数据库的等级列表里 (如高于最高级)，按前缀现场编译
+            valid = [cfg for cfg in self.levels.get(b_id, []) if cfg.level <= level]
+            if not valid:
+                return None
+            hit = self._curves[(b_id, level)] = (valid, MitigationCurve(valid))
+        return hit
+
+    def make_building(self, b_id: str, level: int, current_hp: Optional[float] = None,
+                      hp_ratio: Optional[float] = None) -> Optional[Building]:
+        hit = self.curve(b_id, level)
+        if hit is None:
+            return None
+        valid, curve = hit
+        hp = curve.total_hp
+        if current_hp is not None:
+            hp = float(current_hp)
+        elif hp_ratio is not None:
+            hp = curve.total_hp * float(hp_ratio)
+        return Building(f"{b_id} Lv{level}", valid, hp, curve=curve)
+
+# ============================================================================
+# 3. 磁盘缓存
+# ============================================================================
+# 缓存文件记录每个源文件的 (mtime_ns, size, sha256)。mtime 与大小不变时直接命中；
+# 否则重新计算哈希，内容未变仍命中 (并刷新记录的 mtime)，内容变化则重新编译。
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _source_info(path: str, digest: Optional[str] = None) -> dict:
+    st = os.stat(path)
+    return {"path": os.path.abspath(path), "mtime_ns": st.st_mtime_ns, "size": st.st_size,
+            "sha256": digest or _file_sha256(path)}
+
+def _cache_path(cache_dir: str, paths: Tuple[str, ...], prefix: str = "db") -> str:
+    key = hashlib.blake2b("\0".join(os.path.abspath(p) for p in paths).encode(), digest_size=8).hexdigest()
+    return os.path.join(cache_dir, f"{prefix}_{key}.pickle")
+
+def _check_sources(recorded: List[dict], paths: Tuple[str, ...]) -> Tuple[bool, bool]:
+    """返回 (缓存是否有效, 是否需要刷新记录的 mtime)。"""
+    if len(recorded) != len(paths):
+        return False, False
+    touched = False
+    for rec, path in zip(recorded, paths):
+        st = os.stat(path)
+        if rec["mtime_ns"] == st.st_mtime_ns and rec["size"] == st.st_size:
+            continue
+        if rec["size"] != st.st_size or rec["sha256"] != _file_sha256(path):
+            return False, False
+        touched = True
+    return True, touched
+
+def _read_cache(path: str) -> Optional[dict]:
+    try:
+        with open(path, 'rb') as f:
+            blob = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+    if not isinstance(blob, dict) or blob.get("version") != CACHE_VERSION:
+        return None
+    return blob
+
+def _write_cache(path: str, blob: dict):
+    # 先写临时文件再原子替换，并发进程不会读到半截缓存；目录不可写时静默放弃
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            pickle.dump(blob, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+def compile_databases(units_path: str, buildings_path: str) -> Tuple[UnitDatabase, BuildingDatabase]:
+    with open(units_path, 'r', encoding='utf-8') as f: units = json.load(f)
+    with open(buildings_path, 'r', encoding='utf-8') as f: buildings = json.load(f)
+    return UnitDatabase(units), BuildingDatabase(buildings)
+
+def load_databases(units_path: str = "units.json", buildings_path: str = "buildings.json",
+                   cache_dir: Optional[str] = "") -> Tuple[UnitDatabase, BuildingDatabase]:
+    """
+    加载编译后的单位/建筑数据库，优先使用磁盘缓存。
+    cache_dir 为空串时使用 units.json 所在目录下的 CACHE_DIR；为 None 时不读写缓存。
+    """
+    if cache_dir is None:
+        return compile_databases(units_path, buildings_path)
+    if cache_dir == "":
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(units_path)), CACHE_DIR)
+    paths = (units_path, buildings_path)
+    path = _cache_path(cache_dir, paths)
+
+    blob = _read_cache(path)
+    if blob is not None:
+        valid, touched = _check_sources(blob["sources"], paths)
+        if valid:
+            if touched:
+                blob["sources"] = [_source_info(p, rec["sha256"]) for p, rec in zip(paths, blob["sources"])]
+                _write_cache(path, blob)
+            return blob["units"], blob["buildings"]
+
+    sources = [_source_info(p) for p in paths]
+    units, buildings = compile_databases(units_path, buildings_path)
+    _write_cache(path, {"version": CACHE_VERSION, "sources": sources, "units": units, "buildings": buildings})
+    return units, buildings
+
+# ============================================================================
+# 4. 惰性索引数据库
+# ============================================================================
+# 生产环境的数据库包含全部单位、等级与科技分支，远大于随仓库提供的样例。
+# 首次加载时单遍扫描 JSON 顶层对象，逐条校验格式，并记录每个条目值在文件中的 (字节偏移, 长度)，
+# 索引与 load_databases 的缓存放在同一目录，源文件不变时冷启动只读取索引。
+# 之后按 id 取条目时才从文件中读出该段并解码 / 编译，一场战斗只物化它引用到的单位和建筑。
+
+class SchemaError(ValueError):
+    """数据库条目格式错误 (建索引时一次性校验)。"""
+
+class StaleDatabase(RuntimeError):
+    """源文件在原地被修改，索引偏移已失效；需重新加载 (见 DatabaseWatcher)。"""
+
+def _is_number(x) -> bool:
+    return isinstance(x, (int, float)) and not isinstance(x, bool)
+
+def validate_unit(u_id: str, entry) -> List[str]:
+    if not isinstance(entry, dict):
+        return [f"unit {u_id!r}: entry must be an object"]
+    errors = []
+    if not _is_number(entry.get("hp")) or entry["hp"] <= 0:
+        errors.append(f"unit {u_id!r}: hp must be a positive number")
+    if entry.get("armor_type") not in ArmorType._value2member_map_:
+        errors.append(f"unit {u_id!r}: unknown armor_type {entry.get('armor_type')!r}")
+    for table in ("attack", "defense"):
+        vals = entry.get(table, {})
+        if not isinstance(vals, dict) or not all(_is_number(v) for v in vals.values()):
+            errors.append(f"unit {u_id!r}: {table} must map armor types to numbers")
+    return errors
+
+def validate_building(b_id: str, entry) -> List[str]:
+    levels = entry.get("levels") if isinstance(entry, dict) else None
+    if not isinstance(levels, list) or not levels:
+        return [f"building {b_id!r}: levels must be a non-empty list"]
+    errors = []
+    for k, lv in enumerate(levels):
+        if not (isinstance(lv, dict) and isinstance(lv.get("level"), int) and _is_number(lv.get("hp"))
+                and _is_number(lv.get("mitigation"))):
+            errors.append(f"building {b_id!r}: levels[{k}] needs integer level and numeric hp / mitigation")
+        elif lv["hp"] < 0 or not 0.0 <= lv["mitigation"] <= 1.0:
+            errors.append(f"building {b_id!r}: levels[{k}] hp must be >= 0 and mitigation within [0, 1]")
+    return errors
+
+def _skip_ws(text: str, pos: int) -> int:
+    while pos < len(text) and text[pos] in " \t\r\n":
+        pos += 1
+    return pos
+
+def index_json(path: str, validate: Callable[[str, object], List[str]]) -> Dict[str, Tuple[int, int]]:
+    """
+    扫描 path 的顶层对象，返回 {id: (值的字节偏移, 字节长度)}，并用 validate 校验每个条目。
+    重复的 id 与 json.load 相同取最后一个。任一条目不合格时抛出 SchemaError (列出全部问题)。
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    text = data.decode('utf-8')
+    decoder = json.JSONDecoder()
+    offsets: Dict[str, Tuple[int, int]] = {}
+    errors: List[str] = []
+    pos = _skip_ws(text, 0)
+    if text[pos:pos + 1] != "{":
+        raise SchemaError(f"{path}: top level must be an object")
+    pos = _skip_ws(text, pos + 1)
+    char_at, byte_at = 0, 0         # 字符偏移 -> 字节偏移 (增量换算，总计 O(n))
+    while text[pos:pos + 1] != "}":
+        key, pos = decoder.raw_decode(text, pos)
+        pos = _skip_ws(text, pos)
+        if not isinstance(key, str) or text[pos:pos + 1] != ":":
+            raise SchemaError(f"{path}: malformed object near character {pos}")
+        start = _skip_ws(text, pos + 1)
+        value, end = decoder.raw_decode(text, start)
+        errors.extend(validate(key, value))
+        byte_at += len(text[char_at:start].encode('utf-8'))
+        length = len(text[start:end].encode('utf-8'))
+        offsets[key] = (byte_at, length)
+        char_at, byte_at = end, byte_at + length
+        pos = _skip_ws(text, end)
+        if text[pos:pos + 1] == ",":
+            pos = _skip_ws(text, pos + 1)
+        elif text[pos:pos + 1] != "}":
+            raise SchemaError(f"{path}: expected ',' or '}}' near character {pos}")
+    if errors:
+        raise SchemaError(f"{path}: {len(errors)} invalid entries\n  " + "\n  ".join(errors[:20]))
+    return offsets
+
+class _EntryReader:
+    """按 (偏移, 长度) 从源文件读取并解码单个条目；文件句柄按需打开，不随对象序列化。"""
+
+    def __init__(self, path: str, offsets: Dict[str, Tuple[int, int]], source: dict):
+        self.path = path
+        self.offsets = offsets
+        self.source = source
+        self._fh = None
+
+    def read(self, key: str):
+        off, n = self.offsets[key]
+        if self._fh is None:
+            self._fh = open(self.path, 'rb')
+        st = os.fstat(self._fh.fileno())
+        # 以改名方式替换的文件，旧句柄仍指向原内容；原地修改则偏移失效
+        if st.st_mtime_ns != self.source["mtime_ns"] or st.st_size != self.source["size"]:
+            raise StaleDatabase(f"{self.path} changed on disk; reload the database")
+        self._fh.seek(off)
+        return json.loads(self._fh.read(n))
+
+    def read_many(self, keys: Iterable[str]) -> Dict[str, object]:
+        """按文件顺序批量读取 (预取一场战斗引用的全部条目)。"""
+        return {k: self.read(k) for k in sorted(set(keys), key=lambda k: self.offsets[k][0])}
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_fh"] = None
+        return state
+
+class LazyUnitDatabase(UnitDatabase):
+    """
+    UnitDatabase 的惰性版本：id 列表来自索引，条目与 UnitStats 在首次访问时才读取、编译。
+    """
+
+    def __init__(self, reader: _EntryReader):
+        self.reader = reader
+        self.ids = list(reader.offsets)
+        self.index = {u: i for i, u in enumerate(self.ids)}
+        self.raw: Dict[str, dict] = {}      # 已物化的条目
+        self._stats: Dict[str, UnitStats] = {}
+
+    def __getitem__(self, u_id: str) -> dict:
+        entry = self.raw.get(u_id)
+        if entry is None:
+            entry = self.raw[u_id] = self.reader.read(u_id)
+        return entry
+
+    def stats(self, u_id: str) -> UnitStats:
+        st = self._stats.get(u_id)
+        if st is None:
+            st = self._stats[u_id] = compile_unit_stats(u_id, self[u_id])
+        return st
+
+    def prefetch(self, ids: Iterable[str]):
+        todo = [u for u in ids if u in self.index and u not in self.raw]
+        self.raw.update(self.reader.read_many(todo))
+
+    def close(self):
+        """关闭源文件句柄；已物化的条目仍可用，之后的读取会重新打开文件。"""
+        self.reader.close()
+
+    @property
+    def materialized(self) -> int:
+        return len(self.raw)
+
+class LazyBuildingDatabase(BuildingDatabase):
+    """BuildingDatabase 的惰性版本：建筑的等级配置与减伤曲线在首次用到该建筑时才编译。"""
+
+    def __init__(self, reader: _EntryReader):
+        self.reader = reader
+        self.raw: Dict[str, dict] = {}
+        self.levels: Dict[str, List[BuildingLevelConfig]] = {}
+        self._curves: Dict[Tuple[str, int], Tuple[List[BuildingLevelConfig], MitigationCurve]] = {}
+
+    def __getitem__(self, b_id: str) -> dict:
+        entry = self.raw.get(b_id)
+        if entry is None:
+            entry = self.raw[b_id] = self.reader.read(b_id)
+            self.levels[b_id] = sorted((BuildingLevelConfig(l["level"], l["hp"], l["mitigation"])
+                                        for l in entry["levels"]), key=lambda x: x.level)
+        return entry
+
+    def __iter__(self):
+        return iter(self.reader.offsets)
+
+    def __len__(self) -> int:
+        return len(self.reader.offsets)
+
+    def __contains__(self, b_id) -> bool:
+        return b_id in self.reader.offsets
+
+    def curve(self, b_id: str, level: int) -> Optional[Tuple[List[BuildingLevelConfig], MitigationCurve]]:
+        if b_id in self.reader.offsets:
+            self[b_id]
+        return super().curve(b_id, level)
+
+    def prefetch(self, ids: Iterable[str]):
+        for b_id in ids:
+            if b_id in self.reader.offsets:
+                self[b_id]
+
+    def close(self):
+        self.reader.close()
+
+    @property
+    def materialized(self) -> int:
+        return len(self.raw)
+
+def referenced_ids(conf: dict) -> Tuple[List[str], List[str]]:
+    """战斗配置 (或 team 配置) 引用的 (单位 id, 建筑 id)，供 prefetch 使用。"""
+    units, buildings = [], []
+    teams = [conf[t] for t in ("team_a", "team_b") if t in conf] or [conf]
+    for team in teams:
+        stacks = [team] if "units" in team else team.get("stacks", [])
+        for s in stacks:
+            units.extend(u["id"] for u in s.get("units", []))
+            if s.get("building"):
+                buildings.append(s["building"]["id"])
+    return list(dict.fromkeys(units)), list(dict.fromkeys(buildings))
+
+def _load_index(path: str, cache_dir: Optional[str], validate) -> Tuple[_EntryReader, bool]:
+    """返回 (条目读取器, 是否使用了已有索引)。索引失效或不存在时重新扫描 (并校验) 源文件。"""
+    idx_path = None
+    if cache_dir is not None:
+        idx_path = _cache_path(cache_dir, (path,), "idx")
+        blob = _read_cache(idx_path)
+        if blob is not None and blob.get("index_version") == INDEX_VERSION:
+            valid, touched = _check_sources([blob["source"]], (path,))
+            if valid:
+                if touched:
+                    blob["source"] = _source_info(path, blob["source"]["sha256"])
+                    _write_cache(idx_path, blob)
+                return _EntryReader(path, blob["offsets"], blob["source"]), True
+    source = _source_info(path)
+    offsets = index_json(path, validate)
+    if idx_path is not None:
+        _write_cache(idx_path, {"version": CACHE_VERSION, "index_version": INDEX_VERSION,
+                                "source": source, "offsets": offsets})
+    return _EntryReader(path, offsets, source), False
+
+def load_lazy_databases(units_path: str = "units.json", buildings_path: str = "buildings.json",
+                        cache_dir: Optional[str] = "") -> Tuple[LazyUnitDatabase, LazyBuildingDatabase]:
+    """
+    加载惰性索引数据库 (接口同 load_databases，可直接传给 build_army)。
+    cache_dir 规则同 load_databases；为 None 时每次重新扫描源文件。
+    """
+    if cache_dir == "":
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(units_path)), CACHE_DIR)
+    u_reader, _ = _load_index(units_path, cache_dir, validate_unit)
+    b_reader, _ = _load_index(buildings_path, cache_dir, validate_building)
+    return LazyUnitDatabase(u_reader), LazyBuildingDatabase(b_reader)
+
+# ============================================================================
+# 5. 热更新
+# ============================================================================
+
+class DatabaseWatcher:
+    """
+    持有当前数据库并监视两个源文件。poll() 发现 (mtime, 大小) 变化时重新加载 (重建索引并校验)，
+    成功后整体替换 current；新文件格式错误时保留旧数据库并记录 last_error。
+    读取方每次使用 watcher.current 取得一致的 (units, buildings)，已在使用旧对象的战斗不受影响
+    (旧的惰性数据库在替换时关闭文件句柄，已物化的条目照常可用)。
+    start() 在后台线程中定期 poll；也可以由调用方在合适的时机 (如每批请求前) 自行调用。
+    """
+
+    def __init__(self, units_path: str = "units.json", buildings_path: str = "buildings.json",
+                 cache_dir: Optional[str] = "", lazy: bool = True, interval: float = WATCH_INTERVAL,
+                 on_reload: Optional[Callable[[tuple], None]] = None):
+        self.paths = (units_path, buildings_path)
+        self.cache_dir = cache_dir
+        self.lazy = lazy
+        self.interval = interval
+        self.on_reload = on_reload
+        self.reloads = 0
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._checked = 0.0
+        self._stamp = self._file_stamp()
+        self.current = self._load()
+
+    def _file_stamp(self) -> tuple:
+        out = []
+        for p in self.paths:
+            try:
+                st = os.stat(p)
+                out.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                out.append(None)
+        return tuple(out)
+
+    def _load(self) -> tuple:
+        loader = load_lazy_databases if self.lazy else load_databases
+        return loader(*self.paths, cache_dir=self.cache_dir)
+
+    def poll(self, force: bool = False) -> bool:
+        """检查源文件，发生变化并加载成功时替换数据库并返回 True。两次检查至少间隔 interval 秒。"""
+        now = time.monotonic()
+        if not force and now - self._checked < self.interval:
+            return False
+        with self._lock:
+            self._checked = now
+            stamp = self._file_stamp()
+            if stamp == self._stamp and not force:
+                return False
+            try:
+                fresh = self._load()
+            except (OSError, ValueError) as e:      # SchemaError / JSONDecodeError 均为 ValueError
+                self.last_error = f"{type(e).__name__}: {e}"
+                self._stamp = stamp                 # 同一份坏文件不反复重试，等待下一次修改
+                return False
+            self._stamp = stamp
+            old, self.current = self.current, fresh
+            self.last_error = None
+            self.reloads += 1
+            if self.lazy:
+                # 旧的惰性数据库不再从 current 取得，释放其源文件句柄
+                for db in old:
+                    db.close()
+        if self.on_reload is not None:
+            self.on_reload(fresh)
+        return True
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="cow-db-watch", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+# ============================================================================
+# 6. 冷启动报告
+# ============================================================================
+
+@dataclass
+class LoadReport:
+    method: str
+    seconds: float          # 冷启动耗时
+    traced_bytes: int       # 加载结束后数据库占用的内存 (tracemalloc)
+    units: int              # 条目总数
+    buildings: int
+    materialized: int       # 构建示例战斗后已物化的条目数 (单位 + 建筑)
+    build_seconds: float    # 构建示例战斗双方 Army 的耗时
+
+def measure_load(method: str, loader: Callable[[], tuple], conf: Optional[dict] = None) -> LoadReport:
+    from cow_batch import _traced_bytes
+    from run_battle import build_army
+    t0 = time.perf_counter()
+    loader()
+    seconds = time.perf_counter() - t0
+    # 第二次加载只用于计量内存 (tracemalloc 会拖慢计时)
+    (units, buildings), traced = _traced_bytes(loader)
+    build_seconds = 0.0
+    if conf is not None:
+        t0 = time.perf_counter()
+        for team in ("team_a", "team_b"):
+            build_army(conf[team], units, buildings)
+        build_seconds = time.perf_counter() - t0
+    materialized = (units.materialized + buildings.materialized if isinstance(units, LazyUnitDatabase)
+                    else len(units) + len(buildings))
+    return LoadReport(method, seconds, traced, len(units), len(buildings), materialized, build_seconds)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="数据库加载方式对比：冷启动耗时与常驻内存")
+    parser.add_argument("--units", default="units.json")
+    parser.add_argument("--buildings", default="buildings.json")
+    parser.add_argument("--config", default="battle_config.json", help="用于统计物化条目数的示例战斗")
+    parser.add_argument("--cache-dir", default="", help="缓存 / 索引目录 (默认 units.json 旁的 .cow_cache)")
+    args = parser.parse_args(argv)
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        conf = json.load(f)
+    paths = (args.units, args.buildings)
+    methods = [
+        ("json+compile", lambda: compile_databases(*paths)),
+        ("compiled cache", lambda: load_databases(*paths, cache_dir=args.cache_dir)),
+        ("lazy index", lambda: load_lazy_databases(*paths, cache_dir=args.cache_dir)),
+    ]
+    # 先各加载一次，使缓存与索引就绪 (报告的是热缓存下的冷启动)
+    for _, loader in methods[1:]:
+        loader()
+    print(f"{'METHOD':<16} | {'COLD START':>10} | {'MEMORY':>10} | {'ENTRIES':>9} | {'MATERIALIZED':>12} | {'BUILD':>8}")
+    for name, loader in methods:
+        r = measure_load(name, loader, conf)
+        print(f"{r.method:<16} | {r.seconds*1000:>7.2f} ms | {r.traced_bytes/2**20:>6.2f} MiB | "
+              f"{r.units + r.buildings:>9} | {r.materialized:>12} | {r.build_seconds*1000:>5.2f} ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,523 @@
+import sys
+import math
+import time
+import argparse
+from array import array
+from collections import defaultdict
+from dataclasses import dataclass, field
+from statistics import NormalDist
+from typing import List, Dict, Optional, Tuple
+
+from cow_core import (
+    Army, ArmySnapshot, BattleMode, BattleOutcome, air_strike_flags, play_round, is_zero_output_matchup,
+    RANDOM_MU, RANDOM_SIGMA, RANDOM_MIN, RANDOM_MAX,
+)
+from cow_batch import restore_army, _pick_vector, _vector_engine
+from cow_rng import CounterRNG, fresh_seed
+
+# ============================================================================
+# 1. 配置
+# ============================================================================
+# 精确分布引擎：战斗中唯一的随机性是每回合两个截断正态系数 (攻击 / 防御)。
+# 把系数离散为 Gauss 求积节点，逐回合传播「状态 -> 概率」的分布，直接得到胜负概率与战损分布，
+# 没有抽样噪声。数量相同且 HP 相差不超过容差的状态合并 (HP 取概率加权平均)，状态数超过上限时自动改用 Monte Carlo 抽样。
+
+DEFAULT_NODES = 3           # 每个系数的求积节点数 (每回合分支数为其平方)
+DEFAULT_TOLERANCE = 0.01    # 合并容差：Group HP 以单兵 HP 为单位、建筑 HP 以满级 HP 为单位
+DEFAULT_MAX_STATES = 50000
+FALLBACK_TRIALS = 10000
+_GRID = 4000                # 离散化系数分布所用的网格数
+
+def _factor_measure() -> List[Tuple[float, float]]:
+    """截断后系数的分布 [(取值, 概率)]：两端截断处的原子加区间内的细网格。"""
+    nd = NormalDist(RANDOM_MU, RANDOM_SIGMA)
+    h = (RANDOM_MAX - RANDOM_MIN) / _GRID
+    pts = [(RANDOM_MIN, nd.cdf(RANDOM_MIN)), (RANDOM_MAX, 1.0 - nd.cdf(RANDOM_MAX))]
+    pts += [(RANDOM_MIN + (k + 0.5) * h, nd.cdf(RANDOM_MIN + (k + 1) * h) - nd.cdf(RANDOM_MIN + k * h))
+            for k in range(_GRID)]
+    return pts
+
+def factor_nodes(n: int = DEFAULT_NODES) -> List[Tuple[float, float]]:
+    """
+    截断正态系数的 n 点 Gauss 求积 [(取值, 概率)]：节点为该分布正交多项式的根，
+    前 2n-1 阶矩与连续分布一致 (均值、方差等)，概率之和为 1。
+    """
+    pts = _factor_measure()
+    # Stieltjes 过程求三项递推系数 p_{k+1} = (x - a_k) p_k - b_k p_{k-1}
+    prev, cur = [0.0] * len(pts), [1.0] * len(pts)
+    alphas, norms = [], []
+    for k in range(n):
+        norm = sum(w * p * p for (_, w), p in zip(pts, cur))
+        alpha = sum(w * x * p * p for (x, w), p in zip(pts, cur)) / norm
+        beta = norm / norms[-1] if norms else 0.0
+        alphas.append(alpha)
+        norms.append(norm)
+        prev, cur = cur, [(x - alpha) * p - beta * q for (x, _), p, q in zip(pts, cur, prev)]
+
+    def poly(x: float) -> List[float]:
+        """p_0(x) .. p_n(x)。"""
+        vals = [1.0, x - alphas[0]]
+        for k in range(1, n):
+            vals.append((x - alphas[k]) * vals[k] - norms[k] / norms[k - 1] * vals[k - 1])
+        return vals
+
+    # p_n 的 n 个根都在 (RANDOM_MIN, RANDOM_MAX) 内：细扫描找变号区间，再二分
+    roots = []
+    step = (RANDOM_MAX - RANDOM_MIN) / _GRID
+    lo, f_lo = RANDOM_MIN, poly(RANDOM_MIN)[n]
+    for k in range(1, _GRID + 1):
+        hi = RANDOM_MIN + k * step
+        f_hi = poly(hi)[n]
+        if f_lo == 0.0:
+            roots.append(lo)
+        elif f_lo * f_hi < 0:
+            a, b = lo, hi
+            for _ in range(60):
+                m = 0.5 * (a + b)
+                if poly(a)[n] * poly(m)[n] <= 0: b = m
+                else: a = m
+            roots.append(0.5 * (a + b))
+        lo, f_lo = hi, f_hi
+    # Christoffel 权重 1 / sum_k p_k(x)^2 / ||p_k||^2
+    nodes = []
+    for x in roots[:n]:
+        vals = poly(x)
+        nodes.append((x, 1.0 / sum(v * v / h for v, h in zip(vals, norms))))
+    return nodes
+
+# ============================================================================
+# 2. 结果结构
+# ============================================================================
+
+@dataclass
+class GroupDistribution:
+    label: str
+    initial_count: int
+    initial_hp: float
+    count_dist: Dict[int, float]    # 战后数量 -> 概率
+    mean_hp_lost: float
+
+    @property
+    def mean_dead(self) -> float:
+        return sum((self.initial_count - c) * p for c, p in self.count_dist.items())
+
+    def dead_percentile(self, q: float) -> int:
+        """阵亡数量的 q 百分位 (q 取 0~100，取累计概率首次达到 q% 的值)。"""
+        acc = 0.0
+        dead = 0
+        for dead in sorted(self.initial_count - c for c in self.count_dist):
+            acc += self.count_dist[self.initial_count - dead]
+            if acc >= q / 100.0 - 1e-12:
+                return dead
+        return dead
+
+@dataclass
+class BuildingDistribution:
+    label: str
+    initial_hp: float
+    mean_hp: float
+
+@dataclass
+class SideDistribution:
+    name: str
+    groups: List[GroupDistribution] = field(default_factory=list)
+    buildings: List[BuildingDistribution] = field(default_factory=list)
+
+@dataclass
+class ExactResult:
+    method: str                     # "exact" (分布传播) / "sampling" (状态数超限后的抽样)
+    win_prob: float
+    draw_prob: float
+    loss_prob: float
+    rounds_dist: Dict[int, float]   # 结算回合数 -> 概率
+    side_a: SideDistribution
+    side_b: SideDistribution
+    peak_states: int                # 传播中同时存在的最大状态数
+    branches: int                   # 每个状态每回合的分支数 (系数节点数的平方)
+    trials: int = 0                 # 抽样次数 (仅 sampling)
+
+    @property
+    def mean_rounds(self) -> float:
+        return sum(r * p for r, p in self.rounds_dist.items())
+
+# ============================================================================
+# 3. 结局累计
+# ============================================================================
+
+def _weighted_counts(vals, w) -> List[Tuple[int, float]]:
+    """[(取值, 权重之和)]，vals 与 w 为等长数组。"""
+    import numpy as np
+    uniq, inv = np.unique(vals, return_inverse=True)
+    return list(zip(uniq.tolist(), np.bincount(inv.ravel(), weights=w, minlength=len(uniq)).tolist()))
+
+class _Tally:
+    """按概率累计结局：胜负、回合数、各 Group 战后数量分布、损失 HP 与建筑 HP 的期望。"""
+
+    def __init__(self, army_a: Army, army_b: Army):
+        self.armies = (army_a, army_b)
+        self.groups = [[(s, g) for s in army.stacks for g in s.groups] for army in self.armies]
+        self.count_dist = [[defaultdict(float) for _ in gs] for gs in self.groups]
+        self.hp_lost = [[0.0] * len(gs) for gs in self.groups]
+        self.stacks_bld = [[s for s in army.stacks if s.building] for army in self.armies]
+        self.bld_hp = [[0.0] * len(ss) for ss in self.stacks_bld]
+        self.bld_rows = [[i for i, s in enumerate(army.stacks) if s.building] for army in self.armies]
+        self.outcomes = defaultdict(float)
+        self.rounds = defaultdict(float)
+
+    @staticmethod
+    def _outcome(a_alive: bool, b_alive: bool) -> BattleOutcome:
+        if a_alive and not b_alive: return BattleOutcome.A_WIN
+        if b_alive and not a_alive: return BattleOutcome.B_WIN
+        return BattleOutcome.DRAW
+
+    def add(self, p: float, rounds: int):
+        """以概率 p 记录两支 Army 的当前状态为一个结局。"""
+        army_a, army_b = self.armies
+        self.outcomes[self._outcome(army_a.is_alive, army_b.is_alive)] += p
+        self.rounds[rounds] += p
+        for side in (0, 1):
+            for k, (_, g) in enumerate(self.groups[side]):
+                self.count_dist[side][k][g.count] += p
+                self.hp_lost[side][k] += p * (g.initial_hp - g.current_hp)
+            for k, s in enumerate(self.stacks_bld[side]):
+                self.bld_hp[side][k] += p * s.building.current_hp
+
+    def add_columns(self, w, rounds, a_alive, b_alive, states):
+        """
+        记录一批数组状态为结局 (需要 numpy)：w 为各列概率，rounds 为整数或逐列数组，
+        states 为两方的 (count (G, N), hp (G, N), bld_hp (S, N))。
+        """
+        import numpy as np
+        if not len(w):
+            return
+        self.outcomes[BattleOutcome.A_WIN] += float(w[a_alive & ~b_alive].sum())
+        self.outcomes[BattleOutcome.B_WIN] += float(w[b_alive & ~a_alive].sum())
+        self.outcomes[BattleOutcome.DRAW] += float(w[a_alive == b_alive].sum())
+        for r, p in _weighted_counts(np.broadcast_to(rounds, w.shape), w):
+            self.rounds[r] += p
+        for side, (count, hp, bld_hp) in enumerate(states):
+            for k, (_, g) in enumerate(self.groups[side]):
+                for c, p in _weighted_counts(count[k], w):
+                    self.count_dist[side][k][c] += p
+                self.hp_lost[side][k] += float(w @ (g.initial_hp - hp[k]))
+            for k, row in enumerate(self.bld_rows[side]):
+                self.bld_hp[side][k] += float(w @ bld_hp[row])
+
+    def add_vector(self, res):
+        """记录向量 / jit 引擎的一批试验 (VectorResult)，每个试验权重相同。"""
+        import numpy as np
+        trials = len(res.rounds)
+        w = np.full(trials, 1.0 / trials)
+        self.add_columns(w, res.rounds, res.a_alive, res.b_alive,
+                         [(va.count, va.hp, va.bld_hp) for va in (res.army_a, res.army_b)])
+
+    def result(self, method: str, peak_states: int, branches: int, trials: int = 0) -> ExactResult:
+        sides = []
+        for side, army in enumerate(self.armies):
+            sd = SideDistribution(army.name)
+            for k, (s, g) in enumerate(self.groups[side]):
+                sd.groups.append(GroupDistribution(f"[{s.name}] {g.name}", g.initial_count, g.initial_hp,
+                                                   dict(sorted(self.count_dist[side][k].items())),
+                                                   self.hp_lost[side][k]))
+            for k, s in enumerate(self.stacks_bld[side]):
+                sd.buildings.append(BuildingDistribution(f"{s.name}:{s.building.name}", s.building.initial_hp,
+                                                         self.bld_hp[side][k]))
+            sides.append(sd)
+        o = self.outcomes
+        return ExactResult(method, o[BattleOutcome.A_WIN], o[BattleOutcome.DRAW], o[BattleOutcome.B_WIN],
+                           dict(sorted(self.rounds.items())), sides[0], sides[1], peak_states, branches, trials)
+
+# ============================================================================
+# 4. 分布传播
+# ============================================================================
+
+class _StateKey:
+    """把两方快照映射为合并键：数量精确，HP 按容差量化 (tolerance=0 时按原值)。"""
+
+    def __init__(self, army_a: Army, army_b: Army, tolerance: float):
+        self.layout = []
+        for army in (army_a, army_b):
+            groups = [g for s in army.stacks for g in s.groups]
+            n = len(groups)
+            quanta = [g.max_hp_per_unit * tolerance for g in groups]
+            quanta += [s.building.max_hp * tolerance for s in army.stacks if s.building]
+            hp_idx = list(range(n)) + list(range(2 * n, 2 * n + len(quanta) - n))
+            self.layout.append((n, hp_idx, quanta if tolerance > 0 else None))
+
+    def __call__(self, snap_a: ArmySnapshot, snap_b: ArmySnapshot) -> tuple:
+        key = []
+        for (n, hp_idx, quanta), snap in zip(self.layout, (snap_a, snap_b)):
+            f = snap.f
+            key.extend(snap.i[:n])
+            if quanta is None:
+                key.extend(f[k] for k in hp_idx)
+            else:
+                key.extend(round(f[k] / q) if q > 0 else f[k] for k, q in zip(hp_idx, quanta))
+        return tuple(key)
+
+    def unchanged(self, before: Tuple[ArmySnapshot, ArmySnapshot], after: Tuple[ArmySnapshot, ArmySnapshot]) -> bool:
+        """数量、HP、建筑 HP 均未改变 (逐位比较，用于不动点判定)。"""
+        for (n, hp_idx, _), s0, s1 in zip(self.layout, before, after):
+            if s0.i[:n] != s1.i[:n] or any(s0.f[k] != s1.f[k] for k in hp_idx):
+                return False
+        return True
+
+class StateExplosion(Exception):
+    """状态数超过上限 (exact_distribution 捕获后改用抽样)。"""
+
+def _propagate(army_a: Army, army_b: Army, mode: BattleMode, max_rounds: int, nodes: List[Tuple[float, float]],
+               tolerance: float, max_states: int, siege_damage: bool, tally: _Tally) -> int:
+    """逐回合传播状态分布，结局写入 tally，返回峰值状态数。状态数超限时抛出 StateExplosion。"""
+    if max_rounds <= 0 or not army_a.is_alive or not army_b.is_alive:
+        tally.add(1.0, 0)
+        return 1
+    if is_zero_output_matchup(army_a, army_b, mode):
+        tally.add(1.0, max_rounds)
+        return 1
+    pairs = [(fa, fd, pa * pd) for fa, pa in nodes for fd, pd in nodes]
+    # 向量引擎支持的配置把「状态 x 分支」整批推进；其余 (目标选择类 / 关闭建筑伤害 / 无 numpy) 逐个推进
+    vec = _vector_engine() if siege_damage else None
+    if vec is not None and vec.supports(army_a, army_b, mode):
+        return _propagate_arrays(vec, army_a, army_b, mode, max_rounds, pairs, tolerance, max_states, tally)
+    return _propagate_scalar(army_a, army_b, mode, max_rounds, pairs, tolerance, max_states, siege_damage, tally)
+
+def _propagate_scalar(army_a: Army, army_b: Army, mode: BattleMode, max_rounds: int, pairs: list,
+                      tolerance: float, max_states: int, siege_damage: bool, tally: _Tally) -> int:
+    key_of = _StateKey(army_a, army_b, tolerance)
+    start = (army_a.snapshot(), army_b.snapshot())
+    states = {key_of(*start): [1.0, start]}
+    peak = 1
+    for r in range(1, max_rounds + 1):
+        nxt = {}
+        for p, snaps in states.values():
+            for fa, fd, w in pairs:
+                restore_army(army_a, snaps[0])
+                restore_army(army_b, snaps[1])
+                play_round(army_a, army_b, mode, fa, fd, siege_damage)
+                q = p * w
+                if not army_a.is_alive or not army_b.is_alive:
+                    tally.add(q, r)
+                    continue
+                after = (army_a.snapshot(), army_b.snapshot())
+                if r < max_rounds and key_of.unchanged(snaps, after):
+                    # 不动点：本回合无任何变化 (与随机系数无关)，此后每回合都相同
+                    tally.add(q, max_rounds)
+                    continue
+                # 合并后的 HP 取概率加权平均 (数量在同一键内相同)
+                key = key_of(*after)
+                entry = nxt.get(key)
+                if entry is None:
+                    nxt[key] = [q, after, [array('d', (q * x for x in snap.f)) for snap in after]]
+                else:
+                    entry[0] += q
+                    for acc, snap in zip(entry[2], after):
+                        for k, x in enumerate(snap.f):
+                            acc[k] += q * x
+        if len(nxt) > max_states:
+            raise StateExplosion(f"round {r}: {len(nxt)} states > {max_states}")
+        peak = max(peak, len(nxt))
+        states = {}
+        for key, (p, after, sums) in nxt.items():
+            states[key] = [p, tuple(ArmySnapshot(array('d', (x / p for x in acc)), snap.i)
+                                    for acc, snap in zip(sums, after))]
+        if not states:
+            break
+    for p, snaps in states.values():
+        restore_army(army_a, snaps[0])
+        restore_army(army_b, snaps[1])
+        tally.add(p, max_rounds)
+    return peak
+
+def _merge_keys(np, sides, cols, tolerance: float):
+    """
+    (D, n) 的整数合并键，与 _StateKey 相同：数量精确，HP 按容差量化 (tolerance=0 时取原值的位模式)。
+    sides 为两方的 (VectorArmy, Group 量化单位 (G,), 建筑量化单位 (S,))。
+    """
+    rows = []
+    for v, hp_quanta, bld_quanta in sides:
+        rows.append(v.count[:, cols])
+        for vals, quanta in ((v.hp[:, cols], hp_quanta), (v.bld_hp[:, cols], bld_quanta)):
+            if tolerance > 0:
+                q = np.where(quanta > 0, quanta, 1.0)[:, None]
+                rows.append(np.where(quanta[:, None] > 0, np.rint(vals / q), vals).astype(np.int64))
+            else:
+                rows.append(np.ascontiguousarray(vals).view(np.int64))
+    return np.concatenate(rows, axis=0)
+
+def _merged_mean(np, vals, slot, q, prob):
+    """(R, n) 的各列按 slot 合并为 (R, 合并后状态数) 的概率加权平均。"""
+    out = np.empty((vals.shape[0], len(prob)))
+    for k in range(vals.shape[0]):
+        out[k] = np.bincount(slot, weights=q * vals[k], minlength=len(prob)) / prob
+    return out
+
+def _propagate_arrays(vec, army_a: Army, army_b: Army, mode: BattleMode, max_rounds: int, pairs: list,
+                      tolerance: float, max_states: int, tally: _Tally) -> int:
+    """
+    数组版传播：每回合把 N 个状态各复制为 K 个分支 (共 N*K 列)，用 cow_vector 一次推进一回合，
+    再按合并键去重 (np.unique) 并累加概率 (np.bincount)。状态顺序与合并方式与 _propagate_scalar 相同。
+    """
+    import numpy as np
+    va, vb = vec.VectorArmy(army_a, 1), vec.VectorArmy(army_b, 1)
+    sides = [(v, v.max_hp[:, 0] * tolerance,
+              np.array([s.building.max_hp if s.building else 0.0 for s in army.stacks]) * tolerance)
+             for v, army in ((va, army_a), (vb, army_b))]
+    fa = np.array([x[0] for x in pairs])
+    fd = np.array([x[1] for x in pairs])
+    w = np.array([x[2] for x in pairs])
+    K = len(pairs)
+    states = [(va.count, va.hp, va.bld_hp), (vb.count, vb.hp, vb.bld_hp)]
+    prob = np.ones(1)
+    peak = 1
+    for r in range(1, max_rounds + 1):
+        n = len(prob)
+        for v, (count, hp, bld_hp) in zip((va, vb), states):
+            v.load_state(np.repeat(count, K, axis=1), np.repeat(hp, K, axis=1), np.repeat(bld_hp, K, axis=1))
+        bld_before = (va.bld_hp.copy(), vb.bld_hp.copy())
+        q = np.repeat(prob, K) * np.tile(w, n)
+        vec.play_vector_round(va, vb, mode, np.ones(n * K, dtype=bool), np.tile(fa, n), np.tile(fd, n))
+
+        a_alive, b_alive = va.alive(), vb.alive()
+        ended = ~(a_alive & b_alive)
+        if r < max_rounds:
+            # 不动点：本回合无任何变化 (与随机系数无关)，此后每回合都相同
+            still = ~ended & ~va.hit & ~vb.hit
+            still &= (va.bld_hp == bld_before[0]).all(axis=0) & (vb.bld_hp == bld_before[1]).all(axis=0)
+        else:
+            still = np.zeros_like(ended)
+        for mask, rounds in ((ended, r), (still, max_rounds)):
+            cols = np.flatnonzero(mask)
+            tally.add_columns(q[cols], rounds, a_alive[cols], b_alive[cols],
+                              [(v.count[:, cols], v.hp[:, cols], v.bld_hp[:, cols]) for v in (va, vb)])
+
+        cols = np.flatnonzero(~ended & ~still)
+        if not len(cols):
+            return peak
+        _, first, inv = np.unique(_merge_keys(np, sides, cols, tolerance), axis=1,
+                                  return_index=True, return_inverse=True)
+        if len(first) > max_states:
+            raise StateExplosion(f"round {r}: {len(first)} states > {max_states}")
+        peak = max(peak, len(first))
+        # np.unique 按键排序；按首次出现的位置重排，保持与标量版相同的状态顺序
+        order = np.argsort(first, kind="stable")
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        slot = rank[inv.ravel()]
+        qc = q[cols]
+        prob = np.bincount(slot, weights=qc, minlength=len(first))
+        keep = cols[first[order]]
+        states = [(v.count[:, keep], _merged_mean(np, v.hp[:, cols], slot, qc, prob),
+                   _merged_mean(np, v.bld_hp[:, cols], slot, qc, prob)) for v in (va, vb)]
+    n = len(prob)
+    tally.add_columns(prob, max_rounds, np.ones(n, dtype=bool), np.ones(n, dtype=bool), states)
+    return peak
+
+def _sample(army_a: Army, army_b: Army, mode: BattleMode, max_rounds: int, trials: int, seed: int,
+            siege_damage: bool, engine: str, tally: _Tally):
+    """抽样回退：第 t 个试验使用随机流 (seed, t)，与 cow_batch 相同。"""
+    vec = _pick_vector(engine, trials, army_a, army_b, mode) if siege_damage else None
+    if vec is not None:
+        tally.add_vector(vec.run_vector_battle(army_a, army_b, mode, trials, max_rounds, True, seed=seed))
+        return
+    from cow_core import run_simulation
+    snap_a, snap_b = army_a.snapshot(), army_b.snapshot()
+    for t in range(trials):
+        restore_army(army_a, snap_a)
+        restore_army(army_b, snap_b)
+        res = run_simulation(army_a, army_b, mode, max_rounds, True, False, verbose=False,
+                             rng=CounterRNG(seed, t), siege_damage=siege_damage)
+        tally.add(1.0 / trials, res.rounds)
+
+def exact_distribution(army_a: Army, army_b: Army, mode: BattleMode, max_rounds: int = 50,
+                       nodes: int = DEFAULT_NODES, tolerance: float = DEFAULT_TOLERANCE,
+                       max_states: int = DEFAULT_MAX_STATES, use_random: bool = True, siege_damage: bool = True,
+                       fallback_trials: int = FALLBACK_TRIALS, seed: Optional[int] = None,
+                       engine: str = "auto") -> ExactResult:
+    """
+    计算一场战斗的结局分布。use_random=False 时只有一条路径 (等同确定性 run_simulation)。
+    状态数超过 max_states 时改用 fallback_trials 次抽样 (engine 同 cow_batch.run_monte_carlo)，
+    结果的 method 为 "sampling"。两支 Army 在返回前恢复为初始状态。
+    """
+    quad = factor_nodes(nodes) if use_random else [(1.0, 1.0)]
+    branches = len(quad) ** 2
+    snap_a, snap_b = army_a.snapshot(), army_b.snapshot()
+    tally = _Tally(army_a, army_b)
+    try:
+        with air_strike_flags(army_a, mode):
+            peak = _propagate(army_a, army_b, mode, max_rounds, quad, tolerance, max_states, siege_damage, tally)
+        result = tally.result("exact", peak, branches)
+    except StateExplosion:
+        restore_army(army_a, snap_a)
+        restore_army(army_b, snap_b)
+        tally = _Tally(army_a, army_b)
+        seed = fresh_seed() if seed is None else seed
+        _sample(army_a, army_b, mode, max_rounds, fallback_trials, seed, siege_damage, engine, tally)
+        result = tally.result("sampling", max_states, branches, fallback_trials)
+    restore_army(army_a, snap_a)
+    restore_army(army_b, snap_b)
+    return result
+
+# ============================================================================
+# 5. 输出与命令行
+# ============================================================================
+
+def print_exact_summary(result: ExactResult, percentiles=(5, 50, 95)):
+    how = (f"exact, peak {result.peak_states} states x {result.branches} branches" if result.method == "exact"
+           else f"sampling fallback, {result.trials} trials")
+    print(f"=== {result.side_a.name} vs {result.side_b.name} ({how}) ===")
+    print(f"  胜 {result.win_prob*100:.4f}% | 平 {result.draw_prob*100:.4f}% | 负 {result.loss_prob*100:.4f}%"
+          f" | 平均回合 {result.mean_rounds:.3f}")
+    for side in (result.side_a, result.side_b):
+        print(f"\n[{side.name}] 阵亡数量分布:")
+        header = " | ".join(f"P{q:g}".rjust(6) for q in percentiles)
+        print(f"  {'UNIT (STACK)':<30} | {'MEAN DEAD':>10} | {'MEAN HP LOST':>12} | {header}")
+        for g in side.groups:
+            cells = " | ".join(f"{g.dead_percentile(q):>6}" for q in percentiles)
+            print(f"  {g.label:<30} | {g.mean_dead:>10.3f} | {g.mean_hp_lost:>12.2f} | {cells}")
+        for b in side.buildings:
+            print(f"  {('BLD ' + b.label):<30} | 期望战后 HP {b.mean_hp:.2f} / {b.initial_hp:.2f}")
+
+def main(argv=None):
+    from run_battle import load_json, build_army
+    from cow_db import load_databases
+    from cow_batch import run_monte_carlo
+
+    parser = argparse.ArgumentParser(description="精确结局分布 (随机系数离散化 + 状态分布传播)")
+    parser.add_argument("--config", default="battle_config.json")
+    parser.add_argument("--nodes", type=int, default=DEFAULT_NODES, help="每个随机系数的求积节点数")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="状态合并容差 (单兵 HP / 建筑满级 HP 的比例，0 表示只合并完全相同的状态)")
+    parser.add_argument("--max-states", type=int, default=DEFAULT_MAX_STATES, help="超过后改用抽样")
+    parser.add_argument("--fallback-trials", type=int, default=FALLBACK_TRIALS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compare", type=int, default=0, metavar="TRIALS",
+                        help="同时运行 Monte Carlo 并对比胜负概率与耗时")
+    args = parser.parse_args(argv)
+
+    u_db, b_db = load_databases("units.json", "buildings.json")
+    conf = load_json(args.config)
+    mode = BattleMode(conf.get("battle_mode", "LAND_ATTACK"))
+    max_rounds = conf.get("max_rounds", 50)
+    siege = conf.get("siege_damage", True)
+    army_a = build_army(conf["team_a"], u_db, b_db)
+    army_b = build_army(conf["team_b"], u_db, b_db)
+
+    t0 = time.perf_counter()
+    res = exact_distribution(army_a, army_b, mode, max_rounds, args.nodes, args.tolerance, args.max_states,
+                             conf.get("enable_randomness", True), siege, args.fallback_trials, args.seed)
+    t_exact = time.perf_counter() - t0
+    print_exact_summary(res)
+    print(f"\n耗时 {t_exact:.3f} s")
+    if args.compare > 0:
+        t0 = time.perf_counter()
+        mc = run_monte_carlo(army_a, army_b, mode, args.compare, max_rounds, args.seed, siege_damage=siege)
+        t_mc = time.perf_counter() - t0
+        # 二项分布标准误，用于判断差异是否在抽样噪声之内
+        se = math.sqrt(max(mc.win_prob * (1 - mc.win_prob), 1e-12) / args.compare)
+        print(f"Monte Carlo ({args.compare} trials): 胜 {mc.win_prob*100:.4f}% | 平 {mc.draw_prob*100:.4f}%"
+              f" | 负 {mc.loss_prob*100:.4f}% | 平均回合 {mc.mean_rounds:.3f} | 耗时 {t_mc:.3f} s")
+        print(f"胜率差 {abs(mc.win_prob - res.win_prob)*100:.4f}% (MC 标准误 {se*100:.4f}%)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
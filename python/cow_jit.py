@@ -0,0 +1,447 @@
+import sys
+import math
+import argparse
+from collections import namedtuple
+from typing import List, Optional, Callable, Tuple
+
+import numpy as np
+from numba import njit
+
+from cow_core import (
+    Army, BattleMode, run_simulation, is_zero_output_matchup,
+    CASUALTY_THRESHOLD, RANDOM_MU, RANDOM_SIGMA, RANDOM_MIN, RANDOM_MAX,
+)
+from cow_rng import GOLDEN, MIX_1, MIX_2, TWO_PI, INV_2_53, CounterRNG, stream_key, fresh_seed
+from cow_vector import VectorArmy, VectorResult, ARMORS, BUILDING_IDX, OUTPUT_LIMIT, supports
+
+# ============================================================================
+# 1. 说明
+# ============================================================================
+# numba 编译的整场战斗内核：一次调用在编译代码中跑完全部试验的全部回合，
+# 逐试验的计算与 cow_vector 完全相同 (后者已与标量引擎逐位对拍)，随机数使用
+# cow_rng 的计数器流 (seed, first_trial + t)，因此与标量引擎 + CounterRNG 逐试验一致。
+# 支持范围同 cow_vector.supports()；接口同 cow_vector.run_vector_battle，
+# cow_batch 可以按模块互换两种引擎。首次编译结果缓存在 __pycache__ 中。
+
+_U64_GOLDEN = np.uint64(GOLDEN)
+_U64_MIX_1 = np.uint64(MIX_1)
+_U64_MIX_2 = np.uint64(MIX_2)
+_U64_1 = np.uint64(1)
+_U64_11 = np.uint64(11)
+_U64_27 = np.uint64(27)
+_U64_30 = np.uint64(30)
+_U64_31 = np.uint64(31)
+
+MODE_CODES = {BattleMode.LAND_ATTACK: 0, BattleMode.LAND_MEET: 1, BattleMode.AIR_STRIKE: 2}
+
+# 一方的静态数组 (Group 按 Stack 连续排列，见 VectorArmy)
+ArmyArrays = namedtuple("ArmyArrays", [
+    "stack_start",     # (S+1,) 各 Stack 的 Group 起点
+    "armor",           # (G,)
+    "max_hp",          # (G,)
+    "atk", "dfn",      # (G, A)
+    "tmul", "cmul",    # (G,) 地形 / 核心乘数
+    "gain",            # (G,) tmul * cmul，用于筛掉输出恒为 0 的行
+    "armor_set",       # (A,) bool 本方出现的护甲类型
+    "stack_armors",    # (S, A) bool 各 Stack 出现的护甲类型
+    "has_bld",         # (S,) bool
+    "has_mit",         # (S,) bool 建筑或核心减伤
+    "core_add",        # (S,)
+    "curve_len",       # (S,) 减伤曲线级数 (0 表示无曲线)
+    "ends", "starts", "hps", "mits",   # (S, L)
+    "cum_mit",         # (S, L+1)
+    "partial_lv",      # (S, L) bool
+    "init_count", "init_hp", "init_bld",
+])
+
+def pack_army(va: VectorArmy) -> ArmyArrays:
+    S, G = va.S, va.G
+    stack_start = np.zeros(S + 1, dtype=np.int64)
+    for si, sl in enumerate(va.stack_slices):
+        stack_start[si + 1] = sl.stop
+    armor_set = np.zeros(len(ARMORS), dtype=np.bool_)
+    armor_set[va.armor_set] = True
+    stack_armors = np.zeros((S, len(ARMORS)), dtype=np.bool_)
+    for si, arm in enumerate(va.stack_armor_sets):
+        stack_armors[si, arm] = True
+
+    L = max([len(c[0][2]) for cs in va.curves for c in cs] + [1])
+    curve_len = np.zeros(S, dtype=np.int64)
+    ends, starts, hps, mits = (np.zeros((S, L)) for _ in range(4))
+    cum_mit = np.zeros((S, L + 1))
+    partial_lv = np.zeros((S, L), dtype=np.bool_)
+    for si, cs in enumerate(va.curves):
+        for (c_ends, c_starts, c_hps, c_mits, c_cum, c_partial), _ in cs:
+            n = len(c_hps)
+            curve_len[si] = n
+            ends[si, :n], starts[si, :n], hps[si, :n], mits[si, :n] = c_ends, c_starts, c_hps, c_mits
+            cum_mit[si, :n + 1] = c_cum
+            partial_lv[si, :n] = c_partial
+
+    tmul = np.ascontiguousarray(va.terrain_mult[:, 0])
+    cmul = np.ascontiguousarray(va.core_mult[:, 0])
+    return ArmyArrays(
+        stack_start, va.armor.astype(np.int64), np.ascontiguousarray(va.max_hp[:, 0]),
+        np.ascontiguousarray(va.atk), np.ascontiguousarray(va.dfn), tmul, cmul, tmul * cmul,
+        armor_set, stack_armors, np.array(va.has_bld, dtype=np.bool_), np.array(va.has_mitigation, dtype=np.bool_),
+        np.array([0.0 if c is None else float(c) for c in va.core_add]),
+        curve_len, ends, starts, hps, mits, cum_mit, partial_lv,
+        np.ascontiguousarray(va.init_count[:, 0]), np.ascontiguousarray(va.init_hp[:, 0]),
+        np.ascontiguousarray(va.init_bld_hp[:, 0]))
+
+# ============================================================================
+# 2. 内核
+# ============================================================================
+# 各函数与 VectorArmy 的同名方法一一对应，只是逐试验标量化。
+# 除 _run_trials 外的函数都不分配数组，关闭引用计数 (_nrt=False)：否则每次调用
+# 都要对 ArmyArrays 的 23 个数组逐个 incref/decref，开销是计算本身的数百倍。
+_kernel = njit(cache=True, _nrt=False)
+
+@_kernel
+def _mix64(z):
+    z = (z ^ (z >> _U64_30)) * _U64_MIX_1
+    z = (z ^ (z >> _U64_27)) * _U64_MIX_2
+    return z ^ (z >> _U64_31)
+
+@_kernel
+def _gauss(key, n):
+    """CounterRNG.gauss：计数器 n / n+1 上的 Box-Muller。"""
+    u1 = float(_mix64(key + (n + _U64_1) * _U64_GOLDEN) >> _U64_11) * INV_2_53
+    u2 = float(_mix64(key + (n + np.uint64(2)) * _U64_GOLDEN) >> _U64_11) * INV_2_53
+    z = RANDOM_MU + RANDOM_SIGMA * (math.sqrt(-2.0 * math.log(1.0 - u1)) * math.cos(TWO_PI * u2))
+    return min(RANDOM_MAX, max(RANDOM_MIN, z))
+
+@_kernel
+def _stack_alive(ar, cnt, hp, si):
+    any_hp = False
+    any_cnt = False
+    for g in range(ar.stack_start[si], ar.stack_start[si + 1]):
+        if hp[g] > 0: any_hp = True
+        if cnt[g] > 0: any_cnt = True
+    return any_hp and any_cnt
+
+@_kernel
+def _alive(ar, cnt, hp):
+    for si in range(len(ar.stack_start) - 1):
+        if _stack_alive(ar, cnt, hp, si):
+            return True
+    return False
+
+@_kernel
+def _output(ar, cnt, hp, table, a, g0, g1, buf_d, buf_c):
+    # 按伤害降序 (稳定) 插入，前 OUTPUT_LIMIT 个单位出手
+    n = 0
+    for g in range(g0, g1):
+        if table[g, a] * ar.gain[g] > 0:
+            c = cnt[g]
+            eff = 0.2 + 0.8 * (hp[g] / (max(c, 1) * ar.max_hp[g]))
+            d = table[g, a] * eff * ar.tmul[g] * ar.cmul[g]
+            j = n
+            while j > 0 and buf_d[j - 1] < d:
+                buf_d[j] = buf_d[j - 1]
+                buf_c[j] = buf_c[j - 1]
+                j -= 1
+            buf_d[j] = d
+            buf_c[j] = c
+            n += 1
+    total = 0.0
+    left = OUTPUT_LIMIT
+    for i in range(n):
+        take = min(left, buf_c[i])
+        total = total + take * buf_d[i]
+        left -= take
+        if left <= 0:
+            break
+    return total
+
+@_kernel
+def _mitigation(ar, bld, si):
+    mit = 0.0
+    n = ar.curve_len[si]
+    if n > 0:
+        h = bld[si]
+        if h >= ar.hps[si, 0] - 1e-9:
+            k = 0
+            while k < n and ar.ends[si, k] <= h:
+                k += 1
+            kk = min(k, n - 1)
+            if k < n and ar.partial_lv[si, kk]:
+                partial = (0.2 + 0.8 * ((h - ar.starts[si, kk]) / ar.hps[si, kk])) * ar.mits[si, kk]
+                mit = ar.cum_mit[si, k] + partial
+            else:
+                mit = ar.cum_mit[si, k]
+    mit = mit + ar.core_add[si]
+    return min(mit, 1.0)
+
+@_kernel
+def _receive(ar, cnt, hp, bld, pot, g0, g1, total, amount):
+    """返回是否有 Group 受到伤害。"""
+    if total <= 0:
+        return False
+    for g in range(g0, g1):
+        amount[g] = pot[ar.armor[g]] * (cnt[g] / max(total, 1))
+    for si in range(len(ar.stack_start) - 1):
+        s0, s1 = ar.stack_start[si], ar.stack_start[si + 1]
+        if not ar.has_mit[si] or s1 <= g0 or s0 >= g1:
+            continue
+        m = 1.0 - _mitigation(ar, bld, si)
+        for g in range(max(s0, g0), min(s1, g1)):
+            amount[g] = amount[g] * m
+    hit = False
+    for g in range(g0, g1):
+        h = hp[g]
+        c = cnt[g]
+        am = amount[g]
+        if not (am > 0 and h > 0 and c > 0):
+            continue
+        hit = True
+        if h / (max(c, 1) * ar.max_hp[g]) < CASUALTY_THRESHOLD:
+            q = math.floor(am / (h / max(c, 1)))
+            c = c - np.int64(min(q, c))
+        h = h - min(h, am)
+        if h <= 1e-5:
+            hp[g] = 0.0
+            cnt[g] = 0
+        else:
+            hp[g] = 0.0 if c == 0 else h
+            cnt[g] = c
+    return hit
+
+@_kernel
+def _receive_army(ar, cnt, hp, bld, pot, b_dmg, siege, amount, alive_buf):
+    total = 0
+    for g in range(len(cnt)):
+        total += cnt[g]
+    if total <= 0:
+        return False
+    S = len(ar.stack_start) - 1
+    siege = siege and ar.has_bld.any()
+    if siege:
+        for si in range(S):
+            alive_buf[si] = _stack_alive(ar, cnt, hp, si)
+    hit = _receive(ar, cnt, hp, bld, pot, 0, len(cnt), total, amount)
+    if siege:
+        for si in range(S):
+            if ar.has_bld[si] and alive_buf[si]:
+                bld[si] = max(0.0, bld[si] - b_dmg)
+    return hit
+
+@_kernel
+def _clash(act, a_cnt, a_hp, a_bld, si, tgt, t_cnt, t_hp, t_bld, f_atk, f_def, ws):
+    """等价于 cow_vector._clash；返回 (攻方受伤, 守方受伤)。"""
+    if not _stack_alive(act, a_cnt, a_hp, si) or not _alive(tgt, t_cnt, t_hp):
+        return False, False
+    buf_d, buf_c, atk_pot, def_pot, a_amount, t_amount, alive_buf = ws
+    g0, g1 = act.stack_start[si], act.stack_start[si + 1]
+    for a in range(len(atk_pot)):
+        atk_pot[a] = 0.0
+        def_pot[a] = 0.0
+        if tgt.armor_set[a]:
+            atk_pot[a] = _output(act, a_cnt, a_hp, act.atk, a, g0, g1, buf_d, buf_c) * f_atk
+    siege = tgt.has_bld.any()
+    b_dmg = 0.0
+    if siege:
+        b_dmg = _output(act, a_cnt, a_hp, act.atk, BUILDING_IDX, g0, g1, buf_d, buf_c) * f_atk
+    for a in range(len(def_pot)):
+        if act.stack_armors[si, a]:
+            def_pot[a] = _output(tgt, t_cnt, t_hp, tgt.dfn, a, 0, len(t_cnt), buf_d, buf_c) * f_def
+    t_hit = _receive_army(tgt, t_cnt, t_hp, t_bld, atk_pot, b_dmg, siege, t_amount, alive_buf)
+    total = 0
+    for g in range(g0, g1):
+        total += a_cnt[g]
+    a_hit = _receive(act, a_cnt, a_hp, a_bld, def_pot, g0, g1, total, a_amount)
+    return a_hit, t_hit
+
+@_kernel
+def _air_strike(A, a_cnt, a_hp, a_bld, si, B, b_cnt, b_hp, b_bld, f_atk, f_def, ws):
+    """等价于 cow_vector._air_strike：防空先开火，飞机存活才投弹。"""
+    if not _stack_alive(A, a_cnt, a_hp, si) or not _alive(B, b_cnt, b_hp):
+        return False, False
+    buf_d, buf_c, atk_pot, def_pot, a_amount, b_amount, alive_buf = ws
+    g0, g1 = A.stack_start[si], A.stack_start[si + 1]
+    for a in range(len(def_pot)):
+        def_pot[a] = 0.0
+        if A.stack_armors[si, a]:
+            def_pot[a] = _output(B, b_cnt, b_hp, B.dfn, a, 0, len(b_cnt), buf_d, buf_c) * f_def
+    total = 0
+    for g in range(g0, g1):
+        total += a_cnt[g]
+    a_hit = _receive(A, a_cnt, a_hp, a_bld, def_pot, g0, g1, total, a_amount)
+    if not _stack_alive(A, a_cnt, a_hp, si):
+        return a_hit, False
+    for a in range(len(atk_pot)):
+        atk_pot[a] = 0.0
+        if B.armor_set[a]:
+            atk_pot[a] = _output(A, a_cnt, a_hp, A.atk, a, g0, g1, buf_d, buf_c) * f_atk
+    siege = B.has_bld.any()
+    b_dmg = 0.0
+    if siege:
+        b_dmg = _output(A, a_cnt, a_hp, A.atk, BUILDING_IDX, g0, g1, buf_d, buf_c) * f_atk
+    b_hit = _receive_army(B, b_cnt, b_hp, b_bld, atk_pot, b_dmg, siege, b_amount, alive_buf)
+    return a_hit, b_hit
+
+@_kernel
+def _battle(A, B, mode, max_rounds, use_random, detect_stalemate, key, a_cnt, a_hp, a_bld, b_cnt, b_hp, b_bld,
+            ws, order, bld_prev):
+    """推进一场战斗 (状态数组原地修改)，返回回合数。"""
+    SA, SB = len(A.stack_start) - 1, len(B.stack_start) - 1
+    n = np.uint64(0)
+    for r in range(1, max_rounds + 1):
+        if not _alive(A, a_cnt, a_hp) or not _alive(B, b_cnt, b_hp):
+            return r - 1
+        if detect_stalemate:
+            for si in range(SA):
+                bld_prev[si] = a_bld[si]
+            for si in range(SB):
+                bld_prev[SA + si] = b_bld[si]
+        f_atk = 1.0
+        f_def = 1.0
+        if use_random:
+            f_atk = _gauss(key, n)
+            f_def = _gauss(key, n + np.uint64(2))
+            n += np.uint64(4)
+
+        hit = False
+        if mode == 0:
+            for si in range(SA):
+                h1, h2 = _clash(A, a_cnt, a_hp, a_bld, si, B, b_cnt, b_hp, b_bld, f_atk, f_def, ws)
+                hit = hit or h1 or h2
+        elif mode == 1:
+            # 回合开始时存活的 Stack 按 A、B 交替排队
+            na = 0
+            for si in range(SA):
+                if _stack_alive(A, a_cnt, a_hp, si):
+                    order[na] = si
+                    na += 1
+            nb = 0
+            for si in range(SB):
+                if _stack_alive(B, b_cnt, b_hp, si):
+                    order[SA + nb] = si
+                    nb += 1
+            for i in range(max(na, nb)):
+                if i < na:
+                    h1, h2 = _clash(A, a_cnt, a_hp, a_bld, order[i], B, b_cnt, b_hp, b_bld, f_atk, f_def, ws)
+                    hit = hit or h1 or h2
+                if i < nb:
+                    h1, h2 = _clash(B, b_cnt, b_hp, b_bld, order[SA + i], A, a_cnt, a_hp, a_bld, f_atk, f_def, ws)
+                    hit = hit or h1 or h2
+        else:
+            for si in range(SA):
+                h1, h2 = _air_strike(A, a_cnt, a_hp, a_bld, si, B, b_cnt, b_hp, b_bld, f_atk, f_def, ws)
+                hit = hit or h1 or h2
+
+        if detect_stalemate and r < max_rounds and not hit:
+            # 不动点：无 Group 受伤且建筑 HP 未变，此后每回合都相同
+            same = True
+            for si in range(SA):
+                if a_bld[si] != bld_prev[si]: same = False
+            for si in range(SB):
+                if b_bld[si] != bld_prev[SA + si]: same = False
+            if same and _alive(A, a_cnt, a_hp) and _alive(B, b_cnt, b_hp):
+                return max_rounds
+    return max_rounds
+
+@njit(cache=True)
+def _run_trials(A, B, mode, max_rounds, use_random, detect_stalemate, zero_output, keys,
+                out_a_cnt, out_a_hp, out_a_bld, out_b_cnt, out_b_hp, out_b_bld, rounds):
+    GA, GB = len(A.init_count), len(B.init_count)
+    SA, SB = len(A.init_bld), len(B.init_bld)
+    G = max(GA, GB)
+    n_armor = A.atk.shape[1]
+    # 工作区：排序缓冲、潜在伤害、两方受伤量 (攻守对调时共用，按较大一方分配)、建筑存活标记
+    ws = (np.empty(G + 1), np.empty(G + 1, dtype=np.int64), np.empty(n_armor), np.empty(n_armor),
+          np.empty(G + 1), np.empty(G + 1), np.empty(max(SA, SB) + 1, dtype=np.bool_))
+    order = np.empty(SA + SB, dtype=np.int64)
+    bld_prev = np.empty(SA + SB)
+    # 逐试验状态，每个试验开始时从初始值重置
+    a_cnt, a_hp, a_bld = A.init_count.copy(), A.init_hp.copy(), A.init_bld.copy()
+    b_cnt, b_hp, b_bld = B.init_count.copy(), B.init_hp.copy(), B.init_bld.copy()
+    for t in range(len(keys)):
+        a_cnt[:] = A.init_count
+        a_hp[:] = A.init_hp
+        a_bld[:] = A.init_bld
+        b_cnt[:] = B.init_count
+        b_hp[:] = B.init_hp
+        b_bld[:] = B.init_bld
+        if zero_output:
+            both = _alive(A, a_cnt, a_hp) and _alive(B, b_cnt, b_hp)
+            rounds[t] = max_rounds if both else 0
+        else:
+            rounds[t] = _battle(A, B, mode, max_rounds, use_random, detect_stalemate, keys[t],
+                                a_cnt, a_hp, a_bld, b_cnt, b_hp, b_bld, ws, order, bld_prev)
+        out_a_cnt[:, t] = a_cnt
+        out_a_hp[:, t] = a_hp
+        out_a_bld[:, t] = a_bld
+        out_b_cnt[:, t] = b_cnt
+        out_b_hp[:, t] = b_hp
+        out_b_bld[:, t] = b_bld
+
+# ============================================================================
+# 3. 入口
+# ============================================================================
+
+def run_vector_battle(army_a: Army, army_b: Army, mode: BattleMode, trials: int, max_rounds: int = 50,
+                      use_random: bool = True, seed: Optional[int] = None,
+                      draw: Optional[Callable] = None, detect_stalemate: bool = True,
+                      first_trial: int = 0) -> VectorResult:
+    """
+    与 cow_vector.run_vector_battle 同接口、同结果 (VectorResult)，在编译内核中逐试验运行。
+    第 t 个试验使用随机流 (seed, first_trial + t)；不支持自定义 draw。
+    """
+    if draw is not None:
+        raise ValueError("jit engine only supports the built-in counter streams (draw=None)")
+    if not supports(army_a, army_b, mode):
+        raise ValueError("jit engine does not support split / air / targeted stacks; use run_simulation")
+    va = VectorArmy(army_a, trials)
+    vb = VectorArmy(army_b, trials)
+    seed = fresh_seed() if seed is None else seed
+    keys = np.array([stream_key(seed, t) for t in range(first_trial, first_trial + trials)], dtype=np.uint64)
+    zero = detect_stalemate and max_rounds > 0 and is_zero_output_matchup(army_a, army_b, mode)
+    rounds = np.zeros(trials, dtype=np.int64)
+    _run_trials(pack_army(va), pack_army(vb), MODE_CODES[mode], max_rounds, use_random, detect_stalemate, zero, keys,
+                va.count, va.hp, va.bld_hp, vb.count, vb.hp, vb.bld_hp, rounds)
+    return VectorResult(va, vb, rounds)
+
+# ============================================================================
+# 4. 标量对拍
+# ============================================================================
+
+def check_parity(make_armies: Callable[[], Tuple[Army, Army]], mode: BattleMode, trials: int = 8,
+                 max_rounds: int = 50, use_random: bool = True, seed: int = 0,
+                 rtol: float = 1e-9, atol: float = 1e-6) -> List[str]:
+    """逐试验与标量引擎 + CounterRNG(seed, t) 比较，返回不一致项 (空列表表示通过)。"""
+    errors = []
+    army_a, army_b = make_armies()
+    res = run_vector_battle(army_a, army_b, mode, trials, max_rounds, use_random, seed)
+    for t in range(trials):
+        sa, sb = make_armies()
+        rounds = run_simulation(sa, sb, mode, max_rounds, use_random, False, verbose=False,
+                                rng=CounterRNG(seed, t)).rounds
+        if rounds != res.rounds[t]:
+            errors.append(f"trial {t}: rounds scalar={rounds} jit={res.rounds[t]}")
+        for army, v in ((sa, res.army_a), (sb, res.army_b)):
+            groups = [g for s in army.stacks for g in s.groups]
+            for gi, g in enumerate(groups):
+                if g.count != v.count[gi, t]:
+                    errors.append(f"trial {t}: {v.labels[gi]} count scalar={g.count} jit={v.count[gi, t]}")
+                if not np.isclose(g.current_hp, v.hp[gi, t], rtol=rtol, atol=atol):
+                    errors.append(f"trial {t}: {v.labels[gi]} hp scalar={g.current_hp} jit={v.hp[gi, t]}")
+            for si, s in enumerate(army.stacks):
+                if s.building and not np.isclose(s.building.current_hp, v.bld_hp[si, t], rtol=rtol, atol=atol):
+                    errors.append(f"trial {t}: [{s.name}] building hp scalar={s.building.current_hp} "
+                                  f"jit={v.bld_hp[si, t]}")
+    return errors
+
+def main(argv=None):
+    from run_battle import load_json
+    from cow_db import load_databases
+    from cow_vector import run_parity_scenarios
+    parser = argparse.ArgumentParser(description="numba 编译引擎与标量引擎逐试验对拍")
+    parser.add_argument("--config", default="battle_config.json", help="派生对拍场景的基础战斗配置")
+    args = parser.parse_args(argv)
+    u_db, b_db = load_databases("units.json", "buildings.json")
+    failed = run_parity_scenarios(check_parity, load_json(args.config), u_db, b_db)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,414 @@
+import sys
+import json
+import math
+import time
+import random
+import argparse
+from dataclasses import dataclass
+from statistics import NormalDist
+from typing import List, Dict, Optional, Tuple
+
+from cow_core import Army, BattleMode, BattleOutcome, run_simulation
+from cow_batch import count_outcomes, _vector_engine
+from cow_db import load_databases
+from cow_solver import wilson_interval, _split_total
+from run_battle import load_json, build_army
+
+# ============================================================================
+# 1. 成本与预算
+# ============================================================================
+# 成本表与 units.json 放在一起：{单位 id: {资源: 数量}}，值为单个数字时视为不区分资源的总成本。
+# 预算按资源给出上限，"total" 限制全部资源之和；组合的成本 (优化目标) 为全部资源之和。
+
+DEFAULT_COSTS = "unit_costs.json"
+DEFAULT_TARGET = 0.9
+DEFAULT_POPULATION = 48
+DEFAULT_ELITE = 0.2
+DEFAULT_GENERATIONS = 30
+DEFAULT_PATIENCE = 4
+DEFAULT_BATCH = 128
+DEFAULT_MAX_TRIALS = 2048
+SMOOTHING = 0.7             # 交叉熵更新时新精英统计量的权重
+MIN_SIGMA = 1.0             # 数量分布标准差下限，避免过早收敛到单点
+MIN_STACK_PROB = 0.02
+MAX_COLUMNS = 1 << 16       # 单次向量运行的最大列数 (变体数 x 试验数)
+
+def load_costs(path: str) -> Dict[str, Dict[str, float]]:
+    raw = load_json(path)
+    return {uid: ({"total": float(v)} if isinstance(v, (int, float)) else {k: float(x) for k, x in v.items()})
+            for uid, v in raw.items()}
+
+def parse_budget(specs: List[str]) -> Dict[str, float]:
+    """"50000" (总量) 或 "资源=上限"，可多次给出。"""
+    limits = {}
+    for spec in specs:
+        res, sep, raw = spec.partition("=")
+        if sep:
+            limits[res.strip()] = float(raw)
+        else:
+            limits["total"] = float(res)
+    return limits
+
+def _spend(counts, costs: List[Dict[str, float]]) -> Dict[str, float]:
+    spend: Dict[str, float] = {}
+    for c, cost in zip(counts, costs):
+        if c:
+            for res, x in cost.items():
+                spend[res] = spend.get(res, 0.0) + c * x
+    return spend
+
+def _affordable(spend: Dict[str, float], limits: Dict[str, float]) -> float:
+    """预算可容纳的倍数：组合乘以该系数后恰好用满最紧的一项资源。"""
+    scale = math.inf
+    for res, limit in limits.items():
+        used = sum(spend.values()) if res == "total" else spend.get(res, 0.0)
+        if used > 0:
+            scale = min(scale, limit / used)
+    return scale
+
+def _budget_scale(spend: Dict[str, float], limits: Dict[str, float]) -> float:
+    """把组合按比例缩小到预算内所需的系数 (已在预算内时为 1)。"""
+    return min(1.0, _affordable(spend, limits))
+
+# ============================================================================
+# 2. 候选组合
+# ============================================================================
+
+@dataclass(frozen=True)
+class Composition:
+    counts: Tuple[int, ...]     # 与单位池对应的各单位总数
+    stacks: int                 # 平均拆分到的 Stack 数
+
+    def team(self, pool: List[str], name: str = "A队", template: Optional[dict] = None) -> dict:
+        """
+        展开为 build_army 可用的 team 配置。各单位按最大余数法平均分到各 Stack；
+        数量为 0 的单位也保留 (不影响战斗)，使同一 Stack 数的候选结构一致，可作为变体批量运行。
+        template 为 Stack 模板 (核心 / 建筑 / Split 等键及单位条目的 terrain_bonus)。
+        """
+        template = template or {}
+        stack_keys = {k: v for k, v in template.items() if k not in ("name", "units")}
+        units = template.get("units") or [{}]
+        unit_keys = {k: units[0][k] for k in ("terrain_bonus", "hp_ratio") if k in units[0]}
+        shares = [1.0 / self.stacks] * self.stacks
+        split = [_split_total(c, shares) for c in self.counts]
+        stacks = []
+        for si in range(self.stacks):
+            stacks.append(dict(stack_keys, name=f"Stack {si + 1}",
+                               units=[dict(unit_keys, id=uid, count=split[k][si]) for k, uid in enumerate(pool)]))
+        return {"name": name, "stacks": stacks}
+
+    def describe(self, pool: List[str]) -> str:
+        mix = ", ".join(f"{uid} x{c}" for uid, c in zip(pool, self.counts) if c)
+        return f"{mix or '(empty)'} / {self.stacks} stack{'s' if self.stacks > 1 else ''}"
+
+@dataclass
+class Candidate:
+    comp: Composition
+    cost: float
+    spend: Dict[str, float]
+    wins: int = 0
+    trials: int = 0
+    passed: Optional[bool] = None
+    pruned: str = ""            # "cost" (不比已知最优便宜) / "dominated" (不多于某个已失败的组合)
+
+    @property
+    def win_prob(self) -> float:
+        return self.wins / self.trials if self.trials else 0.0
+
+@dataclass
+class OptimizeResult:
+    best: Optional[Candidate]
+    leaderboard: List[Candidate]
+    generations: int
+    stop_reason: str            # "stable" (排名稳定) / "max_generations"
+    evaluated: int              # 实际模拟过的不同组合数
+    cache_hits: int             # 重复抽到、直接复用结果的次数
+    pruned: int
+    trials_used: int
+    seconds: float
+
+def _rank_key(c: Candidate) -> tuple:
+    """达标的按成本从低到高；未达标的按胜率从高到低；被剪枝的排在最后。"""
+    if c.pruned:
+        return (2, c.cost)
+    if c.passed:
+        return (0, c.cost)
+    return (1, -c.win_prob, c.cost)
+
+# ============================================================================
+# 3. 优化器
+# ============================================================================
+
+class CompositionOptimizer:
+    """
+    交叉熵搜索满足目标胜率的最便宜组合。每代按当前分布 (各单位数量 ~ 截断正态，Stack 数 ~ 分类分布)
+    抽样一批候选，超预算的按比例缩小；评估后取精英更新分布。
+
+    评估与 cow_solver.ForceSolver 相同：逐批加测，Wilson 区间完全落在目标一侧即停止，
+    所有候选的第 t 个试验使用同一随机流 (公共随机数)。同一 Stack 数的候选结构一致，
+    作为 cow_vector 的变体一起推进；不支持时逐个调用 count_outcomes。
+    结果按组合缓存，重复抽到的组合不再模拟。两种廉价的剪枝代替模拟：
+    成本不低于已知最优的候选不可能更优；各单位数量都不多于某个已失败组合的候选
+    (假设兵力增加不会降低胜率，同 ForceSolver) 视为失败。
+    """
+
+    def __init__(self, conf: dict, units_db, buildings_db, costs: Dict[str, Dict[str, float]],
+                 budget: Dict[str, float], pool: Optional[List[str]] = None, target: float = DEFAULT_TARGET,
+                 confidence: float = 0.95, max_stacks: int = 4, population: int = DEFAULT_POPULATION,
+                 elite: float = DEFAULT_ELITE, batch: int = DEFAULT_BATCH, max_trials: int = DEFAULT_MAX_TRIALS,
+                 seed: int = 0, engine: str = "auto"):
+        self.conf = conf
+        self.units_db, self.buildings_db = units_db, buildings_db
+        self.pool = pool or [uid for uid in units_db if uid in costs]
+        missing = [uid for uid in self.pool if uid not in costs or uid not in units_db]
+        if missing:
+            raise ValueError(f"units without cost entry or unknown to the database: {missing}")
+        if not budget:
+            raise ValueError("budget is required")
+        self.costs = [costs[uid] for uid in self.pool]
+        self.budget = budget
+        self.mode = BattleMode(conf.get("battle_mode", "LAND_ATTACK"))
+        self.max_rounds = conf.get("max_rounds", 50)
+        self.use_random = conf.get("enable_randomness", True)
+        self.siege = conf.get("siege_damage", True)
+        team_a = conf.get("team_a", {})
+        self.team_name = team_a.get("name", "A队")
+        self.template = (team_a.get("stacks") or [None])[0]
+
+        self.target = target
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self.max_stacks = max_stacks
+        self.population = population
+        self.n_elite = max(2, math.ceil(population * elite))
+        self.batch = batch
+        self.max_trials = max_trials
+        self.seed = seed
+        self.engine = engine
+        self.rng = random.Random(seed)
+
+        # 初始分布：预算平均分给各单位
+        n = len(self.pool)
+        alone = [_affordable(_spend([1], [cost]), budget) for cost in self.costs]
+        self.mu = [max(1.0, min(a, 1e6) / n) for a in alone]
+        self.sigma = [max(MIN_SIGMA, m) for m in self.mu]
+        self.stack_probs = [1.0 / max_stacks] * max_stacks
+
+        self.cache: Dict[Composition, Candidate] = {}
+        self.failed: Dict[int, List[Tuple[int, ...]]] = {}
+        self.best: Optional[Candidate] = None
+        self.cache_hits = 0
+        self.pruned = 0
+
+    # ------------------------------------------------------------------
+    # 抽样
+    # ------------------------------------------------------------------
+
+    def _sample(self) -> Composition:
+        counts = [max(0, round(self.rng.gauss(m, s))) for m, s in zip(self.mu, self.sigma)]
+        if not any(counts):
+            counts[self.rng.randrange(len(counts))] = 1
+        scale = _budget_scale(_spend(counts, self.costs), self.budget)
+        if scale < 1.0:
+            counts = [int(c * scale) for c in counts]
+        stacks = self.rng.choices(range(1, self.max_stacks + 1), weights=self.stack_probs)[0]
+        return Composition(tuple(counts), max(1, min(stacks, sum(counts))))
+
+    def _update(self, elites: List[Candidate]):
+        a = SMOOTHING
+        for k in range(len(self.pool)):
+            vals = [c.comp.counts[k] for c in elites]
+            mean = sum(vals) / len(vals)
+            std = math.sqrt(sum((v - mean) ** 2 for v in vals) / len(vals))
+            self.mu[k] = a * mean + (1 - a) * self.mu[k]
+            self.sigma[k] = max(MIN_SIGMA, a * std + (1 - a) * self.sigma[k])
+        freq = [0.0] * self.max_stacks
+        for c in elites:
+            freq[c.comp.stacks - 1] += 1.0 / len(elites)
+        probs = [max(MIN_STACK_PROB, a * f + (1 - a) * p) for f, p in zip(freq, self.stack_probs)]
+        self.stack_probs = [p / sum(probs) for p in probs]
+
+    # ------------------------------------------------------------------
+    # 评估
+    # ------------------------------------------------------------------
+
+    def _armies(self, comp: Composition) -> Tuple[Army, Army]:
+        team = comp.team(self.pool, self.team_name, self.template)
+        return (build_army(team, self.units_db, self.buildings_db),
+                build_army(self.conf["team_b"], self.units_db, self.buildings_db))
+
+    def _prune(self, cand: Candidate) -> str:
+        if self.best is not None and cand.cost >= self.best.cost:
+            return "cost"
+        counts = cand.comp.counts
+        for f in self.failed.get(cand.comp.stacks, ()):
+            if all(c <= x for c, x in zip(counts, f)):
+                return "dominated"
+        return ""
+
+    def _simulate(self, cands: List[Candidate], trials: int):
+        """每个候选追加 trials 次试验 (第 cand.trials 个试验起)。"""
+        if not self.use_random:
+            want = BattleOutcome.A_WIN
+            for c in cands:
+                army_a, army_b = self._armies(c.comp)
+                res = run_simulation(army_a, army_b, self.mode, self.max_rounds, False, False, verbose=False,
+                                     siege_damage=self.siege)
+                c.wins, c.trials = int(res.outcome == want), 1
+            return
+        vec = _vector_engine() if self.engine in ("auto", "vector") and self.siege else None
+        groups: Dict[Tuple[int, int], List[Candidate]] = {}
+        for c in cands:
+            groups.setdefault((c.comp.stacks, c.trials), []).append(c)
+        for (_, first), group in groups.items():
+            pairs = [self._armies(c.comp) for c in group]
+            if vec is not None and vec.supports_variants(pairs, self.mode):
+                step = max(1, MAX_COLUMNS // trials)
+                for i in range(0, len(group), step):
+                    res = vec.run_vector_variants(pairs[i:i + step], self.mode, trials, self.max_rounds,
+                                                  seed=self.seed, first_trial=first)
+                    wins = (res.a_alive & ~res.b_alive).reshape(-1, trials).sum(axis=1)
+                    for c, w in zip(group[i:i + step], wins.tolist()):
+                        c.wins += w
+                        c.trials += trials
+                continue
+            if self.engine == "vector":
+                raise RuntimeError("vector engine unavailable for these candidates")
+            for c, (army_a, army_b) in zip(group, pairs):
+                wins, _, _ = count_outcomes(army_a, army_b, self.mode, trials, self.max_rounds, self.seed,
+                                            self.engine, first, self.siege)
+                c.wins += wins
+                c.trials += trials
+
+    def evaluate(self, cands: List[Candidate]):
+        """逐批加测直到每个候选都有定论 (或达到 max_trials)，比较便宜的候选先定论以尽早收紧成本剪枝。"""
+        pending = sorted((c for c in cands if c.passed is None), key=lambda c: c.cost)
+        while pending:
+            self._simulate(pending, self.batch if self.use_random else 1)
+            for c in pending:
+                lo, hi = wilson_interval(c.wins, c.trials, self.z)
+                if not self.use_random:
+                    c.passed = c.wins == 1
+                elif lo >= self.target:
+                    c.passed = True
+                elif hi < self.target:
+                    c.passed = False
+                elif c.trials >= self.max_trials:
+                    c.passed = c.win_prob >= self.target
+                if c.passed:
+                    if self.best is None or c.cost < self.best.cost:
+                        self.best = c
+                elif c.passed is False:
+                    self.failed.setdefault(c.comp.stacks, []).append(c.comp.counts)
+            pending = [c for c in pending if c.passed is None]
+            # 本轮出现更便宜的达标组合后，剩余候选可能已不必继续
+            for c in pending:
+                c.pruned = self._prune(c)
+                if c.pruned:
+                    self.pruned += 1
+            pending = [c for c in pending if not c.pruned]
+
+    # ------------------------------------------------------------------
+    # 主循环
+    # ------------------------------------------------------------------
+
+    def run(self, generations: int = DEFAULT_GENERATIONS, patience: int = DEFAULT_PATIENCE) -> OptimizeResult:
+        t0 = time.perf_counter()
+        stable, last_top, stop = 0, None, "max_generations"
+        gen = 0
+        for gen in range(1, generations + 1):
+            batch, fresh = [], []
+            for _ in range(self.population):
+                comp = self._sample()
+                cand = self.cache.get(comp)
+                if cand is not None:
+                    self.cache_hits += 1
+                    if cand not in batch:
+                        batch.append(cand)
+                    continue
+                spend = _spend(comp.counts, self.costs)
+                cand = self.cache[comp] = Candidate(comp, sum(spend.values()), spend)
+                cand.pruned = self._prune(cand)
+                if cand.pruned:
+                    self.pruned += 1
+                else:
+                    fresh.append(cand)
+                batch.append(cand)
+            self.evaluate(fresh)
+            batch.sort(key=_rank_key)
+            self._update(batch[:self.n_elite])
+
+            # 排名稳定：全局前 n_elite 名连续 patience 代不变
+            top = tuple(c.comp for c in self.leaderboard(self.n_elite))
+            stable = stable + 1 if top == last_top else 0
+            last_top = top
+            if self.best is not None and stable >= patience:
+                stop = "stable"
+                break
+        return OptimizeResult(self.best, self.leaderboard(), gen, stop,
+                              sum(1 for c in self.cache.values() if c.trials), self.cache_hits, self.pruned,
+                              sum(c.trials for c in self.cache.values()), time.perf_counter() - t0)
+
+    def leaderboard(self, n: Optional[int] = None) -> List[Candidate]:
+        ranked = sorted((c for c in self.cache.values() if not c.pruned and c.passed is not None), key=_rank_key)
+        return ranked if n is None else ranked[:n]
+
+    def battle_config(self, cand: Candidate) -> dict:
+        """以候选组合替换 team_a 的完整战斗配置，可直接交给 run_battle。"""
+        conf = dict(self.conf)
+        conf["team_a"] = cand.comp.team(self.pool, self.team_name, self.template)
+        return conf
+
+def optimize_composition(conf: dict, units_db, buildings_db, costs, budget, generations: int = DEFAULT_GENERATIONS,
+                         patience: int = DEFAULT_PATIENCE, **kwargs) -> OptimizeResult:
+    return CompositionOptimizer(conf, units_db, buildings_db, costs, budget, **kwargs).run(generations, patience)
+
+# ============================================================================
+# 4. 命令行
+# ============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="在资源预算内搜索达到目标胜率的最便宜组合 (交叉熵搜索)")
+    parser.add_argument("--config", default="battle_config.json", help="战斗配置 (使用其中的 team_b 与战斗参数)")
+    parser.add_argument("--costs", default=DEFAULT_COSTS, help="单位成本表")
+    parser.add_argument("--budget", action="append", required=True,
+                        help="预算，可重复：总量 (如 50000) 或 资源=上限 (如 oil=8000)")
+    parser.add_argument("--unit", action="append", default=None, help="候选单位 id (可重复，默认成本表中的全部单位)")
+    parser.add_argument("--target", type=float, default=DEFAULT_TARGET, help="目标胜率")
+    parser.add_argument("--confidence", type=float, default=0.95, help="置信度")
+    parser.add_argument("--max-stacks", type=int, default=4, help="最多拆分的 Stack 数")
+    parser.add_argument("--population", type=int, default=DEFAULT_POPULATION, help="每代候选数")
+    parser.add_argument("--elite", type=float, default=DEFAULT_ELITE, help="精英比例")
+    parser.add_argument("--generations", type=int, default=DEFAULT_GENERATIONS, help="最大代数")
+    parser.add_argument("--patience", type=int, default=DEFAULT_PATIENCE, help="排名连续不变多少代后停止")
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH, help="每批 Monte Carlo 次数")
+    parser.add_argument("--max-trials", type=int, default=DEFAULT_MAX_TRIALS, help="单个候选的最大试验次数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engine", choices=["auto", "scalar", "vector", "jit"], default="auto")
+    parser.add_argument("--top", type=int, default=5, help="打印排名前几的组合")
+    parser.add_argument("--out", default=None, help="把最优组合写成完整战斗配置")
+    args = parser.parse_args(argv)
+
+    conf = load_json(args.config)
+    units_db, buildings_db = load_databases("units.json", "buildings.json")
+    opt = CompositionOptimizer(conf, units_db, buildings_db, load_costs(args.costs), parse_budget(args.budget),
+                               args.unit, args.target, args.confidence, args.max_stacks, args.population,
+                               args.elite, args.batch, args.max_trials, args.seed, args.engine)
+    res = opt.run(args.generations, args.patience)
+
+    print(f"=== {res.generations} generations ({res.stop_reason}), {res.evaluated} compositions simulated, "
+          f"{res.cache_hits} cache hits, {res.pruned} pruned, {res.trials_used} trials, {res.seconds:.2f} s ===")
+    for i, c in enumerate(res.leaderboard[:args.top], 1):
+        spend = " ".join(f"{k}={v:g}" for k, v in sorted(c.spend.items()))
+        print(f"  {i:>2}. {'PASS' if c.passed else 'FAIL'} {c.win_prob*100:6.2f}% ({c.wins}/{c.trials}) "
+              f"cost {c.cost:>9.0f} | {c.comp.describe(opt.pool)} | {spend}")
+    if res.best is None:
+        print(f"预算内未找到胜率达到 {args.target*100:.1f}% 的组合")
+        return 1
+    print(f"最便宜组合: {res.best.comp.describe(opt.pool)} | 成本 {res.best.cost:.0f} | 胜率 {res.best.win_prob*100:.2f}%")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(opt.battle_config(res.best), f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
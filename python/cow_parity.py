@@ -0,0 +1,371 @@
+import os
+import sys
+import json
+import copy
+import random
+import shutil
+import argparse
+import subprocess
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional, Tuple
+
+from cow_core import BattleMode, run_simulation
+from cow_db import UnitDatabase, BuildingDatabase
+from run_battle import load_json, build_army
+
+# ============================================================================
+# 1. 配置
+# ============================================================================
+# 把同一份配置分别交给网页版引擎 (docs/js/engine.js，在 Node 中运行) 和 Python 引擎，
+# 逐回合比较双方每个 Group 的数量与 HP 以及建筑 HP。
+#   - 网页版没有攻城伤害，Python 侧以 siege_damage=False 运行；
+#   - 两边都逐回合完整推进 (Python 侧关闭僵局检测)；
+#   - 开启随机时两边回放同一串高斯值 (网页版的 randomGauss 被替换)，不依赖各自的随机数实现。
+
+DOCS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "docs")
+ENGINE_JS = os.path.join(DOCS_DIR, "js", "engine.js")
+EXAMPLES_JS = os.path.join(DOCS_DIR, "data", "examples.js")
+
+# Node 端驱动：每个 case 在独立的 vm 上下文中加载 engine.js，
+# 通过替换全局函数 buildArmy / log / randomGauss 取得 Army 引用、逐回合状态与随机数。
+JS_DRIVER = r"""
+const fs = require('fs');
+const vm = require('vm');
+const input = JSON.parse(fs.readFileSync(0, 'utf8'));
+
+function loadExamples(path) {
+    const ctx = vm.createContext({ window: {} });
+    vm.runInContext(fs.readFileSync(path, 'utf8'), ctx);
+    return ctx.window.COW_EXAMPLES;
+}
+
+function armyState(army) {
+    return {
+        groups: [].concat(...army.stacks.map(s => s.groups.map(g => [g.count, g.current_hp]))),
+        buildings: army.stacks.filter(s => s.building).map(s => s.building.current_hp),
+    };
+}
+
+function runCase(src, c) {
+    // detailed_output 会打开 engine.js 的调试日志 (console.log)，这里丢弃以免污染 stdout
+    const ctx = vm.createContext({ I18N: null, console: { log() {}, warn() {}, error() {} } });
+    vm.runInContext(src, ctx);
+    const armies = [], rounds = [];
+    const build = ctx.buildArmy;
+    ctx.buildArmy = (...args) => { const a = build(...args); armies.push(a); return a; };
+    let summaries = 0;
+    ctx.log = (key, params) => {
+        // 每回合末尾依次为 A、B 各输出一行 summary
+        if (key === 'summary' && ++summaries % 2 === 0) {
+            rounds.push({ a: armyState(armies[0]), b: armyState(armies[1]) });
+        }
+        return key;
+    };
+    let i = 0;
+    ctx.randomGauss = (mu, sigma) => {
+        if (i >= c.gauss.length) throw new Error('gauss sequence exhausted');
+        return c.gauss[i++];
+    };
+    ctx.runEngine(c.units, c.buildings, c.conf.team_a, c.conf.team_b, c.conf);
+    return { rounds: rounds, draws: i };
+}
+
+let out;
+if (input.op === 'examples') {
+    out = loadExamples(input.path);
+} else {
+    const src = fs.readFileSync(input.engine, 'utf8');
+    out = input.cases.map(c => {
+        try { return runCase(src, c); }
+        catch (e) { return { error: String(e && e.stack || e) }; }
+    });
+}
+process.stdout.write(JSON.stringify(out));
+"""
+
+class NodeUnavailable(RuntimeError):
+    pass
+
+def _node(payload: dict, node: Optional[str] = None) -> object:
+    node = node or shutil.which("node")
+    if node is None:
+        raise NodeUnavailable("node executable not found")
+    proc = subprocess.run([node, "-e", JS_DRIVER], input=json.dumps(payload), capture_output=True,
+                          text=True, encoding="utf-8")
+    if proc.returncode != 0:
+        raise RuntimeError(f"node driver failed:\n{proc.stderr}")
+    return json.loads(proc.stdout)
+
+def load_examples(path: str = EXAMPLES_JS, node: Optional[str] = None) -> dict:
+    """读取 docs/data/examples.js 中的 COW_EXAMPLES (units / buildings / scenarios)。"""
+    return _node({"op": "examples", "path": os.path.abspath(path)}, node)
+
+# ============================================================================
+# 2. 对拍用例
+# ============================================================================
+
+@dataclass
+class ParityCase:
+    name: str
+    conf: dict
+    units: dict         # 原始 JSON 数据库，两边共用
+    buildings: dict
+    gauss: List[float] = field(default_factory=list)
+
+@dataclass
+class ParityResult:
+    name: str
+    rounds: int = 0
+    errors: List[str] = field(default_factory=list)
+    skipped: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.skipped is None and not self.errors
+
+def known_gap(conf: dict) -> Optional[str]:
+    """两边规则本就不同、无法逐回合对拍的配置，返回原因。"""
+    teams = [conf.get("team_a", {}), conf.get("team_b", {})]
+    for team in teams:
+        stacks = team.get("stacks", []) if "units" not in team else [team]
+        for s in stacks:
+            b = s.get("building")
+            if b and b.get("current_hp") is None and b.get("hp_ratio") not in (None, 1, 1.0):
+                return "building hp_ratio is ignored by engine.js"
+    if conf.get("battle_mode") == BattleMode.AIR_STRIKE.value:
+        team_a = teams[0]
+        if "units" in team_a or not all(s.get("is_airplane") for s in team_a.get("stacks", [])):
+            return "AIR_STRIKE treats every team_a stack as air only in the Python engine"
+    return None
+
+def make_case(name: str, conf: dict, units: dict, buildings: dict, seed: Optional[int] = None) -> ParityCase:
+    """开启随机的配置预先生成足够的高斯值 (每回合 2 个)，seed 为 None 时使用 0。"""
+    gauss = []
+    if conf.get("enable_randomness", True):
+        rng = random.Random(0 if seed is None else seed)
+        gauss = [rng.gauss(1.0, 0.1) for _ in range(2 * conf.get("max_rounds", 50))]
+    return ParityCase(name, conf, units, buildings, gauss)
+
+class _ReplayGauss:
+    """按顺序回放预先生成的高斯值，代替 rng.gauss。"""
+
+    def __init__(self, values: List[float]):
+        self.values = iter(values)
+
+    def gauss(self, mu: float, sigma: float) -> float:
+        return next(self.values)
+
+# ============================================================================
+# 3. 运行与比较
+# ============================================================================
+
+def _python_rounds(case: ParityCase, units_db: UnitDatabase, buildings_db: BuildingDatabase) -> List[dict]:
+    conf = case.conf
+    army_a = build_army(conf["team_a"], units_db, buildings_db)
+    army_b = build_army(conf["team_b"], units_db, buildings_db)
+    res = run_simulation(army_a, army_b, BattleMode(conf.get("battle_mode", "LAND_ATTACK")),
+                         conf.get("max_rounds", 50), conf.get("enable_randomness", True), False,
+                         verbose=False, rng=_ReplayGauss(case.gauss), record_rounds=True,
+                         detect_stalemate=False, siege_damage=False)
+    return [{side: {"groups": [(g.count, g.current_hp) for g in st.groups],
+                    "buildings": [b.current_hp for b in st.buildings],
+                    "labels": [f"[{g.stack}] {g.name}" for g in st.groups]}
+             for side, st in (("a", snap.army_a), ("b", snap.army_b))}
+            for snap in res.snapshots]
+
+def _close(x: float, y: float, rtol: float, atol: float) -> bool:
+    return abs(x - y) <= atol + rtol * abs(y)
+
+def compare_rounds(py: List[dict], js: List[dict], rtol: float = 1e-9, atol: float = 1e-6,
+                   max_errors: int = 10) -> List[str]:
+    """逐回合比较，返回不一致项 (空列表表示一致)。数量必须相等，HP 按容差比较。"""
+    errors = []
+    if len(py) != len(js):
+        errors.append(f"rounds python={len(py)} js={len(js)}")
+    for r, (p, j) in enumerate(zip(py, js), start=1):
+        for side in ("a", "b"):
+            ps, js_side = p[side], j[side]
+            for label, (pc, ph), (jc, jh) in zip(ps["labels"], ps["groups"], js_side["groups"]):
+                if pc != jc:
+                    errors.append(f"round {r}: team_{side} {label} count python={pc} js={jc}")
+                if not _close(ph, jh, rtol, atol):
+                    errors.append(f"round {r}: team_{side} {label} hp python={ph!r} js={jh!r}")
+            for bi, (pb, jb) in enumerate(zip(ps["buildings"], js_side["buildings"])):
+                if not _close(pb, jb, rtol, atol):
+                    errors.append(f"round {r}: team_{side} building #{bi} hp python={pb!r} js={jb!r}")
+        if errors:
+            # 第一处分歧之后的差异都是连带的，只报告到该回合为止
+            break
+    return errors[:max_errors]
+
+def run_parity(cases: List[ParityCase], engine_path: str = ENGINE_JS, node: Optional[str] = None,
+               rtol: float = 1e-9, atol: float = 1e-6) -> List[ParityResult]:
+    """一次 Node 调用跑完全部用例，再逐个与 Python 引擎比较。"""
+    results = [ParityResult(c.name, skipped=known_gap(c.conf)) for c in cases]
+    todo = [(c, r) for c, r in zip(cases, results) if r.skipped is None]
+    payload = {"op": "run", "engine": os.path.abspath(engine_path),
+               "cases": [{"conf": c.conf, "units": c.units, "buildings": c.buildings, "gauss": c.gauss}
+                         for c, _ in todo]}
+    js_out = _node(payload, node) if todo else []
+
+    db_cache: Dict[Tuple[int, int], Tuple[UnitDatabase, BuildingDatabase]] = {}
+    for (case, res), js in zip(todo, js_out):
+        if "error" in js:
+            res.errors.append(f"engine.js raised: {js['error'].splitlines()[0]}")
+            continue
+        key = (id(case.units), id(case.buildings))
+        if key not in db_cache:
+            db_cache[key] = (UnitDatabase(case.units), BuildingDatabase(case.buildings))
+        py = _python_rounds(case, *db_cache[key])
+        res.rounds = len(js["rounds"])
+        res.errors = compare_rounds(py, js["rounds"], rtol, atol)
+    return results
+
+# ============================================================================
+# 4. 场景
+# ============================================================================
+
+def example_cases(examples: dict, seeds: int = 0) -> List[ParityCase]:
+    """examples.js 中的全部场景；seeds > 0 时另外以随机模式各跑 seeds 次。"""
+    cases = []
+    for sc in examples["scenarios"]:
+        conf = sc["data"]
+        cases.append(make_case(sc["name"], conf, examples["units"], examples["buildings"]))
+        for seed in range(seeds):
+            rnd = dict(conf, enable_randomness=True)
+            cases.append(make_case(f"{sc['name']} (seed {seed})", rnd, examples["units"], examples["buildings"], seed))
+    return cases
+
+def flag_scenarios(conf: dict) -> List[Tuple[str, dict]]:
+    """
+    在给定配置基础上派生出覆盖 Split / 远程 / 空军 / 巡逻 / 手动目标 / 停在地面的空军的场景
+    (单位 id 取自仓库自带的 units.json)。
+    """
+    base = copy.deepcopy(conf)
+    a_stacks = base["team_a"].setdefault("stacks", [])
+    b_stacks = base["team_b"].setdefault("stacks", [])
+    scenarios = [("config", copy.deepcopy(base))]
+
+    # B 方：前排带掩体；后排远程 + 指定目标的装甲车 + 未指定目标、被动防守时停在地面的轰炸机
+    b = copy.deepcopy(base)
+    if b_stacks:
+        b["team_b"]["stacks"][0]["building"] = {"id": "Bunker", "level": 3}
+    b["team_b"]["stacks"] += [
+        {"name": "B Artillery", "split": True,
+         "units": [{"id": "Infantry_Lvl1", "count": 60, "ranged": True}]},
+        {"name": "B Raiders", "target": a_stacks[-1]["name"] if a_stacks else "",
+         "units": [{"id": "Allies_Armored_Car_Lvl1", "count": 20}]},
+        {"name": "B Parked Wing", "is_airplane": True, "target": "",
+         "units": [{"id": "Allies_Tactical_Bomber_Lvl1", "count": 6}]},
+    ]
+    # A 方：巡逻的空军直奔停机坪，另有一个超远程后排
+    b["team_a"]["stacks"] += [
+        {"name": "A Patrol", "is_airplane": True, "patrol": True, "target": "B Parked Wing",
+         "units": [{"id": "Allies_Tactical_Bomber_Lvl1", "count": 10}]},
+        {"name": "A Guns", "split": True,
+         "units": [{"id": "Medium_Tank_Lvl1", "count": 15, "ultra_ranged": True},
+                   {"id": "Infantry_Lvl1", "count": 30}]},
+    ]
+    for mode in (BattleMode.LAND_ATTACK, BattleMode.LAND_MEET):
+        c = copy.deepcopy(b)
+        c["battle_mode"] = mode.value
+        scenarios.append((f"flags {mode.value}", c))
+
+    # 双方都有在空中的空军：地面部队打不到，只能互相缠斗
+    air = copy.deepcopy(b)
+    air["battle_mode"] = BattleMode.LAND_MEET.value
+    for s in air["team_b"]["stacks"]:
+        if s.get("is_airplane"):
+            s["target"] = "A Patrol"
+    scenarios.append(("flags air-to-air", air))
+
+    # 巡逻的空军不指定目标，按默认优先级自行选择
+    free = copy.deepcopy(b)
+    free["battle_mode"] = BattleMode.LAND_ATTACK.value
+    for s in free["team_a"]["stacks"]:
+        if s.get("patrol"):
+            s["target"] = ""
+    scenarios.append(("flags free patrol", free))
+
+    # 双方都有 Split 的远程 / 超远程后排，B 方手动目标指向 A 方的后排；
+    # 前排耗尽后只剩双方后排，对拍一直持续到回合上限
+    duel = copy.deepcopy(b)
+    duel["battle_mode"] = BattleMode.LAND_MEET.value
+    duel["team_b"]["stacks"].append({"name": "B Guns", "split": True,
+                                     "units": [{"id": "Medium_Tank_Lvl1", "count": 12, "ultra_ranged": True}]})
+    for s in duel["team_b"]["stacks"]:
+        if s["name"] == "B Raiders":
+            s["target"] = "A Guns"
+    scenarios.append(("flags split duel", duel))
+
+    strike = copy.deepcopy(base)
+    strike["battle_mode"] = BattleMode.AIR_STRIKE.value
+    for s in strike["team_a"]["stacks"]:
+        s["is_airplane"] = True
+        for u in s["units"]:
+            u["id"] = "Allies_Tactical_Bomber_Lvl1"
+    strike["team_b"]["stacks"].append({"name": "B Flak", "split": True,
+                                       "units": [{"id": "Allies_Armored_Car_Lvl1", "count": 25, "ranged": True}]})
+    scenarios.append(("flags AIR_STRIKE", strike))
+
+    # 空袭中的巡逻机：空对地攻击两次 (各半伤害)，每次都先承受防空
+    patrol = copy.deepcopy(strike)
+    patrol["team_a"]["stacks"][0]["patrol"] = True
+    scenarios.append(("flags AIR_STRIKE patrol", patrol))
+    return scenarios
+
+def config_cases(conf: dict, units: dict, buildings: dict, seeds: int = 0) -> List[ParityCase]:
+    cases = []
+    for label, c in flag_scenarios(conf):
+        c = dict(c, enable_randomness=False)
+        cases.append(make_case(label, c, units, buildings))
+        for seed in range(seeds):
+            cases.append(make_case(f"{label} (seed {seed})", dict(c, enable_randomness=True), units, buildings, seed))
+    return cases
+
+# ============================================================================
+# 5. CLI
+# ============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="网页版引擎 (engine.js) 与 Python 引擎逐回合对拍")
+    parser.add_argument("configs", nargs="*", help="额外的对战配置 (默认 battle_config.json)")
+    parser.add_argument("--engine", default=ENGINE_JS, help="engine.js 路径")
+    parser.add_argument("--examples", default=EXAMPLES_JS, help="examples.js 路径，传空串跳过")
+    parser.add_argument("--seeds", type=int, default=2, help="每个场景额外以随机模式运行的次数")
+    parser.add_argument("--node", default=None, help="node 可执行文件")
+    parser.add_argument("--units", default="units.json")
+    parser.add_argument("--buildings", default="buildings.json")
+    parser.add_argument("--verbose", action="store_true", help="列出每个不一致项")
+    args = parser.parse_args(argv)
+
+    try:
+        cases = []
+        if args.examples:
+            cases += example_cases(load_examples(args.examples, args.node), args.seeds)
+        units, buildings = load_json(args.units), load_json(args.buildings)
+        for path in args.configs or ["battle_config.json"]:
+            cases += [ParityCase(f"{os.path.basename(path)}: {c.name}", c.conf, c.units, c.buildings, c.gauss)
+                      for c in config_cases(load_json(path), units, buildings, args.seeds)]
+        results = run_parity(cases, args.engine, args.node)
+    except NodeUnavailable as e:
+        print(f"跳过对拍: {e}")
+        return 2
+
+    failed = 0
+    for res in results:
+        if res.skipped:
+            status = f"SKIP ({res.skipped})"
+        elif res.errors:
+            status = f"FAIL ({len(res.errors)})"
+            failed += 1
+        else:
+            status = f"OK   {res.rounds} rounds"
+        print(f"  {res.name[:56]:<56} {status}")
+        for e in res.errors[:None if args.verbose else 3]:
+            print(f"    - {e}")
+    print(f"{len(results)} cases, {failed} failed")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+import sys
+import json
+import time
+import tracemalloc
+from collections import defaultdict
+from dataclasses import dataclass, field, asdict
+from typing import List, Dict, Optional, Tuple
+
+import cow_core
+from cow_core import BattleReporter, add_global_reporter, remove_global_reporter
+
+# ============================================================================
+# 1. 被测阶段
+# ============================================================================
+# 启用时用计时包装替换这些函数/方法，退出时原样还原；未启用时引擎代码没有任何额外开销。
+# 模块级函数都在 cow_core 内部按模块全局名调用，替换模块属性即可生效。
+
+PHASES: List[Tuple[object, str, str]] = [
+    (cow_core, "get_interleaved_turn_order", "turn_order"),
+    (cow_core, "resolve_atomic_clash", "clash"),
+    (cow_core, "select_target", "select_target"),
+    (cow_core, "is_stack_grounded_plane", "grounded_plane"),
+    (cow_core, "_attack_map", "attack_map"),
+    (cow_core, "_defense_map", "defense_map"),
+    (cow_core.Army, "compute_army_blob_output", "army_output"),
+    (cow_core.Army, "receive_damage", "army.receive_damage"),
+    (cow_core.Army, "get_all_armor_types", "get_all_armor_types"),
+    (cow_core.Stack, "calculate_output", "calculate_output"),
+    (cow_core, "_distribute", "damage_distribution"),
+    (cow_core.Building, "get_current_mitigation", "get_current_mitigation"),
+    (cow_core, "is_zero_output_matchup", "zero_output_check"),
+    (cow_core, "_building_hps", "building_hps"),
+    (cow_core, "_side_untouched", "side_untouched"),
+    (cow_core, "steady_state_jump", "steady_state_jump"),
+    (cow_core, "capture_army_state", "capture_state"),
+    (cow_core.ConsoleReporter, "on_round_start", "console"),
+    (cow_core.ConsoleReporter, "on_round_end", "console"),
+    (cow_core.ConsoleReporter, "on_battle_end", "console"),
+]
+
+# ============================================================================
+# 2. 统计结构
+# ============================================================================
+
+@dataclass
+class PhaseStats:
+    calls: int = 0
+    total_s: float = 0.0    # 含子阶段
+    self_s: float = 0.0     # 不含子阶段
+
+@dataclass
+class BattleProfile:
+    rounds: int
+    clashes: int
+    seconds: float
+    alloc_peak_bytes: Optional[int] = None   # 仅在 allocations=True 时记录
+    alloc_net_blocks: Optional[int] = None
+
+@dataclass
+class ProfileReport:
+    wall_s: float
+    phases: Dict[str, PhaseStats]
+    battles: List[BattleProfile] = field(default_factory=list)
+
+    @property
+    def rounds(self) -> int:
+        return sum(b.rounds for b in self.battles)
+
+    @property
+    def clashes(self) -> int:
+        return sum(b.clashes for b in self.battles)
+
+    def summary(self) -> str:
+        lines = [f"=== Profile: {len(self.battles)} battles, {self.rounds} rounds, {self.clashes} clashes, "
+                 f"wall {self.wall_s*1000:.1f} ms ==="]
+        lines.append(f"  {'PHASE':<28} | {'CALLS':>9} | {'TOTAL ms':>10} | {'SELF ms':>10} | {'SELF %':>6} | {'us/call':>8}")
+        total_self = sum(p.self_s for p in self.phases.values()) or 1.0
+        for name, p in sorted(self.phases.items(), key=lambda kv: kv[1].self_s, reverse=True):
+            lines.append(f"  {name:<28} | {p.calls:>9} | {p.total_s*1000:>10.2f} | {p.self_s*1000:>10.2f} | "
+                         f"{p.self_s / total_self * 100:>5.1f}% | {p.total_s / max(p.calls, 1) * 1e6:>8.2f}")
+        peaks = [b.alloc_peak_bytes for b in self.battles if b.alloc_peak_bytes is not None]
+        if peaks:
+            blocks = [b.alloc_net_blocks for b in self.battles]
+            lines.append(f"  alloc peak / battle: mean {sum(peaks) / len(peaks) / 1024:.1f} KiB, "
+                         f"max {max(peaks) / 1024:.1f} KiB | net blocks mean {sum(blocks) / len(blocks):.1f}")
+        return "\n".join(lines)
+
+    def to_dict(self) -> dict:
+        return {"wall_s": self.wall_s, "battles": len(self.battles), "rounds": self.rounds,
+                "clashes": self.clashes, "phases": {k: asdict(v) for k, v in self.phases.items()},
+                "per_battle": [asdict(b) for b in self.battles]}
+
+# ============================================================================
+# 3. Profiler
+# ============================================================================
+
+class _BattleHook(BattleReporter):
+    """把每场战斗与每个回合记为调用栈上的一帧。"""
+
+    def __init__(self, prof: "Profiler"):
+        self.prof = prof
+
+    def on_battle_start(self, army_a, army_b, mode, use_random):
+        self.prof._battle_start()
+
+    def on_round_start(self, r, factor_atk, factor_def):
+        self.prof.rounds += 1
+        self.prof._enter("round")
+
+    def on_round_end(self, r, army_a, army_b):
+        self.prof._exit()
+
+    def on_battle_end(self, army_a, army_b, result):
+        self.prof._battle_end()
+
+class Profiler:
+    """
+    按阶段统计调用次数与耗时 (含/不含子阶段)，并记录每场战斗的回合数、交战次数，
+    可选记录每场战斗的内存峰值 (tracemalloc，开销较大)。用作上下文管理器:
+
+        with Profiler() as prof:
+            run_simulation(...)
+        print(prof.report().summary())
+
+    仅统计标量引擎；向量化引擎不经过这些函数。
+    """
+
+    _active: Optional["Profiler"] = None
+
+    def __init__(self, allocations: bool = False):
+        self.allocations = allocations
+        self.phases: Dict[str, PhaseStats] = defaultdict(PhaseStats)
+        self.folded: Dict[Tuple[str, ...], float] = defaultdict(float)
+        self.battles: List[BattleProfile] = []
+        self.rounds = 0
+        self._stack: List[list] = []     # [label, start, child_s]
+        self._path: List[str] = []
+        self._originals: List[Tuple[object, str, object]] = []
+        self._hook = _BattleHook(self)
+        self._battle = None
+        self._wall = 0.0
+
+    # ------------------------------------------------------------------
+    # 安装 / 卸载
+    # ------------------------------------------------------------------
+
+    def __enter__(self) -> "Profiler":
+        if Profiler._active is not None:
+            raise RuntimeError("another Profiler is already active")
+        Profiler._active = self
+        for owner, name, label in PHASES:
+            orig = owner.__dict__[name] if isinstance(owner, type) else getattr(owner, name)
+            self._originals.append((owner, name, orig))
+            setattr(owner, name, self._wrap(label, orig))
+        add_global_reporter(self._hook)
+        if self.allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._own_tracemalloc = True
+        else:
+            self._own_tracemalloc = False
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._wall = time.perf_counter() - self._wall
+        remove_global_reporter(self._hook)
+        for owner, name, orig in reversed(self._originals):
+            setattr(owner, name, orig)
+        self._originals.clear()
+        if self._own_tracemalloc:
+            tracemalloc.stop()
+        Profiler._active = None
+        return False
+
+    def _wrap(self, label: str, fn):
+        enter, leave = self._enter, self._exit
+
+        def timed(*args, **kwargs):
+            enter(label)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                leave()
+        timed.__wrapped__ = fn
+        return timed
+
+    # ------------------------------------------------------------------
+    # 计时栈
+    # ------------------------------------------------------------------
+
+    def _enter(self, label: str):
+        self._path.append(label)
+        self._stack.append([label, time.perf_counter(), 0.0])
+
+    def _exit(self):
+        label, start, child = self._stack.pop()
+        elapsed = time.perf_counter() - start
+        st = self.phases[label]
+        st.calls += 1
+        st.total_s += elapsed
+        st.self_s += elapsed - child
+        self.folded[tuple(self._path)] += elapsed - child
+        self._path.pop()
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def _battle_start(self):
+        self._battle = [self.rounds, self.phases["clash"].calls, None, None]
+        if self.allocations:
+            tracemalloc.reset_peak()
+            self._battle[2] = tracemalloc.get_traced_memory()[0]
+            self._battle[3] = sys.getallocatedblocks()
+        self._enter("battle")
+
+    def _battle_end(self):
+        start_s = self._stack[-1][1]
+        self._exit()
+        rounds0, clashes0, mem0, blocks0 = self._battle
+        bp = BattleProfile(self.rounds - rounds0, self.phases["clash"].calls - clashes0,
+                           time.perf_counter() - start_s)
+        if self.allocations:
+            bp.alloc_peak_bytes = tracemalloc.get_traced_memory()[1] - mem0
+            bp.alloc_net_blocks = sys.getallocatedblocks() - blocks0
+        self.battles.append(bp)
+
+    # ------------------------------------------------------------------
+    # 导出
+    # ------------------------------------------------------------------
+
+    def report(self) -> ProfileReport:
+        return ProfileReport(self._wall, dict(self.phases), list(self.battles))
+
+    def write_json(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report().to_dict(), f, ensure_ascii=False, indent=2)
+
+    def write_folded(self, path: str):
+        """折叠栈格式 (flamegraph.pl / speedscope 可直接读取)，数值为自身耗时 (微秒)。"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, secs in sorted(self.folded.items()):
+                us = int(round(secs * 1e6))
+                if us > 0:
+                    f.write(";".join(stack) + f" {us}\n")
@@ -0,0 +1,460 @@
+import sys
+import json
+import mmap
+import struct
+import argparse
+from array import array
+from dataclasses import dataclass
+from typing import List, Dict, Optional, Tuple, Iterator
+
+from cow_core import (
+    Army, BattleMode, BattleReporter, BattleResult, ArmySnapshot, ArmyState, GroupState, BuildingState,
+    RoundSnapshot, run_simulation, print_state_details, print_state_summary,
+)
+
+# ============================================================================
+# 1. 说明
+# ============================================================================
+# 逐回合回放：记录每回合各 Group 的数量 / HP / 本回合损失 / 本回合阵亡、各建筑 HP 与减伤、
+# 以及双方随机系数，写成按列存储的二进制文件。读取端 mmap 打开，只解码请求的回合与 Group，
+# 可以按原控制台格式 (ConsoleReporter) 重现任意回合，无需重新模拟。
+#
+# 行 0 为开战前的初始状态，之后每个实际模拟的回合结束时记一行。僵局检测 / 外推跳过的回合不产生行，
+# 因此行号与回合号在跳跃之后不再相同，每行的引擎回合号单独记在全局列 round 中。
+
+MAGIC = b"COWRPLY1"
+VERSION = 2
+# 版本 1 没有 round 列，按行号作为回合号读取
+READABLE_VERSIONS = (1, 2)
+DEFAULT_BLOCK = 64
+
+# 每方的列 (名称, 类型)：count / dead / hp / loss 每 Group 一格，bld_hp / mit 每建筑一格
+SIDE_COLUMNS = (("count", "q"), ("dead", "q"), ("hp", "d"), ("loss", "d"), ("bld_hp", "d"), ("mit", "d"))
+# 全局列 factors：每行 (攻击系数, 防御系数)；round：每行对应的引擎回合号
+
+@dataclass
+class GroupInfo:
+    stack: str
+    name: str
+    max_hp_per_unit: float
+    initial_count: int
+    initial_hp: float
+
+@dataclass
+class BuildingInfo:
+    stack: str
+    name: str
+    initial_hp: float
+
+@dataclass
+class SideInfo:
+    name: str
+    groups: List[GroupInfo]
+    buildings: List[BuildingInfo]
+
+def _side_info(army: Army) -> SideInfo:
+    return SideInfo(army.name,
+                    [GroupInfo(s.name, g.name, g.max_hp_per_unit, g.initial_count, g.initial_hp)
+                     for s in army.stacks for g in s.groups],
+                    [BuildingInfo(s.name, s.building.name, s.building.initial_hp)
+                     for s in army.stacks if s.building])
+
+# ============================================================================
+# 2. 记录
+# ============================================================================
+
+class ReplayRecorder(BattleReporter):
+    """
+    作为 reporter 挂到 run_simulation 上，战斗结束后 save(path) 写出回放文件。
+    每回合只做两次整块数组拷贝 (Army.snapshot) 和建筑减伤查询，不做任何格式化。
+    """
+
+    def __init__(self, block: int = DEFAULT_BLOCK):
+        self.block = block
+        self.mode: Optional[BattleMode] = None
+        self.use_random = False
+        self.sides: List[SideInfo] = []
+        self.result: Optional[BattleResult] = None
+        self._armies: Tuple[Army, ...] = ()
+        self._snaps: List[Optional[ArmySnapshot]] = [None, None]
+        self._f = [array('d'), array('d')]      # 每行：Group HP..., 本回合损失..., 建筑 HP...
+        self._i = [array('q'), array('q')]      # 每行：Group 数量..., 本回合阵亡...
+        self._mit = [array('d'), array('d')]
+        self._factors = array('d')
+        self._rounds = array('q')
+        self._pending = (1.0, 1.0)
+        self._round = 0
+
+    @property
+    def rows(self) -> int:
+        return len(self._factors) // 2
+
+    def _capture(self):
+        for k, army in enumerate(self._armies):
+            snap = self._snaps[k] = army.snapshot(self._snaps[k])
+            self._f[k].extend(snap.f)
+            self._i[k].extend(snap.i)
+            self._mit[k].extend([s.building.get_current_mitigation() for s in army.stacks if s.building])
+        self._factors.extend(self._pending)
+        self._rounds.append(self._round)
+
+    def on_battle_start(self, army_a, army_b, mode, use_random):
+        self.mode, self.use_random = mode, use_random
+        self._armies = (army_a, army_b)
+        self.sides = [_side_info(army_a), _side_info(army_b)]
+        self._pending = (1.0, 1.0)
+        self._round = 0
+        self._capture()
+
+    def on_round_start(self, r, factor_atk, factor_def):
+        self._pending = (factor_atk, factor_def)
+        self._round = r
+
+    def on_round_end(self, r, army_a, army_b):
+        self._capture()
+
+    def on_battle_end(self, army_a, army_b, result):
+        self.result = result
+        self._armies = ()
+
+    def _columns(self) -> List[Tuple[int, str, str, int, array]]:
+        """拆成 (方, 列名, 类型, 每行格数, 行优先数据)。"""
+        rows = self.rows
+        cols = []
+        for k, side in enumerate(self.sides):
+            n, nb = len(side.groups), len(side.buildings)
+            f, i, mit = self._f[k], self._i[k], self._mit[k]
+            wf, wi = 2 * n + nb, 2 * n
+            split = {"count": (i, wi, 0, n), "dead": (i, wi, n, n), "hp": (f, wf, 0, n),
+                     "loss": (f, wf, n, n), "bld_hp": (f, wf, 2 * n, nb), "mit": (mit, nb, 0, nb)}
+            for name, typecode in SIDE_COLUMNS:
+                src, width, off, cnt = split[name]
+                data = array(typecode)
+                for r in range(rows):
+                    base = r * width + off
+                    data.extend(src[base:base + cnt])
+                cols.append((k, name, typecode, cnt, data))
+        cols.append((-1, "factors", "d", 2, self._factors))
+        cols.append((-1, "round", "q", 1, self._rounds))
+        return cols
+
+    def save(self, path: str):
+        header, data = encode_replay(self)
+        write_replay(path, header, data)
+
+def record_replay(path: str, army_a: Army, army_b: Army, mode: BattleMode, block: int = DEFAULT_BLOCK,
+                  **kwargs) -> BattleResult:
+    """运行一场战斗 (参数同 run_simulation) 并写出回放文件。"""
+    rec = ReplayRecorder(block)
+    kwargs.setdefault("verbose", False)
+    reporters = list(kwargs.pop("reporters", ())) + [rec]
+    result = run_simulation(army_a, army_b, mode, reporters=reporters, **kwargs)
+    rec.save(path)
+    return result
+
+# ============================================================================
+# 3. 文件格式
+# ============================================================================
+# MAGIC (8 字节) | 头部长度 (u32 小端) | 头部 JSON | 补齐到 8 字节 | 数据区 (u64 小端字)
+#
+# 数据区按列存放。每列每 block 行为一块，块首行为关键帧 (完整一行)，其余各行相对上一行做
+# 稀疏差分：ceil(n/64) 个掩码字标出变化的格子，后跟这些格子的新值。比较与存储都按 64 位
+# 位模式进行 (float 也是)，因此无损；未受攻击的 Group、全灭后的 Group、未变化的建筑
+# 每行只占掩码中的一位。头部记录每块的起点，读取任意回合只需从所在块的关键帧开始解码。
+
+def _words(data: array) -> memoryview:
+    return memoryview(data).cast("B").cast("Q")
+
+def _encode_column(words: memoryview, rows: int, n: int, block: int, out: array) -> List[int]:
+    """把一列追加到 out，返回各块起点 (字偏移)。"""
+    m = (n + 63) >> 6
+    no_change = array('Q', bytes(8 * m))
+    starts = []
+    prev = None
+    for r in range(rows):
+        row = words[r * n:(r + 1) * n]
+        if r % block == 0:
+            starts.append(len(out))
+            out.extend(row)
+        elif row == prev:
+            out.extend(no_change)
+        else:
+            mask = [0] * m
+            vals = []
+            for k in range(n):
+                v = row[k]
+                if v != prev[k]:
+                    mask[k >> 6] |= 1 << (k & 63)
+                    vals.append(v)
+            out.extend(mask)
+            out.extend(vals)
+        prev = row
+    return starts
+
+def encode_replay(rec: ReplayRecorder) -> Tuple[bytes, array]:
+    data = array('Q')
+    columns = []
+    for side, name, typecode, n, values in rec._columns():
+        starts = _encode_column(_words(values), rec.rows, n, rec.block, data) if n else []
+        columns.append({"side": side, "name": name, "type": typecode, "n": n, "blocks": starts})
+    res = rec.result
+    meta = {
+        "version": VERSION, "mode": rec.mode.value, "use_random": rec.use_random,
+        "rows": rec.rows, "block": rec.block,
+        "sides": [{"name": s.name,
+                   "groups": [[g.stack, g.name, g.max_hp_per_unit, g.initial_count, g.initial_hp] for g in s.groups],
+                   "buildings": [[b.stack, b.name, b.initial_hp] for b in s.buildings]} for s in rec.sides],
+        "columns": columns,
+        "result": None if res is None else {"rounds": res.rounds, "outcome": res.outcome.value,
+                                            "end_reason": res.end_reason.value,
+                                            "rounds_simulated": res.rounds_simulated},
+    }
+    return json.dumps(meta, ensure_ascii=False).encode(), data
+
+def _data_offset(header_len: int) -> int:
+    return (len(MAGIC) + 4 + header_len + 7) // 8 * 8
+
+def write_replay(path: str, header: bytes, data: array):
+    if sys.byteorder != "little":
+        data = array('Q', data)
+        data.byteswap()
+    with open(path, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header)) + header)
+        f.write(b"\0" * (_data_offset(len(header)) - f.tell()))
+        data.tofile(f)
+
+# ============================================================================
+# 4. 读取
+# ============================================================================
+
+class Replay:
+    """
+    只读回放文件。打开时只解析头部；column() / state() / print_round() 按需解码。
+
+        with Replay("battle.replay") as rp:
+            rp.print_round(37)
+            hp = rp.column(0, "hp", 100, 200, groups=range(0, 3))
+    """
+
+    def __init__(self, path: str):
+        if sys.byteorder != "little":
+            raise RuntimeError("replay files are little-endian; big-endian hosts are not supported")
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a replay file")
+        (header_len,) = struct.unpack_from("<I", self._mm, len(MAGIC))
+        start = len(MAGIC) + 4
+        meta = json.loads(self._mm[start:start + header_len].decode())
+        if meta["version"] not in READABLE_VERSIONS:
+            self.close()
+            raise ValueError(f"{path}: unsupported replay version {meta['version']}")
+        self.mode = BattleMode(meta["mode"])
+        self.use_random: bool = meta["use_random"]
+        self.rows: int = meta["rows"]
+        self.block: int = meta["block"]
+        self.result: Optional[dict] = meta["result"]
+        self.sides = [SideInfo(s["name"], [GroupInfo(*g) for g in s["groups"]],
+                               [BuildingInfo(*b) for b in s["buildings"]]) for s in meta["sides"]]
+        self._columns: Dict[Tuple[int, str], dict] = {(c["side"], c["name"]): c for c in meta["columns"]}
+        self._words = memoryview(self._mm)[_data_offset(header_len):].cast("Q")
+        self._round_numbers: Optional[List[int]] = None
+
+    def close(self):
+        if getattr(self, "_words", None) is not None:
+            self._words.release()
+            self._words = None
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self) -> "Replay":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    @property
+    def rounds(self) -> int:
+        """记录的回合数 (不含初始状态行)。"""
+        return self.rows - 1
+
+    @property
+    def round_numbers(self) -> List[int]:
+        """每行对应的引擎回合号 (行 0 为 0)，首次访问时解码并缓存。"""
+        if self._round_numbers is None:
+            if (-1, "round") in self._columns:
+                self._round_numbers = [row[0] for row in self.column(-1, "round")]
+            else:
+                self._round_numbers = list(range(self.rows))
+        return self._round_numbers
+
+    # ------------------------------------------------------------------
+    # 列解码
+    # ------------------------------------------------------------------
+
+    def _iter_rows(self, col: dict, first: int, last: int) -> Iterator[array]:
+        """依次产出第 first .. last-1 行 (64 位位模式)，从 first 所在块的关键帧开始解码。"""
+        n, block, words = col["n"], self.block, self._words
+        m = (n + 63) >> 6
+        b = first // block
+        pos = col["blocks"][b]
+        cur = array('Q', words[pos:pos + n])
+        pos += n
+        r = b * block
+        while True:
+            if r >= first:
+                yield cur
+            r += 1
+            if r >= last:
+                return
+            if r % block == 0:
+                pos = col["blocks"][r // block]
+                cur[:] = array('Q', words[pos:pos + n])
+                pos += n
+                continue
+            vals = pos + m
+            for w in range(m):
+                mask = words[pos + w]
+                while mask:
+                    low = mask & -mask
+                    cur[(w << 6) + low.bit_length() - 1] = words[vals]
+                    vals += 1
+                    mask ^= low
+            pos = vals
+
+    def column(self, side: int, name: str, first: int = 0, last: Optional[int] = None,
+               groups: Optional[range] = None) -> List[list]:
+        """
+        第 first .. last-1 行 (默认全部) 的一列，按行返回列表；groups 只取其中的格子 (Group / 建筑下标)。
+        side 为 0 (A) / 1 (B)，全局列 factors 用 side=-1。
+        """
+        col = self._columns[(side, name)]
+        last = self.rows if last is None else min(last, self.rows)
+        if not 0 <= first < last:
+            return []
+        if col["n"] == 0:
+            return [[] for _ in range(first, last)]
+        typecode = col["type"]
+        out = []
+        for bits in self._iter_rows(col, first, last):
+            row = array(typecode, bits.tobytes()).tolist()
+            out.append(row if groups is None else [row[k] for k in groups])
+        return out
+
+    def _row(self, side: int, name: str, r: int) -> list:
+        return self.column(side, name, r, r + 1)[0]
+
+    # ------------------------------------------------------------------
+    # 视图
+    # ------------------------------------------------------------------
+
+    def factors(self, r: int) -> Tuple[float, float]:
+        fa, fd = self._row(-1, "factors", r)
+        return fa, fd
+
+    def army_state(self, side: int, r: int) -> ArmyState:
+        info = self.sides[side]
+        count, dead = self._row(side, "count", r), self._row(side, "dead", r)
+        hp, loss = self._row(side, "hp", r), self._row(side, "loss", r)
+        groups = [GroupState(g.stack, g.name, count[k], hp[k], count[k] * g.max_hp_per_unit, g.initial_count,
+                             g.initial_hp, loss[k], dead[k]) for k, g in enumerate(info.groups)]
+        buildings = []
+        if info.buildings:
+            bld, mit = self._row(side, "bld_hp", r), self._row(side, "mit", r)
+            buildings = [BuildingState(b.stack, b.name, bld[k], b.initial_hp, mit[k])
+                         for k, b in enumerate(info.buildings)]
+        # 与 Army.total_hp 相同的求和顺序：先按 Stack 求和，再累加各 Stack
+        total_hp = 0
+        stack_hp, stack = 0, None
+        for g in groups:
+            if g.stack != stack and stack is not None:
+                total_hp += stack_hp
+                stack_hp = 0
+            stack = g.stack
+            stack_hp += g.current_hp
+        total_hp += stack_hp
+        return ArmyState(info.name, total_hp, sum(count), groups, buildings)
+
+    def state(self, r: int) -> RoundSnapshot:
+        """第 r 行的完整状态 (r=0 为开战前)，RoundSnapshot.round 为该行的引擎回合号。"""
+        if not 0 <= r < self.rows:
+            raise IndexError(f"row {r} not in replay (0..{self.rows - 1})")
+        fa, fd = self.factors(r)
+        return RoundSnapshot(self.round_numbers[r], fa, fd, self.army_state(0, r), self.army_state(1, r))
+
+    def print_round(self, r: int, detailed: bool = False, factors: bool = False):
+        """按 ConsoleReporter 的格式打印第 r 行 (标题为引擎回合号)；factors=True 时额外打印随机系数。"""
+        snap = self.state(r)
+        print(f"\nRound {snap.round}:")
+        if factors:
+            print(f"  factors: atk {snap.factor_atk:.4f} | def {snap.factor_def:.4f}")
+        for state in (snap.army_a, snap.army_b):
+            print_state_details(state, detailed)
+        for state in (snap.army_a, snap.army_b):
+            print_state_summary(state)
+
+# ============================================================================
+# 5. 命令行
+# ============================================================================
+
+def _parse_range(text: Optional[str], last_round: int) -> range:
+    """回合号范围 (引擎回合号，含两端)。"""
+    if not text:
+        return range(1, last_round + 1)
+    lo, sep, hi = text.partition(":")
+    if not sep:
+        return range(int(lo), int(lo) + 1)
+    return range(int(lo) if lo else 1, int(hi) + 1 if hi else last_round + 1)
+
+def main(argv=None):
+    from run_battle import load_json, build_army
+    from cow_db import load_databases
+    from cow_rng import CounterRNG
+
+    parser = argparse.ArgumentParser(description="战斗回放：记录为二进制文件并按回合查看")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_rec = sub.add_parser("record", help="运行配置中的战斗并写出回放")
+    p_rec.add_argument("out", help="输出回放文件")
+    p_rec.add_argument("--config", default="battle_config.json")
+    p_rec.add_argument("--seed", type=int, default=None)
+    p_rec.add_argument("--block", type=int, default=DEFAULT_BLOCK, help="关键帧间隔 (回合)")
+    p_show = sub.add_parser("show", help="按控制台格式打印回合")
+    p_show.add_argument("replay")
+    p_show.add_argument("--rounds", default=None, help="回合或范围，如 12、10:20、:5 (默认全部)")
+    p_show.add_argument("--detailed", action="store_true", help="列出所有 Group (同 detailed_output)")
+    p_show.add_argument("--factors", action="store_true", help="同时打印随机系数")
+    p_info = sub.add_parser("info", help="打印头部信息")
+    p_info.add_argument("replay")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "record":
+        u_db, b_db = load_databases("units.json", "buildings.json")
+        conf = load_json(args.config)
+        army_a = build_army(conf["team_a"], u_db, b_db)
+        army_b = build_army(conf["team_b"], u_db, b_db)
+        res = record_replay(args.out, army_a, army_b, BattleMode(conf.get("battle_mode", "LAND_ATTACK")),
+                            args.block, max_rounds=conf.get("max_rounds", 50),
+                            use_random=conf.get("enable_randomness", True), rng=CounterRNG(args.seed),
+                            extrapolate=conf.get("extrapolate_steady_state", False),
+                            siege_damage=conf.get("siege_damage", True))
+        print(f"{args.out}: {res.rounds_simulated} rounds recorded, {res.outcome.value}", file=sys.stderr)
+        return 0
+
+    with Replay(args.replay) as rp:
+        if args.cmd == "info":
+            print(json.dumps({"mode": rp.mode.value, "use_random": rp.use_random, "rounds": rp.rounds,
+                              "block": rp.block, "result": rp.result,
+                              "sides": [{"name": s.name, "groups": len(s.groups), "buildings": len(s.buildings)}
+                                        for s in rp.sides]}, ensure_ascii=False))
+            return 0
+        # 按引擎回合号选行，被跳过的回合没有记录
+        wanted = _parse_range(args.rounds, rp.round_numbers[-1])
+        for r, rnd in enumerate(rp.round_numbers):
+            if rnd in wanted:
+                rp.print_round(r, args.detailed, args.factors)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+import sys
+import math
+import random
+import argparse
+from typing import Optional, List
+
+# ============================================================================
+# 1. 计数器哈希
+# ============================================================================
+# 计数器式随机流：第 n 个均匀数是 (流密钥, n) 的纯函数 (SplitMix64 输出函数)，
+# 没有需要顺序推进的内部状态。因此：
+#   - 同一 (seed, stream) 在任何批大小、分块方式、进程数下都得到同一序列；
+#   - 不同 stream (通常为试验序号) 的序列互不相关，可以任意拆分到各进程；
+#   - 向量引擎可以对一批试验的计数器一次性求值 (见 cow_vector.StreamGauss)。
+
+MASK64 = (1 << 64) - 1
+GOLDEN = 0x9E3779B97F4A7C15
+MIX_1 = 0xBF58476D1CE4E5B9
+MIX_2 = 0x94D049BB133111EB
+TWO_PI = 2.0 * math.pi
+INV_2_53 = 1.0 / (1 << 53)
+
+def mix64(z: int) -> int:
+    z = ((z ^ (z >> 30)) * MIX_1) & MASK64
+    z = ((z ^ (z >> 27)) * MIX_2) & MASK64
+    return z ^ (z >> 31)
+
+def stream_key(seed: int, stream: int = 0) -> int:
+    """(seed, stream) -> 64 位流密钥。"""
+    k = mix64((seed + GOLDEN) & MASK64)
+    return mix64((k ^ mix64((stream * GOLDEN + GOLDEN) & MASK64)) & MASK64)
+
+def fresh_seed() -> int:
+    """未指定种子时使用；取自全局 random，调用方先 random.seed() 即可复现。"""
+    return random.getrandbits(64)
+
+# ============================================================================
+# 2. 标量随机流
+# ============================================================================
+
+class CounterRNG:
+    """
+    计数器式随机流，提供引擎所需的 gauss(mu, sigma) (可直接作为 run_simulation 的 rng)。
+    第 n 次 gauss 使用计数器 2n / 2n+1 上的两个均匀数做 Box-Muller (只取余弦支)，
+    因此第 n 次抽样只取决于 (seed, stream, n)。seed 为 None 时随机选取。
+    """
+    __slots__ = ("seed", "stream", "key", "counter")
+
+    def __init__(self, seed: Optional[int] = None, stream: int = 0):
+        self.seed = fresh_seed() if seed is None else seed
+        self.stream = stream
+        self.key = stream_key(self.seed, stream)
+        self.counter = 0
+
+    def spawn(self, stream: int) -> "CounterRNG":
+        """以本流的密钥为种子派生子流 (例如批次 -> 试验)。"""
+        return CounterRNG(self.key, stream)
+
+    def seek(self, counter: int):
+        self.counter = counter
+
+    def _uniform(self, n: int) -> float:
+        return (mix64((self.key + (n + 1) * GOLDEN) & MASK64) >> 11) * INV_2_53
+
+    def random(self) -> float:
+        """[0, 1) 均匀数。"""
+        n = self.counter
+        self.counter = n + 1
+        return self._uniform(n)
+
+    def gauss(self, mu: float = 0.0, sigma: float = 1.0) -> float:
+        n = self.counter
+        self.counter = n + 2
+        u1 = self._uniform(n)
+        u2 = self._uniform(n + 1)
+        return mu + sigma * (math.sqrt(-2.0 * math.log(1.0 - u1)) * math.cos(TWO_PI * u2))
+
+def trial_rngs(seed: Optional[int], trials: int, first: int = 0) -> List[CounterRNG]:
+    """试验 first .. first+trials-1 各自的随机流。"""
+    seed = fresh_seed() if seed is None else seed
+    return [CounterRNG(seed, t) for t in range(first, first + trials)]
+
+# ============================================================================
+# 3. 自检
+# ============================================================================
+
+def self_check(seed: int = 7, trials: int = 64, draws: int = 40) -> List[str]:
+    """
+    检查可复现性与可拆分性：同一流重建后序列相同、按任意顺序交错抽样不影响各流；
+    numpy 可用时再检查向量化抽样 (含部分试验跳过抽样) 与标量流逐值一致。
+    """
+    errors = []
+    ref = [[r.gauss() for _ in range(draws)] for r in trial_rngs(seed, trials)]
+    again = trial_rngs(seed, trials)
+    interleaved = [[] for _ in range(trials)]
+    for _ in range(draws):
+        for t in reversed(range(trials)):
+            interleaved[t].append(again[t].gauss())
+    if interleaved != ref:
+        errors.append("interleaved draws differ from sequential draws")
+    tail = trial_rngs(seed, trials // 2, first=trials // 2)
+    if [[r.gauss() for _ in range(draws)] for r in tail] != ref[trials // 2:]:
+        errors.append("split stream range differs from the full range")
+    if len({round(x, 12) for row in ref for x in row}) != trials * draws:
+        errors.append("duplicate values across streams")
+
+    try:
+        import numpy as np
+        from cow_vector import StreamGauss
+    except ImportError:
+        return errors
+    from cow_core import RANDOM_MU, RANDOM_SIGMA
+    draw = StreamGauss(seed, range(trials))
+    scalar = trial_rngs(seed, trials)
+    mask_rng = random.Random(seed)
+    for i in range(draws):
+        mask = np.array([mask_rng.random() < 0.7 for _ in range(trials)])
+        vals = draw(mask)
+        for t in np.flatnonzero(mask).tolist():
+            exp = scalar[t].gauss(RANDOM_MU, RANDOM_SIGMA)
+            if not math.isclose(vals[t], exp, rel_tol=1e-12):
+                errors.append(f"draw {i} trial {t}: vector={vals[t]!r} scalar={exp!r}")
+    return errors
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="计数器式随机流自检")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--trials", type=int, default=64)
+    parser.add_argument("--draws", type=int, default=40)
+    args = parser.parse_args(argv)
+    errors = self_check(args.seed, args.trials, args.draws)
+    for e in errors[:10]:
+        print(f"  - {e}")
+    print("rng self-check: " + ("OK" if not errors else f"FAIL ({len(errors)})"))
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,303 @@
+import sys
+import copy
+import json
+import math
+import time
+import argparse
+from dataclasses import dataclass, field, asdict
+from typing import List, Dict, Optional, Tuple, Any
+
+from cow_core import Army, BattleMode, BattleOutcome, run_simulation
+from cow_batch import snapshot_army, restore_army, VECTOR_MIN_TRIALS, _vector_engine
+from cow_db import load_databases
+from cow_rng import CounterRNG
+from cow_surface import METRICS
+from cow_sweep import set_path
+from run_battle import load_json, build_army
+
+# ============================================================================
+# 1. 扰动参数
+# ============================================================================
+# 每个 Lever 对基础配置的一个参数 (路径同 cow_sweep) 做一次扰动。基础配置与全部扰动配置
+# 作为变体一起运行，同一序号的试验使用同一串随机数 (公共随机数)，因此成对差值只反映参数差异，
+# 远小于两次独立 Monte Carlo 之间的噪声。
+#
+# 关闭随机时结果是参数的分段常数函数 (阵亡按整数向下取整、建筑按等级分段)，不存在有意义的
+# 解析导数，此时按同样的方式做单次确定性有限差分。
+
+DEFAULT_TRIALS = 256
+
+# 配置中省略时引擎采用的取值
+_IMPLICIT = {"terrain_bonus": 0.0, "hp_ratio": 1.0, "core": False}
+# 未指定 step / value 时的默认步长 (count 与 current_hp 为相对步长)
+_DEFAULT_STEP = {"count": 0.1, "current_hp": -0.1, "hp_ratio": -0.1, "terrain_bonus": 0.1, "level": 1}
+
+def _get_path(conf: dict, path: str):
+    node = conf
+    for k in path.split("."):
+        if isinstance(node, list):
+            node = node[int(k)]
+        elif isinstance(node, dict) and k in node:
+            node = node[k]
+        else:
+            return None
+    return node
+
+@dataclass
+class Lever:
+    path: str
+    step: Optional[float] = None    # 数值参数的增量
+    value: Any = None               # 直接给出扰动后的取值，优先于 step
+
+    @property
+    def key(self) -> str:
+        return self.path.rsplit(".", 1)[-1]
+
+    def perturb(self, conf: dict) -> Tuple[Any, Any]:
+        """返回 (基准取值, 扰动后取值)。布尔参数 (core) 取反。"""
+        base = _get_path(conf, self.path)
+        if base is None:
+            base = _IMPLICIT.get(self.key)
+        if self.value is not None:
+            return base, self.value
+        if isinstance(base, bool):
+            return base, not base
+        if base is None:
+            raise ValueError(f"lever {self.path!r}: no value in config and no default, give value=")
+        step = self.step if self.step is not None else _DEFAULT_STEP.get(self.key)
+        if step is None:
+            raise ValueError(f"lever {self.path!r}: no default step, give step= or value=")
+        if self.step is None and self.key == "count":
+            return base, base + max(1, round(base * step))
+        if self.step is None and self.key == "current_hp":
+            return base, base * (1.0 + step)
+        return base, base + step
+
+    def label(self, base, value) -> str:
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and isinstance(base, (int, float)):
+            d = value - base
+            return f"{self.path} {'+' if d >= 0 else ''}{d:g}"
+        return f"{self.path} -> {json.dumps(value, ensure_ascii=False)}"
+
+def parse_lever(spec: str) -> Lever:
+    """"路径" (默认步长)、"路径+=步长" / "路径-=步长" 或 "路径=JSON 值"。"""
+    for op, sign in (("+=", 1.0), ("-=", -1.0)):
+        if op in spec:
+            path, _, raw = spec.partition(op)
+            return Lever(path, step=sign * float(raw))
+    if "=" in spec:
+        path, _, raw = spec.partition("=")
+        return Lever(path, value=json.loads(raw))
+    return Lever(spec)
+
+def default_levers(conf: dict) -> List[Lever]:
+    """配置中每个单位的数量 / HP / 地形，以及每个 Stack 的核心与建筑等级 / HP。"""
+    levers = []
+    for team in ("team_a", "team_b"):
+        tconf = conf.get(team, {})
+        stacks = [(team, tconf)] if "units" in tconf else \
+                 [(f"{team}.stacks.{si}", s) for si, s in enumerate(tconf.get("stacks", []))]
+        for prefix, s in stacks:
+            for ui, _ in enumerate(s.get("units", [])):
+                for key in ("count", "hp_ratio", "terrain_bonus"):
+                    levers.append(Lever(f"{prefix}.units.{ui}.{key}"))
+            levers.append(Lever(f"{prefix}.core"))
+            if s.get("building"):
+                levers.append(Lever(f"{prefix}.building.level"))
+                levers.append(Lever(f"{prefix}.building.hp_ratio"))
+    return levers
+
+# ============================================================================
+# 2. 结果结构
+# ============================================================================
+
+@dataclass
+class Effect:
+    delta: float      # 扰动后 - 基准 (逐试验成对差值的均值)
+    stderr: float     # 成对差值的标准误
+    per_unit: float   # delta / step
+
+@dataclass
+class LeverEffect:
+    label: str
+    path: str
+    base_value: Any
+    value: Any
+    step: float       # 扰动后 - 基准 (布尔按 0 / 1 计)
+    effects: Dict[str, Effect] = field(default_factory=dict)
+
+@dataclass
+class SensitivityReport:
+    base: Dict[str, float]
+    levers: List[LeverEffect]
+    trials: int
+    randomness: bool
+    engine: str
+    seconds: float
+
+    def ranked(self, metric: str = "win_prob", per_unit: bool = False) -> List[LeverEffect]:
+        """按 |delta| (或 |per_unit|) 从大到小排列。"""
+        key = (lambda e: abs(e.effects[metric].per_unit)) if per_unit else (lambda e: abs(e.effects[metric].delta))
+        return sorted(self.levers, key=key, reverse=True)
+
+    def summary(self, metric: str = "win_prob") -> str:
+        mode = f"{self.trials} trials (common random numbers)" if self.randomness else "deterministic"
+        lines = [f"=== Sensitivity of {metric}: {len(self.levers)} levers, {mode}, "
+                 f"engine {self.engine}, {self.seconds:.2f} s ===",
+                 f"  base {metric} = {self.base[metric]:.4f}",
+                 f"  {'LEVER':<48} | {'DELTA':>9} | {'± SE':>8} | {'PER UNIT':>10}"]
+        for e in self.ranked(metric):
+            eff = e.effects[metric]
+            lines.append(f"  {e.label:<48} | {eff.delta:>+9.4f} | {eff.stderr:>8.4f} | {eff.per_unit:>+10.4g}")
+        return "\n".join(lines)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+# ============================================================================
+# 3. 逐试验指标
+# ============================================================================
+# 每个变体得到 {指标: [逐试验取值]}，指标与 cow_surface.METRICS 一致。
+
+def _empty() -> Dict[str, list]:
+    return {m: [] for m in METRICS}
+
+def _run_vector(vec, pairs, mode, trials, max_rounds, use_random, seed) -> List[Dict[str, list]]:
+    res = vec.run_vector_variants(pairs, mode, trials, max_rounds, use_random, seed=seed)
+    a_alive, b_alive = res.a_alive, res.b_alive
+    win = (a_alive & ~b_alive).astype(float)
+    loss = (b_alive & ~a_alive).astype(float)
+    cols = {"win_prob": win, "draw_prob": 1.0 - win - loss, "loss_prob": loss, "mean_rounds": res.rounds}
+    for side, va in (("a", res.army_a), ("b", res.army_b)):
+        cols[f"{side}_dead"] = va.init_count.sum(axis=0).repeat(trials) - va.count.sum(axis=0)
+        cols[f"{side}_hp_lost"] = va.init_hp.sum(axis=0).repeat(trials) - va.hp.sum(axis=0)
+    out = []
+    for v in range(len(pairs)):
+        sl = slice(v * trials, (v + 1) * trials)
+        out.append({m: cols[m][sl].astype(float).tolist() for m in METRICS})
+    return out
+
+def _side_loss(army: Army) -> Tuple[float, float]:
+    groups = [g for s in army.stacks for g in s.groups]
+    return (float(sum(g.initial_count - g.count for g in groups)),
+            sum(g.initial_hp - g.current_hp for g in groups))
+
+def _run_scalar(pairs, mode, trials, max_rounds, use_random, seed, siege) -> List[Dict[str, list]]:
+    """逐变体逐试验运行标量引擎；各变体的第 t 个试验都使用随机流 (seed, t)，与向量引擎相同。"""
+    out = []
+    for army_a, army_b in pairs:
+        snap_a, snap_b = snapshot_army(army_a), snapshot_army(army_b)
+        cols = _empty()
+        for t in range(trials):
+            if t:
+                restore_army(army_a, snap_a)
+                restore_army(army_b, snap_b)
+            res = run_simulation(army_a, army_b, mode, max_rounds, use_random, False, verbose=False,
+                                 rng=CounterRNG(seed, t), siege_damage=siege)
+            a_dead, a_lost = _side_loss(army_a)
+            b_dead, b_lost = _side_loss(army_b)
+            for m, v in zip(METRICS, (float(res.outcome == BattleOutcome.A_WIN), float(res.outcome == BattleOutcome.DRAW),
+                                      float(res.outcome == BattleOutcome.B_WIN), float(res.rounds),
+                                      a_dead, a_lost, b_dead, b_lost)):
+                cols[m].append(v)
+        out.append(cols)
+    return out
+
+def _paired(base: List[float], pert: List[float]) -> Tuple[float, float]:
+    n = len(base)
+    diffs = [p - b for b, p in zip(base, pert)]
+    mean = sum(diffs) / n
+    if n < 2:
+        return mean, 0.0
+    var = sum((d - mean) ** 2 for d in diffs) / (n - 1)
+    return mean, math.sqrt(var / n)
+
+# ============================================================================
+# 4. 分析入口
+# ============================================================================
+
+def analyze(conf: dict, levers: List[Lever], units_db, buildings_db, trials: int = DEFAULT_TRIALS,
+            seed: int = 0, engine: str = "auto", randomness: Optional[bool] = None) -> SensitivityReport:
+    """
+    计算各 Lever 对 METRICS 的影响。基础配置与全部扰动配置作为一批运行：
+    向量引擎可用且各变体结构一致时 (只改数量 / HP / 地形 / 核心 / 建筑) 一次推进
+    (1 + len(levers)) * trials 列，总耗时接近单次批量模拟；否则逐变体运行标量引擎，
+    仍使用公共随机数。randomness 为 None 时取配置的 enable_randomness，关闭时只运行 1 次。
+    engine: "auto" / "vector" / "scalar"。
+    """
+    t0 = time.perf_counter()
+    use_random = conf.get("enable_randomness", True) if randomness is None else randomness
+    trials = trials if use_random else 1
+    mode = BattleMode(conf.get("battle_mode", "LAND_ATTACK"))
+    max_rounds = conf.get("max_rounds", 50)
+    siege = conf.get("siege_damage", True)
+
+    confs, changes = [conf], []
+    for lever in levers:
+        base, value = lever.perturb(conf)
+        c = copy.deepcopy(conf)
+        set_path(c, lever.path, value)
+        confs.append(c)
+        changes.append((lever, base, value))
+    pairs = [(build_army(c["team_a"], units_db, buildings_db), build_army(c["team_b"], units_db, buildings_db))
+             for c in confs]
+
+    vec = _vector_engine() if engine in ("auto", "vector") else None
+    ok = vec is not None and siege and vec.supports_variants(pairs, mode)
+    if engine == "vector" and not ok:
+        raise RuntimeError("vector engine unavailable for these levers (needs numpy, siege damage, "
+                           "supported stacks and unchanged unit types)")
+    if ok and (engine == "vector" or len(pairs) * trials >= VECTOR_MIN_TRIALS):
+        used = "vector"
+        runs = _run_vector(vec, pairs, mode, trials, max_rounds, use_random, seed)
+    else:
+        used = "scalar"
+        runs = _run_scalar(pairs, mode, trials, max_rounds, use_random, seed, siege)
+
+    base_runs = runs[0]
+    report = SensitivityReport({m: sum(base_runs[m]) / trials for m in METRICS}, [], trials, use_random, used, 0.0)
+    for (lever, base, value), cols in zip(changes, runs[1:]):
+        step = float(value) - float(base) if isinstance(value, (int, float)) and isinstance(base, (int, float)) \
+            else float("nan")
+        effect = LeverEffect(lever.label(base, value), lever.path, base, value, step)
+        for m in METRICS:
+            delta, se = _paired(base_runs[m], cols[m])
+            effect.effects[m] = Effect(delta, se, delta / step if step else float("nan"))
+        report.levers.append(effect)
+    report.seconds = time.perf_counter() - t0
+    return report
+
+# ============================================================================
+# 5. 命令行
+# ============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="敏感度分析：各参数扰动对战斗结果的影响 (公共随机数有限差分)")
+    parser.add_argument("--config", default="battle_config.json", help="基础战斗配置")
+    parser.add_argument("--lever", action="append", default=[],
+                        help="扰动参数，可重复：路径 (默认步长)、路径+=步长、路径-=步长 或 路径=JSON 值；"
+                             "省略时扰动配置中的全部单位与建筑参数")
+    parser.add_argument("--trials", type=int, default=DEFAULT_TRIALS, help="每个变体的试验次数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engine", choices=["auto", "scalar", "vector"], default="auto")
+    rnd = parser.add_mutually_exclusive_group()
+    rnd.add_argument("--random", dest="randomness", action="store_const", const=True, default=None,
+                     help="强制开启随机 (默认取配置的 enable_randomness)")
+    rnd.add_argument("--deterministic", dest="randomness", action="store_const", const=False,
+                     help="强制关闭随机，做单次确定性差分")
+    parser.add_argument("--metric", choices=METRICS, default="win_prob", help="排序与打印的指标")
+    parser.add_argument("--json", default=None, help="完整结果写入 JSON 文件")
+    args = parser.parse_args(argv)
+
+    conf = load_json(args.config)
+    u_db, b_db = load_databases("units.json", "buildings.json")
+    levers = [parse_lever(s) for s in args.lever] or default_levers(conf)
+    report = analyze(conf, levers, u_db, b_db, args.trials, args.seed, args.engine, args.randomness)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report.to_dict(), f, ensure_ascii=False, indent=2)
+    print(report.summary(args.metric))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,460 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import subprocess
+import concurrent.futures
+from dataclasses import dataclass, asdict
+from typing import List, Dict, Optional, Tuple
+
+import cow_sweep
+from cow_sweep import run_case
+
+# ============================================================================
+# 1. 配置
+# ============================================================================
+
+DEFAULT_BATCH_SIZE = 32        # 单批最多合并的请求数
+DEFAULT_BATCH_WINDOW = 0.005   # 凑批等待时间 (秒)
+DEFAULT_MAX_PENDING = 1024     # 排队上限，超出直接返回 503
+DEFAULT_TIMEOUT = 30.0         # 单个请求的超时 (秒)
+MAX_BODY = 8 << 20
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable",
+               504: "Gateway Timeout"}
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+class Overloaded(Exception):
+    pass
+
+# ============================================================================
+# 2. Worker (进程池中运行，数据库由 cow_sweep._init_worker 常驻加载并热更新)
+# ============================================================================
+
+def _run_batch(items: List[Tuple[dict, int, Optional[int]]]) -> List[dict]:
+    cow_sweep.refresh_worker_db()       # 数据库文件更新后无需重启服务
+    db = cow_sweep._WORKER_DB
+    out = []
+    for conf, trials, seed in items:
+        try:
+            out.append(run_case(conf, db["units"], db["buildings"], trials, seed, db["cache"]))
+        except Exception as e:  # 单个配置出错只影响自身
+            out.append({"error": f"{type(e).__name__}: {e}"})
+    return out
+
+# ============================================================================
+# 3. 服务端
+# ============================================================================
+
+@dataclass
+class ServerStats:
+    requests: int = 0
+    completed: int = 0
+    rejected: int = 0      # 排队已满
+    timeouts: int = 0
+    errors: int = 0
+    batches: int = 0
+    batched_items: int = 0
+
+    @property
+    def mean_batch(self) -> float:
+        return self.batched_items / self.batches if self.batches else 0.0
+
+class _Pending:
+    __slots__ = ("item", "future")
+
+    def __init__(self, item: Tuple[dict, int, Optional[int]], future: asyncio.Future):
+        self.item = item
+        self.future = future
+
+class BattleServer:
+    """
+    常驻战斗服务：HTTP/1.1 (TCP 或 Unix socket)，请求体为 build_army 使用的同一份战斗配置。
+    并发请求先进入有界队列 (满则 503；/batch 的各项等待空位)，由凑批协程按 batch_size / batch_window 合并后交给进程池；
+    每个 worker 只加载一次数据库。
+
+    路由:
+      POST /battle   单个配置 (可带顶层 "trials" / "seed")，返回一个 JSON 结果
+      POST /batch    {"configs": [...], "trials": n, "seed": s}，以 NDJSON 分块流式返回，完成一个写一个
+      GET  /stats    计数器
+      GET  /health
+    """
+
+    def __init__(self, units_path: str = "units.json", buildings_path: str = "buildings.json",
+                 workers: Optional[int] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                 batch_window: float = DEFAULT_BATCH_WINDOW, max_pending: int = DEFAULT_MAX_PENDING,
+                 timeout: float = DEFAULT_TIMEOUT, cache_path: Optional[str] = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            self.workers, initializer=cow_sweep._init_worker, initargs=(units_path, buildings_path, cache_path))
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.timeout = timeout
+        self.queue: "asyncio.Queue[_Pending]" = asyncio.Queue(max_pending)
+        # 同时在途的批次数，超过时凑批协程阻塞，队列随之填满形成背压
+        self.in_flight = asyncio.Semaphore(self.workers * 2)
+        self.stats = ServerStats()
+        self.started = time.time()
+        self._servers = []
+        self._batcher: Optional[asyncio.Task] = None
+        self._conns = set()
+
+    # ------------------------------------------------------------------
+    # 凑批与调度
+    # ------------------------------------------------------------------
+
+    def submit(self, conf: dict, trials: int = 0, seed: Optional[int] = None) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait(_Pending((conf, trials, seed), fut))
+        except asyncio.QueueFull:
+            self.stats.rejected += 1
+            raise Overloaded("server overloaded")
+        self.stats.requests += 1
+        return fut
+
+    async def enqueue(self, conf: dict, trials: int = 0, seed: Optional[int] = None) -> asyncio.Future:
+        """同 submit，但队列已满时等待空位而不是拒绝 (用于 /batch 内的各项)。"""
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put(_Pending((conf, trials, seed), fut))
+        self.stats.requests += 1
+        return fut
+
+    async def run_one(self, conf: dict, trials: int = 0, seed: Optional[int] = None, wait: bool = False) -> dict:
+        """wait=True 时排队等待空位 (见 enqueue)，超时从进入队列开始计算。"""
+        fut = await self.enqueue(conf, trials, seed) if wait else self.submit(conf, trials, seed)
+        try:
+            # 超时会取消 future，尚在排队的请求随后被凑批协程丢弃
+            return await asyncio.wait_for(fut, self.timeout)
+        except asyncio.TimeoutError:
+            self.stats.timeouts += 1
+            raise
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            batch = [p for p in batch if not p.future.done()]
+            if not batch:
+                continue
+            await self.in_flight.acquire()
+            asyncio.ensure_future(self._dispatch(batch))
+
+    async def _dispatch(self, batch: List[_Pending]):
+        loop = asyncio.get_running_loop()
+        try:
+            self.stats.batches += 1
+            self.stats.batched_items += len(batch)
+            try:
+                results = await loop.run_in_executor(self.pool, _run_batch, [p.item for p in batch])
+            except Exception as e:
+                results = [{"error": f"{type(e).__name__}: {e}"}] * len(batch)
+            for p, res in zip(batch, results):
+                if "error" in res:
+                    self.stats.errors += 1
+                self.stats.completed += 1
+                if not p.future.done():
+                    p.future.set_result(res)
+        finally:
+            self.in_flight.release()
+
+    # ------------------------------------------------------------------
+    # HTTP
+    # ------------------------------------------------------------------
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765, unix: Optional[str] = None):
+        # 先拉起全部 worker 并加载数据库：既避免首个请求承担启动开销，
+        # 也避免 fork 出的子进程继承之后建立的 socket (会导致连接关闭后对端收不到 EOF)
+        await asyncio.get_running_loop().run_in_executor(self.pool, _run_batch, [])
+        self._batcher = asyncio.ensure_future(self._batch_loop())
+        if unix:
+            self._servers.append(await asyncio.start_unix_server(self._handle, path=unix))
+        else:
+            self._servers.append(await asyncio.start_server(self._handle, host, port))
+        return self._servers[-1]
+
+    async def close(self):
+        for srv in self._servers:
+            srv.close()
+            await srv.wait_closed()
+        # 给仍在处理的连接一点时间收尾，之后强制断开
+        if self._conns:
+            _, rest = await asyncio.wait(self._conns, timeout=1.0)
+            for task in rest:
+                task.cancel()
+        if self._batcher:
+            self._batcher.cancel()
+        self.pool.shutdown(cancel_futures=True)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._conns.add(task)
+        try:
+            while True:
+                try:
+                    req = await _read_request(reader)
+                except HttpError as e:
+                    # 请求头/体不完整，连接状态不可信，回复后直接断开
+                    await _send_json(writer, e.status, {"error": str(e)})
+                    break
+                if req is None:
+                    break
+                method, path, headers, body = req
+                try:
+                    await self._route(method, path, body, writer)
+                except HttpError as e:
+                    await _send_json(writer, e.status, {"error": str(e)})
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._conns.discard(task)
+            writer.close()
+
+    async def _route(self, method: str, path: str, body: bytes, writer: asyncio.StreamWriter):
+        if path == "/health":
+            return await _send_json(writer, 200, {"ok": True})
+        if path == "/stats":
+            return await _send_json(writer, 200, {**asdict(self.stats), "mean_batch": self.stats.mean_batch,
+                                                  "queued": self.queue.qsize(), "workers": self.workers,
+                                                  "uptime": time.time() - self.started})
+        if path not in ("/battle", "/batch"):
+            raise HttpError(404, f"unknown path {path}")
+        if method != "POST":
+            raise HttpError(405, "POST required")
+        try:
+            payload = json.loads(body)
+        except ValueError as e:
+            raise HttpError(400, f"invalid JSON: {e}")
+        if not isinstance(payload, dict):
+            raise HttpError(400, "request body must be a JSON object")
+
+        if path == "/battle":
+            try:
+                res = await self.run_one(payload, *_trials_seed(payload))
+            except Overloaded as e:
+                raise HttpError(503, str(e))
+            except asyncio.TimeoutError:
+                raise HttpError(504, "battle timed out")
+            return await _send_json(writer, 500 if "error" in res else 200, res)
+
+        await self._stream_batch(payload, writer)
+
+    async def _stream_batch(self, payload: dict, writer: asyncio.StreamWriter):
+        configs = payload.get("configs")
+        if not isinstance(configs, list):
+            raise HttpError(400, "\"configs\" must be a list")
+        trials, seed = _trials_seed(payload)
+
+        # 各项等待队列空位而不是直接 503：超过 max_pending 的批次不会拒绝自己的后续项，
+        # 队列满时其他客户端的单个请求仍按 Overloaded 处理
+        async def one(idx: int, conf: dict) -> dict:
+            try:
+                return {"index": idx, **await self.run_one(conf, trials, seed, wait=True)}
+            except asyncio.TimeoutError:
+                return {"index": idx, "error": "battle timed out"}
+
+        tasks = [asyncio.ensure_future(one(i, c)) for i, c in enumerate(configs)]
+        try:
+            writer.write(_head(200, "application/x-ndjson", {"Transfer-Encoding": "chunked"}))
+            for coro in asyncio.as_completed(tasks):
+                line = (json.dumps(await coro, ensure_ascii=False) + "\n").encode()
+                writer.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                await writer.drain()
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            # 连接中断时取消尚未完成的项 (仍在排队的随后被凑批协程丢弃)
+            for t in tasks:
+                t.cancel()
+
+async def _read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, path, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise HttpError(400, "malformed request line")
+    headers = {}
+    while True:
+        h = await reader.readline()
+        if h in (b"\r\n", b"\n", b""):
+            break
+        k, _, v = h.decode("latin-1").partition(":")
+        headers[k.strip().lower()] = v.strip()
+    try:
+        n = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HttpError(400, "invalid Content-Length")
+    if n < 0:
+        raise HttpError(400, "invalid Content-Length")
+    if n > MAX_BODY:
+        raise HttpError(413, "request body too large")
+    body = await reader.readexactly(n) if n else b""
+    return method, path, headers, body
+
+def _trials_seed(payload: dict) -> Tuple[int, Optional[int]]:
+    """读取顶层 "trials" / "seed"，类型或取值不合法时返回 400。"""
+    trials, seed = payload.get("trials", 0), payload.get("seed")
+    # bool 是 int 的子类，需要单独排除
+    if not isinstance(trials, int) or isinstance(trials, bool) or trials < 0:
+        raise HttpError(400, "\"trials\" must be a non-negative integer")
+    if seed is not None and (not isinstance(seed, int) or isinstance(seed, bool)):
+        raise HttpError(400, "\"seed\" must be an integer or null")
+    return trials, seed
+
+def _head(status: int, ctype: str, extra: Dict[str, str]) -> bytes:
+    lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}", f"Content-Type: {ctype}"]
+    lines += [f"{k}: {v}" for k, v in extra.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+async def _send_json(writer: asyncio.StreamWriter, status: int, obj):
+    data = json.dumps(obj, ensure_ascii=False).encode()
+    extra = {"Content-Length": str(len(data))}
+    if status == 503:
+        extra["Retry-After"] = "1"
+    writer.write(_head(status, "application/json", extra) + data)
+    await writer.drain()
+
+# ============================================================================
+# 4. 客户端与基准测试
+# ============================================================================
+
+class BattleClient:
+    """保持长连接的最小 HTTP 客户端，供基准测试和脚本调用。"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host: str = "127.0.0.1", port: int = 8765, unix: Optional[str] = None):
+        if unix:
+            return cls(*await asyncio.open_unix_connection(unix))
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def post(self, path: str, obj) -> Tuple[int, dict]:
+        data = json.dumps(obj).encode()
+        self.writer.write(f"POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                          f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            h = await self.reader.readline()
+            if h in (b"\r\n", b""):
+                break
+            k, _, v = h.decode("latin-1").partition(":")
+            if k.strip().lower() == "content-length":
+                length = int(v)
+        return status, json.loads(await self.reader.readexactly(length))
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+def bench_subprocess(config_path: str, n: int) -> float:
+    """
+    逐次启动 run_battle.py 子进程 (原调用方式)，返回每秒请求数。
+    子进程以 --quiet 运行，与服务端一样不生成逐回合战报，两边只比较启动与计算开销。
+    """
+    t0 = time.perf_counter()
+    for _ in range(n):
+        subprocess.run([sys.executable, "run_battle.py", "--config", config_path, "--quiet"],
+                       stdout=subprocess.DEVNULL, check=True)
+    return n / (time.perf_counter() - t0)
+
+async def bench_server(conf: dict, n: int, concurrency: int, workers: Optional[int] = None,
+                       port: int = 0) -> Tuple[float, ServerStats]:
+    """启动进程内服务端，用 concurrency 条长连接并发发送 n 个请求，返回 (每秒请求数, 服务端统计)。"""
+    server = BattleServer(workers=workers)
+    srv = await server.start(port=port)
+    port = srv.sockets[0].getsockname()[1]
+    counter = iter(range(n))
+
+    async def client():
+        c = await BattleClient.connect(port=port)
+        for _ in counter:
+            status, _ = await c.post("/battle", conf)
+            if status != 200:
+                raise RuntimeError(f"server returned {status}")
+        await c.close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    rate = n / (time.perf_counter() - t0)
+    await server.close()
+    return rate, server.stats
+
+# ============================================================================
+# 5. 命令行
+# ============================================================================
+
+async def _serve(args):
+    server = BattleServer(args.units, args.buildings, args.workers, args.batch_size, args.batch_window / 1000,
+                          args.max_pending, args.timeout, args.cache)
+    srv = await server.start(args.host, args.port, args.unix)
+    where = args.unix or "{}:{}".format(*srv.sockets[0].getsockname()[:2])
+    print(f"battle server listening on {where} ({server.workers} workers)", file=sys.stderr, flush=True)
+    try:
+        await srv.serve_forever()
+    finally:
+        await server.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="常驻战斗计算服务")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("serve", help="启动服务")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--unix", default=None, help="改为监听 Unix socket 路径")
+    p.add_argument("--workers", type=int, default=None, help="进程数 (默认 CPU 核数)")
+    p.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    p.add_argument("--batch-window", type=float, default=DEFAULT_BATCH_WINDOW * 1000, help="凑批等待 (毫秒)")
+    p.add_argument("--max-pending", type=int, default=DEFAULT_MAX_PENDING, help="排队上限 (超出返回 503)")
+    p.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="单个请求超时 (秒)")
+    p.add_argument("--cache", default=None, help="确定性战斗结果缓存 (sqlite 文件路径)")
+    p.add_argument("--units", default="units.json")
+    p.add_argument("--buildings", default="buildings.json")
+
+    b = sub.add_parser("bench", help="对比子进程调用与常驻服务的吞吐")
+    b.add_argument("--config", default="battle_config.json")
+    b.add_argument("-n", type=int, default=20, help="请求数")
+    b.add_argument("--concurrency", type=int, default=8)
+    b.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "serve":
+        try:
+            asyncio.run(_serve(args))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    with open(args.config, 'r', encoding='utf-8') as f: conf = json.load(f)
+    sub_rate = bench_subprocess(args.config, args.n)
+    srv_rate, stats = asyncio.run(bench_server(conf, args.n, args.concurrency, args.workers))
+    print(f"subprocess: {sub_rate:8.2f} req/s")
+    print(f"server:     {srv_rate:8.2f} req/s  (x{srv_rate / sub_rate:.1f}, mean batch {stats.mean_batch:.1f})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+import sys
+import argparse
+from dataclasses import dataclass, field
+from statistics import NormalDist
+from typing import List, Dict, Optional, Tuple
+
+from cow_core import Army, BattleMode, BattleOutcome, UnitGroup, run_simulation
+from cow_batch import count_outcomes, snapshot_army, restore_army
+from cow_cache import BattleCache
+from cow_db import load_databases
+from run_battle import load_json, build_army
+
+# ============================================================================
+# 1. 目标 Group 定位
+# ============================================================================
+# 目标单位用配置路径表示，例如 "team_a.stacks.0.units.0"；旧格式 (team 直接带 units) 写作 "team_a.units.0"。
+
+def _locate(conf: dict, path: str, army: Army, units_db: dict) -> Tuple[UnitGroup, dict]:
+    keys = path.split(".")
+    team = conf[keys[0]]
+    if keys[1] == "units":
+        s_idx, entries, u_idx = 0, team["units"], int(keys[2])
+    else:
+        s_idx, entries, u_idx = int(keys[2]), team["stacks"][int(keys[2])]["units"], int(keys[4])
+    # build_army 会跳过数据库中不存在的单位，这里按同样规则换算 Group 下标
+    g_idx = sum(1 for e in entries[:u_idx] if e["id"] in units_db)
+    return army.stacks[s_idx].groups[g_idx], entries[u_idx]
+
+def _set_count(group: UnitGroup, entry: dict, count: int):
+    """直接修改已构建的 Group 数量 (保持配置中的血量比例)，避免每次探测都从 JSON 重建 Army。"""
+    full = count * group.max_hp_per_unit
+    if entry.get("current_hp") is not None:
+        base_full = entry["count"] * group.max_hp_per_unit
+        ratio = float(entry["current_hp"]) / base_full if base_full > 0 else 1.0
+    elif entry.get("hp_ratio") is not None:
+        ratio = float(entry["hp_ratio"])
+    else:
+        ratio = 1.0
+    group.count = count
+    group.current_hp = full * ratio
+    group.initial_count = count
+    group.initial_hp = group.current_hp
+
+def _split_total(total: int, shares: List[float]) -> List[int]:
+    """按比例把总数拆给各目标 (最大余数法，保证和为 total)。"""
+    raw = [total * s for s in shares]
+    out = [int(r) for r in raw]
+    rest = total - sum(out)
+    for i in sorted(range(len(raw)), key=lambda i: raw[i] - out[i], reverse=True)[:rest]:
+        out[i] += 1
+    return out
+
+# ============================================================================
+# 2. 结果结构
+# ============================================================================
+
+@dataclass
+class Probe:
+    total: int
+    wins: int = 0
+    trials: int = 0
+    passed: Optional[bool] = None
+
+    @property
+    def win_prob(self) -> float:
+        return self.wins / self.trials if self.trials else 0.0
+
+@dataclass
+class SolverResult:
+    total: Optional[int]            # 满足目标的最小总数，None 表示在 max_count 内无解
+    counts: Dict[str, int]
+    win_prob: float
+    ci: Tuple[float, float]
+    trials_used: int
+    probes: List[Probe] = field(default_factory=list)
+
+def wilson_interval(wins: int, n: int, z: float) -> Tuple[float, float]:
+    if n == 0: return 0.0, 1.0
+    p = wins / n
+    denom = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denom
+    half = z * ((p * (1 - p) / n + z * z / (4 * n * n)) ** 0.5) / denom
+    return max(0.0, center - half), min(1.0, center + half)
+
+# ============================================================================
+# 3. 求解器
+# ============================================================================
+
+class ForceSolver:
+    """
+    搜索目标单位的最小总数，使我方胜率达到 target (在给定置信度下)。
+    假设胜率随数量单调不减：先倍增/折半 (galloping) 找到区间，再二分。
+    每个数量的探测结果会被缓存，后续回到同一数量时在已有样本上继续加测；
+    所有探测的第 t 个试验使用同一随机流 (共同随机数)，相邻数量的比较更稳定。
+    """
+
+    def __init__(self, conf: dict, units_db: dict, buildings_db: dict, targets: List[str],
+                 target: float = 0.9, confidence: float = 0.95, batch: int = 256, max_trials: int = 8192,
+                 seed: int = 0, engine: str = "auto", cache: Optional[BattleCache] = None):
+        self.conf = conf
+        self.army_a = build_army(conf["team_a"], units_db, buildings_db)
+        self.army_b = build_army(conf["team_b"], units_db, buildings_db)
+        self.mode = BattleMode(conf.get("battle_mode", "LAND_ATTACK"))
+        self.max_rounds = conf.get("max_rounds", 50)
+        self.use_random = conf.get("enable_randomness", True)
+        self.siege = conf.get("siege_damage", True)
+        self.extrapolate = conf.get("extrapolate_steady_state", False)
+
+        sides = {p.split(".")[0] for p in targets}
+        if len(sides) != 1:
+            raise ValueError("all targets must belong to the same team")
+        self.side = sides.pop()
+        army = self.army_a if self.side == "team_a" else self.army_b
+        self.targets = targets
+        self.located = [_locate(conf, p, army, units_db) for p in targets]
+        base = [entry["count"] for _, entry in self.located]
+        base_total = sum(base)
+        self.shares = [c / base_total for c in base] if base_total > 0 else [1.0 / len(base)] * len(base)
+        self.base_total = max(1, base_total)
+
+        self.target = target
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self.batch = batch
+        self.max_trials = max_trials
+        self.seed = seed
+        self.engine = engine
+        self.cache = cache
+        self.probes: Dict[int, Probe] = {}
+
+    def _apply(self, total: int) -> Dict[str, int]:
+        counts = _split_total(total, self.shares)
+        for (group, entry), c in zip(self.located, counts):
+            _set_count(group, entry, c)
+        return dict(zip(self.targets, counts))
+
+    def _wins(self, trials: int, first_trial: int) -> int:
+        a_win, _, b_win = count_outcomes(self.army_a, self.army_b, self.mode, trials, self.max_rounds,
+                                         self.seed, self.engine, first_trial, self.siege)
+        return a_win if self.side == "team_a" else b_win
+
+    def evaluate(self, total: int) -> Probe:
+        probe = self.probes.setdefault(total, Probe(total))
+        if probe.passed is not None:
+            return probe
+        self._apply(total)
+
+        if not self.use_random:
+            snap_a, snap_b = snapshot_army(self.army_a), snapshot_army(self.army_b)
+            if self.cache is not None:
+                res = self.cache.run(self.army_a, self.army_b, self.mode, self.max_rounds,
+                                     extrapolate=self.extrapolate, siege_damage=self.siege)
+            else:
+                res = run_simulation(self.army_a, self.army_b, self.mode, self.max_rounds, False, False,
+                                     verbose=False, extrapolate=self.extrapolate, siege_damage=self.siege)
+            restore_army(self.army_a, snap_a)
+            restore_army(self.army_b, snap_b)
+            want = BattleOutcome.A_WIN if self.side == "team_a" else BattleOutcome.B_WIN
+            probe.trials, probe.wins = 1, int(res.outcome == want)
+            probe.passed = probe.wins == 1
+            return probe
+
+        # 逐批加测，置信区间完全落在目标一侧即提前停止
+        while probe.trials < self.max_trials:
+            # 第 t 个试验始终使用随机流 (seed, t)，与 cow_batch / cow_optimize 一致
+            probe.wins += self._wins(self.batch, probe.trials)
+            probe.trials += self.batch
+            lo, hi = wilson_interval(probe.wins, probe.trials, self.z)
+            if lo >= self.target:
+                probe.passed = True
+                return probe
+            if hi < self.target:
+                probe.passed = False
+                return probe
+        probe.passed = probe.win_prob >= self.target
+        return probe
+
+    def solve(self, start: Optional[int] = None, max_count: int = 100000) -> SolverResult:
+        n = max(1, start or self.base_total)
+        lo, hi = 0, None   # lo: 已知不满足；hi: 已知满足
+
+        # 1. Galloping
+        if self.evaluate(n).passed:
+            hi = n
+            while n > 1:
+                n //= 2
+                if self.evaluate(n).passed: hi = n
+                else:
+                    lo = n
+                    break
+        else:
+            lo = n
+            while n < max_count:
+                n = min(n * 2, max_count)
+                if self.evaluate(n).passed:
+                    hi = n
+                    break
+                lo = n
+
+        if hi is None:
+            return self._result(None)
+
+        # 2. 二分
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if self.evaluate(mid).passed: hi = mid
+            else: lo = mid
+        return self._result(hi)
+
+    def _result(self, total: Optional[int]) -> SolverResult:
+        trials_used = sum(p.trials for p in self.probes.values())
+        probes = sorted(self.probes.values(), key=lambda p: p.total)
+        if total is None:
+            return SolverResult(None, {}, 0.0, (0.0, 0.0), trials_used, probes)
+        p = self.probes[total]
+        counts = self._apply(total)
+        # 关闭随机时结果是确定的，区间退化为单点
+        ci = wilson_interval(p.wins, p.trials, self.z) if self.use_random else (p.win_prob, p.win_prob)
+        return SolverResult(total, counts, p.win_prob, ci, trials_used, probes)
+
+def solve_min_force(conf: dict, units_db: dict, buildings_db: dict, targets: List[str], target: float = 0.9,
+                    confidence: float = 0.95, start: Optional[int] = None, max_count: int = 100000,
+                    **kwargs) -> SolverResult:
+    return ForceSolver(conf, units_db, buildings_db, targets, target, confidence, **kwargs).solve(start, max_count)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="求满足目标胜率的最小兵力")
+    parser.add_argument("--config", default="battle_config.json")
+    parser.add_argument("--unit", action="append", required=True,
+                        help="目标单位路径 (可多次指定，按配置中的数量比例分配)，如 team_a.stacks.0.units.0")
+    parser.add_argument("--target", type=float, default=0.9, help="目标胜率")
+    parser.add_argument("--confidence", type=float, default=0.95, help="置信度")
+    parser.add_argument("--batch", type=int, default=256, help="每批 Monte Carlo 次数")
+    parser.add_argument("--max-trials", type=int, default=8192, help="单个探测点的最大试验次数")
+    parser.add_argument("--max-count", type=int, default=100000, help="搜索上限")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    conf = load_json(args.config)
+    units_db, buildings_db = load_databases("units.json", "buildings.json")
+    solver = ForceSolver(conf, units_db, buildings_db, args.unit,
+                         args.target, args.confidence, args.batch, args.max_trials, args.seed)
+    res = solver.solve(max_count=args.max_count)
+    for p in res.probes:
+        print(f"  probe {p.total:>6}: {p.win_prob*100:6.2f}% ({p.wins}/{p.trials}) {'PASS' if p.passed else 'FAIL'}")
+    if res.total is None:
+        print(f"在 {args.max_count} 以内无法达到 {args.target*100:.1f}% 胜率")
+        return 1
+    print(f"最小兵力: {res.total} {res.counts} | 胜率 {res.win_prob*100:.2f}% "
+          f"[{res.ci[0]*100:.2f}%, {res.ci[1]*100:.2f}%] | 总试验 {res.trials_used}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
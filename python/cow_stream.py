@@ -0,0 +1,172 @@
+import io
+import sys
+import gzip
+import json
+import time
+import multiprocessing
+from collections import deque
+from dataclasses import dataclass
+from typing import List, Optional, Tuple, Iterable, Iterator, IO
+
+import cow_sweep
+from cow_sweep import run_case, task_seed
+
+# ============================================================================
+# 1. 配置
+# ============================================================================
+
+GZIP_MAGIC = b"\x1f\x8b"
+DEFAULT_CHUNKSIZE = 64
+# 每个 worker 同时在途的批次数：足以让 worker 不空等，又使主进程内存与输入规模无关
+INFLIGHT_PER_WORKER = 4
+
+# ============================================================================
+# 2. JSONL 输入 / 输出 (支持 gzip)
+# ============================================================================
+
+def open_input(path: str) -> IO[str]:
+    """打开 JSONL 输入 ("-" 为 stdin)，按文件头自动识别 gzip。"""
+    raw = sys.stdin.buffer if path == "-" else open(path, "rb")
+    if not isinstance(raw, io.BufferedReader):
+        raw = io.BufferedReader(raw)
+    if raw.peek(2)[:2] == GZIP_MAGIC:
+        raw = gzip.GzipFile(fileobj=raw, mode="rb")
+    return io.TextIOWrapper(raw, encoding="utf-8")
+
+class JsonlWriter:
+    """按批写出已编码的 JSONL 行 ("-" 为 stdout)。compress 为 None 时按 .gz 后缀决定是否 gzip。"""
+
+    def __init__(self, path: str, compress: Optional[bool] = None):
+        self._stdout = path == "-"
+        self._raw = sys.stdout.buffer if self._stdout else open(path, "wb")
+        if compress is None:
+            compress = path.endswith(".gz")
+        self._gz = gzip.GzipFile(fileobj=self._raw, mode="wb") if compress else None
+        self.f = io.TextIOWrapper(self._gz or self._raw, encoding="utf-8", newline="\n")
+
+    def write_lines(self, lines: List[str]):
+        self.f.write("".join(lines))
+        self.f.flush()
+
+    def close(self):
+        self.f.flush()
+        self.f.detach()
+        if self._gz is not None:
+            self._gz.close()     # 写入 gzip 尾部，不关闭底层文件
+        if self._stdout:
+            self._raw.flush()
+        else:
+            self._raw.close()
+
+def iter_chunks(lines: Iterable[str], size: int) -> Iterator[List[Tuple[int, str]]]:
+    """把非空行按 size 分批，带上记录序号 (从 0 开始，跳过空行)。"""
+    chunk: List[Tuple[int, str]] = []
+    index = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        chunk.append((index, line))
+        index += 1
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# ============================================================================
+# 3. Worker (数据库由 cow_sweep._init_worker 常驻加载，每批之前检查热更新)
+# ============================================================================
+
+def process_record(index: int, line: str, trials: int = 0, seed: int = 0) -> Tuple[str, bool]:
+    """
+    运行一行配置，返回 (紧凑 JSON 行, 是否出错)。
+    配置中的 "seed" 优先，否则由 (基础种子, 记录序号) 派生，结果与分批和进程数无关；
+    配置中的 "id" 原样带回，便于与历史数据对齐。
+    """
+    rec = {"i": index}
+    try:
+        conf = json.loads(line)
+        if "id" in conf:
+            rec["id"] = conf["id"]
+        rec["seed"] = rec_seed = conf.get("seed", task_seed(seed, index))
+        db = cow_sweep._WORKER_DB
+        rec.update(run_case(conf, db["units"], db["buildings"], trials, rec_seed, db["cache"], detail=False))
+        failed = False
+    except Exception as e:  # 单条记录出错不应中断整个流
+        rec["error"] = f"{type(e).__name__}: {e}"
+        failed = True
+    return json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n", failed
+
+def _run_chunk(chunk: List[Tuple[int, str]], trials: int, seed: int) -> Tuple[List[str], int]:
+    cow_sweep.refresh_worker_db()
+    lines = []
+    errors = 0
+    for index, line in chunk:
+        out, failed = process_record(index, line, trials, seed)
+        lines.append(out)
+        errors += failed
+    return lines, errors
+
+# ============================================================================
+# 4. 流式主流程
+# ============================================================================
+
+@dataclass
+class StreamStats:
+    records: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+
+    def summary(self) -> str:
+        rate = self.records / self.seconds if self.seconds > 0 else 0.0
+        return f"stream done: {self.records} records, {self.errors} errors, {self.seconds:.2f} s ({rate:.1f} rec/s)"
+
+def run_stream(lines: Iterable[str], writer: JsonlWriter, trials: int = 0, seed: int = 0,
+               workers: Optional[int] = None, chunksize: int = DEFAULT_CHUNKSIZE,
+               units_path: str = "units.json", buildings_path: str = "buildings.json",
+               cache_path: Optional[str] = None) -> StreamStats:
+    """
+    逐行读取战斗配置，每条输出一行紧凑结果，输出顺序与输入一致。
+    输入按 chunksize 分批交给进程池，同时在途的批次数有上限，主进程只保留这些批次，
+    内存占用与输入总量无关。workers=1 时在当前进程内顺序执行。
+    """
+    stats = StreamStats()
+    t0 = time.perf_counter()
+    workers = workers or multiprocessing.cpu_count() or 1
+    chunks = iter_chunks(lines, max(1, chunksize))
+
+    def emit(done: Tuple[List[str], int]):
+        out, errors = done
+        writer.write_lines(out)
+        stats.records += len(out)
+        stats.errors += errors
+
+    if workers == 1:
+        cow_sweep._init_worker(units_path, buildings_path, cache_path)
+        for chunk in chunks:
+            emit(_run_chunk(chunk, trials, seed))
+    else:
+        # 不用 Pool.imap：它的分发线程会把整个输入一次读进队列
+        with multiprocessing.Pool(workers, initializer=cow_sweep._init_worker,
+                                  initargs=(units_path, buildings_path, cache_path)) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.apply_async(_run_chunk, (chunk, trials, seed)))
+                if len(pending) >= workers * INFLIGHT_PER_WORKER:
+                    emit(pending.popleft().get())
+            while pending:
+                emit(pending.popleft().get())
+
+    stats.seconds = time.perf_counter() - t0
+    return stats
+
+def stream_file(src: str, dst: str = "-", compress: Optional[bool] = None, **kwargs) -> StreamStats:
+    """src / dst 为路径或 "-" (stdin / stdout)；输入 gzip 自动识别，输出按 compress 或 .gz 后缀压缩。"""
+    reader = open_input(src)
+    writer = JsonlWriter(dst, compress)
+    try:
+        return run_stream(reader, writer, **kwargs)
+    finally:
+        writer.close()
+        if src != "-":
+            reader.close()
@@ -0,0 +1,371 @@
+import sys
+import copy
+import json
+import mmap
+import time
+import struct
+import argparse
+import itertools
+import multiprocessing
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import List, Dict, Optional, Tuple, Any
+
+from cow_core import BattleMode, BattleOutcome, run_simulation
+from cow_batch import run_monte_carlo
+from cow_rng import CounterRNG
+import cow_sweep
+from cow_sweep import set_path, task_seed
+from run_battle import load_json, build_army
+
+# ============================================================================
+# 1. 配置
+# ============================================================================
+# 结果曲面：对基础配置的若干参数 (轴) 做网格预计算，查询时在网格内多线性插值。
+# 连续轴 (数量、hp_ratio、terrain_bonus) 插值；离散轴 (core、建筑等级) 必须精确命中某个取值。
+
+MAGIC = b"COWSURF1"
+METRICS = ("win_prob", "draw_prob", "loss_prob", "mean_rounds", "a_dead", "a_hp_lost", "b_dead", "b_hp_lost")
+DEFAULT_TRIALS = 200
+DEFAULT_MAX_ERROR = 0.05
+
+@dataclass
+class Axis:
+    path: str                  # 配置路径，同 cow_sweep
+    values: List[Any]          # 连续轴须严格递增
+    discrete: bool = False
+
+    def to_dict(self) -> dict:
+        return {"path": self.path, "values": self.values, "discrete": self.discrete}
+
+def parse_axes(spec: Dict[str, Any]) -> List[Axis]:
+    """{路径: [取值...]} 或 {路径: {"values": [...], "discrete": true}}；布尔取值自动视为离散轴。"""
+    axes = []
+    for path, v in spec.items():
+        values, discrete = (v["values"], v.get("discrete", False)) if isinstance(v, dict) else (v, False)
+        discrete = discrete or any(isinstance(x, bool) for x in values)
+        if not values:
+            raise ValueError(f"axis {path!r} has no values")
+        if not discrete and any(b <= a for a, b in zip(values, values[1:])):
+            raise ValueError(f"continuous axis {path!r} must be strictly increasing")
+        axes.append(Axis(path, list(values), discrete))
+    return axes
+
+# ============================================================================
+# 2. 单点模拟
+# ============================================================================
+
+def point_config(base_conf: dict, params: Dict[str, Any]) -> dict:
+    conf = copy.deepcopy(base_conf)
+    for path, value in params.items():
+        set_path(conf, path, value)
+    return conf
+
+def simulate_point(conf: dict, units_db: dict, buildings_db: dict, trials: int, seed: int) -> Tuple[float, ...]:
+    """按 METRICS 顺序返回一个配置的指标；trials > 0 为 Monte Carlo 期望，否则按配置运行一场。"""
+    army_a = build_army(conf["team_a"], units_db, buildings_db)
+    army_b = build_army(conf["team_b"], units_db, buildings_db)
+    mode = BattleMode(conf.get("battle_mode", "LAND_ATTACK"))
+    max_rounds = conf.get("max_rounds", 50)
+    if trials > 0:
+        mc = run_monte_carlo(army_a, army_b, mode, trials, max_rounds, seed,
+                             siege_damage=conf.get("siege_damage", True))
+        return (mc.win_prob, mc.draw_prob, mc.loss_prob, mc.mean_rounds,
+                sum(s.mean_dead for s in mc.side_a.stacks), sum(s.mean_hp_lost for s in mc.side_a.stacks),
+                sum(s.mean_dead for s in mc.side_b.stacks), sum(s.mean_hp_lost for s in mc.side_b.stacks))
+    res = run_simulation(army_a, army_b, mode, max_rounds, conf.get("enable_randomness", True), False,
+                         verbose=False, rng=CounterRNG(seed), extrapolate=conf.get("extrapolate_steady_state", False),
+                         siege_damage=conf.get("siege_damage", True))
+    return (float(res.outcome == BattleOutcome.A_WIN), float(res.outcome == BattleOutcome.DRAW),
+            float(res.outcome == BattleOutcome.B_WIN), float(res.rounds),
+            float(res.army_a.total_dead), res.army_a.total_hp_lost,
+            float(res.army_b.total_dead), res.army_b.total_hp_lost)
+
+# ============================================================================
+# 3. 离线预计算
+# ============================================================================
+
+# worker 数据库由 cow_sweep._init_worker 加载。预计算期间不做热更新，整张曲面使用同一份数据。
+
+def _run_point(task: Tuple[dict, int, int]) -> Tuple[float, ...]:
+    conf, trials, seed = task
+    db = cow_sweep._WORKER_DB
+    return simulate_point(conf, db["units"], db["buildings"], trials, seed)
+
+def build_surface(base_conf: dict, axes: List[Axis], path: str, trials: int = DEFAULT_TRIALS, seed: int = 0,
+                  workers: Optional[int] = None, units_path: str = "units.json",
+                  buildings_path: str = "buildings.json") -> int:
+    """
+    对轴的笛卡尔积逐点模拟并写出曲面文件，返回网格点数。点的顺序为行优先 (最后一个轴变化最快)，
+    每点的种子由 (seed, 点序号) 派生，与进程数无关。
+    """
+    workers = workers or multiprocessing.cpu_count() or 1
+    tasks = ((point_config(base_conf, dict(zip((a.path for a in axes), values))), trials, task_seed(seed, i))
+             for i, values in enumerate(itertools.product(*(a.values for a in axes))))
+    n_points = 1
+    for a in axes:
+        n_points *= len(a.values)
+
+    data = array('d')
+    if workers == 1:
+        cow_sweep._init_worker(units_path, buildings_path)
+        for task in tasks:
+            data.extend(_run_point(task))
+    else:
+        chunksize = max(1, n_points // (workers * 4))
+        with multiprocessing.Pool(workers, initializer=cow_sweep._init_worker,
+                                  initargs=(units_path, buildings_path)) as pool:
+            for row in pool.imap(_run_point, tasks, chunksize):
+                data.extend(row)
+
+    header = json.dumps({"axes": [a.to_dict() for a in axes], "metrics": list(METRICS), "trials": trials,
+                         "seed": seed, "base": base_conf}, ensure_ascii=False).encode()
+    write_surface(path, header, data)
+    return n_points
+
+# ============================================================================
+# 4. 文件格式
+# ============================================================================
+# MAGIC (8 字节) | 头部长度 (u32 小端) | 头部 JSON | 补齐到 8 字节 | float64 小端数组 [点][指标]
+# 数据区直接 mmap 后按 memoryview.cast("d") 读取，打开文件不拷贝数据，多个进程共享同一份页缓存。
+
+def _data_offset(header_len: int) -> int:
+    return (len(MAGIC) + 4 + header_len + 7) // 8 * 8
+
+def write_surface(path: str, header: bytes, data: array):
+    if sys.byteorder != "little":
+        data = array('d', data)
+        data.byteswap()
+    with open(path, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header)) + header)
+        f.write(b"\0" * (_data_offset(len(header)) - f.tell()))
+        data.tofile(f)
+
+@dataclass
+class SurfaceAnswer:
+    values: Dict[str, float]
+    source: str             # "grid" (插值) / "live" (实时模拟)
+    error: float = 0.0      # 插值误差估计，见 OutcomeSurface.lookup
+
+class OutcomeSurface:
+    """
+    只读结果曲面。lookup() 只做插值 (网格外返回 None)，query() 在网格外、
+    参数不在轴上或误差估计超过 max_error 时回退到实时模拟。
+
+        with OutcomeSurface("tank_vs_inf.surf") as surf:
+            ans = surf.query({"team_a.stacks.0.units.0.count": 12, "team_b.stacks.0.building.level": 2})
+    """
+
+    def __init__(self, path: str, units_path: str = "units.json", buildings_path: str = "buildings.json"):
+        if sys.byteorder != "little":
+            raise RuntimeError("surface files are little-endian; big-endian hosts are not supported")
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not an outcome surface file")
+        (header_len,) = struct.unpack_from("<I", self._mm, len(MAGIC))
+        start = len(MAGIC) + 4
+        meta = json.loads(self._mm[start:start + header_len].decode())
+        self.axes = [Axis(a["path"], a["values"], a["discrete"]) for a in meta["axes"]]
+        self.metrics: List[str] = meta["metrics"]
+        self.trials: int = meta["trials"]
+        self.seed: int = meta["seed"]
+        self.base: dict = meta["base"]
+        self._data = memoryview(self._mm)[_data_offset(header_len):].cast("d")
+        self._paths = frozenset(a.path for a in self.axes)
+        self._index = [{v: i for i, v in enumerate(a.values)} if a.discrete else None for a in self.axes]
+        # 行优先步长 (以点为单位)
+        self._strides = []
+        stride = 1
+        for a in reversed(self.axes):
+            self._strides.append(stride)
+            stride *= len(a.values)
+        self._strides.reverse()
+        if len(self._data) != stride * len(self.metrics):
+            self.close()
+            raise ValueError(f"{path}: data size does not match header")
+        self._units_path, self._buildings_path = units_path, buildings_path
+        self.live_runs = 0
+
+    def close(self):
+        if getattr(self, "_data", None) is not None:
+            self._data.release()
+            self._data = None
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self) -> "OutcomeSurface":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def __len__(self) -> int:
+        return len(self._data) // len(self.metrics)
+
+    def point(self, idx: int) -> Dict[str, float]:
+        m = len(self.metrics)
+        return dict(zip(self.metrics, self._data[idx * m:(idx + 1) * m]))
+
+    # ------------------------------------------------------------------
+    # 插值
+    # ------------------------------------------------------------------
+
+    def _corners(self, params: Dict[str, Any]) -> Optional[List[List[Tuple[int, float]]]]:
+        """每个轴的 (下标, 权重) 列表；参数不全或落在网格外时返回 None。"""
+        out = []
+        for axis, index in zip(self.axes, self._index):
+            if axis.path not in params:
+                return None
+            x = params[axis.path]
+            if index is not None:
+                i = index.get(x)
+                if i is None:
+                    return None
+                out.append([(i, 1.0)])
+                continue
+            vals = axis.values
+            if x < vals[0] or x > vals[-1]:
+                return None
+            j = min(bisect_right(vals, x) - 1, len(vals) - 1)
+            t = 0.0 if j == len(vals) - 1 else (x - vals[j]) / (vals[j + 1] - vals[j])
+            # 恰好落在网格值上时只取一个角点，结果与预计算值完全一致
+            out.append([(j, 1.0)] if t == 0.0 else [(j, 1.0 - t), (j + 1, t)])
+        return out
+
+    def _curvature_error(self, corners: List[List[Tuple[int, float]]]) -> List[float]:
+        """
+        各指标的线性插值误差估计：对每个需要插值的轴，在单元下角点处用相邻三个网格点的二阶均差 dd
+        估计曲率，误差约为 |dd| * (x - x_j) * (x_{j+1} - x)，各轴相加。只有两个取值的轴无从估计曲率，
+        改用该轴两端的差值 (保守)。
+        """
+        m = len(self.metrics)
+        data, strides = self._data, self._strides
+        base = sum(c[0][0] * st for c, st in zip(corners, strides))
+        err = [0.0] * m
+        for ax, c in enumerate(corners):
+            if len(c) == 1:
+                continue
+            vals = self.axes[ax].values
+            j, t = c[0][0], c[1][1]
+            st = strides[ax]
+            if len(vals) < 3:
+                p0, p1 = data[base * m:(base + 1) * m], data[(base + st) * m:(base + st + 1) * m]
+                for k in range(m):
+                    err[k] += abs(p1[k] - p0[k])
+                continue
+            i0 = j - 1 if j > 0 else j
+            x0, x1, x2 = vals[i0], vals[i0 + 1], vals[i0 + 2]
+            o0 = (base + (i0 - j) * st) * m
+            f0, f1, f2 = data[o0:o0 + m], data[o0 + st * m:o0 + st * m + m], data[o0 + 2 * st * m:o0 + 2 * st * m + m]
+            h = vals[j + 1] - vals[j]
+            scale = t * (1.0 - t) * h * h / (x2 - x0)
+            for k in range(m):
+                dd = (f2[k] - f1[k]) / (x2 - x1) - (f1[k] - f0[k]) / (x1 - x0)
+                err[k] += abs(dd) * scale
+        return err
+
+    def lookup(self, params: Dict[str, Any]) -> Optional[SurfaceAnswer]:
+        """
+        多线性插值，error 为各指标插值误差估计的最大值 (见 _curvature_error)；概率类指标取绝对误差，
+        其余指标除以 max(1, |插值|) 换算为相对误差。落在网格点上时 error 为 0。
+        """
+        if not self._paths.issuperset(params):
+            return None
+        corners = self._corners(params)
+        if corners is None:
+            return None
+        m = len(self.metrics)
+        data, strides = self._data, self._strides
+        acc = [0.0] * m
+        for combo in itertools.product(*corners):
+            off = 0
+            w = 1.0
+            for (i, wi), stride in zip(combo, strides):
+                off += i * stride
+                w *= wi
+            row = data[off * m:off * m + m]
+            for k in range(m):
+                acc[k] += w * row[k]
+        error = 0.0
+        if any(len(c) > 1 for c in corners):
+            error = max(e / max(1.0, abs(v)) for e, v in zip(self._curvature_error(corners), acc))
+        return SurfaceAnswer(dict(zip(self.metrics, acc)), "grid", error)
+
+    # ------------------------------------------------------------------
+    # 查询 (带实时回退)
+    # ------------------------------------------------------------------
+
+    def simulate(self, params: Dict[str, Any], trials: Optional[int] = None) -> SurfaceAnswer:
+        """对基础配置应用 params 后实时模拟 (试验次数默认与预计算一致)。"""
+        db = cow_sweep.worker_databases(self._units_path, self._buildings_path)
+        self.live_runs += 1
+        conf = point_config(self.base, params)
+        values = simulate_point(conf, *db, self.trials if trials is None else trials, self.seed)
+        return SurfaceAnswer(dict(zip(METRICS, values)), "live")
+
+    def query(self, params: Dict[str, Any], max_error: float = DEFAULT_MAX_ERROR, live: bool = True
+              ) -> Optional[SurfaceAnswer]:
+        ans = self.lookup(params)
+        if ans is not None and ans.error <= max_error:
+            return ans
+        return self.simulate(params) if live else None
+
+# ============================================================================
+# 5. 命令行
+# ============================================================================
+
+def _parse_params(items: List[str]) -> Dict[str, Any]:
+    params = {}
+    for item in items:
+        path, _, raw = item.partition("=")
+        params[path] = json.loads(raw)
+    return params
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="结果曲面：离线预计算与插值查询")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_build = sub.add_parser("build", help="按规格文件预计算网格")
+    p_build.add_argument("spec", help="规格文件: {\"base\": <配置路径或对象>, \"axes\": {路径: [取值...]}}")
+    p_build.add_argument("out", help="输出曲面文件")
+    p_build.add_argument("--trials", type=int, default=None, help=f"每点 Monte Carlo 次数 (默认 {DEFAULT_TRIALS})")
+    p_build.add_argument("--seed", type=int, default=None)
+    p_build.add_argument("--workers", type=int, default=None, help="进程数 (默认 CPU 核数)")
+    p_query = sub.add_parser("query", help="查询一个参数点")
+    p_query.add_argument("surface")
+    p_query.add_argument("params", nargs="+", help="路径=JSON 值，如 team_a.stacks.0.units.0.count=12")
+    p_query.add_argument("--max-error", type=float, default=DEFAULT_MAX_ERROR)
+    p_query.add_argument("--no-live", action="store_true", help="只插值，不回退到实时模拟")
+    p_query.add_argument("--repeat", type=int, default=10000, help="插值计时的重复次数")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "build":
+        spec = load_json(args.spec)
+        base = spec.get("base", "battle_config.json")
+        base_conf = load_json(base) if isinstance(base, str) else base
+        trials = args.trials if args.trials is not None else spec.get("trials", DEFAULT_TRIALS)
+        seed = args.seed if args.seed is not None else spec.get("seed", 0)
+        t0 = time.perf_counter()
+        n = build_surface(base_conf, parse_axes(spec["axes"]), args.out, trials, seed, args.workers)
+        print(f"surface built: {n} points, {time.perf_counter() - t0:.2f} s", file=sys.stderr)
+        return 0
+
+    params = _parse_params(args.params)
+    with OutcomeSurface(args.surface) as surf:
+        ans = surf.query(params, args.max_error, live=not args.no_live)
+        if ans is None:
+            print("outside grid or above error bound")
+            return 1
+        print(json.dumps({"source": ans.source, "error": ans.error, **ans.values}, ensure_ascii=False))
+        if surf.lookup(params) is not None and args.repeat > 0:
+            t0 = time.perf_counter()
+            for _ in range(args.repeat):
+                surf.lookup(params)
+            print(f"lookup: {(time.perf_counter() - t0) / args.repeat * 1e6:.2f} us", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
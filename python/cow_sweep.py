@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import copy
+import hashlib
+import argparse
+import itertools
+import multiprocessing
+from dataclasses import asdict
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Callable, Tuple
+
+from cow_core import ArmyState, BattleMode, run_simulation
+from cow_batch import run_monte_carlo
+from cow_cache import BattleCache
+from cow_db import DatabaseWatcher
+from cow_rng import CounterRNG
+from run_battle import load_json, build_army
+
+# ============================================================================
+# 1. 参数网格
+# ============================================================================
+# 参数路径使用点号分隔，整数段表示列表下标，例如:
+#   "team_a.stacks.0.units.0.count"
+#   "team_b.stacks.1.building.level"
+#   "max_rounds"
+
+def set_path(conf: dict, path: str, value):
+    keys = path.split(".")
+    node = conf
+    for k in keys[:-1]:
+        node = node[int(k)] if isinstance(node, list) else node.setdefault(k, {})
+    last = keys[-1]
+    if isinstance(node, list):
+        node[int(last)] = value
+    else:
+        node[last] = value
+
+def expand_grid(base_conf: dict, grid: Dict[str, List[Any]]) -> Iterator[Tuple[int, Dict[str, Any], dict]]:
+    """按笛卡尔积展开参数网格，逐个产出 (case 序号, 参数, 完整配置)。"""
+    paths = list(grid.keys())
+    for idx, values in enumerate(itertools.product(*(grid[p] for p in paths))):
+        params = dict(zip(paths, values))
+        conf = copy.deepcopy(base_conf)
+        for p, v in params.items():
+            set_path(conf, p, v)
+        yield idx, params, conf
+
+def task_seed(base_seed: int, case: int) -> int:
+    """由 (基础种子, case 序号) 派生的确定性种子，与调度顺序和进程数无关。"""
+    digest = hashlib.blake2b(f"{base_seed}:{case}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+# ============================================================================
+# 2. Worker (每个进程只加载一次数据库)
+# ============================================================================
+
+_WORKER_DB: Dict[str, dict] = {}
+
+def _init_worker(units_path: str, buildings_path: str, cache_path: Optional[str] = None):
+    # 惰性索引数据库：worker 只物化任务引用到的条目；源文件变化时由 refresh_worker_db 热替换
+    watcher = DatabaseWatcher(units_path, buildings_path)
+    _WORKER_DB["watcher"] = watcher
+    _WORKER_DB["units"], _WORKER_DB["buildings"] = watcher.current
+    _WORKER_DB["cache"] = BattleCache(disk_path=cache_path) if cache_path else None
+
+def refresh_worker_db() -> bool:
+    """常驻 worker 在每批任务前调用：源文件有变化且新文件校验通过时换用新数据库。"""
+    watcher = _WORKER_DB.get("watcher")
+    if watcher is None or not watcher.poll():
+        return False
+    _WORKER_DB["units"], _WORKER_DB["buildings"] = watcher.current
+    return True
+
+def worker_databases(units_path: str = "units.json", buildings_path: str = "buildings.json") -> tuple:
+    """
+    当前进程的常驻 (units, buildings) 数据库，供进程内按需模拟的调用方使用。
+    首次调用或路径不同时按 _init_worker 的方式加载 (保留已有的结果缓存)，之后每次调用检查热更新。
+    """
+    watcher = _WORKER_DB.get("watcher")
+    if watcher is None or watcher.paths != (units_path, buildings_path):
+        cache = _WORKER_DB.get("cache")
+        _init_worker(units_path, buildings_path)
+        _WORKER_DB["cache"] = cache
+    else:
+        refresh_worker_db()
+    return _WORKER_DB["units"], _WORKER_DB["buildings"]
+
+def compact_state(state: ArmyState) -> dict:
+    """ArmyState 的紧凑形式：总量 + 各 Group [数量, HP] + 各建筑 HP (顺序与配置一致)。"""
+    return {"count": state.total_count, "hp": state.total_hp, "dead": state.total_dead,
+            "hp_lost": state.total_hp_lost, "groups": [[g.count, g.current_hp] for g in state.groups],
+            "buildings": [b.current_hp for b in state.buildings]}
+
+def run_case(conf: dict, units_db: dict, buildings_db: dict, trials: int = 0, seed: Optional[int] = None,
+             cache: Optional[BattleCache] = None, detail: bool = True) -> dict:
+    """
+    运行单个配置：trials > 0 时为 Monte Carlo 汇总，否则按配置运行一场 (静默)。
+    关闭随机的单场战斗在提供 cache 时走确定性结果缓存。
+    detail=False 时单场结果只输出 compact_state。
+    """
+    army_a = build_army(conf["team_a"], units_db, buildings_db)
+    army_b = build_army(conf["team_b"], units_db, buildings_db)
+    mode = BattleMode(conf.get("battle_mode", "LAND_ATTACK"))
+    max_rounds = conf.get("max_rounds", 50)
+    siege = conf.get("siege_damage", True)
+
+    if trials > 0:
+        mc = run_monte_carlo(army_a, army_b, mode, trials, max_rounds, seed, siege_damage=siege)
+        return {"trials": trials, "win_prob": mc.win_prob, "draw_prob": mc.draw_prob,
+                "loss_prob": mc.loss_prob, "mean_rounds": mc.mean_rounds,
+                "casualties_p50": {
+                    side.name: {row.label: {"dead": row.dead.get(50), "hp_lost": row.hp_lost.get(50)}
+                                for row in side.stacks}
+                    for side in (mc.side_a, mc.side_b)}}
+
+    use_rnd = conf.get("enable_randomness", True)
+    extrapolate = conf.get("extrapolate_steady_state", False)
+    if cache is not None and not use_rnd:
+        result = cache.run(army_a, army_b, mode, max_rounds, extrapolate=extrapolate, siege_damage=siege)
+    else:
+        result = run_simulation(army_a, army_b, mode, max_rounds, use_rnd, False, verbose=False,
+                                rng=CounterRNG(seed), extrapolate=extrapolate, siege_damage=siege)
+    state = asdict if detail else compact_state
+    return {"outcome": result.outcome.value, "rounds": result.rounds, "end_reason": result.end_reason.value,
+            "team_a": state(result.army_a), "team_b": state(result.army_b)}
+
+def _run_task(task: Tuple[int, Dict[str, Any], dict, int, int]) -> dict:
+    case, params, conf, trials, seed = task
+    try:
+        result = run_case(conf, _WORKER_DB["units"], _WORKER_DB["buildings"], trials, seed, _WORKER_DB["cache"])
+    except Exception as e:  # 单个 case 出错不应中断整个扫描
+        return {"case": case, "params": params, "seed": seed, "error": f"{type(e).__name__}: {e}"}
+    return {"case": case, "params": params, "seed": seed, **result}
+
+# ============================================================================
+# 3. 结果输出
+# ============================================================================
+
+class JsonlSink:
+    """逐条写出 JSON Lines，结果一到达即落盘。"""
+
+    def __init__(self, path: str):
+        self.f = sys.stdout if path == "-" else open(path, "w", encoding="utf-8")
+
+    def __call__(self, record: dict):
+        self.f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.f.flush()
+
+    def close(self):
+        if self.f is not sys.stdout:
+            self.f.close()
+
+# ============================================================================
+# 4. 扫描主流程
+# ============================================================================
+
+def run_sweep(base_conf: dict, grid: Dict[str, List[Any]], sink: Callable[[dict], None],
+              trials: int = 0, seed: int = 0, workers: Optional[int] = None, chunksize: int = 0,
+              units_path: str = "units.json", buildings_path: str = "buildings.json",
+              cache_path: Optional[str] = None) -> int:
+    """
+    将参数网格的每个 case 分发到进程池，结果完成即交给 sink (不保证顺序，记录中带 case 序号)。
+    返回 case 总数。workers=1 时在当前进程内顺序执行。
+    cache_path 指定 sqlite 文件时，各 worker 共享确定性战斗结果缓存。
+    """
+    workers = workers or os.cpu_count() or 1
+    tasks = ((case, params, conf, trials, task_seed(seed, case))
+             for case, params, conf in expand_grid(base_conf, grid))
+    n_cases = 1
+    for values in grid.values():
+        n_cases *= len(values)
+    if chunksize <= 0:
+        # 每个 worker 大约分到 4 批，兼顾负载均衡与 IPC 开销
+        chunksize = max(1, n_cases // (workers * 4))
+
+    if workers == 1:
+        _init_worker(units_path, buildings_path, cache_path)
+        for task in tasks:
+            sink(_run_task(task))
+        return n_cases
+
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(units_path, buildings_path, cache_path)) as pool:
+        for record in pool.imap_unordered(_run_task, tasks, chunksize):
+            sink(record)
+    return n_cases
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="对 battle_config 的参数网格进行并行扫描")
+    parser.add_argument("grid", help="网格文件: {\"base\": <配置路径或对象>, \"params\": {路径: [取值...]}}")
+    parser.add_argument("--out", default="-", help="结果 JSONL 路径 (默认 stdout)")
+    parser.add_argument("--trials", type=int, default=0, help="每个 case 的 Monte Carlo 次数 (0 为单场)")
+    parser.add_argument("--seed", type=int, default=0, help="基础随机种子")
+    parser.add_argument("--workers", type=int, default=None, help="进程数 (默认 CPU 核数)")
+    parser.add_argument("--chunksize", type=int, default=0, help="每批下发的 case 数 (0 为自动)")
+    parser.add_argument("--cache", default=None, help="确定性战斗结果缓存 (sqlite 文件路径)")
+    args = parser.parse_args(argv)
+
+    spec = load_json(args.grid)
+    base = spec.get("base", "battle_config.json")
+    base_conf = load_json(base) if isinstance(base, str) else base
+
+    sink = JsonlSink(args.out)
+    try:
+        n = run_sweep(base_conf, spec["params"], sink, args.trials, args.seed, args.workers, args.chunksize,
+                      cache_path=args.cache)
+    finally:
+        sink.close()
+    print(f"sweep done: {n} cases", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,733 @@
+import sys
+import random
+import argparse
+from dataclasses import dataclass
+from typing import List, Optional, Callable, Tuple, Sequence, Union
+
+import numpy as np
+
+from cow_core import (
+    Army, ArmorType, ARMOR_ORDER, ARMOR_ORDINAL, BattleMode, run_simulation, is_zero_output_matchup,
+    CASUALTY_THRESHOLD, RANDOM_MU, RANDOM_SIGMA, RANDOM_MIN, RANDOM_MAX,
+    CORE_DMG_MULTI, CORE_MITIGATION_ADD,
+)
+from cow_rng import GOLDEN, MIX_1, MIX_2, TWO_PI, INV_2_53, stream_key, fresh_seed
+
+# ============================================================================
+# 1. 常量
+# ============================================================================
+
+ARMORS = ARMOR_ORDER
+ARMOR_INDEX = ARMOR_ORDINAL
+BUILDING_IDX = ARMOR_INDEX[ArmorType.BUILDING]
+OUTPUT_LIMIT = 10
+
+# ============================================================================
+# 2. 随机数来源
+# ============================================================================
+# 引擎每次需要一个随机系数时调用 draw(mask)，返回 (T,) 的原始高斯值 (未截断)。
+# mask 标记本次真正消耗随机数的试验，与标量引擎逐次调用 rng.gauss 的顺序一一对应。
+
+class NumpyGauss:
+    """
+    variants > 1 时每次只抽 trials 个值并复制到各变体：同一序号的试验在所有变体中
+    使用同一串随机数 (公共随机数)，变体之间的差异因此不含抽样噪声。
+    """
+
+    def __init__(self, trials: int, seed: Optional[int] = None, variants: int = 1):
+        self.trials = trials
+        self.variants = variants
+        self.gen = np.random.default_rng(seed)
+
+    def __call__(self, mask: np.ndarray) -> np.ndarray:
+        vals = self.gen.normal(RANDOM_MU, RANDOM_SIGMA, self.trials)
+        return vals if self.variants == 1 else np.tile(vals, self.variants)
+
+_U64 = np.uint64
+
+def _mix64(z: np.ndarray) -> np.ndarray:
+    """cow_rng.mix64 的 uint64 数组版 (乘法按 2^64 取模回绕)。"""
+    z = (z ^ (z >> _U64(30))) * _U64(MIX_1)
+    z = (z ^ (z >> _U64(27))) * _U64(MIX_2)
+    return z ^ (z >> _U64(31))
+
+class StreamGauss:
+    """
+    cow_rng.CounterRNG 的向量化版本：列 t 使用流 (seed, streams[t])，只有 mask 内的试验推进计数器，
+    因此每个试验得到的序列与标量引擎用 CounterRNG(seed, streams[t]) 逐次调用 gauss 相同
+    (numpy 与 math 的 log 可能差最后一位)，且与批大小、分块方式无关。
+    streams 在变体间重复时 (见 run_vector_variants) 即为公共随机数。
+    """
+
+    def __init__(self, seed: Optional[int], streams):
+        seed = fresh_seed() if seed is None else seed
+        self.keys = np.array([stream_key(seed, int(s)) for s in streams], dtype=np.uint64)
+        self.counter = np.zeros(len(self.keys), dtype=np.uint64)
+
+    def _uniform(self, n: np.ndarray) -> np.ndarray:
+        z = _mix64(self.keys + (n + _U64(1)) * _U64(GOLDEN))
+        return (z >> _U64(11)).astype(float) * INV_2_53
+
+    def __call__(self, mask: np.ndarray) -> np.ndarray:
+        n = self.counter
+        u1 = self._uniform(n)
+        u2 = self._uniform(n + _U64(1))
+        self.counter = n + (mask.astype(np.uint64) << _U64(1))
+        return RANDOM_MU + RANDOM_SIGMA * (np.sqrt(-2.0 * np.log(1.0 - u1)) * np.cos(TWO_PI * u2))
+
+class PerTrialGauss:
+    """每个试验持有独立的 random.Random，与标量引擎逐试验复现同一序列 (用于对拍)。"""
+
+    def __init__(self, rngs: List[random.Random]):
+        self.rngs = rngs
+
+    def __call__(self, mask: np.ndarray) -> np.ndarray:
+        out = np.full(len(self.rngs), RANDOM_MU)
+        for t in np.flatnonzero(mask):
+            out[t] = self.rngs[t].gauss(RANDOM_MU, RANDOM_SIGMA)
+        return out
+
+def _clamp(vals: np.ndarray) -> np.ndarray:
+    return np.minimum(RANDOM_MAX, np.maximum(RANDOM_MIN, vals))
+
+# ============================================================================
+# 3. 数组化 Army
+# ============================================================================
+
+def _structure(army: Army) -> tuple:
+    """决定数组布局与交战顺序的静态结构 (Stack 划分、兵种、行为标记)，同批变体必须一致。"""
+    return tuple((s.is_split, s.is_air, s.manual_target, s.is_patrol,
+                  tuple((g.name, g.stats.armor_type, tuple(g.stats.attack_table), tuple(g.stats.defense_table),
+                         g.max_hp_per_unit, g.is_ranged, g.is_ultra_ranged) for g in s.groups))
+                 for s in army.stacks)
+
+def _curve_arrays(curve) -> tuple:
+    return (np.array(curve.ends), np.array(curve.starts), np.array(curve.hps),
+            np.array(curve.mits), np.array(curve.cum_mit), np.array(curve.levels) > 1)
+
+class VectorArmy:
+    """
+    Army 的数组表示：静态属性按 Group 排列为 (G,) / (G, A)，
+    可变状态按 Group 主序存放为 (G, T) / (S, T)，同一 Stack 的 Group 在内存中连续，
+    因此每个 Stack 对应一个切片，单次交战只触及参与的 Group。
+
+    army 也可以是结构相同 (见 _structure) 的一组变体：变体 v 占用第 [v*trials, (v+1)*trials) 列，
+    数量、HP、地形、核心与建筑可以逐变体不同。各变体取值相同的参数仍按 (G, 1) 存放，
+    单配置时与原先的计算完全一致。
+    """
+
+    def __init__(self, army: Union[Army, Sequence[Army]], trials: int):
+        armies = [army] if isinstance(army, Army) else list(army)
+        army = armies[0]
+        shape = _structure(army)
+        if any(_structure(a) != shape for a in armies[1:]):
+            raise ValueError(f"variants of army '{army.name}' differ in stacks / unit types")
+        V = len(armies)
+        self.name = army.name
+        self.variants = V
+        self.per_variant = trials
+        self.trials = trials * V
+        self.stack_names = [s.name for s in army.stacks]
+        pairs = [(si, g) for si, s in enumerate(army.stacks) for g in s.groups]
+        self.labels = [f"[{army.stacks[si].name}] {g.name}" for si, g in pairs]
+        self.S = len(army.stacks)
+        self.G = len(pairs)
+        groups = [[g for s in a.stacks for g in s.groups] for a in armies]      # V x G
+
+        self.stack_of = np.array([si for si, _ in pairs], dtype=np.intp)
+        self.armor = np.array([ARMOR_INDEX[g.stats.armor_type] for _, g in pairs], dtype=np.intp)
+        self.max_hp = np.array([g.max_hp_per_unit for _, g in pairs], dtype=float)[:, None]
+        self.atk = np.array([g.stats.attack_table for _, g in pairs],
+                            dtype=float).reshape(self.G, len(ARMORS))
+        self.dfn = np.array([g.stats.defense_table for _, g in pairs],
+                            dtype=float).reshape(self.G, len(ARMORS))
+        self.terrain_mult = self._columns([[1.0 + g.terrain_bonus for g in gs] for gs in groups])
+        self.core_mult = self._columns([[CORE_DMG_MULTI if g.is_core else 1.0 for g in gs] for gs in groups])
+        # 输出的逐行乘数 (为 1 的省略)；_row_gain 用于静态筛行，_row_mixed 标记部分变体下乘积为 0 的行
+        self._t_mult = [self._row_factor(self.terrain_mult[g]) for g in range(self.G)]
+        self._c_mult = [self._row_factor(self.core_mult[g]) for g in range(self.G)]
+        gain = self.terrain_mult * self.core_mult
+        self._row_gain = gain.max(axis=1).tolist()
+        self._row_mixed = ((gain > 0).any(axis=1) & ~(gain > 0).all(axis=1)).tolist()
+
+        self.stack_slices = []
+        pos = 0
+        for s in army.stacks:
+            self.stack_slices.append(slice(pos, pos + len(s.groups)))
+            pos += len(s.groups)
+        self.all_slice = slice(0, self.G)
+        self.armor_set = sorted(set(self.armor.tolist()))
+        self.stack_armor_sets = [sorted(set(self.armor[sl].tolist())) for sl in self.stack_slices]
+        core = self._columns([[CORE_MITIGATION_ADD if s.is_core else 0.0 for s in a.stacks] for a in armies])
+        self.core_add = [self._row_factor(core[si], 0.0) for si in range(self.S)]
+
+        # 建筑按 Stack 存放各变体的 Building (无建筑为 None，HP 记为 0、减伤为 0)；
+        # curves[si] 为 [(曲线数组, 列下标)]，列下标为 None 表示全部试验共用同一曲线
+        self.buildings = [[a.stacks[si].building for a in armies] for si in range(self.S)]
+        self.has_bld = [any(b is not None for b in bs) for bs in self.buildings]
+        self.has_building = any(self.has_bld)
+        self.curves = [self._stack_curves(bs) for bs in self.buildings]
+        # 既无建筑也非核心的 Stack 减伤恒为 0
+        self.has_mitigation = [h or c is not None for h, c in zip(self.has_bld, self.core_add)]
+
+        self.init_count = np.array([[g.count for g in gs] for gs in groups], dtype=np.int64).T
+        self.init_hp = np.array([[g.current_hp for g in gs] for gs in groups], dtype=float).reshape(V, self.G).T
+        self.init_bld_hp = np.array([[b.current_hp if b else 0.0 for b in bs] for bs in self.buildings],
+                                    dtype=float).reshape(self.S, V)
+        self.reset()
+
+    def _columns(self, per_variant: List[List[float]]) -> np.ndarray:
+        """V x N 的逐变体取值转为 (N, T)；各变体相同时保持 (N, 1)。"""
+        vals = np.array(per_variant, dtype=float).reshape(self.variants, -1).T
+        if (vals == vals[:, :1]).all():
+            return vals[:, :1].copy()
+        return np.repeat(vals, self.per_variant, axis=1)
+
+    @staticmethod
+    def _row_factor(col: np.ndarray, neutral: float = 1.0):
+        """某一行的乘数 / 加数：恒为 neutral 时为 None，各列相同时为标量，否则为 (T,)。"""
+        if (col == col[0]).all():
+            return None if col[0] == neutral else col[0]
+        return col
+
+    def _stack_curves(self, buildings: list) -> list:
+        curves = {}
+        for v, b in enumerate(buildings):
+            if b is not None and b.curve.hps:
+                key = (tuple(b.curve.levels), tuple(b.curve.hps), tuple(b.curve.mits))
+                curves.setdefault(key, (b.curve, []))[1].append(v)
+        out = []
+        for curve, vs in curves.values():
+            cols = None
+            if len(vs) < len(buildings):
+                cols = (np.array(vs)[:, None] * self.per_variant + np.arange(self.per_variant)).ravel()
+            out.append((_curve_arrays(curve), cols))
+        return out
+
+    def reset(self):
+        n = self.per_variant
+        self.count = np.repeat(self.init_count, n, axis=1)
+        self.hp = np.repeat(self.init_hp, n, axis=1)
+        self.bld_hp = np.repeat(self.init_bld_hp, n, axis=1)
+        self.hit = np.zeros(self.trials, dtype=bool)   # 本回合是否有 Group 受到伤害 (僵局检测用)
+
+    def load_state(self, count: np.ndarray, hp: np.ndarray, bld_hp: np.ndarray):
+        """
+        以任意列数的状态 (G, N) / (S, N) 替换当前状态，每列一个独立状态 (仅单配置)。
+        供逐状态推进的调用方使用 (见 cow_exact)；数组被直接引用，不做拷贝。
+        """
+        if self.variants != 1:
+            raise ValueError("load_state requires a single-configuration VectorArmy")
+        self.count, self.hp, self.bld_hp = count, hp, bld_hp
+        self.trials = self.per_variant = count.shape[1]
+        self.hit = np.zeros(self.trials, dtype=bool)
+
+    # ------------------------------------------------------------------
+    # 聚合状态
+    # ------------------------------------------------------------------
+
+    def stack_alive(self, si: int) -> np.ndarray:
+        sl = self.stack_slices[si]
+        return (self.hp[sl] > 0).any(axis=0) & (self.count[sl] > 0).any(axis=0)
+
+    def alive(self) -> np.ndarray:
+        res = np.zeros(self.trials, dtype=bool)
+        for si in range(self.S):
+            res |= self.stack_alive(si)
+        return res
+
+    def stack_count(self, si: int) -> np.ndarray:
+        return self.count[self.stack_slices[si]].sum(axis=0)
+
+    def total_count(self) -> np.ndarray:
+        return self.count.sum(axis=0)
+
+    def stack_mitigation(self, si: int) -> np.ndarray:
+        """(T,) 某个 Stack 的总减伤 (建筑按当前 HP 衰减 + 核心固定值)。"""
+        mit = np.zeros(self.trials)
+        for curve, cols in self.curves[si]:
+            # 与 MitigationCurve.mitigation 相同的二分查找与折算公式，逐试验并行
+            ends, starts, hps, mits, cum_mit, partial_lv = curve
+            hp = self.bld_hp[si] if cols is None else self.bld_hp[si, cols]
+            k = np.searchsorted(ends, hp, side="right")
+            kk = np.minimum(k, len(hps) - 1)
+            partial = (0.2 + 0.8 * ((hp - starts[kk]) / hps[kk])) * mits[kk]
+            total = np.where((k < len(hps)) & partial_lv[kk], cum_mit[k] + partial, cum_mit[k])
+            if cols is None:
+                mit = np.where(hp < hps[0] - 1e-9, 0.0, total)
+            else:
+                mit[cols] = np.where(hp < hps[0] - 1e-9, 0.0, total)
+        if self.core_add[si] is not None:
+            mit = mit + self.core_add[si]
+        return np.minimum(mit, 1.0)
+
+    # ------------------------------------------------------------------
+    # 输出 (等价于 Stack.calculate_output)
+    # ------------------------------------------------------------------
+
+    def output(self, table: np.ndarray, armor_idx: int, sl: slice) -> np.ndarray:
+        # eff >= 0.2 恒为正，因此 dmg > 0 只取决于静态的 base * 地形 * 核心，可预先筛掉整行；
+        # count == 0 的 Group 取用 0 个单位，不影响结果。
+        gain = self._row_gain
+        rows = [g for g in range(sl.start, sl.stop) if table[g, armor_idx] * gain[g] > 0]
+        if not rows:
+            return np.zeros(self.trials)
+        ds, cs = [], []
+        for g in rows:
+            cnt = self.count[g]
+            eff = 0.2 + 0.8 * (self.hp[g] / (np.maximum(cnt, 1) * self.max_hp[g, 0]))
+            d = table[g, armor_idx] * eff
+            if self._t_mult[g] is not None: d = d * self._t_mult[g]
+            if self._c_mult[g] is not None: d = d * self._c_mult[g]
+            if self._row_mixed[g]:
+                # 该行在部分变体中伤害为 0：标量引擎不会选入，数量记 0 即不占输出名额
+                cnt = np.where(d > 0, cnt, 0)
+            ds.append(d)
+            cs.append(cnt)
+        if len(rows) == 2:
+            # 稳定排序：仅当后者严格更大时交换
+            swap = ds[1] > ds[0]
+            if swap.any():
+                ds = [np.where(swap, ds[1], ds[0]), np.where(swap, ds[0], ds[1])]
+                cs = [np.where(swap, cs[1], cs[0]), np.where(swap, cs[0], cs[1])]
+        elif len(rows) > 2:
+            # 稳定排序与 list.sort(reverse=True) 的平局顺序一致
+            d_all, c_all = np.array(ds), np.array(cs)
+            order = np.argsort(-d_all, axis=0, kind="stable")
+            d_all = np.take_along_axis(d_all, order, axis=0)
+            c_all = np.take_along_axis(c_all, order, axis=0)
+            ds, cs = list(d_all), list(c_all)
+
+        total = cs[0] * 0.0
+        left = None
+        for d, c in zip(ds, cs):
+            take = np.minimum(OUTPUT_LIMIT, c) if left is None else np.minimum(left, c)
+            total = total + take * d
+            left = OUTPUT_LIMIT - take if left is None else left - take
+        return total
+
+    # ------------------------------------------------------------------
+    # 受伤 (等价于 receive_damage_distribution + UnitGroup.apply_damage)
+    # ------------------------------------------------------------------
+
+    def receive(self, pot: np.ndarray, sl: slice, total_count: np.ndarray, active: np.ndarray):
+        active = active & (total_count > 0)
+        if not active.any():
+            return
+        amount = pot[self.armor[sl]] * (self.count[sl] / np.maximum(total_count, 1))
+        for si, s_sl in enumerate(self.stack_slices):
+            if not self.has_mitigation[si] or s_sl.stop <= sl.start or s_sl.start >= sl.stop:
+                continue
+            rows = slice(s_sl.start - sl.start, s_sl.stop - sl.start)
+            amount[rows] = amount[rows] * (1.0 - self.stack_mitigation(si))
+        self.apply_damage(amount, sl, active)
+
+    def apply_damage(self, amount: np.ndarray, sl: slice, active: np.ndarray):
+        hp = self.hp[sl]
+        cnt = self.count[sl]
+        act = (amount > 0) & (hp > 0) & (cnt > 0) & active
+        if not act.any():
+            return
+        self.hit |= act.any(axis=0)
+        amount = amount * act
+        ratio = hp / (np.maximum(cnt, 1) * self.max_hp[sl])
+        kill = act & (ratio < CASUALTY_THRESHOLD)
+        if kill.any():
+            avg = hp / np.maximum(cnt, 1)
+            q = np.floor(amount / np.where(kill, avg, 1.0))
+            cnt = cnt - np.where(kill, np.minimum(q, cnt), 0).astype(np.int64)
+
+        hp = hp - np.minimum(hp, amount)
+        wiped = act & (hp <= 1e-5)
+        self.hp[sl] = np.where(wiped | (act & (cnt == 0)), 0.0, hp)
+        self.count[sl] = np.where(wiped, 0, cnt)
+
+    def take_building_damage(self, dmg: np.ndarray, active: np.ndarray, alive: List[np.ndarray]):
+        for si, has in enumerate(self.has_bld):
+            if has:
+                col = self.bld_hp[si]
+                self.bld_hp[si] = np.where(active & alive[si], np.maximum(0.0, col - dmg), col)
+
+    def receive_army(self, pot: np.ndarray, b_dmg: Optional[np.ndarray], active: np.ndarray):
+        """
+        等价于 Army.receive_damage (无 Split / 空军 Stack 时全部 Stack 同属前排池)：
+        总兵力在分发前一次性计算，建筑伤害只作用于分发前存活的 Stack。
+        """
+        total = self.total_count()
+        active = active & (total > 0)
+        alive = [self.stack_alive(si) for si in range(self.S)] if b_dmg is not None and self.has_building else None
+        self.receive(pot, self.all_slice, total, active)
+        if alive is not None:
+            self.take_building_damage(b_dmg, active, alive)
+
+# ============================================================================
+# 4. 战斗结果
+# ============================================================================
+
+@dataclass
+class VectorResult:
+    """变体批量运行时各数组按变体分段排列 (见 VectorArmy)。"""
+    army_a: VectorArmy
+    army_b: VectorArmy
+    rounds: np.ndarray
+
+    @property
+    def a_alive(self) -> np.ndarray:
+        return self.army_a.alive()
+
+    @property
+    def b_alive(self) -> np.ndarray:
+        return self.army_b.alive()
+
+# ============================================================================
+# 5. 主循环
+# ============================================================================
+
+def _clash(act_army: VectorArmy, si: int, tgt_army: VectorArmy, active: np.ndarray,
+           f_atk: np.ndarray, f_def: np.ndarray):
+    """等价于 resolve_atomic_clash。"""
+    active = active & act_army.stack_alive(si) & tgt_army.alive()
+    if not active.any():
+        return
+    T = act_army.trials
+    sl = act_army.stack_slices[si]
+
+    atk_pot = np.zeros((len(ARMORS), T))
+    for a in tgt_army.armor_set:
+        atk_pot[a] = act_army.output(act_army.atk, a, sl) * f_atk
+    b_dmg = None
+    if tgt_army.has_building:
+        b_dmg = act_army.output(act_army.atk, BUILDING_IDX, sl) * f_atk
+
+    def_pot = np.zeros((len(ARMORS), T))
+    for a in act_army.stack_armor_sets[si]:
+        def_pot[a] = tgt_army.output(tgt_army.dfn, a, tgt_army.all_slice) * f_def
+
+    tgt_army.receive_army(atk_pot, b_dmg, active)
+    act_army.receive(def_pot, sl, act_army.stack_count(si), active)
+
+def _air_strike(army_a: VectorArmy, si: int, army_b: VectorArmy, active: np.ndarray,
+                f_atk: np.ndarray, f_def: np.ndarray):
+    """等价于空军对地的 resolve_atomic_clash：防空先开火，飞机存活才投弹。"""
+    active = active & army_a.stack_alive(si) & army_b.alive()
+    if not active.any():
+        return
+    T = army_a.trials
+    sl = army_a.stack_slices[si]
+
+    # 1. B 防空
+    def_pot = np.zeros((len(ARMORS), T))
+    for a in army_a.stack_armor_sets[si]:
+        def_pot[a] = army_b.output(army_b.dfn, a, army_b.all_slice) * f_def
+    army_a.receive(def_pot, sl, army_a.stack_count(si), active)
+
+    # 2. 轰炸
+    active = active & army_a.stack_alive(si)
+    atk_pot = np.zeros((len(ARMORS), T))
+    for a in army_b.armor_set:
+        atk_pot[a] = army_a.output(army_a.atk, a, sl) * f_atk
+    b_dmg = None
+    if army_b.has_building:
+        b_dmg = army_a.output(army_a.atk, BUILDING_IDX, sl) * f_atk
+    army_b.receive_army(atk_pot, b_dmg, active)
+
+def play_vector_round(va: VectorArmy, vb: VectorArmy, mode: BattleMode, fighting: np.ndarray,
+                      f_atk: np.ndarray, f_def: np.ndarray):
+    """对 fighting 中的列推进一回合的全部交战 (对应 cow_core.play_round)。"""
+    if mode == BattleMode.LAND_ATTACK:
+        for si in range(va.S):
+            _clash(va, si, vb, fighting, f_atk, f_def)
+    elif mode == BattleMode.LAND_MEET:
+        # 回合开始时存活的 Stack 按 A、B 交替排队 (同一位置上 A 先于 B)
+        turn_order = sorted([(i, 0, si, m) for i, si, m in _alive_slots(va, fighting)] +
+                            [(i, 1, si, m) for i, si, m in _alive_slots(vb, fighting)],
+                            key=lambda x: (x[0], x[1]))
+        for _, side, si, mask in turn_order:
+            if side == 0: _clash(va, si, vb, mask, f_atk, f_def)
+            else: _clash(vb, si, va, mask, f_atk, f_def)
+    elif mode == BattleMode.AIR_STRIKE:
+        for si in range(va.S):
+            _air_strike(va, si, vb, fighting, f_atk, f_def)
+
+def supports(army_a: Army, army_b: Army, mode: BattleMode) -> bool:
+    """
+    向量引擎只实现无目标选择的情形：没有 Split / 空军 / 手动目标的 Stack
+    (AIR_STRIKE 中 A 方按空军处理，但不能巡逻)。其余配置需使用标量引擎。
+    """
+    for army in (army_a, army_b):
+        for s in army.stacks:
+            if s.is_split or s.manual_target:
+                return False
+            if s.is_air and not (mode == BattleMode.AIR_STRIKE and army is army_a and not s.is_patrol):
+                return False
+    return True
+
+def _alive_slots(army: VectorArmy, fighting: np.ndarray) -> List[Tuple[int, int, np.ndarray]]:
+    """
+    回合开始时存活的 Stack 在队列中的位置：返回 (位置, Stack 序号, 试验掩码)。
+    各试验存活的 Stack 不同，同一位置上不同 Stack 的掩码互不相交。
+    """
+    slots = []
+    rank = np.zeros(army.trials, dtype=np.int64)
+    for si in range(army.S):
+        alive = fighting & army.stack_alive(si)
+        if not alive.any():
+            continue
+        for i in np.unique(rank[alive]).tolist():
+            slots.append((i, si, alive & (rank == i)))
+        rank += alive
+    return slots
+
+def supports_variants(pairs: Sequence[Tuple[Army, Army]], mode: BattleMode) -> bool:
+    """一组 (A, B) 变体能否在向量引擎中一次推进：各自受支持，且同侧结构一致。"""
+    if not all(supports(a, b, mode) for a, b in pairs):
+        return False
+    shape_a, shape_b = _structure(pairs[0][0]), _structure(pairs[0][1])
+    return all(_structure(a) == shape_a and _structure(b) == shape_b for a, b in pairs[1:])
+
+def run_vector_battle(army_a: Army, army_b: Army, mode: BattleMode, trials: int, max_rounds: int = 50,
+                      use_random: bool = True, seed: Optional[int] = None,
+                      draw: Optional[Callable] = None, detect_stalemate: bool = True,
+                      first_trial: int = 0) -> VectorResult:
+    """
+    以 trials 个试验并行推进同一场战斗。army_a / army_b 仅作为初始状态读取，不会被修改。
+    draw 为自定义随机源 (见 StreamGauss / NumpyGauss / PerTrialGauss)，默认第 t 列使用
+    随机流 (seed, first_trial + t)，与标量引擎的 CounterRNG(seed, first_trial + t) 相同，
+    一批试验因此可以任意拆分后分别运行。
+    detect_stalemate 与 run_simulation 相同：零输出对阵直接结束，进入不动点的试验停止推进，
+    两者的回合数都按 max_rounds 计。仅支持 supports() 为真的配置。
+    """
+    return run_vector_variants([(army_a, army_b)], mode, trials, max_rounds, use_random, seed, draw, detect_stalemate,
+                               first_trial)
+
+def run_vector_variants(pairs: Sequence[Tuple[Army, Army]], mode: BattleMode, trials: int, max_rounds: int = 50,
+                        use_random: bool = True, seed: Optional[int] = None,
+                        draw: Optional[Callable] = None, detect_stalemate: bool = True,
+                        first_trial: int = 0) -> VectorResult:
+    """
+    把结构相同的多组 (A, B) 变体作为一批推进，每组 trials 个试验，结果按变体分段 (共 len(pairs) * trials 列)。
+    默认随机源中各变体的第 t 个试验共用随机流 (seed, first_trial + t) (公共随机数)，
+    变体间的差值因此只反映参数差异。
+    仅支持 supports_variants() 为真的配置。
+    """
+    V = len(pairs)
+    if not supports_variants(pairs, mode):
+        raise ValueError("vector engine does not support split / air / targeted stacks "
+                         "or structurally different variants; use run_simulation")
+    va = VectorArmy([a for a, _ in pairs], trials)
+    vb = VectorArmy([b for _, b in pairs], trials)
+    T = va.trials
+    if use_random and draw is None:
+        draw = StreamGauss(seed, np.tile(np.arange(first_trial, first_trial + trials), V))
+    if not use_random:
+        draw = None
+
+    stalled = np.zeros(T, dtype=bool)
+    if detect_stalemate and max_rounds > 0:
+        zero = [is_zero_output_matchup(a, b, mode) for a, b in pairs]
+        if all(zero):
+            rounds = np.where(va.alive() & vb.alive(), max_rounds, 0).astype(np.int64)
+            return VectorResult(va, vb, rounds)
+        if any(zero):
+            # 零输出的变体从一开始就按僵局处理，其余变体照常推进
+            stalled = np.repeat(zero, trials) & va.alive() & vb.alive()
+
+    return VectorResult(va, vb, advance(va, vb, mode, max_rounds, draw, detect_stalemate, stalled))
+
+def advance(va: VectorArmy, vb: VectorArmy, mode: BattleMode, max_rounds: int = 50,
+            draw: Optional[Callable] = None, detect_stalemate: bool = True,
+            stalled: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    从 va / vb 的当前状态 (可由 load_state 载入) 原地推进至多 max_rounds 回合，返回各试验的回合数。
+    draw 为 None 时不加随机；stalled 标记从一开始就按僵局处理的试验。
+    这里不做零输出预判，这类试验在第一回合后由不动点判据结束，最终状态与回合数相同。
+    """
+    T = va.trials
+    rounds = np.zeros(T, dtype=np.int64)
+    ones = np.ones(T)
+    stalled = np.zeros(T, dtype=bool) if stalled is None else stalled
+
+    for r in range(1, max_rounds + 1):
+        fighting = va.alive() & vb.alive() & ~stalled
+        if not fighting.any():
+            break
+        rounds += fighting
+        if detect_stalemate:
+            va.hit[:] = False
+            vb.hit[:] = False
+            b_hps = (va.bld_hp.copy(), vb.bld_hp.copy())
+
+        f_atk, f_def = ones, ones
+        if draw is not None:
+            f_atk = _clamp(draw(fighting))
+            f_def = _clamp(draw(fighting))
+
+        play_vector_round(va, vb, mode, fighting, f_atk, f_def)
+
+        if detect_stalemate and r < max_rounds:
+            # 与标量引擎相同的不动点判据：无 Group 受伤且建筑 HP 未变
+            still = fighting & ~va.hit & ~vb.hit & va.alive() & vb.alive()
+            still &= (va.bld_hp == b_hps[0]).all(axis=0) & (vb.bld_hp == b_hps[1]).all(axis=0)
+            stalled |= still
+
+    rounds[stalled] = max_rounds
+    return rounds
+
+# ============================================================================
+# 6. 标量对拍
+# ============================================================================
+
+def check_parity(make_armies: Callable[[], Tuple[Army, Army]], mode: BattleMode, trials: int = 8,
+                 max_rounds: int = 50, use_random: bool = True, seed: int = 0,
+                 rtol: float = 1e-9, atol: float = 1e-6) -> List[str]:
+    """
+    用相同的逐试验随机序列分别运行标量引擎与向量引擎，返回不一致项 (空列表表示通过)。
+    make_armies 每次调用需返回一对全新的 Army。
+    """
+    return check_variant_parity(lambda: [make_armies()], mode, trials, max_rounds, use_random, seed, rtol, atol)
+
+def check_variant_parity(make_pairs: Callable[[], List[Tuple[Army, Army]]], mode: BattleMode, trials: int = 8,
+                         max_rounds: int = 50, use_random: bool = True, seed: int = 0,
+                         rtol: float = 1e-9, atol: float = 1e-6) -> List[str]:
+    """
+    变体批量版的 check_parity：所有变体放在同一批向量运行中，逐变体逐试验与标量引擎比较。
+    make_pairs 每次调用需返回一组全新的 (A, B) 变体；每个变体的第 t 个试验都使用 Random(seed + t)。
+    """
+    errors = []
+    pairs = make_pairs()
+    V = len(pairs)
+    draw = None
+    if use_random:
+        draw = PerTrialGauss([random.Random(seed + t) for _ in range(V) for t in range(trials)])
+    vec = run_vector_variants(pairs, mode, trials, max_rounds, use_random, draw=draw)
+
+    for v in range(V):
+        tag = f"variant {v} " if V > 1 else ""
+        for t in range(trials):
+            col = v * trials + t
+            sa, sb = make_pairs()[v]
+            rounds = run_simulation(sa, sb, mode, max_rounds, use_random, False,
+                                    verbose=False, rng=random.Random(seed + t)).rounds
+            if rounds != vec.rounds[col]:
+                errors.append(f"{tag}trial {t}: rounds scalar={rounds} vector={vec.rounds[col]}")
+            for army, va in ((sa, vec.army_a), (sb, vec.army_b)):
+                groups = [g for s in army.stacks for g in s.groups]
+                for gi, g in enumerate(groups):
+                    if g.count != va.count[gi, col]:
+                        errors.append(f"{tag}trial {t}: {va.labels[gi]} count scalar={g.count} "
+                                      f"vector={va.count[gi, col]}")
+                    if not np.isclose(g.current_hp, va.hp[gi, col], rtol=rtol, atol=atol):
+                        errors.append(f"{tag}trial {t}: {va.labels[gi]} hp scalar={g.current_hp} "
+                                      f"vector={va.hp[gi, col]}")
+                for si, s in enumerate(army.stacks):
+                    if s.building and not np.isclose(s.building.current_hp, va.bld_hp[si, col], rtol=rtol, atol=atol):
+                        errors.append(f"{tag}trial {t}: [{s.name}] building hp scalar={s.building.current_hp} "
+                                      f"vector={va.bld_hp[si, col]}")
+    return errors
+
+def _parity_scenarios(conf: dict) -> List[Tuple[str, dict]]:
+    """在给定配置基础上派生出覆盖三种模式 + 建筑的对拍场景。"""
+    import copy
+    scenarios = []
+    for mode in BattleMode:
+        c = copy.deepcopy(conf)
+        c["battle_mode"] = mode.value
+        scenarios.append((f"{mode.value}", c))
+    siege = copy.deepcopy(conf)
+    siege["battle_mode"] = BattleMode.LAND_ATTACK.value
+    for s in siege["team_b"].get("stacks", []):
+        s["building"] = {"id": "Bunker", "level": 3, "hp_ratio": 0.8}
+    scenarios.append(("LAND_ATTACK+Bunker", siege))
+    air = copy.deepcopy(siege)
+    air["battle_mode"] = BattleMode.AIR_STRIKE.value
+    for s in air["team_a"].get("stacks", []):
+        for u in s["units"]:
+            u["id"] = "Allies_Tactical_Bomber_Lvl1"
+    scenarios.append(("AIR_STRIKE+Bunker", air))
+    # 坦克对坦克互相无伤害：A 先靠少量步兵交火，步兵打光后进入不动点
+    stale = copy.deepcopy(conf)
+    stale["battle_mode"] = BattleMode.LAND_MEET.value
+    for team in ("team_a", "team_b"):
+        for s in stale[team].get("stacks", []):
+            for u in s["units"]:
+                u["id"] = "Medium_Tank_Lvl1"
+    for s in stale["team_a"].get("stacks", [])[:1]:
+        s["units"].append({"id": "Infantry_Lvl1", "count": 20, "hp_ratio": 1})
+    scenarios.append(("LAND_MEET stalemate", stale))
+    # A 的第一个 Stack 很快阵亡，此后各试验的出手队列不再按 Stack 序号交替
+    uneven = copy.deepcopy(conf)
+    uneven["battle_mode"] = BattleMode.LAND_MEET.value
+    for s in uneven["team_a"].get("stacks", [])[:1]:
+        for u in s["units"]:
+            u["count"] = max(1, u["count"] // 10)
+    scenarios.append(("LAND_MEET uneven", uneven))
+    return scenarios
+
+def _variant_scenarios(conf: dict) -> List[Tuple[str, BattleMode, List[dict]]]:
+    """逐项改动数量、HP、地形、核心与建筑的一组变体 (供变体批量对拍)。"""
+    import copy
+    siege = dict(_parity_scenarios(conf))["LAND_ATTACK+Bunker"]
+    edits = [
+        lambda c: None,
+        lambda c: c["team_a"]["stacks"][0]["units"][0].update(count=c["team_a"]["stacks"][0]["units"][0]["count"] * 2),
+        lambda c: c["team_a"]["stacks"][0]["units"][0].update(terrain_bonus=0.25),
+        lambda c: c["team_a"]["stacks"][0]["units"][0].update(hp_ratio=0.5),
+        lambda c: c["team_b"]["stacks"][0].update(core=not c["team_b"]["stacks"][0].get("core", False)),
+        lambda c: c["team_b"]["stacks"][0]["units"][0].update(terrain_bonus=-1.0),   # 该行输出降为 0
+        lambda c: c["team_b"]["stacks"][0]["building"].update(level=1),
+        lambda c: c["team_b"]["stacks"][0]["building"].update(hp_ratio=0.3),
+        lambda c: c["team_b"]["stacks"][0].update(building=None),
+    ]
+    out = []
+    for mode in (BattleMode.LAND_ATTACK, BattleMode.LAND_MEET):
+        confs = []
+        for edit in edits:
+            c = copy.deepcopy(siege)
+            if c["team_a"].get("stacks") and c["team_b"].get("stacks"):
+                edit(c)
+            confs.append(c)
+        out.append((f"{mode.value} variants", mode, confs))
+    return out
+
+def run_parity_scenarios(check: Callable, conf: dict, units_db, buildings_db) -> bool:
+    """对 _parity_scenarios 的每个场景 (关闭 / 开启随机) 运行 check 并打印结果，有失败时返回 True。"""
+    from run_battle import build_army
+    failed = False
+    for label, c in _parity_scenarios(conf):
+        make = lambda c=c: (build_army(c["team_a"], units_db, buildings_db),
+                            build_army(c["team_b"], units_db, buildings_db))
+        mode = BattleMode(c["battle_mode"])
+        for use_random in (False, True):
+            errs = check(make, mode, trials=8, max_rounds=c.get("max_rounds", 50), use_random=use_random)
+            status = "OK" if not errs else f"FAIL ({len(errs)})"
+            print(f"  {label:<20} random={str(use_random):<5} {status}")
+            for e in errs[:5]:
+                print(f"    - {e}")
+            failed = failed or bool(errs)
+    return failed
+
+def main(argv=None):
+    from run_battle import load_json, build_army
+    from cow_db import load_databases
+    parser = argparse.ArgumentParser(description="向量化引擎与标量引擎逐试验对拍")
+    parser.add_argument("--config", default="battle_config.json", help="派生对拍场景的基础战斗配置")
+    args = parser.parse_args(argv)
+    u_db, b_db = load_databases("units.json", "buildings.json")
+    conf = load_json(args.config)
+
+    failed = run_parity_scenarios(check_parity, conf, u_db, b_db)
+    for label, mode, confs in _variant_scenarios(conf):
+        make = lambda confs=confs: [(build_army(c["team_a"], u_db, b_db), build_army(c["team_b"], u_db, b_db))
+                                    for c in confs]
+        for use_random in (False, True):
+            errs = check_variant_parity(make, mode, trials=4, max_rounds=conf.get("max_rounds", 50),
+                                        use_random=use_random)
+            status = "OK" if not errs else f"FAIL ({len(errs)})"
+            print(f"  {label:<20} random={str(use_random):<5} {status}")
+            for e in errs[:5]:
+                print(f"    - {e}")
+            failed = failed or bool(errs)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,13 @@
 import json
 import sys
 import os
+import argparse
 try:
     from cow_core import *
 except ImportError:
     sys.exit(1)
+from cow_db import UnitDatabase, BuildingDatabase, load_lazy_databases
+from cow_rng import CounterRNG
 
 def load_json(filename):
     with open(filename, 'r', encoding='utf-8') as f: return json.load(f)
@@ -33,7 +36,12 @@ def build_army(team_config, units_db, buildings_db):
         if "building" in s_entry and s_entry["building"]:
             b_conf = s_entry["building"]
             b_id = b_conf["id"]
-            if b_id in buildings_db:
+            if isinstance(buildings_db, BuildingDatabase):
+                # 编译后的数据库：等级前缀与减伤曲线已预先计算并共享
+                if b_id in buildings_db:
+                    b_obj = buildings_db.make_building(b_id, b_conf["level"], b_conf.get("current_hp"),
+                                                       b_conf.get("hp_ratio"))
+            elif b_id in buildings_db:
                 raw = buildings_db[b_id]
                 valid = [l for l in raw["levels"] if l["level"] <= b_conf["level"]]
                 if valid:
@@ -77,21 +85,75 @@ def build_army(team_config, units_db, buildings_db):
                 final_u_hp = total_max * float(u_entry["hp_ratio"])
             
             # 创建 Group，注意传入 is_core
-            grp = create_unit_group_from_json(u_id, u_data, count, t_bonus, is_core)
+            stats = units_db.stats(u_id) if isinstance(units_db, UnitDatabase) else None
+            grp = create_unit_group_from_json(u_id, u_data, count, t_bonus, is_core, stats)
+            grp.is_ultra_ranged = bool(u_entry.get("ultra_ranged", False))
+            grp.is_ranged = bool(u_entry.get("ranged", False)) or grp.is_ultra_ranged
             grp.current_hp = final_u_hp
             # 重置初始记录，因为 create 函数里可能用了默认值
             grp.initial_hp = final_u_hp
             
             groups.append(grp)
             
-        army_stacks.append(Stack(s_name, groups, b_obj, is_core))
+        # 手动目标：未给出为 None，显式给出 null / "" 记为 "" (被动防守的空军因此视为停在地面)
+        target = (s_entry["target"] or "") if "target" in s_entry else None
+        army_stacks.append(Stack(s_name, groups, b_obj, is_core, bool(s_entry.get("split", False)),
+                                 bool(s_entry.get("is_airplane", False)), target,
+                                 bool(s_entry.get("patrol", False))))
 
     return Army(army_name, army_stacks)
 
-def main():
-    u_db = load_json("units.json")
-    b_db = load_json("buildings.json")
-    conf = load_json("battle_config.json")
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Call of War 战斗计算器")
+    parser.add_argument("--config", default="battle_config.json", help="战斗配置文件")
+    parser.add_argument("--trials", type=int, default=0,
+                        help="Monte Carlo 随机试验次数 (>0 时启用批量模式，忽略 enable_randomness)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="随机种子 (Monte Carlo 中第 t 个试验使用随机流 (seed, t)；也用于单场随机战斗)")
+    parser.add_argument("--engine", choices=["auto", "scalar", "vector", "jit"], default="auto",
+                        help="Monte Carlo 引擎 (vector 需要 numpy，jit 需要 numba)")
+    parser.add_argument("--profile", action="store_true", help="统计各阶段耗时并在结束后打印摘要")
+    parser.add_argument("--profile-out", default=None,
+                        help="导出分析数据：.json 为完整统计，其他扩展名为折叠栈 (flamegraph)")
+    parser.add_argument("--profile-alloc", action="store_true", help="额外记录每场战斗的内存峰值 (较慢)")
+    parser.add_argument("--stream", default=None, metavar="JSONL",
+                        help="流式模式：逐行读取战斗配置 (路径或 - 表示 stdin，gzip 自动识别)，每行输出一条紧凑结果")
+    parser.add_argument("--out", default="-", help="流式模式的输出路径 (默认 stdout，.gz 后缀自动压缩)")
+    parser.add_argument("--gzip", action="store_true", help="流式模式强制 gzip 输出 (例如输出到 stdout 时)")
+    parser.add_argument("--workers", type=int, default=None, help="流式模式的进程数 (默认 CPU 核数)")
+    parser.add_argument("--chunksize", type=int, default=64, help="流式模式每批下发的记录数")
+    parser.add_argument("--cache", default=None, help="流式模式的确定性战斗结果缓存 (sqlite 文件路径)")
+    parser.add_argument("--quiet", action="store_true",
+                        help="单场模式不打印逐回合战报，只输出一行结局 (回合数与胜负)")
+    parser.add_argument("--replay", default=None, metavar="PATH",
+                        help="单场模式下同时把逐回合状态写入二进制回放文件 (用 cow_replay.py show 查看)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.profile or args.profile_out or args.profile_alloc:
+        from cow_profile import Profiler
+        with Profiler(allocations=args.profile_alloc) as prof:
+            run(args)
+        print("\n" + prof.report().summary())
+        if args.profile_out:
+            if args.profile_out.endswith(".json"): prof.write_json(args.profile_out)
+            else: prof.write_folded(args.profile_out)
+        return
+    run(args)
+
+def run(args):
+    if args.stream:
+        from cow_stream import stream_file
+        stats = stream_file(args.stream, args.out, True if args.gzip else None, trials=args.trials,
+                            seed=args.seed or 0, workers=args.workers, chunksize=args.chunksize,
+                            cache_path=args.cache)
+        print(stats.summary(), file=sys.stderr)
+        return
+
+    # 惰性索引数据库：只读取、编译本场战斗引用到的单位与建筑
+    u_db, b_db = load_lazy_databases("units.json", "buildings.json")
+    conf = load_json(args.config)
     
     army_a = build_army(conf["team_a"], u_db, b_db)
     army_b = build_army(conf["team_b"], u_db, b_db)
@@ -100,7 +162,25 @@ def main():
     use_rnd = conf.get("enable_randomness", True)
     detailed = conf.get("detailed_output", False)
     
-    run_simulation(army_a, army_b, mode, conf.get("max_rounds", 50), use_rnd, detailed)
+    if args.trials > 0:
+        from cow_batch import run_monte_carlo, print_monte_carlo_summary
+        result = run_monte_carlo(army_a, army_b, mode, args.trials, conf.get("max_rounds", 50), args.seed,
+                                 engine=args.engine, siege_damage=conf.get("siege_damage", True))
+        print_monte_carlo_summary(result)
+        return
+
+    reporters = []
+    if args.replay:
+        from cow_replay import ReplayRecorder
+        reporters.append(ReplayRecorder())
+    result = run_simulation(army_a, army_b, mode, conf.get("max_rounds", 50), use_rnd, detailed,
+                            verbose=not args.quiet, rng=CounterRNG(args.seed), reporters=reporters,
+                            extrapolate=conf.get("extrapolate_steady_state", False),
+                            siege_damage=conf.get("siege_damage", True))
+    if args.quiet:
+        print(f"{result.outcome.value} after {result.rounds} rounds")
+    if args.replay:
+        reporters[0].save(args.replay)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file